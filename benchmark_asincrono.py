@@ -0,0 +1,238 @@
+"""
+Benchmark del modo asyncio frente al modo por hilos.
+
+Levanta una API de Telegram falsa en local que tarda LATENCIA_API en
+responder (como la real vista desde un servidor) y le entrega a cada bot
+un lote de updates /start de chats distintos. Cada handler lee al usuario
+de una BD sintética y le responde con send_message. Compara:
+
+    hilos           TeleBot con el despachador por chats (modo actual)
+    asyncio         AsyncTeleBot con los mismos handlers síncronos (utils/asincrono.py)
+    asyncio nativo  AsyncTeleBot con el handler escrito con async def y db/asincrona.py
+
+Los handlers síncronos se ejecutan con el mismo número de hilos (--hilos)
+en el modo por hilos y en asyncio, para que la diferencia sea solo la forma
+de esperar a la API.
+
+Mide el tiempo total, los updates por segundo, la latencia de cada update
+y cuántas peticiones llegan a estar en curso a la vez en la API.
+
+Necesita pyTelegramBotAPI con aiohttp (pip install pyTelegramBotAPI aiohttp).
+
+Uso:
+    python benchmark_asincrono.py [--updates 2000] [--latencia 0.1] [--hilos 64]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import db.conexion
+from db.conexion import PoolConexiones, conexion
+from db.consultas import ejecutar
+from db.models import ESQUEMA_SQL, INDICES
+from utils.asincrono import HILOS_HANDLERS
+
+LATENCIA_API = 0.1   # Segundos que tarda la API falsa en responder
+PRIMER_CHAT = 100000
+
+
+class ApiFalsa(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, direccion):
+        super().__init__(direccion, _ManejadorApi)
+        self._lock = threading.Lock()
+        self.en_curso = 0
+        self.en_curso_max = 0
+        self.enviados = 0
+
+    def entrar(self):
+        with self._lock:
+            self.en_curso += 1
+            self.en_curso_max = max(self.en_curso_max, self.en_curso)
+
+    def salir(self, metodo):
+        with self._lock:
+            self.en_curso -= 1
+            if metodo == "sendMessage":
+                self.enviados += 1
+
+
+class _ManejadorApi(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        pass
+
+    def do_POST(self):
+        # telebot envía los parámetros en la URL y AsyncTeleBot en el cuerpo
+        metodo = self.path.split("?", 1)[0].rsplit("/", 1)[-1]
+        longitud = int(self.headers.get("Content-Length") or 0)
+        if longitud:
+            self.rfile.read(longitud)
+        self.server.entrar()
+        time.sleep(self.server.latencia)
+        if metodo == "getMe":
+            resultado = {"id": 123, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        else:
+            resultado = {"message_id": 1, "date": int(time.time()),
+                         "chat": {"id": 1, "type": "private"}, "text": "ok"}
+        datos = json.dumps({"ok": True, "result": resultado}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+        self.server.salir(metodo)
+
+    do_GET = do_POST
+
+
+def generar_bd(ruta, num_usuarios):
+    conn = sqlite3.connect(ruta)
+    conn.executescript(ESQUEMA_SQL)
+    for nombre, tabla, columnas in INDICES:
+        conn.execute(f"CREATE INDEX {nombre} ON {tabla} ({columnas})")
+    conn.executemany(
+        "INSERT INTO Usuarios (Nombre, Tipo, Email_UGR, TelegramID, Registrado) VALUES (?, ?, ?, ?, 'SI')",
+        [(f"Estudiante {i}", "estudiante", f"e{i}@correo.ugr.es", PRIMER_CHAT + i) for i in range(num_usuarios)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def generar_updates(num):
+    from telebot import types
+    return [types.Update.de_json({
+        "update_id": i + 1,
+        "message": {"message_id": i + 1, "date": int(time.time()), "text": "/start",
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+                    "chat": {"id": PRIMER_CHAT + i, "type": "private"},
+                    "from": {"id": PRIMER_CHAT + i, "is_bot": False, "first_name": "E"}},
+    }) for i in range(num)]
+
+
+def registrar_handler_sincrono(bot):
+    @bot.message_handler(commands=["start"])
+    def start(message):
+        with conexion() as conn:
+            usuario = ejecutar(conn, "usuarios.por_telegram_id", (message.chat.id,)).fetchone()
+        bot.send_message(message.chat.id, f"Hola, {usuario['Nombre']}")
+
+
+def registrar_handler_nativo(bot):
+    from db.asincrona import get_bd_asincrona
+    bd = get_bd_asincrona()
+
+    @bot.message_handler(commands=["start"])
+    async def start(message):
+        usuario = await bd.consultar_uno("usuarios.por_telegram_id", (message.chat.id,))
+        await bot.asincrono.send_message(message.chat.id, f"Hola, {usuario['Nombre']}")
+
+
+def hilos_del_bot():
+    """Hilos vivos sin contar los de la API falsa"""
+    return sum(1 for hilo in threading.enumerate() if "process_request" not in hilo.name)
+
+
+def esperar_handlers(despachador, num, inicio, limite=600):
+    """Espera a que terminen los num handlers; devuelve (segundos, hilos máximos del bot)"""
+    hilos_max = hilos_del_bot()
+    while despachador.procesados + despachador.errores < num and time.perf_counter() - inicio < limite:
+        time.sleep(0.01)
+        hilos_max = max(hilos_max, hilos_del_bot())
+    return time.perf_counter() - inicio, hilos_max
+
+
+def ejecutar_hilos(updates, hilos):
+    import telebot
+    from utils.despachador import instalar_despachador
+
+    bot = telebot.TeleBot("123:ABC")
+    registrar_handler_sincrono(bot)
+    despachador = instalar_despachador(bot, hilos=hilos)
+    inicio = time.perf_counter()
+    bot.process_new_updates(updates)
+    segundos, hilos = esperar_handlers(despachador, len(updates), inicio)
+    estadisticas = despachador.estadisticas()
+    despachador.detener()
+    return segundos, hilos, estadisticas
+
+
+def ejecutar_asyncio(updates, nativo, hilos):
+    from utils.asincrono import BotSincrono
+
+    bot = BotSincrono("123:ABC", hilos=hilos)
+    (registrar_handler_nativo if nativo else registrar_handler_sincrono)(bot)
+    bot.despachador.iniciar()
+    inicio = time.perf_counter()
+    asyncio.run_coroutine_threadsafe(bot.despachador.admitir_lote(updates), bot.loop).result()
+    segundos, hilos = esperar_handlers(bot.despachador, len(updates), inicio)
+    estadisticas = bot.despachador.estadisticas()
+    bot.despachador.detener()
+    bot.cerrar()
+    return segundos, hilos, estadisticas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del modo asyncio")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--latencia", type=float, default=LATENCIA_API)
+    parser.add_argument("--hilos", type=int, default=HILOS_HANDLERS,
+                        help="Hilos para handlers síncronos, iguales en los dos modos")
+    args = parser.parse_args()
+
+    try:
+        from telebot import apihelper, asyncio_helper
+    except ImportError:
+        print("❌ Hace falta pyTelegramBotAPI con aiohttp: pip install pyTelegramBotAPI aiohttp")
+        sys.exit(1)
+
+    print("=" * 90)
+    print(f"⏱️  BENCHMARK modo asyncio: {args.updates} updates, API con {args.latencia * 1000:.0f} ms de latencia, "
+          f"{args.hilos} hilos de handlers")
+    print("=" * 90)
+    print(f"{'Modo':<15} | {'Segundos':>8} | {'Updates/s':>9} | {'p50 ms':>8} | {'p95 ms':>8} | "
+          f"{'API a la vez':>12} | {'Hilos':>5}")
+    print("-" * 90)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "bench.db")
+        generar_bd(ruta, args.updates)
+        # El benchmark no toca tutoria_ugr.db: el pool compartido apunta a la BD sintética
+        db.conexion._pool = PoolConexiones(ruta)
+
+        for modo in ("hilos", "asyncio", "asyncio nativo"):
+            api = ApiFalsa(("127.0.0.1", 0))
+            api.latencia = args.latencia
+            threading.Thread(target=api.serve_forever, daemon=True).start()
+            url = f"http://127.0.0.1:{api.server_address[1]}/bot{{0}}/{{1}}"
+            apihelper.API_URL = asyncio_helper.API_URL = url
+
+            updates = generar_updates(args.updates)
+            if modo == "hilos":
+                segundos, hilos, estadisticas = ejecutar_hilos(updates, args.hilos)
+            else:
+                segundos, hilos, estadisticas = ejecutar_asyncio(updates, modo == "asyncio nativo", args.hilos)
+
+            print(f"{modo:<15} | {segundos:>8.2f} | {api.enviados / segundos:>9.0f} | "
+                  f"{estadisticas['latencia_p50_ms']:>8.0f} | {estadisticas['latencia_p95_ms']:>8.0f} | "
+                  f"{api.en_curso_max:>12} | {hilos:>5}")
+            if api.enviados < args.updates:
+                print(f"⚠️ Solo se enviaron {api.enviados} de {args.updates} respuestas")
+            api.shutdown()
+            api.server_close()
+
+
+if __name__ == "__main__":
+    main()
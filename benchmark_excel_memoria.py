@@ -0,0 +1,125 @@
+"""
+Benchmark de la carga del Excel en memoria.
+
+Genera una hoja sintética con el formato de data/usuarios.xlsx y compara la
+carga anterior de cargar_excel_en_memoria (libro completo y sheet.cell por
+celda) con leer_indice_emails (read_only + iter_rows(values_only=True)).
+Mide el tiempo y el pico de memoria (tracemalloc); las dos cargas deben
+producir el mismo índice de emails. La carga anterior recalcula
+sheet.max_column en cada fila (recorre todas las celdas), así que crece de
+forma cuadrática y solo se mide con el tamaño pequeño.
+
+Uso:
+    python benchmark_excel_memoria.py [--filas 100000]
+"""
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.excel_manager import leer_indice_emails
+
+FILAS_LIBRO_COMPLETO = 5000
+COLUMNAS = ["Nombre", "Apellidos", "DNI", "Email", "Tipo", "Area", "Carrera", "Asignaturas"]
+
+
+def generar_excel(ruta, num_filas):
+    """Escribe la hoja en modo write_only para no depender de la memoria del generador"""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(COLUMNAS)
+    for i in range(num_filas):
+        profesor = i % 50 == 0
+        sheet.append([
+            f"Nombre{i}", f"Apellido{i} Apellido{i + 1}", str(70000000 + i),
+            f"usuario{i}@{'ugr.es' if profesor else 'correo.ugr.es'}",
+            "profesor" if profesor else "estudiante", "Ingeniería", f"Grado {i % 20}",
+            ";".join(f"Asignatura {(i + k) % 300}" for k in range(6)),
+        ])
+    workbook.save(ruta)
+
+
+def carga_anterior(ruta):
+    """Reproducción de la carga anterior: libro completo y una llamada a cell() por celda"""
+    workbook = openpyxl.load_workbook(ruta)
+    sheet = workbook.active
+    headers = []
+    for col in range(1, sheet.max_column + 1):
+        header = sheet.cell(row=1, column=col).value
+        headers.append(header.strip() if header else f"Column_{col}")
+    email_col = next(i + 1 for i, h in enumerate(headers) if 'mail' in h.lower())
+
+    indice = {}
+    for row in range(2, sheet.max_row + 1):
+        email_value = sheet.cell(row=row, column=email_col).value
+        if not email_value:
+            continue
+        datos = {}
+        for col in range(1, sheet.max_column + 1):
+            value = sheet.cell(row=row, column=col).value
+            if value:
+                datos[headers[col - 1]] = str(value)
+        indice[str(email_value).lower().strip()] = datos
+    return indice
+
+
+def medir(funcion, ruta):
+    """
+    Devuelve (segundos, pico_MB, índice). El tiempo se toma en una pasada sin
+    tracemalloc, que ralentiza mucho las asignaciones, y el pico en otra.
+    """
+    gc.collect()
+    inicio = time.perf_counter()
+    indice = funcion(ruta)
+    segundos = time.perf_counter() - inicio
+
+    del indice
+    gc.collect()
+    tracemalloc.start()
+    indice = funcion(ruta)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return segundos, pico / (1024 * 1024), indice
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la carga del Excel en memoria")
+    parser.add_argument("--filas", type=int, default=100000)
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("⏱️  BENCHMARK carga del Excel: libro completo frente a streaming")
+    print("=" * 70)
+    print(f"{'Filas':>7} | {'Método':<14} | {'Emails':>8} | {'Segundos':>8} | {'Pico MB':>8} | {'Filas/s':>9}")
+    print("-" * 70)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in (FILAS_LIBRO_COMPLETO, args.filas):
+            ruta = os.path.join(tmp, f"usuarios_{num}.xlsx")
+            generar_excel(ruta, num)
+
+            metodos = [("streaming", leer_indice_emails)]
+            if num <= FILAS_LIBRO_COMPLETO:
+                metodos.insert(0, ("libro completo", carga_anterior))
+
+            indices = []
+            for nombre, funcion in metodos:
+                segundos, pico, indice = medir(funcion, ruta)
+                indices.append(indice)
+                print(f"{num:>7} | {nombre:<14} | {len(indice):>8} | {segundos:>8.2f} | "
+                      f"{pico:>8.1f} | {num / segundos:>9.0f}")
+            if any(indice != indices[0] for indice in indices):
+                print("⚠️ Los índices de emails no coinciden")
+            print(f"{'':>7} |   fichero {os.path.getsize(ruta) / (1024 * 1024):.1f} MB")
+            print("-" * 70)
+
+
+if __name__ == "__main__":
+    main()
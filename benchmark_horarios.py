@@ -0,0 +1,114 @@
+"""
+Benchmark del motor de horarios (utils/motor_horarios.py).
+
+Genera horarios sintéticos de profesores con los formatos que hay en la BD y
+compara, para la pregunta "¿está disponible ahora?":
+
+    regex       analizar el texto con expresiones regulares en cada consulta
+                (lo que hacía verificar_horario_tutoria)
+    motor       horario compilado y cacheado + búsqueda binaria
+    lote        disponibles() para todos los profesores en el mismo instante
+
+Además comprueba que las tres respuestas coinciden en todos los casos.
+
+Uso:
+    python benchmark_horarios.py [--profesores 500] [--consultas 200000]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils import motor_horarios
+from utils.motor_horarios import DIAS_SEMANA, compilar_horario, disponibles
+
+_DIAS = r"(lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo)"
+_PATRONES = (
+    _DIAS + r"\s+de\s+(\d{1,2}):?(\d{2})?\s+a\s+(\d{1,2}):?(\d{2})?",
+    _DIAS + r"\s+(\d{1,2}):?(\d{2})?-(\d{1,2}):?(\d{2})?",
+)
+_NOMBRES = ("lunes", "martes", "mi", "jueves", "viernes", "s", "domingo")
+
+
+def disponible_regex(horario_str, momento):
+    """Análisis completo del texto en cada llamada, como antes del motor"""
+    if not horario_str or not horario_str.strip():
+        return False
+    dia = _NOMBRES[momento.weekday()]
+    minuto = momento.hour * 60 + momento.minute
+    for patron in _PATRONES:
+        for m in re.finditer(patron, horario_str.lower()):
+            if not m.group(1).startswith(dia):
+                continue
+            inicio = int(m.group(2)) * 60 + int(m.group(3) or 0)
+            fin = int(m.group(4)) * 60 + int(m.group(5) or 0)
+            if inicio <= minuto < fin:   # Franjas [inicio, fin), como el motor
+                return True
+    return False
+
+
+def generar_horario(rng):
+    franjas = []
+    for dia in rng.sample(DIAS_SEMANA[:5], rng.randint(1, 4)):
+        inicio = rng.randint(8, 18)
+        duracion = rng.choice((1, 2, 3))
+        if rng.random() < 0.5:
+            franjas.append(f"{dia} {inicio:02d}:00-{inicio + duracion:02d}:30")
+        else:
+            franjas.append(f"{dia} de {inicio:02d}:00 a {inicio + duracion:02d}:30")
+    return ", ".join(franjas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del motor de horarios")
+    parser.add_argument("--profesores", type=int, default=500)
+    parser.add_argument("--consultas", type=int, default=200000)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    horarios = {i: generar_horario(rng) for i in range(args.profesores)}
+    lunes = datetime(2025, 1, 6)
+    momentos = [lunes + timedelta(minutes=rng.randrange(7 * 24 * 60)) for _ in range(200)]
+    consultas = [(rng.randrange(args.profesores), rng.choice(momentos)) for _ in range(args.consultas)]
+
+    print("=" * 70)
+    print(f"⏱️  BENCHMARK horarios: {args.profesores} profesores, {args.consultas} consultas")
+    print("=" * 70)
+
+    inicio = time.perf_counter()
+    esperado = [disponible_regex(horarios[p], m) for p, m in consultas]
+    t_regex = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    obtenido = [compilar_horario(horarios[p]).disponible(m) for p, m in consultas]
+    t_motor = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    lotes = {m: disponibles(horarios, m) for m in momentos}
+    t_lote = time.perf_counter() - inicio
+    por_lote = [lotes[m][p] for p, m in consultas]
+
+    print(f"{'Modo':<8} | {'Segundos':>8} | {'µs/consulta':>11}")
+    print("-" * 70)
+    print(f"{'regex':<8} | {t_regex:>8.3f} | {t_regex / len(consultas) * 1e6:>11.2f}")
+    print(f"{'motor':<8} | {t_motor:>8.3f} | {t_motor / len(consultas) * 1e6:>11.2f}")
+    total_lote = len(momentos) * args.profesores
+    print(f"{'lote':<8} | {t_lote:>8.3f} | {t_lote / total_lote * 1e6:>11.2f}   "
+          f"({len(momentos)} instantes x {args.profesores} profesores)")
+    print(f"Motor: {motor_horarios.estadisticas()}")
+
+    distintos = sum(1 for a, b, c in zip(esperado, obtenido, por_lote) if not a == b == c)
+    if distintos:
+        print(f"❌ {distintos} respuestas no coinciden con el análisis por regex")
+        sys.exit(1)
+    print(f"✅ Las {len(consultas)} respuestas coinciden ({sum(esperado)} disponibles)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark de la importación del Excel.
+
+Genera una plantilla sintética (estudiantes con 6 asignaturas y algunos
+profesores) y compara la importación fila a fila anterior (una conexión y
+un commit por usuario y por matrícula) con la importación masiva de
+utils/excel_manager.py (pandas + executemany en una transacción).
+La versión fila a fila solo se mide con el tamaño pequeño.
+
+Uso:
+    python benchmark_importacion.py [--filas 20000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db.models import ESQUEMA_SQL, INDICES
+from db.escritor import EscritorBD
+from utils.excel_manager import preparar_datos_importacion, _importar_en_transaccion
+
+ASIGNATURAS_POR_ESTUDIANTE = 6
+NUM_ASIGNATURAS = 300
+FILAS_FILA_A_FILA = 200
+
+
+def generar_excel(num_filas, semilla=42):
+    """DataFrame con el mismo formato que data/usuarios.xlsx"""
+    rnd = random.Random(semilla)
+    asignaturas = [f"Asignatura {i}" for i in range(NUM_ASIGNATURAS)]
+    carreras = [f"Grado {i}" for i in range(20)]
+    filas = []
+    for i in range(num_filas):
+        profesor = i % 50 == 0
+        filas.append({
+            "Nombre": f"Nombre{i}",
+            "Apellidos": f"Apellido{i} Apellido{i + 1}",
+            "DNI": str(70000000 + i),
+            "Email": f"usuario{i}@{'ugr.es' if profesor else 'correo.ugr.es'}",
+            "Tipo": "profesor" if profesor else "estudiante",
+            "Area": "Ingeniería",
+            "Carrera": rnd.choice(carreras),
+            "Asignaturas": ";".join(rnd.sample(asignaturas, ASIGNATURAS_POR_ESTUDIANTE)),
+        })
+    return pd.DataFrame(filas, dtype=str)
+
+
+def crear_bd(ruta):
+    conn = sqlite3.connect(ruta)
+    conn.executescript(ESQUEMA_SQL)
+    for nombre, tabla, columnas in INDICES:
+        conn.execute(f"CREATE INDEX {nombre} ON {tabla} ({columnas})")
+    conn.commit()
+    conn.close()
+
+
+def importar_fila_a_fila(ruta, df):
+    """Reproducción del patrón anterior: cada operación abre conexión y hace commit"""
+    def operacion(sql, parametros):
+        conn = sqlite3.connect(ruta)
+        cursor = conn.execute(sql, parametros)
+        resultado = cursor.fetchone() if sql.startswith("SELECT") else cursor.lastrowid
+        conn.commit()
+        conn.close()
+        return resultado
+
+    for _, row in df.iterrows():
+        usuario = operacion("SELECT Id_usuario FROM Usuarios WHERE Email_UGR = ?", (row["Email"],))
+        if usuario:
+            user_id = usuario[0]
+        else:
+            user_id = operacion(
+                "INSERT INTO Usuarios (Nombre, Tipo, Email_UGR, Apellidos, DNI, Carrera, Area, Registrado) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 'NO')",
+                (row["Nombre"], row["Tipo"], row["Email"], row["Apellidos"], row["DNI"],
+                 row["Carrera"], row["Area"])
+            )
+        for asignatura in row["Asignaturas"].split(";"):
+            asig = operacion("SELECT Id_asignatura FROM Asignaturas WHERE Nombre = ?", (asignatura,))
+            asig_id = asig[0] if asig else operacion(
+                "INSERT INTO Asignaturas (Nombre) VALUES (?)", (asignatura,))
+            if not operacion("SELECT * FROM Matriculas WHERE Id_usuario = ? AND Id_asignatura = ?",
+                             (user_id, asig_id)):
+                operacion("INSERT INTO Matriculas (Id_usuario, Id_asignatura, Tipo) VALUES (?, ?, ?)",
+                          (user_id, asig_id, "estudiante"))
+
+
+def importar_masivo(ruta, df):
+    """Devuelve (segundos_preparacion, segundos_escritura, resultado)"""
+    inicio = time.perf_counter()
+    usuarios, matriculas, _ = preparar_datos_importacion(df)
+    preparado = time.perf_counter()
+
+    escritor = EscritorBD(ruta)
+    try:
+        resultado = escritor.ejecutar(_importar_en_transaccion(usuarios, matriculas, True, set()), timeout=600)
+    finally:
+        escritor.detener()
+    return preparado - inicio, time.perf_counter() - preparado, resultado
+
+
+def contar(ruta):
+    conn = sqlite3.connect(ruta)
+    usuarios = conn.execute("SELECT COUNT(*) FROM Usuarios").fetchone()[0]
+    matriculas = conn.execute("SELECT COUNT(*) FROM Matriculas").fetchone()[0]
+    conn.close()
+    return usuarios, matriculas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la importación del Excel")
+    parser.add_argument("--filas", type=int, default=20000)
+    args = parser.parse_args()
+
+    print("=" * 78)
+    print("⏱️  BENCHMARK importación del Excel: fila a fila frente a masiva")
+    print("=" * 78)
+    print(f"{'Filas':>7} | {'Método':<12} | {'Usuarios':>8} | {'Matrículas':>10} | {'Segundos':>8} | {'Filas/s':>9}")
+    print("-" * 78)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in (FILAS_FILA_A_FILA, args.filas):
+            df = generar_excel(num)
+
+            if num <= FILAS_FILA_A_FILA:
+                ruta = os.path.join(tmp, f"fila_{num}.db")
+                crear_bd(ruta)
+                inicio = time.perf_counter()
+                importar_fila_a_fila(ruta, df)
+                segundos = time.perf_counter() - inicio
+                usuarios, matriculas = contar(ruta)
+                print(f"{num:>7} | {'fila a fila':<12} | {usuarios:>8} | {matriculas:>10} | "
+                      f"{segundos:>8.2f} | {num / segundos:>9.0f}")
+
+            ruta = os.path.join(tmp, f"masivo_{num}.db")
+            crear_bd(ruta)
+            preparacion, escritura, _ = importar_masivo(ruta, df)
+            segundos = preparacion + escritura
+            usuarios, matriculas = contar(ruta)
+            print(f"{num:>7} | {'masiva':<12} | {usuarios:>8} | {matriculas:>10} | "
+                  f"{segundos:>8.2f} | {num / segundos:>9.0f}")
+            print(f"{'':>7} |   pandas {preparacion:.2f} s, transacción {escritura:.2f} s")
+            print("-" * 78)
+
+
+if __name__ == "__main__":
+    main()
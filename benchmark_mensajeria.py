@@ -0,0 +1,201 @@
+"""
+Benchmark de la cola de salida de Telegram contra una API falsa.
+
+Levanta un servidor HTTP local que imita la Bot API con sus límites (30
+mensajes/s en total, 1/s por chat privado, 20/min por grupo): lo que los
+supera recibe 429 con retry_after y los chats de BLOQUEADOS responden 403.
+Compara el bucle anterior de notificar_cambio_sala (send_message uno a uno
+y except que se traga el error) con utils/mensajeria.py, y mide cuánto
+tardan las respuestas interactivas mientras sale un aviso masivo.
+
+Si telebot está instalado se usa un TeleBot apuntando a la API falsa; si
+no, un cliente HTTP mínimo con los mismos métodos y errores.
+
+Uso:
+    python benchmark_mensajeria.py [--estudiantes 300]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.mensajeria import ColaMensajes, INTERACTIVO, MASIVO
+
+BLOQUEADOS = {100007, 100013}   # Usuarios que han bloqueado el bot
+LATENCIA_API = 0.03             # Segundos que tarda la API falsa en responder
+
+
+class ApiFalsa(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion):
+        super().__init__(direccion, _ManejadorApi)
+        self._lock = threading.Lock()
+        self._global = deque()
+        self._por_chat = defaultdict(deque)
+        self.entregados = defaultdict(list)   # {chat_id: [texto]}
+        self.respuestas = defaultdict(int)
+
+    def admitir(self, chat_id):
+        """Ventanas deslizantes con los límites de Telegram; devuelve retry_after o 0"""
+        ahora = time.monotonic()
+        ventana, limite = (60.0, 20) if chat_id < 0 else (1.0, 1)
+        with self._lock:
+            for cola, segundos in ((self._global, 1.0), (self._por_chat[chat_id], ventana)):
+                while cola and cola[0] <= ahora - segundos:
+                    cola.popleft()
+            if len(self._global) >= 30:
+                return 1
+            if len(self._por_chat[chat_id]) >= limite:
+                return int(ventana - (ahora - self._por_chat[chat_id][0])) + 1
+            self._global.append(ahora)
+            self._por_chat[chat_id].append(ahora)
+            return 0
+
+
+class _ManejadorApi(BaseHTTPRequestHandler):
+    def log_message(self, formato, *args):
+        pass
+
+    def _responder(self, codigo, cuerpo):
+        datos = json.dumps(cuerpo).encode()
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+        self.server.respuestas[codigo] += 1
+
+    def do_POST(self):
+        metodo = self.path.rsplit("/", 1)[-1]
+        longitud = int(self.headers.get("Content-Length") or 0)
+        crudo = self.rfile.read(longitud).decode() if longitud else ""
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            params = json.loads(crudo or "{}")
+        else:
+            params = dict(urllib.parse.parse_qsl(crudo))
+        chat_id = int(params.get("chat_id", 0))
+        time.sleep(LATENCIA_API)
+
+        if metodo == "sendMessage" and chat_id in BLOQUEADOS:
+            return self._responder(403, {"ok": False, "error_code": 403,
+                                         "description": "Forbidden: bot was blocked by the user"})
+        if metodo == "sendMessage":
+            espera = self.server.admitir(chat_id)
+            if espera:
+                return self._responder(429, {"ok": False, "error_code": 429,
+                                             "description": f"Too Many Requests: retry after {espera}",
+                                             "parameters": {"retry_after": espera}})
+            self.server.entregados[chat_id].append(params.get("text"))
+        return self._responder(200, {"ok": True, "result": {
+            "message_id": 1, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text")}})
+
+
+class ErrorApi(Exception):
+    """Mismos atributos que telebot.apihelper.ApiTelegramException"""
+
+    def __init__(self, error_code, result_json):
+        super().__init__(result_json.get("description"))
+        self.error_code = error_code
+        self.result_json = result_json
+
+
+class ClienteHttp:
+    """Cliente mínimo de la Bot API, solo si telebot no está instalado"""
+
+    def __init__(self, url_base):
+        self.url_base = url_base
+
+    def _llamar(self, metodo, **params):
+        peticion = urllib.request.Request(f"{self.url_base}/{metodo}", data=json.dumps(params).encode(),
+                                          headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(peticion, timeout=10) as respuesta:
+                return json.loads(respuesta.read())["result"]
+        except urllib.error.HTTPError as e:
+            raise ErrorApi(e.code, json.loads(e.read()))
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._llamar("sendMessage", chat_id=chat_id, text=text, **kwargs)
+
+
+def crear_bot(puerto):
+    try:
+        import telebot
+        from telebot import apihelper
+    except ImportError:
+        return ClienteHttp(f"http://127.0.0.1:{puerto}/bot123:ABC")
+    apihelper.API_URL = f"http://127.0.0.1:{puerto}/bot{{0}}/{{1}}"
+    return telebot.TeleBot("123:ABC", threaded=False)
+
+
+def bucle_anterior(bot, chat_ids, texto):
+    """Como notificar_cambio_sala antes: uno a uno, los errores se pierden"""
+    for chat_id in chat_ids:
+        try:
+            bot.send_message(chat_id, texto)
+        except Exception:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la cola de salida de Telegram")
+    parser.add_argument("--estudiantes", type=int, default=300)
+    args = parser.parse_args()
+
+    estudiantes = [100000 + i for i in range(args.estudiantes)]
+    # Cada estudiante recibe dos avisos seguidos (cambio de sala y recordatorio)
+    destinos = [c for c in estudiantes for _ in range(2)]
+
+    print("=" * 72)
+    print(f"⏱️  BENCHMARK cola de salida: {len(destinos)} avisos a {len(estudiantes)} estudiantes")
+    print("=" * 72)
+
+    for nombre in ("bucle anterior", "cola de salida"):
+        api = ApiFalsa(("127.0.0.1", 0))
+        threading.Thread(target=api.serve_forever, daemon=True).start()
+        bot = crear_bot(api.server_address[1])
+        inicio = time.perf_counter()
+
+        interactivas = []
+        if nombre == "bucle anterior":
+            bucle_anterior(bot, destinos, "Aviso")
+        else:
+            cola = ColaMensajes(bot, espera_base=0.2)
+            futuros = [cola.enviar_mensaje(c, "Aviso", prioridad=MASIVO) for c in destinos]
+            # Mientras sale el aviso, diez usuarios usan el bot
+            for i in range(10):
+                time.sleep(0.3)
+                enviado = time.perf_counter()
+                cola.enviar_mensaje(200000 + i, "Respuesta", prioridad=INTERACTIVO).result()
+                interactivas.append((time.perf_counter() - enviado) * 1000)
+            for futuro in futuros:
+                futuro.exception()
+            fallidos = sum(1 for f in futuros if f.exception() is not None)
+            cola.detener()
+
+        segundos = time.perf_counter() - inicio
+        entregados = sum(len(v) for c, v in api.entregados.items() if c in set(estudiantes))
+        esperados = len(destinos) - 2 * len(BLOQUEADOS & set(estudiantes))
+        print(f"{nombre:<15} | {segundos:6.1f} s | entregados {entregados}/{esperados} | "
+              f"respuestas API {dict(api.respuestas)}")
+        if nombre == "cola de salida":
+            print(f"{'':<15} | fallidos notificados: {fallidos} (bloqueados) | "
+                  f"respuesta interactiva p50 {sorted(interactivas)[5]:.0f} ms, máx {max(interactivas):.0f} ms")
+            en_orden = all(v == ["Aviso", "Aviso"] for c, v in api.entregados.items() if c in set(estudiantes))
+            print(f"{'':<15} | dos avisos por estudiante, sin duplicados: {'sí' if en_orden else 'NO'}")
+        api.shutdown()
+        api.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Benchmark del comando /tutoria.
+
+Compara la construcción del árbol profesor → asignatura → salas con el
+patrón anterior (una consulta por profesor para asignaturas y otra para
+salas, más el diagnóstico COUNT/LIMIT 5) frente a obtener_arbol_tutorias,
+que usa un número fijo de consultas. Genera bases de datos sintéticas con
+10, 100 y 1000 profesores en un directorio temporal.
+
+Uso:
+    python benchmark_tutoria.py [--repeticiones 20]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db.models import ESQUEMA_SQL, INDICES
+from db.queries import obtener_arbol_tutorias
+
+TAMANOS = (10, 100, 1000)
+ASIGNATURAS_ESTUDIANTE = 8
+ESTUDIANTES_POR_PROFESOR = 5
+
+
+def generar_bd(ruta, num_profesores, semilla=42):
+    """Crea una BD sintética y devuelve el Id_usuario del estudiante de prueba"""
+    rnd = random.Random(semilla)
+    conn = sqlite3.connect(ruta)
+    conn.executescript(ESQUEMA_SQL)
+    for nombre, tabla, columnas in INDICES:
+        conn.execute(f"CREATE INDEX {nombre} ON {tabla} ({columnas})")
+
+    num_asignaturas = max(ASIGNATURAS_ESTUDIANTE * 2, num_profesores // 2)
+    conn.executemany(
+        "INSERT INTO Asignaturas (Id_asignatura, Nombre, Codigo_Asignatura) VALUES (?, ?, ?)",
+        [(i, f"Asignatura {i}", f"COD{i:05d}") for i in range(1, num_asignaturas + 1)]
+    )
+
+    usuarios = []
+    matriculas = []
+    salas = []
+    siguiente_id = 1
+
+    # Estudiante de prueba con 8 asignaturas
+    estudiante_id = siguiente_id
+    usuarios.append((estudiante_id, "Estudiante", "Prueba", "estudiante", "est@correo.ugr.es", None))
+    for asig in range(1, ASIGNATURAS_ESTUDIANTE + 1):
+        matriculas.append((estudiante_id, asig, "estudiante"))
+    siguiente_id += 1
+
+    for p in range(num_profesores):
+        prof_id = siguiente_id
+        siguiente_id += 1
+        usuarios.append((prof_id, f"Profesor{p}", f"Apellido{p}", "profesor",
+                         f"prof{p}@ugr.es", "Lunes 10:00-12:00, Miércoles 16:00-18:00"))
+        # Cada profesor imparte una asignatura del estudiante y otra cualquiera
+        asig_estudiante = rnd.randint(1, ASIGNATURAS_ESTUDIANTE)
+        otra = rnd.randint(1, num_asignaturas)
+        matriculas.append((prof_id, asig_estudiante, "docente"))
+        matriculas.append((prof_id, otra, "docente"))
+        salas.append((prof_id, f"Avisos {p}", "pública", asig_estudiante, f"-100{prof_id}1", "avisos"))
+        salas.append((prof_id, f"Privada {p}", "privada", None, f"-100{prof_id}2", "individual"))
+
+        # Relleno: otros estudiantes para que las tablas tengan un tamaño realista
+        for _ in range(ESTUDIANTES_POR_PROFESOR):
+            est_id = siguiente_id
+            siguiente_id += 1
+            usuarios.append((est_id, f"E{est_id}", None, "estudiante", f"e{est_id}@correo.ugr.es", None))
+            for asig in rnd.sample(range(1, num_asignaturas + 1), 6):
+                matriculas.append((est_id, asig, "estudiante"))
+
+    conn.executemany(
+        "INSERT INTO Usuarios (Id_usuario, Nombre, Apellidos, Tipo, Email_UGR, Horario) VALUES (?, ?, ?, ?, ?, ?)",
+        usuarios
+    )
+    conn.executemany("INSERT INTO Matriculas (Id_usuario, Id_asignatura, Tipo) VALUES (?, ?, ?)", matriculas)
+    conn.executemany(
+        "INSERT INTO Grupos_tutoria (Id_usuario, Nombre_sala, Tipo_sala, Id_asignatura, Chat_id, Proposito_sala) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        salas
+    )
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    return estudiante_id
+
+
+def arbol_n_mas_1(conn, estudiante_id):
+    """Reproducción del patrón anterior del handler (N+1 consultas)"""
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT COUNT(*) as total FROM Grupos_tutoria")
+    if cursor.fetchone()['total'] > 0:
+        cursor.execute("""
+            SELECT g.id_sala, g.Id_usuario, g.Nombre_sala, g.Proposito_sala,
+                   g.Tipo_sala, g.Id_asignatura, a.Nombre as NombreAsignatura
+            FROM Grupos_tutoria g
+            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+            LIMIT 5
+        """)
+        cursor.fetchall()
+
+    cursor.execute("""
+        SELECT a.Id_asignatura, a.Nombre as Asignatura
+        FROM Matriculas m
+        JOIN Asignaturas a ON m.Id_asignatura = a.Id_asignatura
+        WHERE m.Id_usuario = ?
+    """, (estudiante_id,))
+    asignaturas_ids = [a['Id_asignatura'] for a in cursor.fetchall()]
+    placeholders = ','.join(['?'] * len(asignaturas_ids))
+
+    cursor.execute(f"""
+        SELECT DISTINCT u.Id_usuario, u.Nombre, u.Apellidos, u.Email_UGR, u.horario
+        FROM Usuarios u
+        WHERE u.Tipo = 'profesor'
+        AND (
+            u.Id_usuario IN (SELECT DISTINCT g.Id_usuario FROM Grupos_tutoria g
+                             WHERE g.Id_asignatura IN ({placeholders}))
+            OR
+            u.Id_usuario IN (SELECT DISTINCT m.Id_usuario FROM Matriculas m
+                             WHERE m.Id_asignatura IN ({placeholders}) AND m.Tipo = 'docente')
+        )
+        ORDER BY u.Apellidos, u.Nombre
+    """, asignaturas_ids + asignaturas_ids)
+
+    profesores = {p['Id_usuario']: {'asignaturas': {}} for p in cursor.fetchall()}
+
+    for profesor_id in profesores:
+        cursor.execute(f"""
+            SELECT DISTINCT a.Id_asignatura, a.Nombre as NombreAsignatura, a.Codigo_Asignatura as Codigo
+            FROM Matriculas m
+            JOIN Asignaturas a ON m.Id_asignatura = a.Id_asignatura
+            WHERE m.Id_usuario = ? AND m.Tipo = 'docente' AND m.Id_asignatura IN ({placeholders})
+            UNION
+            SELECT DISTINCT a.Id_asignatura, a.Nombre as NombreAsignatura, a.Codigo_Asignatura as Codigo
+            FROM Grupos_tutoria g
+            JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+            WHERE g.Id_usuario = ? AND g.Id_asignatura IN ({placeholders})
+        """, [profesor_id] + asignaturas_ids + [profesor_id] + asignaturas_ids)
+        for asig in cursor.fetchall():
+            profesores[profesor_id]['asignaturas'][asig['Id_asignatura']] = {'salas': []}
+
+    for profesor_id in profesores:
+        cursor.execute("""
+            SELECT g.id_sala, g.Nombre_sala, g.Proposito_sala, g.Chat_id, g.Tipo_sala,
+                   g.Id_asignatura, g.Enlace_invitacion, a.Nombre as NombreAsignatura
+            FROM Grupos_tutoria g
+            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+            WHERE g.Id_usuario = ?
+        """, (profesor_id,))
+        cursor.fetchall()
+
+    return profesores
+
+
+def medir(funcion, conn, estudiante_id, repeticiones):
+    """Devuelve (mediana_ms, p95_ms, consultas_por_llamada, profesores)"""
+    consultas = []
+    conn.set_trace_callback(lambda sql: consultas.append(sql))
+    resultado = funcion(conn, estudiante_id)
+    conn.set_trace_callback(None)
+
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(conn, estudiante_id)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+    return statistics.median(tiempos), p95, len(consultas), len(resultado)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de /tutoria")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    args = parser.parse_args()
+
+    print("=" * 78)
+    print("⏱️  BENCHMARK /tutoria: N+1 frente a consultas agrupadas")
+    print("=" * 78)
+    print(f"{'Profesores':>10} | {'Método':<12} | {'Consultas':>9} | {'Mediana ms':>10} | {'p95 ms':>8}")
+    print("-" * 78)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for num in TAMANOS:
+            ruta = os.path.join(tmp, f"bench_{num}.db")
+            estudiante_id = generar_bd(ruta, num)
+            conn = sqlite3.connect(ruta)
+            conn.row_factory = sqlite3.Row
+
+            antes = medir(arbol_n_mas_1, conn, estudiante_id, args.repeticiones)
+            despues = medir(
+                lambda c, e: obtener_arbol_tutorias(e, conn=c)[1],
+                conn, estudiante_id, args.repeticiones
+            )
+            conn.close()
+
+            for nombre, (mediana, p95, consultas, profesores) in (("N+1", antes), ("agrupado", despues)):
+                print(f"{num:>10} | {nombre:<12} | {consultas:>9} | {mediana:>10.2f} | {p95:>8.2f}")
+            if antes[3] != despues[3]:
+                print(f"⚠️ Distinto número de profesores: {antes[3]} frente a {despues[3]}")
+            print(f"{'':>10} | {'mejora':<12} | {'':>9} | {antes[0] / despues[0]:>9.1f}x |")
+            print("-" * 78)
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,9 @@ from grupo_handlers.utils import (
     configurar_logger, configurar_comandos_por_rol
 )
 # Importar estados desde el manejador central
-from utils.state_manager import user_states, user_data, estados_timestamp, set_state, get_state, clear_state
+from utils.state_manager import (
+    user_states, user_data, estados_timestamp, set_state, get_state, clear_state, instalar_sesiones
+)
 
 # Configuración de logging
 logger = configurar_logger()
@@ -52,35 +54,43 @@ from telebot import apihelper
 apihelper.ENABLE_MIDDLEWARE = True
 
 # Inicializar el bot
-bot = telebot.TeleBot(BOT_TOKEN)
+from config import ESTADOS_COMPARTIDOS, EJECUCION_BOT
+if EJECUCION_BOT == "asyncio":
+    # AsyncTeleBot con la interfaz de TeleBot que usan los handlers (utils/asincrono.py)
+    from utils.asincrono import crear_bot_asincrono
+    bot = crear_bot_asincrono(BOT_TOKEN)
+else:
+    bot = telebot.TeleBot(BOT_TOKEN, use_class_middlewares=ESTADOS_COMPARTIDOS)
 
 # Establecer el nivel de logging de telebot a DEBUG
 telebot.logger.setLevel(logging.DEBUG)
 
-# Mecanismo para prevenir instancias duplicadas del bot
-import socket
+# Instancia única de polling: cerrojo con latido en el backend de estado compartido
+# (sirve entre máquinas, no como el antiguo socket UDP en localhost:12345)
 import sys
 import atexit
+from utils.backend_estado import CerrojoLider
 
-def prevent_duplicate_instances(port=12345):
-    """Evita que se ejecuten múltiples instancias del bot usando un socket de bloqueo"""
-    global lock_socket
-    lock_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        lock_socket.bind(('localhost', port))
-        print(f"🔒 Instancia única asegurada en el puerto {port}")
-    except socket.error:
-        print("⚠️ ADVERTENCIA: Otra instancia del bot ya está en ejecución.")
-        print("⚠️ Cierra todas las demás instancias antes de ejecutar este script.")
-        sys.exit(1)
+def prevent_duplicate_instances(esperar=True):
+    """
+    Solo un proceso puede hacer polling con el mismo token. Los demás se
+    quedan en reserva y toman el relevo si el activo deja de renovar el cerrojo.
+    """
+    def perdido():
+        logger.critical("Otra instancia ha tomado el polling: deteniendo este proceso")
+        bot.stop_polling()
 
-    # Asegurar que el socket se cierra al salir
-    def cleanup():
-        lock_socket.close()
-    atexit.register(cleanup)
+    cerrojo = CerrojoLider("polling:bot_grupos", al_perder=perdido)
+    if not cerrojo.adquirir(esperar=False):
+        print("⚠️ ADVERTENCIA: Otra instancia del bot ya está en ejecución.")
+        if not esperar:
+            sys.exit(1)
+        print("⏳ Esperando en reserva hasta que quede libre...")
+        cerrojo.adquirir(esperar=True)
+    print("🔒 Instancia única asegurada")
 
-# Prevenir múltiples instancias
-prevent_duplicate_instances()
+    # Liberar el cerrojo al salir para que la reserva no espere al TTL
+    atexit.register(cerrojo.liberar)
 
 # Crear una función wrapper que maneje errores de Markdown
 def safe_send_message(chat_id, text, parse_mode=None, **kwargs):
@@ -95,6 +105,8 @@ def safe_send_message(chat_id, text, parse_mode=None, **kwargs):
 
 # Importar funciones de la base de datos compartidas
 from db.queries import get_db_connection, get_user_by_telegram_id, crear_grupo_tutoria
+from db.conexion import DB_PATH
+from db.consultas import ejecutar
 
 # Handlers básicos
 @bot.message_handler(commands=['start'])
@@ -116,7 +128,7 @@ def send_welcome(message):
         # Estamos en un grupo
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Grupos_tutoria WHERE Chat_id = ?", (str(chat_id),))
+        ejecutar(cursor, "salas.por_chat_id", (str(chat_id),))
         grupo = cursor.fetchone()
         conn.close()
         
@@ -215,7 +227,7 @@ def actualizar_interfaz_usuario(user_id, chat_id=None):
 # Iniciar hilo de limpieza periódica
 def limpieza_periodica():
     while True:
-        time.sleep(1800)  # 30 minutos
+        time.sleep(60)  # El barrido solo toca lo que caduca: puede ser frecuente
         try:
             limpiar_estados_obsoletos()
         except Exception as e:
@@ -255,7 +267,7 @@ def configurar_grupo(message):
     # Verificar si el grupo ya está configurado
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Grupos_tutoria WHERE Chat_id = ?", (str(chat_id),))
+    ejecutar(cursor, "salas.por_chat_id", (str(chat_id),))
     grupo = cursor.fetchone()
 
     if grupo:
@@ -264,7 +276,7 @@ def configurar_grupo(message):
         return
 
     # Obtener ID del usuario profesor
-    cursor.execute("SELECT Id_usuario FROM Usuarios WHERE TelegramID = ? AND Tipo = 'profesor'", (str(user_id),))
+    ejecutar(cursor, "usuarios.profesor_por_telegram_id", (str(user_id),))
     profesor_row = cursor.fetchone()
 
     if not profesor_row:
@@ -275,37 +287,17 @@ def configurar_grupo(message):
     profesor_id = profesor_row['Id_usuario']
 
     # CONSULTA MEJORADA: Obtener SOLO asignaturas sin sala de avisos asociada
-    cursor.execute("""
-        SELECT a.Id_asignatura, a.Nombre 
-        FROM Asignaturas a 
-        JOIN Matriculas m ON a.Id_asignatura = m.Id_asignatura
-        WHERE m.Id_usuario = ? 
-        AND NOT EXISTS (
-            SELECT 1 
-            FROM Grupos_tutoria g 
-            WHERE g.Id_asignatura = a.Id_asignatura 
-            AND g.Id_usuario = ?
-        )
-    """, (profesor_id, profesor_id))
+    ejecutar(cursor, "salas.asignaturas_sin_sala", (profesor_id, profesor_id))
 
     asignaturas_disponibles = cursor.fetchall()
 
     # Verificar si ya tiene sala de tutoría privada
-    cursor.execute("""
-        SELECT COUNT(*) as total
-        FROM Grupos_tutoria g
-        WHERE g.Id_usuario = ? AND g.Tipo_sala = 'privada'
-    """, (profesor_id,))
+    ejecutar(cursor, "gestion.contar_salas_privadas", (profesor_id,))
 
     tiene_privada = cursor.fetchone()['total'] > 0
 
     # Depuración - Mostrar salas actuales
-    cursor.execute("""
-        SELECT g.id_sala, g.Nombre_sala, g.Id_asignatura, a.Nombre as Asignatura
-        FROM Grupos_tutoria g
-        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-        WHERE g.Id_usuario = ?
-    """, (profesor_id,))
+    ejecutar(cursor, "salas.resumen_profesor", (profesor_id,))
 
     salas_actuales = cursor.fetchall()
     print(f"\n--- SALAS ACTUALES PARA PROFESOR ID {profesor_id} ---")
@@ -396,11 +388,11 @@ def handle_configuracion_asignatura(call):
         cursor = conn.cursor()
 
         # Obtener nombre de la asignatura
-        cursor.execute("SELECT Nombre FROM Asignaturas WHERE Id_asignatura = ?", (id_asignatura,))
+        ejecutar(cursor, "gestion.nombre_asignatura", (id_asignatura,))
         asignatura_nombre = cursor.fetchone()[0]
 
         # Obtener Id_usuario del profesor a partir de su TelegramID
-        cursor.execute("SELECT Id_usuario FROM Usuarios WHERE TelegramID = ?", (str(user_id),))
+        ejecutar(cursor, "usuarios.id_por_telegram_id", (str(user_id),))
         id_usuario_profesor = cursor.fetchone()[0]
 
         # Cerrar la conexión temporal
@@ -488,7 +480,7 @@ def handle_configuracion_tutoria_privada(call):
         cursor = conn.cursor()
         
         # Obtener Id_usuario y nombre del profesor a partir de su TelegramID
-        cursor.execute("SELECT Id_usuario, Nombre FROM Usuarios WHERE TelegramID = ?", (str(user_id),))
+        ejecutar(cursor, "usuarios.id_nombre_por_telegram_id", (str(user_id),))
         profesor = cursor.fetchone()
         id_usuario_profesor = profesor[0]
         nombre_profesor = profesor[1]
@@ -662,10 +654,7 @@ def handle_ver_estudiantes_cmd(message):
         cursor = conn.cursor()
         
         # Verificar que este chat es un grupo registrado
-        cursor.execute(
-            "SELECT id_sala FROM Grupos_tutoria WHERE Chat_id = ?", 
-            (str(chat_id),)
-        )
+        ejecutar(cursor, "salas.id_por_chat_id", (str(chat_id),))
         sala = cursor.fetchone()
         
         if not sala:
@@ -676,13 +665,7 @@ def handle_ver_estudiantes_cmd(message):
         sala_id = sala['id_sala']
         
         # Obtener lista de estudiantes
-        cursor.execute("""
-            SELECT u.Nombre, u.Apellidos, u.TelegramID, m.Fecha_incorporacion, m.Estado
-            FROM Miembros_Grupo m
-            JOIN Usuarios u ON m.Id_usuario = u.Id_usuario
-            WHERE m.id_sala = ? AND u.Tipo = 'alumno'
-            ORDER BY m.Fecha_incorporacion DESC
-        """, (sala_id,))
+        ejecutar(cursor, "miembros.estudiantes_sala", (sala_id,))
         
         estudiantes = cursor.fetchall()
         conn.close()
@@ -729,7 +712,7 @@ def handle_terminar_tutoria(message):
         # Verificar que estamos en una sala de tutoría
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Grupos_tutoria WHERE Chat_id = ?", (str(chat_id),))
+        ejecutar(cursor, "salas.por_chat_id", (str(chat_id),))
         grupo = cursor.fetchone()
         
         if not grupo:
@@ -958,14 +941,23 @@ if __name__ == "__main__":
     print("🚀🚀🚀 INICIANDO BOT DE GRUPOS Y TUTORÍAS 🚀🚀🚀")
     print("==================================================\n")
     
-    # Eliminar cualquier webhook existente
-    bot.remove_webhook()
+    from config import MODO_BOT
+    if MODO_BOT != "webhook":
+        # Prevenir múltiples instancias de polling (las demás esperan en reserva)
+        prevent_duplicate_instances()
+        
+        # Eliminar cualquier webhook existente
+        bot.remove_webhook()
     
     # Iniciar el hilo de limpieza periódica
     limpieza_thread = threading.Thread(target=limpieza_periodica)
     limpieza_thread.daemon = True
     limpieza_thread.start()
     
+    # kill -USR1 <pid> vuelca las estadísticas de consultas al log
+    from db.consultas import instalar_senal_volcado
+    instalar_senal_volcado()
+    
     try:
         # Registrar handlers de usuarios primero para darle prioridad
         from grupo_handlers.usuarios import register_student_handlers
@@ -975,22 +967,42 @@ if __name__ == "__main__":
         # NO registres más handlers para new_chat_members aquí
         
         # Resto del código...
-        gestion_grupos = GestionGrupos(db_path="db/tutoria.db")
+        gestion_grupos = GestionGrupos(db_path=DB_PATH)
         gestion_grupos.registrar_handlers(bot)
         print("✅ Handlers de gestión de grupos registrados")
         
         register_valoraciones_handlers(bot)
         print("✅ Handlers de valoraciones registrados")
         
-        print("🤖 Bot iniciando polling...")
+        # Con estado compartido, cada update se procesa con el cerrojo de su chat
+        if instalar_sesiones(bot):
+            print("✅ Sesiones de conversación compartidas activadas")
         
-        # Usar polling con configuración mejorada
-        bot.polling(
-            none_stop=True, 
-            interval=0, 
-            timeout=60,
-            allowed_updates=["message", "callback_query", "chat_member", "my_chat_member"]  # Asegúrate de incluir chat_member
-        )
+        allowed_updates = ["message", "callback_query", "chat_member", "my_chat_member"]  # Asegúrate de incluir chat_member
+        if MODO_BOT == "webhook":
+            from config import (WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PUERTO_GRUPOS, WEBHOOK_SECRETO,
+                                WEBHOOK_GRABAR)
+            from utils.webhook import servir_webhook
+            print("🤖 Bot iniciando en modo webhook...")
+            servir_webhook(
+                bot, WEBHOOK_URL, host=WEBHOOK_HOST, puerto=WEBHOOK_PUERTO_GRUPOS, ruta="/webhook/grupos",
+                secreto=WEBHOOK_SECRETO, grabar=WEBHOOK_GRABAR, allowed_updates=allowed_updates
+            )
+        else:
+            # Handlers en orden dentro de cada chat y en paralelo entre chats
+            from config import DESPACHADOR_HILOS, DESPACHADOR_CAPACIDAD
+            from utils.despachador import instalar_despachador
+            instalar_despachador(bot, hilos=DESPACHADOR_HILOS, capacidad=DESPACHADOR_CAPACIDAD)
+            
+            print("🤖 Bot iniciando polling...")
+            
+            # Usar polling con configuración mejorada
+            bot.polling(
+                none_stop=True, 
+                interval=0, 
+                timeout=60,
+                allowed_updates=allowed_updates
+            )
         
     except Exception as e:
         logger.critical(f"Error crítico al iniciar el bot: {e}")
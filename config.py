@@ -22,6 +22,61 @@ GRUPO_BOT_TOKEN = "tu_token_del_bot_para_grupos_aquí"
 SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_EMAIL = os.getenv("SMTP_EMAIL", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_PUERTO = int(os.getenv("SMTP_PUERTO", "587"))
+SMTP_HILOS = int(os.getenv("SMTP_HILOS", "2"))          # Conexiones SMTP simultáneas
+SMTP_REINTENTOS = int(os.getenv("SMTP_REINTENTOS", "4"))  # Intentos por correo
+
+# Cada cuántos segundos se comprueba si ha cambiado el Excel de usuarios
+EXCEL_RECARGA_SEGUNDOS = float(os.getenv("EXCEL_RECARGA_SEGUNDOS", "30"))
+
+# Conversaciones en curso (utils/state_manager.py): caducidad, máximo y si se guardan en la BD
+ESTADOS_TTL = float(os.getenv("ESTADOS_TTL", "3600"))
+ESTADOS_MAX = int(os.getenv("ESTADOS_MAX", "50000"))
+ESTADOS_PERSISTENTES = os.getenv("ESTADOS_PERSISTENTES", "0").lower() in ("1", "true", "si", "sí")
+
+# Estado compartido entre procesos (utils/backend_estado.py): backend ("sqlite" o "memoria") y si
+# varios procesos del mismo bot comparten conversaciones y cerrojos por chat
+ESTADOS_BACKEND = os.getenv("ESTADOS_BACKEND", "sqlite")
+ESTADOS_COMPARTIDOS = os.getenv("ESTADOS_COMPARTIDOS", "0").lower() in ("1", "true", "si", "sí")
+
+# Recepción de updates: "polling" (getUpdates) o "webhook" (utils/webhook.py)
+MODO_BOT = os.getenv("MODO_BOT", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # URL pública https; vacía = no registrar (pruebas en local)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PUERTO = int(os.getenv("WEBHOOK_PUERTO", "8443"))
+WEBHOOK_PUERTO_GRUPOS = int(os.getenv("WEBHOOK_PUERTO_GRUPOS", "8444"))
+WEBHOOK_SECRETO = os.getenv("WEBHOOK_SECRETO") or None
+WEBHOOK_GRABAR = os.getenv("WEBHOOK_GRABAR") or None             # Fichero donde grabar los updates recibidos
+
+# Despachador de updates (utils/despachador.py), en polling y en webhook: fragmentos con orden
+# por chat y updates en cola como máximo (en webhook, al superarlo se responde 503)
+DESPACHADOR_HILOS = int(os.getenv("DESPACHADOR_HILOS", "8"))
+DESPACHADOR_CAPACIDAD = int(os.getenv("DESPACHADOR_CAPACIDAD", "1000"))
+
+# Ejecución de los bots: "hilos" (TeleBot) o "asyncio" (AsyncTeleBot en un bucle de eventos,
+# utils/asincrono.py). En asyncio los handlers síncronos usan un grupo de hilos acotado
+EJECUCION_BOT = os.getenv("EJECUCION_BOT", "hilos")
+ASYNC_HILOS_HANDLERS = int(os.getenv("ASYNC_HILOS_HANDLERS", "64"))
+ASYNC_EN_VUELO = int(os.getenv("ASYNC_EN_VUELO", "5000"))            # Updates en curso como máximo
+ASYNC_CONEXIONES_API = int(os.getenv("ASYNC_CONEXIONES_API", "100"))  # Conexiones con la Bot API
+
+# Límites de envío a Telegram (utils/mensajeria.py)
+TELEGRAM_MSG_SEGUNDO = float(os.getenv("TELEGRAM_MSG_SEGUNDO", "30"))            # En total
+TELEGRAM_MSG_CHAT_SEGUNDO = float(os.getenv("TELEGRAM_MSG_CHAT_SEGUNDO", "1"))   # Por chat privado
+TELEGRAM_MSG_GRUPO_MINUTO = float(os.getenv("TELEGRAM_MSG_GRUPO_MINUTO", "20"))  # Por grupo
+TELEGRAM_HILOS_ENVIO = int(os.getenv("TELEGRAM_HILOS_ENVIO", "4"))
+
+# /disponibles: horas por delante que se consultan si no se indican (máximo una semana)
+DISPONIBLES_HORAS = float(os.getenv("DISPONIBLES_HORAS", "2"))
+
+# Citas de tutoría (utils/citas.py): minutos de cada hueco reservable, días por delante que se
+# pueden reservar y citas pendientes que puede tener un estudiante con un mismo profesor
+CITA_MINUTOS = int(os.getenv("CITA_MINUTOS", "15"))
+CITAS_DIAS = int(os.getenv("CITAS_DIAS", "14"))
+CITAS_POR_PROFESOR = int(os.getenv("CITAS_POR_PROFESOR", "1"))
+
+# Administradores (TelegramID separados por comas) con acceso a /estadisticas_bd
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
 
 # Mapping de áreas y carreras
 AREA_CARRERAS = {
@@ -19,4 +19,9 @@ def init_db():
         create_database()
         print(f"✅ Base de datos creada en: {DB_PATH}")
     else:
-        print(f"✅ Base de datos encontrada en: {DB_PATH}")
\ No newline at end of file
+        print(f"✅ Base de datos encontrada en: {DB_PATH}")
+        # Aplicar a bases de datos existentes las tablas e índices que falten
+        from .models import crear_tablas_faltantes, crear_indices, migrar_horarios_legados
+        crear_tablas_faltantes()
+        crear_indices()
+        migrar_horarios_legados()
\ No newline at end of file
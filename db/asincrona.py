@@ -0,0 +1,104 @@
+"""
+Acceso asíncrono a la base de datos para el modo asyncio (utils/asincrono.py).
+
+sqlite3 no tiene API asíncrona. Las lecturas se ejecutan en un grupo de
+hilos del tamaño del pool de conexiones (que es lo que de verdad limita las
+lecturas simultáneas) y la corrutina espera el resultado sin bloquear el
+bucle de eventos. Las escrituras van al escritor único y se espera su
+Future con asyncio.wrap_future, sin ocupar ningún hilo.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.conexion import conexion, TAMANO_POOL
+from db.consultas import ejecutar, percentil
+from db.escritor import encolar_escritura
+
+logger = logging.getLogger(__name__)
+
+
+class BDAsincrona:
+    """Lecturas del registro de consultas y escrituras del escritor, con await"""
+
+    def __init__(self, hilos=TAMANO_POOL):
+        self.hilos = hilos
+        self._ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="bd-async")
+
+        # Métricas
+        self.lecturas = 0
+        self.escrituras = 0
+        self.en_vuelo = 0
+        self.en_vuelo_max = 0
+        self._latencias = deque(maxlen=1024)   # ms desde el await hasta el resultado
+
+    async def _en_hilo(self, funcion, *args):
+        self.en_vuelo += 1
+        if self.en_vuelo > self.en_vuelo_max:
+            self.en_vuelo_max = self.en_vuelo
+        inicio = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._ejecutor, funcion, *args)
+        finally:
+            self.en_vuelo -= 1
+            self._latencias.append((time.perf_counter() - inicio) * 1000)
+
+    @staticmethod
+    def _leer(nombre, parametros, formato, uno):
+        with conexion() as conn:
+            cursor = ejecutar(conn, nombre, parametros, **formato)
+            return cursor.fetchone() if uno else cursor.fetchall()
+
+    async def consultar(self, nombre, parametros=(), **formato):
+        """Filas de una consulta del registro (CONSULTAS)"""
+        self.lecturas += 1
+        return await self._en_hilo(self._leer, nombre, parametros, formato, False)
+
+    async def consultar_uno(self, nombre, parametros=(), **formato):
+        """Primera fila de una consulta del registro, o None"""
+        self.lecturas += 1
+        return await self._en_hilo(self._leer, nombre, parametros, formato, True)
+
+    async def llamar(self, funcion, *args):
+        """Ejecuta una función síncrona de db/ (get_user_by_telegram_id...) sin bloquear el bucle"""
+        self.lecturas += 1
+        return await self._en_hilo(funcion, *args)
+
+    async def escribir(self, funcion):
+        """Como ejecutar_escritura(funcion), pero con await: devuelve lo que devuelva funcion"""
+        self.escrituras += 1
+        return await asyncio.wrap_future(encolar_escritura(funcion))
+
+    def estadisticas(self):
+        latencias = sorted(self._latencias)
+        return {
+            "hilos": self.hilos,
+            "lecturas": self.lecturas,
+            "escrituras": self.escrituras,
+            "en_vuelo": self.en_vuelo,
+            "en_vuelo_max": self.en_vuelo_max,
+            "latencia_p50_ms": percentil(latencias, 0.50),
+            "latencia_p95_ms": percentil(latencias, 0.95),
+        }
+
+
+_bd = None
+_bd_lock = threading.Lock()
+
+
+def get_bd_asincrona():
+    """Devuelve la capa asíncrona del proceso, creándola la primera vez"""
+    global _bd
+    if _bd is None:
+        with _bd_lock:
+            if _bd is None:
+                _bd = BDAsincrona()
+    return _bd
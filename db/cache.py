@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """
+    Caché en memoria LRU con caducidad (TTL) por entrada, segura entre hilos.
+
+    Se usa para las búsquedas que se repiten en casi todos los mensajes
+    (usuario por TelegramID) y que sólo cambian cuando alguien escribe en la
+    tabla correspondiente, momento en el que se invalida la entrada.
+    """
+
+    _AUSENTE = object()
+
+    def __init__(self, max_entradas=2048, ttl=300.0):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Contadores
+        self.aciertos = 0
+        self.fallos = 0
+        self.caducadas = 0
+        self.expulsadas = 0
+        self.invalidaciones = 0
+
+    def obtener(self, clave, defecto=None):
+        """Devuelve el valor cacheado o `defecto` si no está o ha caducado"""
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._datos.get(clave, self._AUSENTE)
+            if entrada is self._AUSENTE:
+                self.fallos += 1
+                return defecto
+
+            valor, caduca = entrada
+            if caduca <= ahora:
+                del self._datos[clave]
+                self.caducadas += 1
+                self.fallos += 1
+                return defecto
+
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave, valor):
+        """Guarda un valor, expulsando el menos usado si se supera el tamaño"""
+        with self._lock:
+            self._datos[clave] = (valor, time.monotonic() + self.ttl)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+                self.expulsadas += 1
+
+    def invalidar(self, clave):
+        """Elimina una entrada concreta"""
+        with self._lock:
+            if self._datos.pop(clave, self._AUSENTE) is not self._AUSENTE:
+                self.invalidaciones += 1
+
+    def limpiar(self):
+        """Vacía la caché completa"""
+        with self._lock:
+            self.invalidaciones += len(self._datos)
+            self._datos.clear()
+
+    def estadisticas(self):
+        """Resumen de uso de la caché"""
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._datos),
+                "max_entradas": self.max_entradas,
+                "ttl": self.ttl,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "tasa_aciertos": (self.aciertos / total) if total else 0.0,
+                "caducadas": self.caducadas,
+                "expulsadas": self.expulsadas,
+                "invalidaciones": self.invalidaciones,
+            }
@@ -0,0 +1,335 @@
+import sqlite3
+import os
+import sys
+import time
+import queue
+import threading
+import weakref
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.consultas import fabrica_conexion
+
+# Configurar logger
+logger = logging.getLogger(__name__)
+
+# Ruta a la base de datos
+DB_PATH = Path(__file__).parent.parent / "tutoria_ugr.db"
+
+# Parámetros del pool (se pueden ajustar desde datos.env.txt)
+TAMANO_POOL = int(os.getenv("DB_POOL_SIZE", "8"))
+TIMEOUT_ESPERA = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+INTERVALO_SALUD = 30.0          # Segundos de inactividad antes de revalidar una conexión
+SENTENCIAS_CACHEADAS = 256      # Sentencias preparadas que sqlite3 guarda por conexión
+
+# Modo de almacenamiento: WAL permite lecturas concurrentes mientras el hilo escritor trabaja
+MODO_WAL = os.getenv("DB_WAL", "1") != "0"
+PRAGMAS_CONEXION = (
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA mmap_size = 67108864",     # 64 MB
+)
+
+
+def configurar_almacenamiento(db_path=DB_PATH):
+    """
+    Activa el modo WAL en el fichero de la base de datos.
+    journal_mode es persistente, basta con hacerlo una vez al arrancar.
+
+    Returns:
+        str: Modo de journal resultante ('wal', 'delete'...)
+    """
+    conn = sqlite3.connect(str(db_path))
+    try:
+        conn.execute("PRAGMA busy_timeout = 5000")
+        modo = "WAL" if MODO_WAL else "DELETE"
+        resultado = conn.execute(f"PRAGMA journal_mode = {modo}").fetchone()[0]
+        if resultado.lower() != modo.lower():
+            logger.warning(f"No se pudo activar journal_mode={modo} (actual: {resultado})")
+        return resultado
+    finally:
+        conn.close()
+
+
+def aplicar_pragmas(conn):
+    """Aplica los PRAGMA por conexión (no persisten en el fichero)"""
+    for pragma in PRAGMAS_CONEXION:
+        conn.execute(pragma)
+    return conn
+
+
+def conectar(db_path=DB_PATH, **kwargs):
+    """
+    Abre una conexión propia (fuera del pool) con los PRAGMA comunes y
+    cursores instrumentados, para el código que gestiona su propia conexión.
+    """
+    return aplicar_pragmas(sqlite3.connect(str(db_path), factory=fabrica_conexion(), **kwargs))
+
+
+class ConexionPool:
+    """
+    Envoltorio de una conexión sqlite3 prestada por el pool.
+
+    Se comporta como una conexión normal (cursor, execute, commit...), pero
+    close() la devuelve al pool en lugar de cerrarla. Si el código que la pidió
+    olvida llamar a close(), se devuelve sola al ser recolectada.
+    """
+
+    __slots__ = ("_raw", "_finalizador", "__weakref__")
+
+    def __init__(self, pool, raw, agrupada=True):
+        object.__setattr__(self, "_raw", raw)
+        object.__setattr__(self, "_finalizador", weakref.finalize(self, pool._devolver, raw, agrupada))
+
+    def __getattr__(self, nombre):
+        raw = object.__getattribute__(self, "_raw")
+        if raw is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+        return getattr(raw, nombre)
+
+    def __setattr__(self, nombre, valor):
+        # row_factory, isolation_level, etc. se aplican a la conexión real
+        setattr(self._raw, nombre, valor)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+    def close(self):
+        """Devuelve la conexión al pool (se puede llamar varias veces)"""
+        if self._raw is None:
+            return
+        object.__setattr__(self, "_raw", None)
+        self._finalizador()
+
+    @property
+    def cerrada(self):
+        return self._raw is None
+
+
+class PoolConexiones:
+    """Pool de conexiones SQLite reutilizables con comprobación de salud y métricas"""
+
+    def __init__(self, db_path=DB_PATH, tamano_max=TAMANO_POOL, timeout=TIMEOUT_ESPERA,
+                 intervalo_salud=INTERVALO_SALUD):
+        self.db_path = str(db_path)
+        self.tamano_max = tamano_max
+        self.timeout = timeout
+        self.intervalo_salud = intervalo_salud
+
+        # LIFO: la última conexión devuelta es la más "caliente"
+        self._libres = queue.LifoQueue()
+        self._ultimo_uso = {}
+        self._lock = threading.Lock()
+        self._creadas = 0
+        self._cerrado = False
+
+        # Métricas
+        self._prestamos = 0
+        self._esperas = 0
+        self._tiempo_espera_total = 0.0
+        self._tiempo_espera_max = 0.0
+        self._desbordes = 0
+        self._descartadas = 0
+
+    # ===== CICLO DE VIDA DE LAS CONEXIONES =====
+    def _crear(self):
+        """Abre una conexión nueva con la configuración común"""
+        return aplicar_pragmas(sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=SENTENCIAS_CACHEADAS,
+            factory=fabrica_conexion(),
+        ))
+
+    def _esta_sana(self, raw):
+        """Comprueba que una conexión sigue operativa antes de prestarla"""
+        try:
+            inactiva = time.monotonic() - self._ultimo_uso.get(id(raw), 0)
+            if inactiva > self.intervalo_salud:
+                raw.execute("SELECT 1").fetchone()
+            else:
+                # Acceso barato que lanza ProgrammingError si alguien la cerró por debajo
+                raw.in_transaction
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _descartar(self, raw):
+        """Cierra una conexión que no vuelve al pool"""
+        with self._lock:
+            self._creadas -= 1
+            self._descartadas += 1
+            self._ultimo_uso.pop(id(raw), None)
+        try:
+            raw.close()
+        except sqlite3.Error:
+            pass
+
+    def _devolver(self, raw, agrupada=True):
+        """Limpia la conexión y la deja disponible para el siguiente préstamo"""
+        if not agrupada:
+            try:
+                raw.close()
+            except sqlite3.Error:
+                pass
+            return
+
+        try:
+            # No dejar transacciones abiertas que bloqueen a otros escritores
+            if raw.in_transaction:
+                raw.rollback()
+            raw.row_factory = None
+        except sqlite3.Error:
+            self._descartar(raw)
+            return
+
+        if self._cerrado:
+            self._descartar(raw)
+            return
+
+        self._ultimo_uso[id(raw)] = time.monotonic()
+        self._libres.put(raw)
+
+    def obtener(self, row_factory=None, timeout=None):
+        """
+        Presta una conexión del pool
+
+        Args:
+            row_factory: Fábrica de filas a aplicar (por ejemplo sqlite3.Row)
+            timeout: Segundos máximos de espera si el pool está agotado
+
+        Returns:
+            ConexionPool: Conexión prestada; close() la devuelve al pool
+        """
+        timeout = self.timeout if timeout is None else timeout
+        raw = None
+
+        while raw is None:
+            try:
+                raw = self._libres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    puede_crear = self._creadas < self.tamano_max
+                    if puede_crear:
+                        self._creadas += 1
+                if puede_crear:
+                    try:
+                        raw = self._crear()
+                    except sqlite3.Error:
+                        with self._lock:
+                            self._creadas -= 1
+                        raise
+                    break
+
+                # Pool agotado: esperar a que alguien devuelva una conexión
+                inicio = time.monotonic()
+                try:
+                    raw = self._libres.get(timeout=timeout)
+                except queue.Empty:
+                    raw = None
+                espera = time.monotonic() - inicio
+                with self._lock:
+                    self._esperas += 1
+                    self._tiempo_espera_total += espera
+                    self._tiempo_espera_max = max(self._tiempo_espera_max, espera)
+
+                if raw is None:
+                    # Mejor una conexión suelta que bloquear el hilo del bot
+                    logger.warning(f"Pool de conexiones agotado tras {espera:.2f}s, abriendo conexión extra")
+                    with self._lock:
+                        self._desbordes += 1
+                    extra = self._crear()
+                    extra.row_factory = row_factory
+                    with self._lock:
+                        self._prestamos += 1
+                    return ConexionPool(self, extra, agrupada=False)
+
+            if raw is not None and not self._esta_sana(raw):
+                self._descartar(raw)
+                raw = None
+
+        raw.row_factory = row_factory
+        with self._lock:
+            self._prestamos += 1
+        return ConexionPool(self, raw)
+
+    def cerrar(self):
+        """Cierra todas las conexiones libres (las prestadas se cierran al devolverse)"""
+        self._cerrado = True
+        while True:
+            try:
+                raw = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(raw)
+
+    # ===== MÉTRICAS =====
+    def estadisticas(self):
+        """Devuelve un resumen del estado del pool"""
+        with self._lock:
+            libres = self._libres.qsize()
+            return {
+                "tamano_max": self.tamano_max,
+                "creadas": self._creadas,
+                "libres": libres,
+                "en_uso": self._creadas - libres,
+                "prestamos": self._prestamos,
+                "esperas": self._esperas,
+                "espera_media_ms": (self._tiempo_espera_total / self._esperas * 1000) if self._esperas else 0.0,
+                "espera_max_ms": self._tiempo_espera_max * 1000,
+                "desbordes": self._desbordes,
+                "descartadas": self._descartadas,
+            }
+
+
+# ===== POOL COMPARTIDO =====
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Devuelve el pool del proceso, creándolo la primera vez"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    configurar_almacenamiento(DB_PATH)
+                except sqlite3.Error as e:
+                    logger.error(f"Error configurando el modo de almacenamiento: {e}")
+                _pool = PoolConexiones()
+    return _pool
+
+
+def obtener_conexion(row_factory=sqlite3.Row):
+    """Presta una conexión del pool compartido (compatible con get_db_connection)"""
+    return get_pool().obtener(row_factory=row_factory)
+
+
+@contextmanager
+def conexion(row_factory=sqlite3.Row):
+    """
+    Presta una conexión dentro de un bloque with y la devuelve al salir
+
+    Ejemplo:
+        with conexion() as conn:
+            conn.execute("SELECT ...")
+    """
+    conn = obtener_conexion(row_factory)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def estadisticas_pool():
+    """Métricas del pool compartido"""
+    return get_pool().estadisticas()
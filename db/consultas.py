@@ -0,0 +1,974 @@
+"""
+Registro de consultas SQL con nombre y métricas de ejecución.
+
+Todas las consultas de db/queries.py, de los handlers y de GestionGrupos
+están en CONSULTAS con un nombre estable ("usuarios.por_telegram_id") y se
+lanzan con ejecutar(cursor, nombre, parametros), igual que las de main.py y
+bot_grupo_main.py. Las conexiones del pool, del hilo escritor y de
+conectar() usan CursorMedido, que mide cada sentencia (ejecución más
+lectura de filas) y acumula por nombre llamadas, errores, filas devueltas y
+latencias p50/p95/p99. El SQL suelto que quede fuera del registro (migraciones,
+scripts) también se mide, con un nombre "sql:" sacado del propio texto.
+
+El resumen se obtiene con volcar_estadisticas(), con la señal SIGUSR1
+(instalar_senal_volcado) o con el comando /estadisticas_bd.
+"""
+import os
+import signal
+import sqlite3
+import threading
+import time
+import logging
+from collections import deque
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+METRICAS_ACTIVAS = os.getenv("DB_METRICAS", "1") != "0"
+TAMANO_MUESTRA = 1024          # Latencias guardadas por consulta para los percentiles
+MAX_CONSULTAS_DISTINTAS = 512  # Límite de nombres "sql:" para no crecer sin control
+LONGITUD_NOMBRE_ANONIMO = 60
+
+# Asignaturas del estudiante y profesores que las imparten (por matrícula docente o por sala creada)
+_CTE_TUTORIAS = """
+    WITH asig_estudiante AS (
+        SELECT DISTINCT m.Id_asignatura
+        FROM Matriculas m
+        JOIN Asignaturas a ON m.Id_asignatura = a.Id_asignatura
+        WHERE m.Id_usuario = ?
+    ),
+    prof_asig AS (
+        SELECT m.Id_usuario AS Id_profesor, m.Id_asignatura
+        FROM Matriculas m
+        WHERE m.Tipo = 'docente' AND m.Id_asignatura IN asig_estudiante
+        UNION
+        SELECT g.Id_usuario, g.Id_asignatura
+        FROM Grupos_tutoria g
+        WHERE g.Id_asignatura IN asig_estudiante
+    )
+"""
+
+# ===== REGISTRO DE CONSULTAS =====
+# Las plantillas con {placeholders}, {set_clause} o {filtros} se completan en
+# sql(); los valores siempre van como parámetros "?"
+CONSULTAS = {
+    # ----- USUARIOS -----
+    "usuarios.actualizar_horario": "UPDATE Usuarios SET Horario = ? WHERE Id_usuario = ?",
+    "usuarios.actualizar": "UPDATE Usuarios SET {set_clause} WHERE Id_usuario = ?",
+    "usuarios.crear": """
+        INSERT INTO Usuarios
+        (Nombre, Tipo, Email_UGR, TelegramID, Apellidos, DNI, Carrera, Area, Registrado)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    "usuarios.estudiante_por_id": """
+        SELECT *
+        FROM Usuarios
+        WHERE Id_usuario = ? AND Tipo = 'estudiante'
+    """,
+    "usuarios.horario_por_telegram_id": "SELECT Id_usuario, Horario FROM Usuarios WHERE TelegramID = ?",
+    "usuarios.id_nombre_por_telegram_id": "SELECT Id_usuario, Nombre FROM Usuarios WHERE TelegramID = ?",
+    "usuarios.id_por_email": "SELECT Id_usuario FROM Usuarios WHERE Email_UGR = ?",
+    "usuarios.id_por_telegram_id": "SELECT Id_usuario FROM Usuarios WHERE TelegramID = ?",
+    "usuarios.listar": "SELECT * FROM Usuarios ORDER BY Id_usuario",
+    "usuarios.marcar_registrado": "UPDATE Usuarios SET Registrado = 'SI', TelegramID = ? WHERE Email_UGR = ?",
+    "usuarios.nombre": "SELECT Nombre FROM Usuarios WHERE Id_usuario = ?",
+    "usuarios.por_email": "SELECT * FROM Usuarios WHERE Email_UGR = ?",
+    "usuarios.por_id": "SELECT * FROM Usuarios WHERE Id_usuario = ?",
+    "usuarios.por_telegram_id": "SELECT * FROM Usuarios WHERE TelegramID = ?",
+    "usuarios.por_tipo": "SELECT * FROM Usuarios WHERE Tipo = ? ORDER BY Id_usuario",
+    "usuarios.profesor_por_telegram_id": "SELECT Id_usuario FROM Usuarios WHERE TelegramID = ? AND Tipo = 'profesor'",
+    "usuarios.tipo": "SELECT Tipo FROM Usuarios WHERE Id_usuario = ?",
+
+    # ----- MATRÍCULAS -----
+    "matriculas.actualizar": "UPDATE Matriculas SET {set_clause} WHERE id_matricula = ?",
+    "matriculas.buscar": "SELECT * FROM Matriculas WHERE Id_usuario = ? AND Id_asignatura = ?",
+    "matriculas.contar": """
+        SELECT COUNT(*) as count
+        FROM Matriculas
+        WHERE Id_usuario = ? AND Id_asignatura = ?
+    """,
+    "matriculas.crear": "INSERT INTO Matriculas (Id_usuario, Id_asignatura, Tipo) VALUES (?, ?, ?)",
+    "matriculas.crear_con_curso": "INSERT INTO Matriculas (Id_usuario, Id_asignatura, Tipo, Curso) VALUES (?, ?, ?, ?)",
+    "matriculas.por_usuario": """
+        SELECT m.*, a.Nombre as Asignatura
+        FROM Matriculas m
+        JOIN Asignaturas a ON m.Id_asignatura = a.Id_asignatura
+        WHERE m.Id_usuario = ?
+    """,
+    "matriculas.por_usuario_con_carrera": """
+        SELECT
+            m.id_matricula,
+            m.Id_usuario,
+            m.Id_asignatura,
+            m.Curso,
+            a.Nombre as Asignatura,
+            u.Carrera as Carrera
+        FROM
+            Matriculas m
+        JOIN
+            Asignaturas a ON m.Id_asignatura = a.Id_asignatura
+        JOIN
+            Usuarios u ON m.Id_usuario = u.Id_usuario
+        WHERE
+            m.Id_usuario = ?
+    """,
+
+    # ----- GRUPOS DE TUTORÍA -----
+    "grupos.actualizar": "UPDATE Grupos_tutoria SET {set_clause} WHERE id_sala = ?",
+    "grupos.listar": """
+        SELECT g.*, a.Nombre as Asignatura, u.Nombre as Profesor, u.Apellidos as Apellidos_Profesor
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
+        WHERE 1=1{filtros} AND g.Chat_id IS NOT NULL
+    """,
+    "grupos.crear": """
+        INSERT INTO Grupos_tutoria
+        (Id_usuario, Nombre_sala, Tipo_sala, Id_asignatura, Chat_id, Enlace_invitacion, Proposito_sala)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    "grupos.crear_directo": """
+        INSERT INTO Grupos_tutoria
+        (Id_usuario, Nombre_sala, Tipo_sala, Id_asignatura, Chat_id, Proposito_sala, Enlace_invitacion)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    "grupos.por_asignaturas": """
+        SELECT g.*, a.Nombre as Asignatura, u.Nombre as Profesor, u.Apellidos as Apellidos_Profesor
+        FROM Grupos_tutoria g
+        JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
+        WHERE g.Id_asignatura IN ({placeholders}) AND g.Chat_id IS NOT NULL
+        ORDER BY u.Nombre, g.Nombre_sala
+    """,
+    "grupos.por_id": """
+        SELECT g.*, a.Nombre as Asignatura, u.Nombre as Profesor, u.Apellidos as Apellidos_Profesor
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
+        WHERE g.id_sala = ?
+    """,
+
+    # ----- SALAS -----
+    "salas.actualizar_nombre": "UPDATE Grupos_tutoria SET Nombre_sala = ? WHERE id_sala = ?",
+    "salas.actualizar_proposito": """
+        UPDATE Grupos_tutoria SET Proposito_sala = ?
+        WHERE id_sala = ? AND Id_usuario = ?
+    """,
+    "salas.actualizar_tipo": "UPDATE Grupos_tutoria SET Tipo_sala = ? WHERE id_sala = ?",
+    "salas.asignaturas_sin_sala": """
+        SELECT a.Id_asignatura, a.Nombre
+        FROM Asignaturas a
+        JOIN Matriculas m ON a.Id_asignatura = m.Id_asignatura
+        WHERE m.Id_usuario = ?
+        AND NOT EXISTS (
+            SELECT 1
+            FROM Grupos_tutoria g
+            WHERE g.Id_asignatura = a.Id_asignatura
+            AND g.Id_usuario = ?
+        )
+    """,
+    "salas.con_asignatura": """
+        SELECT g.*, a.Nombre as NombreAsignatura
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.id_sala = ?
+    """,
+    "salas.con_asignatura_de_profesor": """
+        SELECT g.*, a.Nombre as NombreAsignatura
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.id_sala = ? AND g.Id_usuario = ?
+    """,
+    "salas.con_asignatura_y_profesor": """
+        SELECT g.*, a.Nombre as NombreAsignatura, u.Nombre as NombreProfesor
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        LEFT JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
+        WHERE g.id_sala = ?
+    """,
+    "salas.de_profesor": """
+        SELECT g.Nombre_sala, g.Proposito_sala, g.Tipo_sala, g.Fecha_creacion,
+               g.id_sala, g.Chat_id, a.Nombre as NombreAsignatura
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.Id_usuario = ?
+        ORDER BY g.Fecha_creacion DESC
+    """,
+    "salas.detalle_solicitud": """
+        SELECT
+            g.*,
+            u.Nombre as NombreProfesor,
+            u.Apellidos as ApellidosProfesor,
+            u.TelegramID as ProfesorTelegramID,
+            u.Horario as HorarioProfesor,
+            a.Nombre as NombreAsignatura
+        FROM Grupos_tutoria g
+        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.id_sala = ? AND g.Id_usuario = ?
+    """,
+    "salas.eliminar_de_profesor": "DELETE FROM Grupos_tutoria WHERE id_sala = ? AND Id_usuario = ?",
+    "salas.id_por_chat_id": "SELECT id_sala FROM Grupos_tutoria WHERE chat_id = ?",
+    "salas.nombre": "SELECT Nombre_sala FROM Grupos_tutoria WHERE id_sala = ?",
+    "salas.por_chat_id": "SELECT * FROM Grupos_tutoria WHERE Chat_id = ?",
+    "salas.por_id": "SELECT * FROM Grupos_tutoria WHERE id_sala = ?",
+    "salas.por_id_y_profesor_telegram": """
+        SELECT g.*, u.Nombre as NombreProfesor, u.Apellidos as ApellidosProfesor
+        FROM Grupos_tutoria g
+        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
+        WHERE g.id_sala = ? AND g.Id_usuario = (
+            SELECT Id_usuario FROM Usuarios WHERE TelegramID = ?
+        )
+    """,
+    "salas.por_profesor_asignatura": """
+        SELECT g.*, u.Nombre as NombreProfesor
+        FROM Grupos_tutoria g
+        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
+        WHERE g.Id_usuario = ? AND (g.Id_asignatura = ? OR g.Id_asignatura IS NULL)
+        ORDER BY g.Proposito_sala ASC
+    """,
+    "salas.resumen_profesor": """
+        SELECT g.id_sala, g.Nombre_sala, g.Id_asignatura, a.Nombre as Asignatura
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.Id_usuario = ?
+    """,
+
+    # ----- MIEMBROS DE GRUPO -----
+    "miembros.activar": """
+        UPDATE Miembros_Grupo
+        SET Estado = 'activo'
+        WHERE id_sala = ? AND Id_usuario = ?
+    """,
+    "miembros.activar_por_id": "UPDATE Miembros_Grupo SET Estado = 'activo' WHERE id_miembro = ?",
+    "miembros.activos_con_usuario": """
+        SELECT u.Nombre, u.Apellidos, u.Email_UGR, mg.Fecha_union, mg.Estado
+        FROM Miembros_Grupo mg
+        JOIN Usuarios u ON mg.Id_usuario = u.Id_usuario
+        WHERE mg.id_sala = ? AND mg.Estado = 'activo'
+        ORDER BY mg.Fecha_union DESC
+    """,
+    "miembros.buscar": """
+        SELECT * FROM Miembros_Grupo
+        WHERE id_sala = ? AND Id_usuario = ?
+    """,
+    "miembros.contar_activos": "SELECT COUNT(*) as total FROM Miembros_Grupo WHERE id_sala = ? AND Estado = 'activo'",
+    "miembros.crear": """
+        INSERT INTO Miembros_Grupo (id_sala, Id_usuario)
+        VALUES (?, ?)
+    """,
+    "miembros.crear_activo": """
+        INSERT INTO Miembros_Grupo (id_sala, Id_usuario, Estado)
+        VALUES (?, ?, 'activo')
+    """,
+    "miembros.crear_pendiente": """
+        INSERT INTO Miembros_Grupo (id_sala, Id_usuario, Estado)
+        VALUES (?, ?, 'pendiente')
+    """,
+    "miembros.eliminar_de_sala": "DELETE FROM Miembros_Grupo WHERE id_sala = ?",
+    "miembros.eliminar_salvo_creador": """
+        DELETE FROM Miembros_Grupo
+        WHERE id_sala = ? AND Id_usuario != (
+            SELECT Id_usuario FROM Grupos_tutoria WHERE id_sala = ?
+        )
+    """,
+    "miembros.estudiantes_sala": """
+        SELECT u.Nombre, u.Apellidos, u.TelegramID, m.Fecha_union as Fecha_incorporacion, m.Estado
+        FROM Miembros_Grupo m
+        JOIN Usuarios u ON m.Id_usuario = u.Id_usuario
+        WHERE m.id_sala = ? AND u.Tipo = 'estudiante'
+        ORDER BY m.Fecha_union DESC
+    """,
+    "miembros.id_por_sala_usuario": "SELECT id_miembro FROM Miembros_Grupo WHERE id_sala = ? AND Id_usuario = ?",
+    "miembros.por_sala": """
+        SELECT id_miembro, id_sala, Id_usuario, Fecha_union, Estado
+        FROM Miembros_Grupo
+        WHERE id_sala = ? AND (? IS NULL OR Estado = ?)
+        ORDER BY id_miembro
+    """,
+
+    # ----- PROFESORES -----
+    "profesores.horario": """
+        SELECT
+            Id_usuario,
+            Nombre,
+            Horario
+        FROM
+            Usuarios
+        WHERE
+            Id_usuario = ? AND Tipo = 'profesor'
+    """,
+    "profesores.por_asignatura": """
+        SELECT DISTINCT u.*
+        FROM Usuarios u
+        JOIN Matriculas m ON u.Id_usuario = m.Id_usuario
+        WHERE m.Id_asignatura = ?
+        AND u.Tipo = 'profesor'
+        AND m.Tipo = 'docente'
+    """,
+    "profesores.por_asignaturas": """
+        SELECT DISTINCT u.Id_usuario, u.Nombre, u.Apellidos, u.Email_UGR, u.Horario
+        FROM Usuarios u
+        JOIN Matriculas m ON u.Id_usuario = m.Id_usuario
+        WHERE u.Tipo = 'profesor' AND m.Id_asignatura IN ({placeholders})
+    """,
+
+    # ----- /tutoria -----
+    "tutorias.asignaturas_estudiante": """
+        SELECT a.Id_asignatura, a.Nombre as Asignatura
+        FROM Matriculas m
+        JOIN Asignaturas a ON m.Id_asignatura = a.Id_asignatura
+        WHERE m.Id_usuario = ?
+    """,
+    "tutorias.profesores_asignaturas": _CTE_TUTORIAS + """
+        SELECT
+            u.Id_usuario, u.Nombre, u.Apellidos, u.Email_UGR, u.Horario,
+            a.Id_asignatura, a.Nombre as NombreAsignatura, a.Codigo_Asignatura as Codigo
+        FROM prof_asig pa
+        JOIN Usuarios u ON u.Id_usuario = pa.Id_profesor
+        JOIN Asignaturas a ON a.Id_asignatura = pa.Id_asignatura
+        WHERE u.Tipo = 'profesor'
+        ORDER BY u.Apellidos, u.Nombre, u.Id_usuario, a.Nombre
+    """,
+    "tutorias.profesores_estudiante": _CTE_TUTORIAS + """
+        SELECT u.Id_usuario, u.Nombre, u.Apellidos, REPLACE(GROUP_CONCAT(DISTINCT a.Nombre), ',', ', ') AS Asignaturas
+        FROM prof_asig pa
+        JOIN Usuarios u ON u.Id_usuario = pa.Id_profesor
+        JOIN Asignaturas a ON a.Id_asignatura = pa.Id_asignatura
+        WHERE u.Tipo = 'profesor'
+        GROUP BY u.Id_usuario
+        ORDER BY u.Apellidos, u.Nombre
+    """,
+    "tutorias.salas_profesores": _CTE_TUTORIAS + """
+        SELECT
+            g.id_sala, g.Id_usuario, g.Nombre_sala, g.Proposito_sala, g.Chat_id,
+            g.Tipo_sala, g.Id_asignatura, g.Enlace_invitacion,
+            a.Nombre as NombreAsignatura
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.Id_usuario IN (SELECT Id_profesor FROM prof_asig)
+        ORDER BY g.Id_usuario, g.id_sala
+    """,
+
+    # ----- HORARIOS -----
+    "horarios.por_usuario": "SELECT dia, hora_inicio, hora_fin FROM Horarios_Profesores WHERE Id_usuario = ?",
+
+    # ----- FRANJAS DE HORARIO (tabla canónica, minutos desde las 00:00) -----
+    "franjas.por_usuario": """
+        SELECT Dia, Inicio, Fin
+        FROM Franjas_horario
+        WHERE Id_usuario = ?
+        ORDER BY Dia, Inicio
+    """,
+    "franjas.por_usuarios": """
+        SELECT Id_usuario, Dia, Inicio, Fin
+        FROM Franjas_horario
+        WHERE Id_usuario IN ({placeholders})
+        ORDER BY Id_usuario, Dia, Inicio
+    """,
+    "franjas.todas": """
+        SELECT Id_usuario, Dia, Inicio, Fin
+        FROM Franjas_horario
+        ORDER BY Id_usuario, Dia, Inicio
+    """,
+    "franjas.borrar_usuario": "DELETE FROM Franjas_horario WHERE Id_usuario = ?",
+    "franjas.insertar": "INSERT INTO Franjas_horario (Id_usuario, Dia, Inicio, Fin) VALUES (?, ?, ?, ?)",
+    "migracion.horarios_pendientes": """
+        SELECT u.Id_usuario, u.Horario
+        FROM Usuarios u
+        WHERE NOT EXISTS (SELECT 1 FROM Franjas_horario f WHERE f.Id_usuario = u.Id_usuario)
+        AND ((u.Horario IS NOT NULL AND u.Horario != '')
+             OR EXISTS (SELECT 1 FROM Horarios_Profesores hp WHERE hp.Id_usuario = u.Id_usuario))
+    """,
+
+    # ----- CARRERAS -----
+    "carreras.crear": "INSERT INTO Carreras (Nombre_carrera) VALUES (?)",
+    "carreras.listar": "SELECT id_carrera, Nombre_carrera FROM Carreras ORDER BY Nombre_carrera",
+    "carreras.por_nombre": "SELECT id_carrera FROM Carreras WHERE Nombre_carrera = ?",
+
+    # ----- ASIGNATURAS -----
+    "asignaturas.asignar_carrera": "UPDATE Asignaturas SET Id_carrera = ? WHERE Id_asignatura = ? AND Id_carrera IS NULL",
+    "asignaturas.crear": "INSERT INTO Asignaturas (Nombre, Id_carrera) VALUES (?, ?)",
+
+    # ----- VALORACIONES -----
+    "valoraciones.crear": """
+        INSERT INTO Valoraciones
+        (evaluador_id, profesor_id, puntuacion, comentario, fecha, es_anonimo, id_sala)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    "valoraciones.profesores_del_estudiante": """
+        SELECT DISTINCT u.Id_usuario, u.Nombre
+        FROM Usuarios u
+        JOIN Matriculas mp ON u.Id_usuario = mp.Id_usuario
+        JOIN Asignaturas a ON mp.Id_asignatura = a.Id_asignatura
+        JOIN Matriculas me ON a.Id_asignatura = me.Id_asignatura
+        WHERE u.Tipo = 'profesor' AND me.Id_usuario = ?
+        ORDER BY u.Nombre
+    """,
+
+    # ----- GestionGrupos (grupo_handlers/grupos.py) -----
+    "gestion.asignaturas_con_sala_publica": """
+        SELECT Id_asignatura
+        FROM Grupos_tutoria
+        WHERE Id_usuario = ? AND Tipo_sala = 'pública' AND Id_asignatura IS NOT NULL
+    """,
+    "gestion.asignaturas_profesor": """
+        SELECT a.Id_asignatura, a.Nombre
+        FROM Usuarios u
+        JOIN Matriculas m ON m.Id_usuario = u.Id_usuario
+        JOIN Asignaturas a ON a.Id_asignatura = m.Id_asignatura
+        WHERE u.TelegramID = ?
+    """,
+    "gestion.cambiar_asignatura_sala": "UPDATE Grupos_tutoria SET Id_asignatura = ? WHERE id_sala = ?",
+    "gestion.chat_de_sala": "SELECT Chat_id FROM Grupos_tutoria WHERE id_sala = ?",
+    "gestion.contar_salas_privadas": """
+        SELECT COUNT(*) as total
+        FROM Grupos_tutoria
+        WHERE Id_usuario = ? AND Tipo_sala = 'privada'
+    """,
+    "gestion.detalle_sala": """
+        SELECT g.Nombre_sala, g.Chat_id,
+               CASE
+                   WHEN g.Tipo_sala = 'privada' THEN 'Sala de Tutorías'
+                   ELSE a.Nombre
+               END as tipo_o_asignatura
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.id_sala = ?
+    """,
+    "gestion.eliminar_sala": "DELETE FROM Grupos_tutoria WHERE id_sala = ?",
+    "gestion.guardar_grupo": """
+        INSERT INTO Grupos_tutoria (
+            Id_usuario, Nombre_sala, Tipo_sala, Id_asignatura,
+            Chat_id, Enlace_invitacion
+        ) VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    "gestion.nombre_asignatura": "SELECT Nombre FROM Asignaturas WHERE Id_asignatura = ?",
+    "gestion.salas_profesor": """
+        SELECT g.id_sala, g.Nombre_sala,
+               CASE
+                   WHEN g.Tipo_sala = 'privada' THEN 'Sala de Tutorías'
+                   ELSE a.Nombre
+               END as tipo_o_asignatura
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.Id_usuario = ?
+    """,
+    "gestion.salas_publicas_profesor": """
+        SELECT g.id_sala, g.Nombre_sala, a.Nombre, g.Id_asignatura
+        FROM Grupos_tutoria g
+        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
+        WHERE g.Id_usuario = ? AND g.Tipo_sala = 'pública'
+    """,
+    "gestion.tipo_sala_por_chat": """
+        SELECT Tipo_sala FROM Grupos_tutoria
+        WHERE Chat_id LIKE ?
+    """,
+    "gestion.tipo_usuario": "SELECT Tipo FROM Usuarios WHERE TelegramID = ?",
+
+    # ----- IMPORTACIÓN MASIVA DEL EXCEL (utils/excel_manager.py) -----
+    "importacion.usuarios": "SELECT Email_UGR, Id_usuario FROM Usuarios WHERE Email_UGR IS NOT NULL",
+    "importacion.upsert_usuario": """
+        INSERT INTO Usuarios (Nombre, Apellidos, DNI, Email_UGR, Tipo, Area, Carrera, Registrado)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 'NO')
+        ON CONFLICT(Email_UGR) DO UPDATE SET
+            Nombre = excluded.Nombre,
+            Apellidos = excluded.Apellidos,
+            DNI = excluded.DNI,
+            Area = excluded.Area,
+            Carrera = excluded.Carrera
+    """,
+    "importacion.carreras": "SELECT Nombre_carrera, id_carrera FROM Carreras",
+    "importacion.crear_carrera": "INSERT OR IGNORE INTO Carreras (Nombre_carrera) VALUES (?)",
+    "importacion.asignaturas": "SELECT Nombre, Id_asignatura FROM Asignaturas ORDER BY Id_asignatura",
+    "importacion.crear_asignatura": "INSERT INTO Asignaturas (Nombre, Id_carrera) VALUES (?, ?)",
+    "importacion.matriculas": "SELECT Id_usuario, Id_asignatura FROM Matriculas",
+    "importacion.hash": "SELECT Hash FROM Importacion_Excel WHERE Ruta = ?",
+    "importacion.guardar_hash": """
+        INSERT INTO Importacion_Excel (Ruta, Hash, Fecha) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(Ruta) DO UPDATE SET Hash = excluded.Hash, Fecha = excluded.Fecha
+    """,
+    "importacion.huellas": "SELECT Email, Huella FROM Huellas_Excel",
+    "importacion.guardar_huella": """
+        INSERT INTO Huellas_Excel (Email, Huella) VALUES (?, ?)
+        ON CONFLICT(Email) DO UPDATE SET Huella = excluded.Huella
+    """,
+    "importacion.borrar_huella": "DELETE FROM Huellas_Excel WHERE Email = ?",
+    "importacion.matriculas_excel": "SELECT Email, Id_asignatura FROM Matriculas_Excel",
+    "importacion.guardar_matricula_excel": "INSERT OR IGNORE INTO Matriculas_Excel (Email, Id_asignatura) VALUES (?, ?)",
+    "importacion.borrar_matricula_excel": "DELETE FROM Matriculas_Excel WHERE Email = ? AND Id_asignatura = ?",
+    "importacion.borrar_matriculas_excel": "DELETE FROM Matriculas_Excel WHERE Email = ?",
+    "importacion.borrar_matricula": "DELETE FROM Matriculas WHERE Id_usuario = ? AND Id_asignatura = ?",
+    "importacion.borrar_matriculas_no_registrado": """
+        DELETE FROM Matriculas WHERE Id_usuario = (
+            SELECT Id_usuario FROM Usuarios
+            WHERE Email_UGR = ? AND TelegramID IS NULL AND COALESCE(Registrado, 'NO') != 'SI'
+        )
+    """,
+    "importacion.borrar_usuario_no_registrado": """
+        DELETE FROM Usuarios
+        WHERE Email_UGR = ? AND TelegramID IS NULL AND COALESCE(Registrado, 'NO') != 'SI'
+    """,
+
+    # ----- CÓDIGOS DE VERIFICACIÓN (db/tokens.py) -----
+    "tokens.vigentes": """
+        SELECT chat_id, Email, Tipo, Huella, Expira, Intentos, Bloqueado_hasta
+        FROM Tokens_verificacion WHERE Caduca > ?
+    """,
+    "tokens.leer": """
+        SELECT chat_id, Email, Tipo, Huella, Expira, Intentos, Bloqueado_hasta
+        FROM Tokens_verificacion WHERE chat_id = ? AND Caduca > ?
+    """,
+    "tokens.contar_vigentes": "SELECT COUNT(*) FROM Tokens_verificacion WHERE Caduca > ?",
+    "tokens.guardar": """
+        INSERT INTO Tokens_verificacion
+            (chat_id, Email, Tipo, Huella, Expira, Intentos, Bloqueado_hasta, Caduca)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            Email = excluded.Email, Tipo = excluded.Tipo, Huella = excluded.Huella,
+            Expira = excluded.Expira, Intentos = excluded.Intentos,
+            Bloqueado_hasta = excluded.Bloqueado_hasta, Caduca = excluded.Caduca
+    """,
+    "tokens.borrar": "DELETE FROM Tokens_verificacion WHERE chat_id = ?",
+    "tokens.borrar_caducados": "DELETE FROM Tokens_verificacion WHERE Caduca <= ?",
+
+    # ----- ESTADO COMPARTIDO Y CERROJOS (utils/backend_estado.py) -----
+    "compartido.leer": "SELECT Valor FROM Estado_compartido WHERE Clave = ? AND Caduca > ?",
+    "compartido.escribir": """
+        INSERT INTO Estado_compartido (Clave, Valor, Caduca) VALUES (?, ?, ?)
+        ON CONFLICT(Clave) DO UPDATE SET Valor = excluded.Valor, Caduca = excluded.Caduca
+    """,
+    "compartido.borrar": "DELETE FROM Estado_compartido WHERE Clave = ?",
+    "compartido.escanear": """
+        SELECT Clave, Valor, Caduca FROM Estado_compartido
+        WHERE Clave >= ? AND Clave < ? AND Caduca > ?
+    """,
+    "compartido.borrar_caducados": "DELETE FROM Estado_compartido WHERE Caduca <= ?",
+    "cerrojos.adquirir": """
+        INSERT INTO Cerrojos (Nombre, Propietario, Caduca) VALUES (?, ?, ?)
+        ON CONFLICT(Nombre) DO UPDATE SET
+            Propietario = excluded.Propietario, Caduca = excluded.Caduca
+        WHERE Cerrojos.Caduca <= ? OR Cerrojos.Propietario = excluded.Propietario
+    """,
+    "cerrojos.renovar": "UPDATE Cerrojos SET Caduca = ? WHERE Nombre = ? AND Propietario = ?",
+    "cerrojos.liberar": "DELETE FROM Cerrojos WHERE Nombre = ? AND Propietario = ?",
+    "cerrojos.borrar_caducados": "DELETE FROM Cerrojos WHERE Caduca <= ?",
+
+    # ----- TRABAJOS DE DIFUSIÓN (utils/difusion.py) -----
+    "difusion.crear": """
+        INSERT INTO Trabajos_difusion
+            (Tipo, Filtro, Texto, Formato, Descripcion, Solicitante, Creado, Actualizado)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    "difusion.pendientes": """
+        SELECT Id_trabajo, Tipo, Filtro, Texto, Formato, Descripcion, Solicitante,
+               Cursor, Total, Enviados, Fallidos
+        FROM Trabajos_difusion
+        WHERE Estado IN ('pendiente', 'en_curso')
+        ORDER BY Id_trabajo
+    """,
+    "difusion.fijar_total": """
+        UPDATE Trabajos_difusion SET Total = ?, Estado = 'en_curso', Actualizado = ?
+        WHERE Id_trabajo = ?
+    """,
+    "difusion.avanzar": """
+        UPDATE Trabajos_difusion
+        SET Cursor = ?, Enviados = Enviados + ?, Fallidos = Fallidos + ?, Actualizado = ?
+        WHERE Id_trabajo = ?
+    """,
+    "difusion.terminar": """
+        UPDATE Trabajos_difusion SET Estado = 'completado', Actualizado = ?
+        WHERE Id_trabajo = ?
+    """,
+    # Destinatarios por páginas: desde el último Id_usuario entregado (Cursor),
+    # por el índice UNIQUE(id_sala, Id_usuario) en lugar de OFFSET
+    "difusion.estudiantes_sala": """
+        SELECT u.Id_usuario, u.TelegramID
+        FROM Miembros_Grupo mg
+        JOIN Usuarios u ON mg.Id_usuario = u.Id_usuario
+        WHERE mg.id_sala = ? AND mg.Id_usuario > ? AND mg.Estado = 'activo'
+          AND u.Tipo = 'estudiante' AND u.TelegramID IS NOT NULL
+        ORDER BY mg.Id_usuario
+        LIMIT ?
+    """,
+    "difusion.contar_estudiantes_sala": """
+        SELECT COUNT(*)
+        FROM Miembros_Grupo mg
+        JOIN Usuarios u ON mg.Id_usuario = u.Id_usuario
+        WHERE mg.id_sala = ? AND mg.Estado = 'activo'
+          AND u.Tipo = 'estudiante' AND u.TelegramID IS NOT NULL
+    """,
+
+    # ----- CITAS Y LISTA DE ESPERA (utils/citas.py) -----
+    # Todas las de un profesor van por el índice de UNIQUE(Id_profesor, Fecha, Inicio)
+    "citas.ocupadas": """
+        SELECT Fecha, Inicio, Fin
+        FROM Citas_tutoria
+        WHERE Id_profesor = ? AND Fecha BETWEEN ? AND ?
+        ORDER BY Fecha, Inicio
+    """,
+    "citas.solapa_profesor": """
+        SELECT 1 FROM Citas_tutoria
+        WHERE Id_profesor = ? AND Fecha = ? AND Inicio < ? AND Fin > ?
+        LIMIT 1
+    """,
+    "citas.solapa_estudiante": """
+        SELECT 1 FROM Citas_tutoria
+        WHERE Id_estudiante = ? AND Fecha = ? AND Inicio < ? AND Fin > ?
+        LIMIT 1
+    """,
+    # Citas que aún no han terminado: (Fecha, Fin) posterior a (hoy, minuto actual)
+    "citas.contar_pendientes": """
+        SELECT COUNT(*) FROM Citas_tutoria
+        WHERE Id_estudiante = ? AND Id_profesor = ?
+          AND (Fecha > ? OR (Fecha = ? AND Fin > ?))
+    """,
+    "citas.insertar": """
+        INSERT INTO Citas_tutoria (Id_profesor, Fecha, Inicio, Fin, Id_estudiante, Id_sala, Creada)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    "citas.por_id": "SELECT * FROM Citas_tutoria WHERE Id_cita = ?",
+    "citas.borrar": "DELETE FROM Citas_tutoria WHERE Id_cita = ?",
+    "citas.pendientes_estudiante": """
+        SELECT c.Id_cita, c.Id_profesor AS Id_otro, c.Fecha, c.Inicio, c.Fin, c.Id_sala,
+               u.Nombre, u.Apellidos, u.TelegramID
+        FROM Citas_tutoria c
+        JOIN Usuarios u ON u.Id_usuario = c.Id_profesor
+        WHERE c.Id_estudiante = ? AND (c.Fecha > ? OR (c.Fecha = ? AND c.Fin > ?))
+        ORDER BY c.Fecha, c.Inicio
+    """,
+    "citas.pendientes_profesor": """
+        SELECT c.Id_cita, c.Id_estudiante AS Id_otro, c.Fecha, c.Inicio, c.Fin, c.Id_sala,
+               u.Nombre, u.Apellidos, u.TelegramID
+        FROM Citas_tutoria c
+        JOIN Usuarios u ON u.Id_usuario = c.Id_estudiante
+        WHERE c.Id_profesor = ? AND (c.Fecha > ? OR (c.Fecha = ? AND c.Fin > ?))
+        ORDER BY c.Fecha, c.Inicio
+    """,
+    "espera.insertar": """
+        INSERT OR IGNORE INTO Lista_espera (Id_profesor, Fecha, Id_estudiante, Id_sala, Creada)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+    "espera.cola": """
+        SELECT Id_espera, Id_estudiante, Id_sala
+        FROM Lista_espera
+        WHERE Id_profesor = ? AND Fecha = ?
+        ORDER BY Id_espera
+    """,
+    "espera.quitar_estudiante": """
+        DELETE FROM Lista_espera WHERE Id_profesor = ? AND Fecha = ? AND Id_estudiante = ?
+    """,
+    "espera.quitar_estudiante_profesor": """
+        DELETE FROM Lista_espera WHERE Id_estudiante = ? AND Id_profesor = ?
+    """,
+    "espera.borrar_de_estudiante": "DELETE FROM Lista_espera WHERE Id_espera = ? AND Id_estudiante = ?",
+    "espera.purgar": "DELETE FROM Lista_espera WHERE Fecha < ?",
+    "espera.de_estudiante": """
+        SELECT e.Id_espera, e.Id_profesor, e.Fecha, u.Nombre, u.Apellidos
+        FROM Lista_espera e
+        JOIN Usuarios u ON u.Id_usuario = e.Id_profesor
+        WHERE e.Id_estudiante = ? AND e.Fecha >= ?
+        ORDER BY e.Fecha
+    """,
+}
+
+# Texto SQL -> nombre, para que CursorMedido sepa qué consulta está midiendo
+_NOMBRE_POR_SQL = {texto: nombre for nombre, texto in CONSULTAS.items() if "{" not in texto}
+_lock_nombres = threading.Lock()
+
+
+def sql(nombre, **formato):
+    """
+    Devuelve el texto de una consulta registrada
+
+    Args:
+        nombre: Nombre en CONSULTAS
+        **formato: Valores para las plantillas ({placeholders}, {set_clause}...)
+    """
+    texto = CONSULTAS[nombre]
+    if formato:
+        texto = texto.format(**formato)
+        with _lock_nombres:
+            # Las variantes de una plantilla son pocas (número de "?" o columnas)
+            if len(_NOMBRE_POR_SQL) < len(CONSULTAS) + MAX_CONSULTAS_DISTINTAS:
+                _NOMBRE_POR_SQL.setdefault(texto, nombre)
+    return texto
+
+
+def ejecutar(cursor, nombre, parametros=(), **formato):
+    """
+    Ejecuta una consulta del registro sobre un cursor o una conexión
+
+    Args:
+        cursor: Cursor o conexión (del pool, del escritor o de conectar())
+        nombre: Nombre en CONSULTAS
+        parametros: Parámetros de la consulta
+        **formato: Valores para las plantillas
+
+    Returns:
+        El cursor, como cursor.execute()
+    """
+    return cursor.execute(sql(nombre, **formato), parametros)
+
+
+def ejecutar_muchos(cursor, nombre, secuencia, **formato):
+    """Como ejecutar(), pero con executemany para una secuencia de parámetros"""
+    return cursor.executemany(sql(nombre, **formato), secuencia)
+
+
+@lru_cache(maxsize=1024)
+def _nombre_anonimo(texto):
+    return "sql:" + " ".join(texto.split())[:LONGITUD_NOMBRE_ANONIMO]
+
+
+def nombre_consulta(texto):
+    """Nombre con el que se registra un SQL: el del registro o uno derivado del texto"""
+    nombre = _NOMBRE_POR_SQL.get(texto)
+    if nombre is None:
+        nombre = _nombre_anonimo(texto)
+    return nombre
+
+
+# ===== ESTADÍSTICAS =====
+class EstadisticasConsulta:
+    """Contadores de una consulta; las latencias se guardan en una muestra acotada"""
+
+    __slots__ = ("llamadas", "errores", "filas", "total", "maximo", "muestra")
+
+    def __init__(self):
+        self.llamadas = 0
+        self.errores = 0
+        self.filas = 0
+        self.total = 0.0
+        self.maximo = 0.0
+        self.muestra = deque(maxlen=TAMANO_MUESTRA)
+
+
+def percentil(ordenada, p):
+    """Valor del percentil p (0-1) de una lista ya ordenada; 0.0 si está vacía"""
+    if not ordenada:
+        return 0.0
+    return ordenada[min(len(ordenada) - 1, int(len(ordenada) * p))]
+
+
+class RegistroEstadisticas:
+    """Estadísticas por nombre de consulta, seguras entre hilos"""
+
+    def __init__(self):
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nombre, segundos, filas=0, error=False):
+        with self._lock:
+            estadisticas = self._datos.get(nombre)
+            if estadisticas is None:
+                if nombre.startswith("sql:") and len(self._datos) >= len(CONSULTAS) + MAX_CONSULTAS_DISTINTAS:
+                    nombre = "sql:(otras)"
+                estadisticas = self._datos.setdefault(nombre, EstadisticasConsulta())
+            estadisticas.llamadas += 1
+            estadisticas.filas += filas
+            estadisticas.total += segundos
+            if segundos > estadisticas.maximo:
+                estadisticas.maximo = segundos
+            estadisticas.muestra.append(segundos)
+            if error:
+                estadisticas.errores += 1
+
+    def resumen(self):
+        """Lista de dicts por consulta, ordenada por tiempo total"""
+        with self._lock:
+            copia = [(nombre, e.llamadas, e.errores, e.filas, e.total, e.maximo, sorted(e.muestra))
+                     for nombre, e in self._datos.items()]
+
+        filas = []
+        for nombre, llamadas, errores, num_filas, total, maximo, ordenada in copia:
+            filas.append({
+                "consulta": nombre,
+                "llamadas": llamadas,
+                "errores": errores,
+                "filas": num_filas,
+                "total_ms": total * 1000,
+                "media_ms": (total / llamadas * 1000) if llamadas else 0.0,
+                "p50_ms": percentil(ordenada, 0.50) * 1000,
+                "p95_ms": percentil(ordenada, 0.95) * 1000,
+                "p99_ms": percentil(ordenada, 0.99) * 1000,
+                "max_ms": maximo * 1000,
+            })
+        filas.sort(key=lambda f: f["total_ms"], reverse=True)
+        return filas
+
+    def reiniciar(self):
+        with self._lock:
+            self._datos.clear()
+
+
+_estadisticas = RegistroEstadisticas()
+
+
+def estadisticas_consultas():
+    """Resumen por consulta (lista de dicts ordenada por tiempo total)"""
+    return _estadisticas.resumen()
+
+
+def reiniciar_estadisticas():
+    """Pone a cero las estadísticas de todas las consultas"""
+    _estadisticas.reiniciar()
+
+
+def volcar_estadisticas(limite=None):
+    """
+    Tabla de texto con las estadísticas por consulta
+
+    Args:
+        limite: Número máximo de consultas a mostrar (las de más tiempo total)
+    """
+    filas = estadisticas_consultas()
+    if limite:
+        filas = filas[:limite]
+    if not filas:
+        return "Sin consultas registradas"
+
+    ancho = max(len(f["consulta"]) for f in filas)
+    lineas = [
+        f"{'Consulta':<{ancho}} | {'Llamadas':>8} | {'Err':>4} | {'Filas':>8} | {'Total ms':>9} | "
+        f"{'p50':>7} | {'p95':>7} | {'p99':>7} | {'Máx':>7}"
+    ]
+    lineas.append("-" * len(lineas[0]))
+    for f in filas:
+        lineas.append(
+            f"{f['consulta']:<{ancho}} | {f['llamadas']:>8} | {f['errores']:>4} | {f['filas']:>8} | "
+            f"{f['total_ms']:>9.1f} | {f['p50_ms']:>7.2f} | {f['p95_ms']:>7.2f} | "
+            f"{f['p99_ms']:>7.2f} | {f['max_ms']:>7.2f}"
+        )
+    return "\n".join(lineas)
+
+
+def instalar_senal_volcado(senal=None):
+    """
+    Vuelca las estadísticas al log al recibir una señal (SIGUSR1 por defecto).
+    Debe llamarse desde el hilo principal; en Windows no hay SIGUSR1 y no hace nada.
+    """
+    senal = senal if senal is not None else getattr(signal, "SIGUSR1", None)
+    if senal is None:
+        return False
+
+    def _volcar(signum, frame):
+        texto = volcar_estadisticas()
+        print(f"📊 Estadísticas de consultas:\n{texto}")
+        logger.info("Estadísticas de consultas:\n%s", texto)
+
+    signal.signal(senal, _volcar)
+    return True
+
+
+# ===== CURSOR Y CONEXIÓN INSTRUMENTADOS =====
+class CursorMedido(sqlite3.Cursor):
+    """
+    Cursor que mide cada sentencia. En los SELECT la muestra incluye el
+    tiempo de lectura de filas y se cierra al agotar el resultado, al
+    ejecutar otra sentencia o al cerrar/liberar el cursor.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._muestra = None  # [nombre, segundos, filas]
+
+    def _cerrar_muestra(self):
+        muestra = self._muestra
+        if muestra is not None:
+            self._muestra = None
+            _estadisticas.registrar(muestra[0], muestra[1], muestra[2])
+
+    def _acumular(self, inicio, filas, agotado):
+        muestra = self._muestra
+        if muestra is None:
+            return
+        muestra[1] += time.perf_counter() - inicio
+        muestra[2] += filas
+        if agotado:
+            self._cerrar_muestra()
+
+    def execute(self, sql, parametros=()):
+        self._cerrar_muestra()
+        nombre = nombre_consulta(sql)
+        inicio = time.perf_counter()
+        try:
+            super().execute(sql, parametros)
+        except Exception:
+            _estadisticas.registrar(nombre, time.perf_counter() - inicio, error=True)
+            raise
+        duracion = time.perf_counter() - inicio
+        if self.description is None:
+            _estadisticas.registrar(nombre, duracion, max(self.rowcount, 0))
+        else:
+            self._muestra = [nombre, duracion, 0]
+        return self
+
+    def executemany(self, sql, secuencia):
+        self._cerrar_muestra()
+        nombre = nombre_consulta(sql)
+        inicio = time.perf_counter()
+        try:
+            super().executemany(sql, secuencia)
+        except Exception:
+            _estadisticas.registrar(nombre, time.perf_counter() - inicio, error=True)
+            raise
+        _estadisticas.registrar(nombre, time.perf_counter() - inicio, max(self.rowcount, 0))
+        return self
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        fila = super().fetchone()
+        self._acumular(inicio, 0 if fila is None else 1, fila is None)
+        return fila
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        inicio = time.perf_counter()
+        filas = super().fetchmany(size)
+        self._acumular(inicio, len(filas), len(filas) < size)
+        return filas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        filas = super().fetchall()
+        self._acumular(inicio, len(filas), True)
+        return filas
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        try:
+            fila = super().__next__()
+        except StopIteration:
+            self._acumular(inicio, 0, True)
+            raise
+        self._acumular(inicio, 1, False)
+        return fila
+
+    def close(self):
+        self._cerrar_muestra()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._cerrar_muestra()
+        except Exception:
+            pass
+
+
+class ConexionMedida(sqlite3.Connection):
+    """Conexión cuyos cursores (y conn.execute) son CursorMedido"""
+
+    def cursor(self, factory=CursorMedido):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, secuencia):
+        return self.cursor().executemany(sql, secuencia)
+
+
+def fabrica_conexion():
+    """Clase de conexión para sqlite3.connect(factory=...) según DB_METRICAS"""
+    return ConexionMedida if METRICAS_ACTIVAS else sqlite3.Connection
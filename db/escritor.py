@@ -0,0 +1,276 @@
+"""
+Hilo escritor único para la base de datos.
+
+SQLite sólo admite un escritor a la vez. En lugar de que cada hilo del bot
+compita por el bloqueo (y reintente con sleep), todas las escrituras se
+encolan aquí y las ejecuta un único hilo con su propia conexión. Las tareas
+que llegan juntas se agrupan en una sola transacción (un commit por lote),
+cada una dentro de su propio SAVEPOINT para que el fallo de una no deshaga
+las demás. Las lecturas siguen usando el pool y, gracias a WAL, no esperan.
+
+Una tarea que escribe desde dentro del escritor se ejecuta en línea, en un
+SAVEPOINT dentro del de la tarea que la llama: ejecutar() devuelve su
+resultado al momento, pero el Future de encolar() se resuelve con el resto
+del lote tras el commit, y falla si la tarea que la contiene o el lote se
+deshacen.
+"""
+import os
+import sys
+import queue
+import sqlite3
+import threading
+import logging
+from concurrent.futures import Future
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.conexion import DB_PATH, SENTENCIAS_CACHEADAS, aplicar_pragmas, configurar_almacenamiento
+from db.consultas import fabrica_conexion
+
+logger = logging.getLogger(__name__)
+
+MAX_LOTE = 64          # Tareas máximas por transacción
+TIMEOUT_ESCRITURA = 30  # Segundos que espera quien encola una escritura síncrona
+
+
+class ConexionEscritor:
+    """
+    Vista de la conexión del escritor que se entrega a cada tarea.
+    commit() no hace nada (el commit es por lote) y rollback() marca la
+    tarea para deshacer sólo su SAVEPOINT.
+    """
+
+    __slots__ = ("_raw", "deshacer")
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.deshacer = False
+
+    def __getattr__(self, nombre):
+        return getattr(self._raw, nombre)
+
+    def cursor(self, *args, **kwargs):
+        return self._raw.cursor(*args, **kwargs)
+
+    def execute(self, *args, **kwargs):
+        return self._raw.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._raw.executemany(*args, **kwargs)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.deshacer = True
+
+    def close(self):
+        pass
+
+
+def _fallar(pendientes, error):
+    """Resuelve con error los Future de tareas cuyas escrituras se han deshecho"""
+    for futuro, _ in pendientes:
+        if not futuro.done():
+            futuro.set_exception(error)
+
+
+class EscritorBD:
+    """Ejecuta en un único hilo todas las escrituras, agrupando commits"""
+
+    def __init__(self, db_path=DB_PATH, max_lote=MAX_LOTE):
+        self.db_path = str(db_path)
+        self.max_lote = max_lote
+        self._cola = queue.Queue()
+        self._hilo = None
+        self._lock = threading.Lock()
+        self._parar = object()
+        self._conn_actual = None
+        self._anidadas = []    # [(futuro, resultado)] de las anidadas en la tarea en curso
+
+        # Métricas
+        self.tareas = 0
+        self.lotes = 0
+        self.errores = 0
+
+    def iniciar(self):
+        """Arranca el hilo escritor si no está corriendo"""
+        with self._lock:
+            if self._hilo and self._hilo.is_alive():
+                return
+            self._hilo = threading.Thread(target=self._bucle, name="escritor-bd", daemon=True)
+            self._hilo.start()
+
+    def detener(self, timeout=5):
+        """Procesa lo pendiente y detiene el hilo"""
+        if self._hilo and self._hilo.is_alive():
+            self._cola.put(self._parar)
+            self._hilo.join(timeout)
+
+    def en_hilo_escritor(self):
+        return threading.current_thread() is self._hilo
+
+    def encolar(self, funcion):
+        """
+        Encola una escritura sin esperar el resultado
+
+        Args:
+            funcion: Callable que recibe (conn, cursor)
+
+        Returns:
+            Future: Se resuelve con el valor devuelto por la función
+        """
+        futuro = Future()
+        if self.en_hilo_escritor():
+            # Una tarea que escribe desde dentro del escritor se ejecuta en su mismo lote
+            correcta, resultado, anidadas = self._ejecutar_tarea(self._conn_actual, funcion, futuro)
+            if correcta:
+                self._anidadas.extend(anidadas)
+                self._anidadas.append((futuro, resultado))
+            return futuro
+        self.iniciar()
+        self._cola.put((funcion, futuro))
+        return futuro
+
+    def ejecutar(self, funcion, timeout=TIMEOUT_ESCRITURA):
+        """Encola una escritura y espera a que se confirme su lote"""
+        if self.en_hilo_escritor():
+            # Anidada: su lote es el de quien llama, que no se confirma hasta que esta vuelva
+            futuro = Future()
+            correcta, resultado, anidadas = self._ejecutar_tarea(self._conn_actual, funcion, futuro)
+            if not correcta:
+                raise futuro.exception()
+            self._anidadas.extend(anidadas)
+            return resultado
+        return self.encolar(funcion).result(timeout)
+
+    # ===== HILO ESCRITOR =====
+    def _conectar(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                               cached_statements=SENTENCIAS_CACHEADAS, isolation_level=None,
+                               factory=fabrica_conexion())
+        conn.row_factory = sqlite3.Row
+        return aplicar_pragmas(conn)
+
+    def _ejecutar_tarea(self, conn, funcion, futuro):
+        """
+        Ejecuta una tarea en su SAVEPOINT. Devuelve (correcta, resultado,
+        anidadas): anidadas son los (futuro, resultado) de las escrituras que
+        la tarea encoló desde dentro, que se publican con ella tras el commit.
+        """
+        contenedora, self._anidadas = self._anidadas, []
+        vista = ConexionEscritor(conn)
+        conn.execute("SAVEPOINT tarea")
+        try:
+            resultado = funcion(vista, vista.cursor())
+        except BaseException as e:
+            conn.execute("ROLLBACK TO tarea")
+            conn.execute("RELEASE tarea")
+            self.errores += 1
+            futuro.set_exception(e)
+            _fallar(self._anidadas, e)
+            return False, None, []
+        finally:
+            anidadas, self._anidadas = self._anidadas, contenedora
+
+        if vista.deshacer:
+            conn.execute("ROLLBACK TO tarea")
+            _fallar(anidadas, sqlite3.OperationalError("Escritura deshecha con la tarea que la contenía"))
+            anidadas = []
+        conn.execute("RELEASE tarea")
+        self.tareas += 1
+        return True, resultado, anidadas
+
+    def _bucle(self):
+        try:
+            configurar_almacenamiento(self.db_path)
+        except sqlite3.Error as e:
+            logger.error(f"Error configurando WAL en el escritor: {e}")
+
+        conn = self._conectar()
+        self._conn_actual = conn
+        detener = False
+
+        while not detener:
+            primero = self._cola.get()
+            if primero is self._parar:
+                break
+
+            # Agrupar lo que ya esté esperando en la cola
+            lote = [primero]
+            while len(lote) < self.max_lote:
+                try:
+                    siguiente = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if siguiente is self._parar:
+                    detener = True
+                    break
+                lote.append(siguiente)
+
+            correctas = []
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for funcion, futuro in lote:
+                    correcta, resultado, anidadas = self._ejecutar_tarea(conn, funcion, futuro)
+                    if correcta:
+                        correctas.extend(anidadas)
+                        correctas.append((futuro, resultado))
+                conn.execute("COMMIT")
+                self.lotes += 1
+            except sqlite3.Error as e:
+                logger.error(f"Error confirmando lote de escrituras: {e}")
+                try:
+                    conn.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                for _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                _fallar(correctas, e)
+                continue
+
+            # Los resultados se publican sólo cuando el lote ya está confirmado
+            for futuro, resultado in correctas:
+                futuro.set_result(resultado)
+
+        conn.close()
+
+    def estadisticas(self):
+        return {
+            "pendientes": self._cola.qsize(),
+            "tareas": self.tareas,
+            "lotes": self.lotes,
+            "tareas_por_lote": (self.tareas / self.lotes) if self.lotes else 0.0,
+            "errores": self.errores,
+        }
+
+
+# ===== ESCRITOR COMPARTIDO =====
+_escritor = None
+_escritor_lock = threading.Lock()
+
+
+def get_escritor():
+    """Devuelve el escritor del proceso, arrancándolo la primera vez"""
+    global _escritor
+    if _escritor is None:
+        with _escritor_lock:
+            if _escritor is None:
+                _escritor = EscritorBD()
+                _escritor.iniciar()
+    return _escritor
+
+
+def ejecutar_escritura(funcion):
+    """
+    Ejecuta una escritura en el hilo escritor y devuelve su resultado.
+    La función recibe (conn, cursor) y no debe hacer commit.
+    """
+    return get_escritor().ejecutar(funcion)
+
+
+def encolar_escritura(funcion):
+    """Encola una escritura sin esperar (devuelve un Future)"""
+    return get_escritor().encolar(funcion)
@@ -1,21 +1,23 @@
 import sqlite3
 import os
+import sys
 from pathlib import Path
 
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.conexion import obtener_conexion
+from db.consultas import ejecutar, ejecutar_muchos
+
 # Ruta de la nueva base de datos
 DB_PATH = Path(__file__).parent.parent / "tutoria_ugr.db"
 
 def get_db_connection():
-    """Obtiene una conexión a la base de datos"""
+    """Obtiene una conexión a la base de datos (prestada por el pool, filas como tuplas)"""
+    return obtener_conexion(row_factory=None)
 
-    return sqlite3.connect(str(DB_PATH))
-
-def create_database():
-    """Crea la estructura completa de la base de datos"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.executescript('''
+# Esquema completo (también lo usa diagnostico_consultas.py sobre una BD en memoria)
+ESQUEMA_SQL = '''
     -- Tabla de Usuarios
     CREATE TABLE IF NOT EXISTS Usuarios (
         Id_usuario INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -107,9 +109,239 @@ def create_database():
         hora_fin TEXT NOT NULL,
         FOREIGN KEY (Id_usuario) REFERENCES Usuarios(Id_usuario)
     );
-    ''')
     
+    -- Horario de tutorías canónico: una fila por franja, en minutos desde las 00:00.
+    -- Usuarios.Horario guarda el mismo horario en texto solo para mostrarlo
+    CREATE TABLE IF NOT EXISTS Franjas_horario (
+        Id_franja INTEGER PRIMARY KEY AUTOINCREMENT,
+        Id_usuario INTEGER NOT NULL,
+        Dia INTEGER NOT NULL CHECK(Dia BETWEEN 0 AND 6),   -- 0 = lunes
+        Inicio INTEGER NOT NULL CHECK(Inicio BETWEEN 0 AND 1440),
+        Fin INTEGER NOT NULL CHECK(Fin BETWEEN 0 AND 1440),
+        CHECK(Inicio <= Fin),
+        FOREIGN KEY (Id_usuario) REFERENCES Usuarios(Id_usuario)
+    );
+    
+    -- Citas de tutoría reservadas en huecos del horario del profesor (utils/citas.py).
+    -- La restricción UNIQUE impide reservar dos veces el mismo hueco
+    CREATE TABLE IF NOT EXISTS Citas_tutoria (
+        Id_cita INTEGER PRIMARY KEY AUTOINCREMENT,
+        Id_profesor INTEGER NOT NULL,
+        Fecha TEXT NOT NULL,                                -- YYYY-MM-DD
+        Inicio INTEGER NOT NULL CHECK(Inicio BETWEEN 0 AND 1439),
+        Fin INTEGER NOT NULL CHECK(Fin BETWEEN 1 AND 1440),
+        Id_estudiante INTEGER NOT NULL,
+        Id_sala INTEGER,
+        Creada REAL NOT NULL,
+        CHECK(Inicio < Fin),
+        UNIQUE(Id_profesor, Fecha, Inicio),
+        FOREIGN KEY (Id_profesor) REFERENCES Usuarios(Id_usuario),
+        FOREIGN KEY (Id_estudiante) REFERENCES Usuarios(Id_usuario),
+        FOREIGN KEY (Id_sala) REFERENCES Grupos_tutoria(id_sala)
+    );
+    
+    -- Lista de espera de un profesor para un día sin huecos libres (por orden de Id_espera)
+    CREATE TABLE IF NOT EXISTS Lista_espera (
+        Id_espera INTEGER PRIMARY KEY AUTOINCREMENT,
+        Id_profesor INTEGER NOT NULL,
+        Fecha TEXT NOT NULL,
+        Id_estudiante INTEGER NOT NULL,
+        Id_sala INTEGER,
+        Creada REAL NOT NULL,
+        UNIQUE(Id_profesor, Fecha, Id_estudiante),
+        FOREIGN KEY (Id_profesor) REFERENCES Usuarios(Id_usuario),
+        FOREIGN KEY (Id_estudiante) REFERENCES Usuarios(Id_usuario)
+    );
+    
+    -- Última importación de cada Excel (hash del contenido)
+    CREATE TABLE IF NOT EXISTS Importacion_Excel (
+        Ruta TEXT PRIMARY KEY,
+        Hash TEXT NOT NULL,
+        Fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    
+    -- Huella de cada fila importada, para reimportar solo lo que cambia
+    CREATE TABLE IF NOT EXISTS Huellas_Excel (
+        Email TEXT PRIMARY KEY,
+        Huella INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    
+    -- Matrículas que vienen del Excel, para quitar las asignaturas que desaparecen de una fila
+    CREATE TABLE IF NOT EXISTS Matriculas_Excel (
+        Email TEXT NOT NULL,
+        Id_asignatura INTEGER NOT NULL,
+        PRIMARY KEY (Email, Id_asignatura)
+    ) WITHOUT ROWID;
+    
+    -- Códigos de verificación del registro pendientes (db/tokens.py)
+    CREATE TABLE IF NOT EXISTS Tokens_verificacion (
+        chat_id INTEGER PRIMARY KEY,
+        Email TEXT NOT NULL,
+        Tipo TEXT NOT NULL,
+        Huella TEXT NOT NULL,
+        Expira REAL NOT NULL,
+        Intentos INTEGER NOT NULL DEFAULT 0,
+        Bloqueado_hasta REAL NOT NULL DEFAULT 0,
+        Caduca REAL NOT NULL
+    );
+    
+    -- Estado compartido entre procesos: conversaciones y otros valores con TTL (utils/backend_estado.py)
+    CREATE TABLE IF NOT EXISTS Estado_compartido (
+        Clave TEXT PRIMARY KEY,
+        Valor TEXT NOT NULL,
+        Caduca REAL NOT NULL
+    ) WITHOUT ROWID;
+    
+    -- Cerrojos entre procesos: por chat y de instancia única
+    CREATE TABLE IF NOT EXISTS Cerrojos (
+        Nombre TEXT PRIMARY KEY,
+        Propietario TEXT NOT NULL,
+        Caduca REAL NOT NULL
+    ) WITHOUT ROWID;
+    
+    -- Avisos a muchos destinatarios en curso o terminados (utils/difusion.py)
+    CREATE TABLE IF NOT EXISTS Trabajos_difusion (
+        Id_trabajo INTEGER PRIMARY KEY AUTOINCREMENT,
+        Tipo TEXT NOT NULL,
+        Filtro INTEGER NOT NULL,
+        Texto TEXT NOT NULL,
+        Formato TEXT,
+        Descripcion TEXT,
+        Solicitante INTEGER,
+        Estado TEXT NOT NULL DEFAULT 'pendiente',
+        Cursor INTEGER NOT NULL DEFAULT 0,
+        Total INTEGER,
+        Enviados INTEGER NOT NULL DEFAULT 0,
+        Fallidos INTEGER NOT NULL DEFAULT 0,
+        Creado REAL NOT NULL,
+        Actualizado REAL NOT NULL
+    );
+'''
+
+# Índices que necesitan las consultas de /tutoria, matrículas, salas y valoraciones
+INDICES = [
+    ("idx_matriculas_usuario", "Matriculas", "Id_usuario"),
+    ("idx_matriculas_asignatura_tipo", "Matriculas", "Id_asignatura, Tipo"),
+    ("idx_grupos_usuario", "Grupos_tutoria", "Id_usuario"),
+    ("idx_grupos_asignatura", "Grupos_tutoria", "Id_asignatura"),
+    ("idx_miembros_sala_estado", "Miembros_Grupo", "id_sala, Estado"),
+    ("idx_valoraciones_profesor", "Valoraciones", "profesor_id"),
+    ("idx_horarios_usuario", "Horarios_Profesores", "Id_usuario"),
+    ("idx_tokens_caduca", "Tokens_verificacion", "Caduca"),
+    ("idx_compartido_caduca", "Estado_compartido", "Caduca"),
+    ("idx_cerrojos_caduca", "Cerrojos", "Caduca"),
+    ("idx_difusion_estado", "Trabajos_difusion", "Estado"),
+    ("idx_franjas_usuario", "Franjas_horario", "Id_usuario, Dia, Inicio"),
+    ("idx_franjas_dia", "Franjas_horario", "Dia, Inicio, Fin"),
+    ("idx_citas_estudiante", "Citas_tutoria", "Id_estudiante, Fecha, Inicio"),
+    ("idx_espera_estudiante", "Lista_espera", "Id_estudiante, Fecha"),
+    ("idx_espera_fecha", "Lista_espera", "Fecha"),
+]
+
+def crear_indices(conn=None):
+    """
+    Crea los índices que falten (migración idempotente).
+
+    Args:
+        conn: Conexión a reutilizar (opcional)
+
+    Returns:
+        list: Nombres de los índices creados en esta llamada
+    """
+    propia = conn is None
+    if propia:
+        conn = get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    existentes = {row[0] for row in cursor.fetchall()}
+
+    creados = []
+    for nombre, tabla, columnas in INDICES:
+        if nombre in existentes:
+            continue
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} ({columnas})")
+        creados.append(nombre)
+
+    if creados:
+        # Actualizar estadísticas para que el planificador use los índices nuevos
+        cursor.execute("ANALYZE")
+        print(f"✅ Índices creados: {', '.join(creados)}")
+
+    conn.commit()
+    if propia:
+        conn.close()
+    return creados
+
+def crear_tablas_faltantes(conn=None):
+    """Crea en una base de datos existente las tablas del esquema que no tenga"""
+    propia = conn is None
+    if propia:
+        conn = get_db_connection()
+    # Todas las sentencias del esquema son CREATE TABLE IF NOT EXISTS
+    conn.executescript(ESQUEMA_SQL)
+    conn.commit()
+    if propia:
+        conn.close()
+
+def migrar_horarios_legados(conn=None):
+    """
+    Pasa a Franjas_horario los horarios guardados en texto (migración idempotente).
+
+    Convierte Usuarios.Horario (cualquiera de los formatos antiguos) y las filas
+    de Horarios_Profesores de los usuarios que aún no tienen franjas, y reescribe
+    Usuarios.Horario en el formato canónico. Los horarios que no se pueden
+    interpretar se dejan como están y se informa de ellos.
+
+    Args:
+        conn: Conexión a reutilizar (opcional)
+
+    Returns:
+        tuple: (usuarios migrados, usuarios con horario no reconocido)
+    """
+    from utils.motor_horarios import analizar_horario, horario_a_texto, indice_dia
+
+    propia = conn is None
+    if propia:
+        conn = get_db_connection()
+    cursor = conn.cursor()
+
+    ejecutar(cursor, "migracion.horarios_pendientes")
+    pendientes = cursor.fetchall()
+
+    migrados, sin_reconocer = 0, []
+    for id_usuario, horario in pendientes:
+        franjas = set(analizar_horario(horario))
+        ejecutar(cursor, "horarios.por_usuario", (id_usuario,))
+        for dia, hora_inicio, hora_fin in cursor.fetchall():
+            if indice_dia(dia) is not None:
+                franjas.update(analizar_horario(f"{dia} {hora_inicio}-{hora_fin}"))
+        if not franjas:
+            sin_reconocer.append(id_usuario)
+            continue
+        franjas = sorted(franjas)
+        ejecutar_muchos(cursor, "franjas.insertar", [(id_usuario,) + franja for franja in franjas])
+        ejecutar(cursor, "usuarios.actualizar_horario", (horario_a_texto(franjas), id_usuario))
+        migrados += 1
+
+    conn.commit()
+    if propia:
+        conn.close()
+    if migrados:
+        print(f"✅ Horarios migrados a Franjas_horario: {migrados}")
+    if sin_reconocer:
+        print(f"⚠️ Horarios no reconocidos (se dejan en texto): usuarios {sin_reconocer}")
+    return migrados, sin_reconocer
+
+def create_database():
+    """Crea la estructura completa de la base de datos"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.executescript(ESQUEMA_SQL)
+
     conn.commit()
+    crear_indices(conn)
     conn.close()
     print(f"✅ Base de datos creada exitosamente en: {DB_PATH}")
     print("   Estructura de base de datos lista para cargar datos del Excel")
@@ -138,8 +370,9 @@ def actualizar_estructura_tablas():
     except:
         print("Actualizando Valoraciones: añadiendo columna id_sala")
         cursor.execute("ALTER TABLE Valoraciones ADD COLUMN id_sala INTEGER")
-    
+
     conn.commit()
+    crear_indices(conn)
     conn.close()
     print("✅ Estructura de tablas actualizada correctamente")
 
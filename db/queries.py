@@ -10,30 +10,147 @@ logger = logging.getLogger(__name__)
 # Añadir directorio padre al path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from db.conexion import obtener_conexion
+from db.consultas import ejecutar, ejecutar_muchos
+from db.escritor import ejecutar_escritura
+from db.cache import CacheLRU
+from db.tipos import Usuario, Matricula, GrupoTutoria, Miembro, iterar_filas, leer_filas, leer_fila
+from utils.motor_horarios import analizar_horario, compilar_franjas, horario_a_texto, disponibles
+from utils.disponibilidad import get_indice_disponibilidad
+from utils.backend_estado import CanalInvalidaciones
+
 # Ruta a la base de datos
 DB_PATH = Path(__file__).parent.parent / "tutoria_ugr.db"
 
 def get_db_connection():
-    """Obtiene una conexión a la base de datos"""
-    conn = sqlite3.connect(str(DB_PATH), check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """
+    Obtiene una conexión a la base de datos desde el pool compartido.
+    Al llamar a close() la conexión vuelve al pool en lugar de cerrarse.
+    """
+    return obtener_conexion(row_factory=sqlite3.Row)
+
+# ===== INVALIDACIONES ENTRE PROCESOS =====
+# Cada proceso (el bot principal, el de grupos y las réplicas detrás del
+# balanceador) tiene sus propias cachés. Las invalidaciones se publican en el
+# backend compartido y los demás procesos las aplican al usar sus cachés,
+# como mucho CACHE_INVALIDACIONES_INTERVALO segundos después.
+_canal = CanalInvalidaciones(intervalo=float(os.getenv("CACHE_INVALIDACIONES_INTERVALO", "2")))
+
+def sincronizar_caches():
+    """Aplica las invalidaciones publicadas por otros procesos desde la última vez"""
+    for mensaje in _canal.recibir():
+        tipo = mensaje.get("tipo")
+        if tipo == "usuario":
+            _invalidar_usuario_local(mensaje.get("user_id"), mensaje.get("telegram_id"))
+        elif tipo == "usuarios":
+            _limpiar_usuarios_local()
+        elif tipo == "horario":
+            profesor_id = mensaje["profesor_id"]
+            _invalidar_horario_local(profesor_id)
+            get_indice_disponibilidad().actualizar(profesor_id, compilar_franjas(get_franjas_profesor(profesor_id)))
+        elif tipo == "horarios":
+            _limpiar_horarios_local()
+
+# ===== CACHÉ DE USUARIOS =====
+# get_user_by_telegram_id se llama al principio de casi todos los handlers;
+# el resultado se cachea por TelegramID y se invalida en cada escritura sobre el usuario
+_cache_usuarios = CacheLRU(
+    max_entradas=int(os.getenv("USER_CACHE_SIZE", "2048")),
+    ttl=float(os.getenv("USER_CACHE_TTL", "300"))
+)
+_telegram_por_usuario = {}  # Id_usuario -> TelegramID de las entradas cacheadas
+_generacion_usuarios = 0    # Evita guardar lecturas que empezaron antes de una invalidación
+
+def invalidar_usuario(user_id=None, telegram_id=None):
+    """Elimina de la caché un usuario por su Id_usuario y/o su TelegramID, también en los demás procesos"""
+    _invalidar_usuario_local(user_id, telegram_id)
+    _canal.publicar({"tipo": "usuario", "user_id": user_id, "telegram_id": telegram_id})
+
+def _invalidar_usuario_local(user_id, telegram_id):
+    global _generacion_usuarios
+    _generacion_usuarios += 1
+    if user_id is not None:
+        telegram_cacheado = _telegram_por_usuario.pop(user_id, None)
+        if telegram_cacheado is not None:
+            _cache_usuarios.invalidar(telegram_cacheado)
+    if telegram_id is not None:
+        _cache_usuarios.invalidar(telegram_id)
+
+def invalidar_cache_usuarios():
+    """Vacía la caché de usuarios (tras importaciones masivas o cambios directos en Usuarios)"""
+    _limpiar_usuarios_local()
+    _canal.publicar({"tipo": "usuarios"})
+
+def _limpiar_usuarios_local():
+    global _generacion_usuarios
+    _generacion_usuarios += 1
+    _telegram_por_usuario.clear()
+    _cache_usuarios.limpiar()
+    _limpiar_horarios_local()
+
+def estadisticas_cache_usuarios():
+    """Aciertos, fallos y tamaño de la caché de usuarios"""
+    return _cache_usuarios.estadisticas()
+
+# ===== CACHÉ DE HORARIOS =====
+# Horario ya compilado (utils/motor_horarios.py) de cada profesor; se invalida
+# al guardar su horario, así que comprobar la disponibilidad no lee la BD
+_cache_horarios = CacheLRU(
+    max_entradas=int(os.getenv("HORARIO_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("HORARIO_CACHE_TTL", "600"))
+)
+_generacion_horarios = 0
+
+def invalidar_horario(profesor_id):
+    """Elimina de la caché el horario compilado de un profesor, también en los demás procesos"""
+    _invalidar_horario_local(profesor_id)
+    _canal.publicar({"tipo": "horario", "profesor_id": profesor_id})
+
+def _invalidar_horario_local(profesor_id):
+    global _generacion_horarios
+    _generacion_horarios += 1
+    _cache_horarios.invalidar(profesor_id)
+
+def invalidar_cache_horarios():
+    """Vacía la caché de horarios compilados y marca el índice de disponibilidad para reconstruirlo"""
+    _limpiar_horarios_local()
+    _canal.publicar({"tipo": "horarios"})
+
+def _limpiar_horarios_local():
+    global _generacion_horarios
+    _generacion_horarios += 1
+    _cache_horarios.limpiar()
+    get_indice_disponibilidad().invalidar()
+
+def estadisticas_cache_horarios():
+    """Aciertos, fallos y tamaño de la caché de horarios"""
+    return _cache_horarios.estadisticas()
+
+def estadisticas_invalidaciones():
+    """Invalidaciones publicadas y recibidas de otros procesos"""
+    return {"publicadas": _canal.publicadas, "recibidas": _canal.recibidas}
 
 # ===== FUNCIONES DE USUARIO =====
 def get_user_by_telegram_id(telegram_id):
+    """Busca un usuario por su TelegramID (con caché LRU+TTL)"""
+    sincronizar_caches()
+    user = _cache_usuarios.obtener(telegram_id)
+    if user is not None:
+        return user
+    
+    generacion = _generacion_usuarios
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Consulta con JOIN para incluir el horario
-    cursor.execute("""
-        SELECT u.*, hp.dia || ' de ' || hp.hora_inicio || ' a ' || hp.hora_fin AS Horario 
-        FROM Usuarios u 
-        LEFT JOIN Horarios_Profesores hp ON u.Id_usuario = hp.Id_usuario
-        WHERE u.TelegramID = ?
-    """, (telegram_id,))
+    ejecutar(cursor, "usuarios.por_telegram_id", (telegram_id,))
     
-    result = cursor.fetchone()
+    result = leer_fila(cursor, Usuario)
     conn.close()
+    
+    # Sólo se cachean usuarios existentes: un alta nueva se verá en la siguiente consulta
+    if result is not None and generacion == _generacion_usuarios:
+        _cache_usuarios.guardar(telegram_id, result)
+        _telegram_por_usuario[result['Id_usuario']] = telegram_id
     return result
 
 def get_user_by_id(user_id):
@@ -41,43 +158,39 @@ def get_user_by_id(user_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT * FROM Usuarios WHERE Id_usuario = ?", (user_id,))
-    user = cursor.fetchone()
+    ejecutar(cursor, "usuarios.por_id", (user_id,))
+    user = leer_fila(cursor, Usuario)
     
     conn.close()
-    return dict(user) if user else None
+    return user
 
 def buscar_usuario_por_email(email):
     """Busca un usuario por su email"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT * FROM Usuarios WHERE Email_UGR = ?", (email,))
-    user = cursor.fetchone()
+    ejecutar(cursor, "usuarios.por_email", (email,))
+    user = leer_fila(cursor, Usuario)
     
     conn.close()
-    return dict(user) if user else None
+    return user
 
 def create_user(nombre, tipo, email, telegram_id=None, apellidos=None, dni=None, carrera=None, Area=None, registrado="NO"):
     """Crea un nuevo usuario en la base de datos con los datos proporcionados"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        cursor.execute(
-            """INSERT INTO Usuarios 
-            (Nombre, Tipo, Email_UGR, TelegramID, Apellidos, DNI, Carrera, Area, Registrado) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+    def _insertar(conn, cursor):
+        ejecutar(cursor, "usuarios.crear",
             (nombre, tipo, email, telegram_id, apellidos, dni, carrera, Area, registrado)
         )
-        conn.commit()
         return cursor.lastrowid
+    
+    try:
+        return ejecutar_escritura(_insertar)
     except Exception as e:
         print(f"Error al crear usuario: {e}")
-        conn.rollback()
         return None
     finally:
-        conn.close()
+        if telegram_id is not None:
+            invalidar_usuario(telegram_id=telegram_id)
 
 def update_user(user_id, **kwargs):
     """Actualiza los datos de un usuario existente"""
@@ -86,18 +199,16 @@ def update_user(user_id, **kwargs):
     
     try:
         # Construir la consulta dinámicamente
-        query = "UPDATE Usuarios SET "
-        query += ", ".join([f"{key} = ?" for key in kwargs.keys()])
-        query += " WHERE Id_usuario = ?"
+        set_clause = ", ".join([f"{key} = ?" for key in kwargs.keys()])
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        def _actualizar(conn, cursor):
+            ejecutar(cursor, "usuarios.actualizar", list(kwargs.values()) + [user_id], set_clause=set_clause)
+            return cursor.rowcount > 0
         
-        cursor.execute(query, list(kwargs.values()) + [user_id])
-        conn.commit()
-        success = cursor.rowcount > 0
-        conn.close()
-        return success
+        try:
+            return ejecutar_escritura(_actualizar)
+        finally:
+            invalidar_usuario(user_id=user_id, telegram_id=kwargs.get('TelegramID'))
     except Exception as e:
         import logging
         logging.getLogger('db.queries').error(f"Error al actualizar usuario: {e}")
@@ -105,27 +216,40 @@ def update_user(user_id, **kwargs):
 
 def update_horario_profesor(user_id, horario):
     """
-    Actualiza el horario de un profesor en la tabla Usuarios
+    Actualiza el horario de un profesor
     
     Args:
         user_id: ID del usuario (profesor)
-        horario: Horario en formato string
+        horario: Lista de franjas (día, inicio, fin) en minutos, o un horario
+                 en texto en cualquiera de los formatos antiguos
         
     Returns:
         bool: True si se actualizó correctamente, False en caso contrario
     """
+    franjas = analizar_horario(horario) if isinstance(horario, str) else sorted(set(horario))
+    return guardar_franjas_profesor(user_id, franjas)
+
+def guardar_franjas_profesor(user_id, franjas):
+    """
+    Sustituye las franjas de un profesor en Franjas_horario y deja en
+    Usuarios.Horario el mismo horario en texto, en una sola transacción
+
+    Args:
+        user_id: ID del usuario (profesor)
+        franjas: Lista de (día, inicio, fin) con día 0 = lunes y horas en minutos
+    """
+    texto = horario_a_texto(franjas)
+
+    def _guardar(conn, cursor):
+        ejecutar(cursor, "franjas.borrar_usuario", (user_id,))
+        ejecutar_muchos(cursor, "franjas.insertar", [(user_id, dia, inicio, fin) for dia, inicio, fin in franjas])
+        ejecutar(cursor, "usuarios.actualizar_horario", (texto, user_id))
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Actualizar directamente en la tabla Usuarios
-        cursor.execute(
-            "UPDATE Usuarios SET Horario = ? WHERE Id_usuario = ?",
-            (horario, user_id)
-        )
-        
-        conn.commit()
-        conn.close()
+        ejecutar_escritura(_guardar)
+        invalidar_usuario(user_id=user_id)
+        invalidar_horario(user_id)
+        get_indice_disponibilidad().actualizar(user_id, compilar_franjas(franjas))
         return True
     except Exception as e:
         import logging
@@ -133,6 +257,14 @@ def update_horario_profesor(user_id, horario):
         logger.error(f"Error al actualizar horario de profesor: {e}")
         return False
 
+def get_franjas_profesor(user_id):
+    """Franjas (día, inicio, fin) de un profesor, ordenadas por día y hora"""
+    conn = get_db_connection()
+    try:
+        return [tuple(fila) for fila in ejecutar(conn, "franjas.por_usuario", (user_id,))]
+    finally:
+        conn.close()
+
 # ===== FUNCIONES DE MATRÍCULA =====
 def crear_matricula(user_id, asignatura_id, tipo_usuario=None, curso="Actual"):
     """
@@ -147,52 +279,46 @@ def crear_matricula(user_id, asignatura_id, tipo_usuario=None, curso="Actual"):
     Returns:
         int: ID de la matrícula creada, o None si hubo error
     """
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
+    def _crear(conn, cursor):
         # Verificar si ya existe la matrícula
-        cursor.execute(
-            "SELECT * FROM Matriculas WHERE Id_usuario = ? AND Id_asignatura = ?", 
+        ejecutar(cursor, "matriculas.buscar", 
             (user_id, asignatura_id)
         )
         existe = cursor.fetchone()
         
         if not existe:
             # Si no se proporciona tipo, obtenerlo del usuario
-            if tipo_usuario is None:
-                cursor.execute("SELECT Tipo FROM Usuarios WHERE Id_usuario = ?", (user_id,))
+            tipo = tipo_usuario
+            if tipo is None:
+                ejecutar(cursor, "usuarios.tipo", (user_id,))
                 user = cursor.fetchone()
                 if user:
-                    tipo_usuario = user[0]
+                    tipo = user[0]
             
             # Crear matrícula con el tipo obtenido
-            cursor.execute(
-                "INSERT INTO Matriculas (Id_usuario, Id_asignatura, Tipo, Curso) VALUES (?, ?, ?, ?)",
-                (user_id, asignatura_id, tipo_usuario, curso)
+            ejecutar(cursor, "matriculas.crear_con_curso",
+                (user_id, asignatura_id, tipo, curso)
             )
-            matricula_id = cursor.lastrowid
-            conn.commit()
-        else:
-            # Ya existe, actualizar tipo y curso si se proporcionan
-            matricula_id = existe['id_matricula']
-            updates = {}
-            if tipo_usuario is not None:
-                updates['Tipo'] = tipo_usuario
-            if curso != "Actual":
-                updates['Curso'] = curso
-                
-            if updates:
-                set_clause = ", ".join([f"{key} = ?" for key in updates.keys()])
-                values = list(updates.values())
-                values.append(matricula_id)
-                
-                cursor.execute(f"UPDATE Matriculas SET {set_clause} WHERE id_matricula = ?", values)
-                conn.commit()
-                
-        conn.close()
+            return cursor.lastrowid
+        
+        # Ya existe, actualizar tipo y curso si se proporcionan
+        matricula_id = existe['id_matricula']
+        updates = {}
+        if tipo_usuario is not None:
+            updates['Tipo'] = tipo_usuario
+        if curso != "Actual":
+            updates['Curso'] = curso
+            
+        if updates:
+            set_clause = ", ".join([f"{key} = ?" for key in updates.keys()])
+            values = list(updates.values())
+            values.append(matricula_id)
+            
+            ejecutar(cursor, "matriculas.actualizar", values, set_clause=set_clause)
         return matricula_id
-        
+    
+    try:
+        return ejecutar_escritura(_crear)
     except Exception as e:
         logger.error(f"Error al crear matrícula: {e}")
         return None
@@ -202,25 +328,9 @@ def get_matriculas_by_user(user_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT 
-            m.id_matricula, 
-            m.Id_usuario, 
-            m.Id_asignatura, 
-            m.Curso, 
-            a.Nombre as Asignatura,
-            u.Carrera as Carrera
-        FROM 
-            Matriculas m
-        JOIN 
-            Asignaturas a ON m.Id_asignatura = a.Id_asignatura
-        JOIN
-            Usuarios u ON m.Id_usuario = u.Id_usuario
-        WHERE 
-            m.Id_usuario = ?
-    """, (user_id,))
-    
-    matriculas = [dict(row) for row in cursor.fetchall()]
+    ejecutar(cursor, "matriculas.por_usuario_con_carrera", (user_id,))
+    
+    matriculas = leer_filas(cursor, Matricula)
     conn.close()
     
     return matriculas
@@ -230,11 +340,7 @@ def verificar_estudiante_matriculado(estudiante_id, asignatura_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT COUNT(*) as count 
-        FROM Matriculas
-        WHERE Id_usuario = ? AND Id_asignatura = ?
-    """, (estudiante_id, asignatura_id))
+    ejecutar(cursor, "matriculas.contar", (estudiante_id, asignatura_id))
     
     result = cursor.fetchone()
     conn.close()
@@ -247,16 +353,9 @@ def get_matriculas_usuario(user_id):
     cursor = conn.cursor()
     
     try:
-        cursor.execute("""
-            SELECT m.*, a.Nombre as Asignatura 
-            FROM Matriculas m
-            JOIN Asignaturas a ON m.Id_asignatura = a.Id_asignatura
-            WHERE m.Id_usuario = ?
-        """, (user_id,))
+        ejecutar(cursor, "matriculas.por_usuario", (user_id,))
         
-        # Convertir filas a diccionarios para facilitar su uso
-        result = [dict(row) for row in cursor.fetchall()]
-        return result
+        return leer_filas(cursor, Matricula)
     except Exception as e:
         print(f"Error al obtener matrículas: {e}")
         return []
@@ -266,24 +365,12 @@ def get_matriculas_usuario(user_id):
 # ===== FUNCIONES DE GRUPOS =====
 def crear_grupo_tutoria(profesor_id, nombre_sala, tipo_sala, asignatura_id, chat_id, enlace=None, proposito=None):
     """Crea un nuevo grupo de tutoría en la base de datos"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    def _insertar(conn, cursor):
+        ejecutar(cursor, "grupos.crear", (profesor_id, nombre_sala, tipo_sala, asignatura_id, str(chat_id), enlace, proposito))
+        return cursor.lastrowid
     
-    try:
-        cursor.execute('''
-            INSERT INTO Grupos_tutoria 
-            (Id_usuario, Nombre_sala, Tipo_sala, Id_asignatura, Chat_id, Enlace_invitacion, Proposito_sala) 
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (profesor_id, nombre_sala, tipo_sala, asignatura_id, str(chat_id), enlace, proposito))
-        
-        conn.commit()
-        grupo_id = cursor.lastrowid
-        return grupo_id
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    # Los errores se propagan al llamador, igual que antes
+    return ejecutar_escritura(_insertar)
 
 def crear_grupo_tutoria_directo(conn, profesor_id, nombre_sala, tipo_sala, asignatura_id, chat_id, enlace=None):
     """
@@ -294,21 +381,14 @@ def crear_grupo_tutoria_directo(conn, profesor_id, nombre_sala, tipo_sala, asign
         cursor = conn.cursor()
         
         # Primera inserción - Grupo (usando el nombre correcto de la columna: Enlace_invitacion)
-        cursor.execute("""
-            INSERT INTO Grupos_tutoria 
-            (Id_usuario, Nombre_sala, Tipo_sala, Id_asignatura, Chat_id, Proposito_sala, Enlace_invitacion)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (profesor_id, nombre_sala, tipo_sala, asignatura_id, chat_id, 
+        ejecutar(cursor, "grupos.crear_directo", (profesor_id, nombre_sala, tipo_sala, asignatura_id, chat_id, 
               'avisos' if tipo_sala == 'pública' else 'individual', enlace))
         
         # Obtener el ID generado del grupo
         grupo_id = cursor.lastrowid
         
         # Añadir al profesor como miembro del grupo (en lugar de usar Administradores_Grupo)
-        cursor.execute("""
-            INSERT INTO Miembros_Grupo (id_sala, Id_usuario, Estado)
-            VALUES (?, ?, 'activo')
-        """, (grupo_id, profesor_id))
+        ejecutar(cursor, "miembros.crear_activo", (grupo_id, profesor_id))
         
         return grupo_id
     except Exception as e:
@@ -329,27 +409,21 @@ def actualizar_grupo_tutoria(grupo_id, **kwargs):
     """
     if not kwargs:
         return False
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    
+    # Construir consulta dinámica
+    set_clause = ", ".join([f"{key} = ?" for key in kwargs.keys()])
+    values = list(kwargs.values())
+    values.append(grupo_id)
+    
+    def _actualizar(conn, cursor):
+        ejecutar(cursor, "grupos.actualizar", values, set_clause=set_clause)
+        return cursor.rowcount > 0
     
     try:
-        # Construir consulta dinámica
-        set_clause = ", ".join([f"{key} = ?" for key in kwargs.keys()])
-        values = list(kwargs.values())
-        values.append(grupo_id)
-        
-        cursor.execute(f"UPDATE Grupos_tutoria SET {set_clause} WHERE id_sala = ?", values)
-        
-        success = cursor.rowcount > 0
-        conn.commit()
-        return success
+        return ejecutar_escritura(_actualizar)
     except Exception as e:
-        conn.rollback()
         logger.error(f"Error al actualizar grupo de tutoría: {e}")
         return False
-    finally:
-        conn.close()
 
 def obtener_grupos(profesor_id=None, asignatura_id=None):
     """
@@ -365,29 +439,21 @@ def obtener_grupos(profesor_id=None, asignatura_id=None):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    query = """
-        SELECT g.*, a.Nombre as Asignatura, u.Nombre as Profesor, u.Apellidos as Apellidos_Profesor
-        FROM Grupos_tutoria g
-        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
-        WHERE 1=1
-    """
+    filtros = ""
     params = []
     
     if profesor_id is not None:
-        query += " AND g.Id_usuario = ?"
+        filtros += " AND g.Id_usuario = ?"
         params.append(profesor_id)
     
     if asignatura_id is not None:
-        query += " AND g.Id_asignatura = ?"
+        filtros += " AND g.Id_asignatura = ?"
         params.append(asignatura_id)
     
-    # Añadir condición para mostrar solo grupos válidos
-    query += " AND g.Chat_id IS NOT NULL"
+    # La consulta registrada ya muestra solo grupos válidos (Chat_id no nulo)
+    ejecutar(cursor, "grupos.listar", params, filtros=filtros)
     
-    cursor.execute(query, params)
-    
-    grupos = [dict(row) for row in cursor.fetchall()]
+    grupos = leer_filas(cursor, GrupoTutoria)
     conn.close()
     
     return grupos
@@ -402,16 +468,9 @@ def obtener_grupos_por_asignaturas(asignaturas_ids):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute(f"""
-        SELECT g.*, a.Nombre as Asignatura, u.Nombre as Profesor, u.Apellidos as Apellidos_Profesor
-        FROM Grupos_tutoria g
-        JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
-        WHERE g.Id_asignatura IN ({placeholders}) AND g.Chat_id IS NOT NULL
-        ORDER BY u.Nombre, g.Nombre_sala
-    """, asignaturas_ids)
+    ejecutar(cursor, "grupos.por_asignaturas", asignaturas_ids, placeholders=placeholders)
     
-    grupos = [dict(row) for row in cursor.fetchall()]
+    grupos = leer_filas(cursor, GrupoTutoria)
     conn.close()
     
     return grupos
@@ -421,41 +480,24 @@ def obtener_grupo_por_id(grupo_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT g.*, a.Nombre as Asignatura, u.Nombre as Profesor, u.Apellidos as Apellidos_Profesor
-        FROM Grupos_tutoria g
-        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
-        WHERE g.id_sala = ?
-    """, (grupo_id,))
+    ejecutar(cursor, "grupos.por_id", (grupo_id,))
     
-    grupo = cursor.fetchone()
+    grupo = leer_fila(cursor, GrupoTutoria)
     conn.close()
     
-    return dict(grupo) if grupo else None
+    return grupo
 
 def añadir_estudiante_grupo(grupo_id, estudiante_id):
     """Añade un estudiante a un grupo de tutoría"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("""
-            INSERT INTO Miembros_Grupo (id_sala, Id_usuario)
-            VALUES (?, ?)
-        """, (grupo_id, estudiante_id))
-        
-        conn.commit()
+        ejecutar_escritura(lambda conn, cursor: ejecutar(cursor, "miembros.crear", (grupo_id, estudiante_id)))
         return True
     except sqlite3.IntegrityError:
         # El estudiante ya está en el grupo
         return True
     except Exception as e:
-        conn.rollback()
         logger.error(f"Error al añadir estudiante al grupo: {e}")
         return False
-    finally:
-        conn.close()
 
 # ===== PROFESORES Y HORARIOS =====
 def obtener_profesores_por_asignaturas(asignaturas_ids):
@@ -468,35 +510,111 @@ def obtener_profesores_por_asignaturas(asignaturas_ids):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute(f"""
-        SELECT DISTINCT u.Id_usuario, u.Nombre, u.Apellidos, u.Email_UGR, hp.dia || ' de ' || hp.hora_inicio || ' a ' || hp.hora_fin AS Horario
-        FROM Usuarios u
-        JOIN Matriculas m ON u.Id_usuario = m.Id_usuario
-        LEFT JOIN Horarios_Profesores hp ON u.Id_usuario = hp.Id_usuario
-        WHERE u.Tipo = 'profesor' AND m.Id_asignatura IN ({placeholders})
-    """, asignaturas_ids)
+    ejecutar(cursor, "profesores.por_asignaturas", asignaturas_ids, placeholders=placeholders)
     
-    profesores = [dict(row) for row in cursor.fetchall()]
+    profesores = leer_filas(cursor, Usuario)
     conn.close()
     
     return profesores
 
+def obtener_profesores_estudiante(estudiante_id):
+    """Profesores de las asignaturas de un estudiante, con los nombres de esas asignaturas"""
+    conn = get_db_connection()
+    try:
+        return ejecutar(conn, "tutorias.profesores_estudiante", (estudiante_id,)).fetchall()
+    finally:
+        conn.close()
+
+def obtener_arbol_tutorias(estudiante_id, conn=None):
+    """
+    Construye el árbol profesor → asignatura → salas que usa /tutoria
+    con un número fijo de consultas (sin una consulta por profesor).
+
+    Args:
+        estudiante_id: Id_usuario del estudiante
+        conn: Conexión a reutilizar (opcional)
+
+    Returns:
+        tuple: (asignaturas del estudiante, dict de profesores). Cada profesor es
+               {id, nombre, email, horario, asignaturas: {id | 'general': {..., salas: []}}}
+    """
+    propia = conn is None
+    if propia:
+        conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        # 1. Asignaturas del estudiante
+        ejecutar(cursor, "tutorias.asignaturas_estudiante", (estudiante_id,))
+        asignaturas = cursor.fetchall()
+
+        profesores = {}
+        if not asignaturas:
+            return asignaturas, profesores
+
+        # 2. Profesores con sus asignaturas (una fila por profesor y asignatura)
+        ejecutar(cursor, "tutorias.profesores_asignaturas", (estudiante_id,))
+
+        for fila in cursor.fetchall():
+            prof_id = fila['Id_usuario']
+            profesor = profesores.get(prof_id)
+            if profesor is None:
+                profesor = profesores[prof_id] = {
+                    'id': prof_id,
+                    'nombre': f"{fila['Nombre']} {fila['Apellidos'] or ''}".strip(),
+                    'email': fila['Email_UGR'],
+                    'horario': fila['Horario'] or 'No especificado',
+                    'asignaturas': {}
+                }
+            profesor['asignaturas'][fila['Id_asignatura']] = {
+                'id': fila['Id_asignatura'],
+                'nombre': fila['NombreAsignatura'],
+                'codigo': fila['Codigo'],
+                'salas': []
+            }
+
+        if not profesores:
+            return asignaturas, profesores
+
+        # Categoría general para salas sin asignatura (o de otras asignaturas)
+        for profesor in profesores.values():
+            profesor['asignaturas']['general'] = {
+                'id': 'general',
+                'nombre': 'General',
+                'salas': []
+            }
+
+        # 3. Todas las salas de esos profesores
+        ejecutar(cursor, "tutorias.salas_profesores", (estudiante_id,))
+
+        for sala in cursor.fetchall():
+            profesor = profesores.get(sala['Id_usuario'])
+            if profesor is None:
+                continue
+            asignaturas_prof = profesor['asignaturas']
+            destino = asignaturas_prof.get(sala['Id_asignatura'], asignaturas_prof['general'])
+            destino['salas'].append({
+                'id': sala['id_sala'],
+                'nombre': sala['Nombre_sala'],
+                'proposito': sala['Proposito_sala'],
+                'tipo': sala['Tipo_sala'],
+                'enlace': sala['Enlace_invitacion'],
+                'chat_id': sala['Chat_id'],
+                'asignatura': sala['NombreAsignatura']
+            })
+
+        return asignaturas, profesores
+    finally:
+        if propia:
+            conn.close()
+
 def get_horarios_profesor(profesor_id):
     """Obtiene el horario de un profesor desde la tabla Usuarios"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
-        cursor.execute('''
-            SELECT 
-                Id_usuario,
-                Nombre,
-                Horario
-            FROM 
-                Usuarios
-            WHERE 
-                Id_usuario = ? AND Tipo = 'profesor'
-        ''', (profesor_id,))
+        ejecutar(cursor, "profesores.horario", (profesor_id,))
         
         result = cursor.fetchone()
         
@@ -512,58 +630,94 @@ def get_horarios_profesor(profesor_id):
     finally:
         conn.close()
 
-def verificar_disponibilidad_profesor(profesor_id):
+def horarios_compilados(profesor_ids):
+    """
+    Horarios compilados de varios profesores, con caché y una sola consulta
+    a Franjas_horario para los que no estén cacheados
+
+    Returns:
+        dict {profesor_id: HorarioCompilado} (vacío si el profesor no tiene horario)
+    """
+    sincronizar_caches()
+    resultado = {}
+    faltan = []
+    for profesor_id in dict.fromkeys(profesor_ids):
+        horario = _cache_horarios.obtener(profesor_id)
+        if horario is None:
+            faltan.append(profesor_id)
+        else:
+            resultado[profesor_id] = horario
+
+    if faltan:
+        generacion = _generacion_horarios
+        conn = get_db_connection()
+        try:
+            leidas = {profesor_id: [] for profesor_id in faltan}
+            # Por bloques para no pasar del límite de parámetros de SQLite
+            for i in range(0, len(faltan), 500):
+                bloque = faltan[i:i + 500]
+                cursor = ejecutar(conn, "franjas.por_usuarios", bloque,
+                                  placeholders=",".join("?" * len(bloque)))
+                for id_usuario, dia, inicio, fin in cursor:
+                    leidas[id_usuario].append((dia, inicio, fin))
+        finally:
+            conn.close()
+
+        for profesor_id in faltan:
+            horario = compilar_franjas(leidas[profesor_id])
+            resultado[profesor_id] = horario
+            if generacion == _generacion_horarios:
+                _cache_horarios.guardar(profesor_id, horario)
+    return resultado
+
+def verificar_disponibilidad_profesor(profesor_id, momento=None):
     """Verifica si un profesor está disponible actualmente según su horario"""
-    from handlers.tutorias import verificar_horario_tutoria
-    
-    # Obtener horario del profesor
-    horario = get_horarios_profesor(profesor_id)
-    
-    # Si no hay horario registrado, asumir no disponible
-    if not horario:
-        return False
-        
-    # Verificar si estamos en horario de tutoría
-    return verificar_horario_tutoria(horario)
+    return disponibilidad_profesores([profesor_id], momento)[profesor_id]
+
+def disponibilidad_profesores(profesor_ids, momento=None):
+    """
+    Disponibilidad de muchos profesores a la vez
+
+    Args:
+        profesor_ids: Ids de usuario de los profesores
+        momento: datetime a comprobar (por defecto, ahora)
+
+    Returns:
+        dict {profesor_id: bool}; sin horario registrado cuenta como no disponible
+    """
+    return disponibles(horarios_compilados(profesor_ids), momento)
 
 # ===== ASIGNATURAS Y CARRERAS =====
 def get_o_crear_carrera(nombre_carrera):
     """Obtiene una carrera por nombre o la crea si no existe"""
     if not nombre_carrera or nombre_carrera.strip() == '':
         return None  # No crear carreras vacías
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
     
-    try:
+    def _obtener_o_crear(conn, cursor):
         # Buscar la carrera por nombre
-        cursor.execute("SELECT id_carrera FROM Carreras WHERE Nombre_carrera = ?", (nombre_carrera,))
+        ejecutar(cursor, "carreras.por_nombre", (nombre_carrera,))
         carrera = cursor.fetchone()
         
         if carrera:
             # La carrera ya existe
-            carrera_id = carrera[0]
-        else:
-            # Crear nueva carrera
-            cursor.execute("INSERT INTO Carreras (Nombre_carrera) VALUES (?)", (nombre_carrera,))
-            carrera_id = cursor.lastrowid
-            conn.commit()
-            
-        return carrera_id
+            return carrera[0]
         
+        # Crear nueva carrera
+        ejecutar(cursor, "carreras.crear", (nombre_carrera,))
+        return cursor.lastrowid
+    
+    try:
+        return ejecutar_escritura(_obtener_o_crear)
     except Exception as e:
         print(f"Error al obtener/crear carrera: {e}")
         return None
-        
-    finally:
-        conn.close()
 
 def get_carreras():
     """Obtiene todas las carreras"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("SELECT id_carrera, Nombre_carrera FROM Carreras ORDER BY Nombre_carrera")
+    ejecutar(cursor, "carreras.listar")
     carreras = [dict(row) for row in cursor.fetchall()]
     
     conn.close()
@@ -584,56 +738,26 @@ def get_carreras_by_area(area_id=None):
     return get_carreras()
 
 def crear_asignatura(nombre, sigla=None, id_carrera=None):
-    """Crea una nueva asignatura en la base de datos"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Crea una nueva asignatura en la base de datos (Asignaturas no tiene columna para la sigla)"""
+    def _insertar(conn, cursor):
+        return ejecutar(cursor, "asignaturas.crear", (nombre, id_carrera)).lastrowid
     
     try:
-        # Verificar columnas existentes
-        cursor.execute("PRAGMA table_info(Asignaturas)")
-        columnas = [col[1] for col in cursor.fetchall()]
-        
-        # Construir consulta según columnas disponibles
-        if 'Sigla' in columnas and 'Id_carrera' in columnas:
-            cursor.execute(
-                "INSERT INTO Asignaturas (Nombre, Sigla, Id_carrera) VALUES (?, ?, ?)",
-                (nombre, sigla, id_carrera)
-            )
-        elif 'Sigla' in columnas:
-            cursor.execute(
-                "INSERT INTO Asignaturas (Nombre, Sigla) VALUES (?, ?)",
-                (nombre, sigla)
-            )
-        else:
-            # Sin columna Sigla
-            cursor.execute(
-                "INSERT INTO Asignaturas (Nombre) VALUES (?)",
-                (nombre,)
-            )
-        
-        conn.commit()
-        return cursor.lastrowid
+        return ejecutar_escritura(_insertar)
     except Exception as e:
         print(f"Error al crear asignatura: {e}")
-        conn.rollback()
         return None
-    finally:
-        conn.close()
 
 def crear_matricula(id_usuario, id_asignatura, tipo_usuario='estudiante', verificar_duplicados=True):
     """Crea una nueva matrícula para un usuario en una asignatura"""
     if id_usuario is None or id_asignatura is None:
         print("Error: Usuario o asignatura inválidos")
         return False
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
     
-    try:
+    def _insertar(conn, cursor):
         # Verificar si ya existe esta matrícula
         if verificar_duplicados:
-            cursor.execute(
-                "SELECT * FROM Matriculas WHERE Id_usuario = ? AND Id_asignatura = ?",
+            ejecutar(cursor, "matriculas.buscar",
                 (id_usuario, id_asignatura)
             )
             if cursor.fetchone():
@@ -642,18 +766,16 @@ def crear_matricula(id_usuario, id_asignatura, tipo_usuario='estudiante', verifi
                 return True
         
         # Crear nueva matrícula
-        cursor.execute(
-            "INSERT INTO Matriculas (Id_usuario, Id_asignatura, Tipo) VALUES (?, ?, ?)",
+        ejecutar(cursor, "matriculas.crear",
             (id_usuario, id_asignatura, tipo_usuario)
         )
-        conn.commit()
         return True
+    
+    try:
+        return ejecutar_escritura(_insertar)
     except Exception as e:
         print(f"Error al crear matrícula: {e}")
-        conn.rollback()
         return False
-    finally:
-        conn.close()
 
 def get_salas_profesor_asignatura(profesor_id, asignatura_id):
     """
@@ -662,15 +784,9 @@ def get_salas_profesor_asignatura(profesor_id, asignatura_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT g.*, u.Nombre as NombreProfesor 
-        FROM Grupos_tutoria g
-        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
-        WHERE g.Id_usuario = ? AND (g.Id_asignatura = ? OR g.Id_asignatura IS NULL)
-        ORDER BY g.Proposito_sala ASC
-    """, (profesor_id, asignatura_id))
+    ejecutar(cursor, "salas.por_profesor_asignatura", (profesor_id, asignatura_id))
     
-    salas = cursor.fetchall()
+    salas = leer_filas(cursor, GrupoTutoria)
     conn.close()
     
     return salas if salas else []
@@ -683,16 +799,36 @@ def get_profesores_asignatura(asignatura_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute("""
-        SELECT DISTINCT u.*
-        FROM Usuarios u
-        JOIN Matriculas m ON u.Id_usuario = m.Id_usuario
-        WHERE m.Id_asignatura = ? 
-        AND u.Tipo = 'profesor' 
-        AND m.Tipo = 'docente'
-    """, (asignatura_id,))
+    ejecutar(cursor, "profesores.por_asignatura", (asignatura_id,))
     
-    profesores = cursor.fetchall()
+    profesores = leer_filas(cursor, Usuario)
     conn.close()
     
     return profesores if profesores else []
+
+# ===== LISTADOS PEREZOSOS =====
+def iterar_miembros_grupo(sala_id, estado='activo', tamano_lote=500):
+    """
+    Recorre los miembros de una sala sin cargar la lista completa en memoria.
+    La conexión se devuelve al pool al terminar (o al abandonar el generador).
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        ejecutar(cursor, "miembros.por_sala", (sala_id, estado, estado))
+        yield from iterar_filas(cursor, Miembro, tamano_lote)
+    finally:
+        conn.close()
+
+def iterar_usuarios(tipo=None, tamano_lote=500):
+    """Recorre todos los usuarios (opcionalmente de un tipo) de forma perezosa"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        if tipo:
+            ejecutar(cursor, "usuarios.por_tipo", (tipo,))
+        else:
+            ejecutar(cursor, "usuarios.listar")
+        yield from iterar_filas(cursor, Usuario, tamano_lote)
+    finally:
+        conn.close()
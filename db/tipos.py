@@ -0,0 +1,191 @@
+"""
+Tipos de fila compactos para los resultados de db.queries.
+
+Cada tipo declara sus columnas en __slots__, así que una fila no lleva un
+dict propio y se construye directamente desde la tupla del cursor. Para no
+romper el código existente se comportan como un diccionario de solo
+lectura: fila['Nombre'], fila.get('Carrera'), 'Horario' in fila, dict(fila).
+Igual que sqlite3.Row, el acceso por clave no distingue mayúsculas
+(fila['horario'] == fila['Horario']). Las columnas que no están en
+__slots__ (alias de JOIN poco habituales) se guardan aparte en _extra.
+"""
+
+_SIN_VALOR = object()
+
+
+class Fila:
+    """Base de las filas tipadas: acceso por atributo o como mapping de solo lectura"""
+
+    __slots__ = ("_extra",)
+    _INDICE = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Índice sin mayúsculas para imitar a sqlite3.Row
+        cls._INDICE = {nombre.lower(): nombre for nombre in cls.__slots__}
+
+    def __init__(self, **valores):
+        object.__setattr__(self, "_extra", None)
+        for clave, valor in valores.items():
+            self._asignar(clave, valor)
+
+    def _asignar(self, clave, valor):
+        nombre = self._INDICE.get(clave.lower())
+        if nombre is not None:
+            object.__setattr__(self, nombre, valor)
+        else:
+            if self._extra is None:
+                object.__setattr__(self, "_extra", {})
+            self._extra[clave] = valor
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError(f"{type(self).__name__} es de solo lectura")
+
+    # ===== INTERFAZ DE MAPPING =====
+    def __getitem__(self, clave):
+        if isinstance(clave, int):
+            # Acceso por posición, como en sqlite3.Row
+            return self.values()[clave]
+        nombre = self._INDICE.get(clave.lower())
+        if nombre is not None:
+            valor = getattr(self, nombre, _SIN_VALOR)
+            if valor is not _SIN_VALOR:
+                return valor
+        elif self._extra:
+            for extra, valor in self._extra.items():
+                if extra.lower() == clave.lower():
+                    return valor
+        raise KeyError(clave)
+
+    def get(self, clave, defecto=None):
+        try:
+            return self[clave]
+        except (KeyError, IndexError):
+            return defecto
+
+    def __contains__(self, clave):
+        return self.get(clave, _SIN_VALOR) is not _SIN_VALOR
+
+    def keys(self):
+        claves = [n for n in type(self).__slots__ if getattr(self, n, _SIN_VALOR) is not _SIN_VALOR]
+        if self._extra:
+            claves.extend(self._extra)
+        return claves
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def como_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, otro):
+        if isinstance(otro, Fila):
+            return type(self) is type(otro) and self.items() == otro.items()
+        if isinstance(otro, dict):
+            return self.como_dict() == otro
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        campos = ", ".join(f"{k}={v!r}" for k, v in self.items())
+        return f"{type(self).__name__}({campos})"
+
+
+class Usuario(Fila):
+    __slots__ = ("Id_usuario", "Nombre", "Apellidos", "DNI", "Tipo", "Email_UGR",
+                 "TelegramID", "Registrado", "Area", "Carrera", "Horario")
+
+
+class Asignatura(Fila):
+    __slots__ = ("Id_asignatura", "Nombre", "Codigo_Asignatura", "Id_carrera")
+
+
+class Matricula(Fila):
+    __slots__ = ("id_matricula", "Id_usuario", "Id_asignatura", "Curso", "Tipo",
+                 "Asignatura", "Carrera")
+
+
+class GrupoTutoria(Fila):
+    __slots__ = ("id_sala", "Id_usuario", "Nombre_sala", "Tipo_sala", "Id_asignatura",
+                 "Chat_id", "Enlace_invitacion", "Proposito_sala", "Fecha_creacion",
+                 "Asignatura", "Profesor", "Apellidos_Profesor", "NombreProfesor")
+
+
+class Miembro(Fila):
+    __slots__ = ("id_miembro", "id_sala", "Id_usuario", "Fecha_union", "Estado")
+
+
+class Valoracion(Fila):
+    __slots__ = ("id_valoracion", "evaluador_id", "profesor_id", "puntuacion",
+                 "comentario", "fecha", "es_anonimo", "id_sala")
+
+
+# ===== CONSTRUCCIÓN DESDE EL CURSOR =====
+def _plan_columnas(cursor, tipo):
+    """Para cada columna del cursor: (índice, slot) o (índice, None) si va a _extra"""
+    plan = []
+    vistas = set()
+    for i, descripcion in enumerate(cursor.description):
+        columna = descripcion[0]
+        # Con columnas repetidas (u.*, ... AS Horario) gana la primera, como en sqlite3.Row
+        if columna.lower() in vistas:
+            continue
+        vistas.add(columna.lower())
+        plan.append((i, tipo._INDICE.get(columna.lower()), columna))
+    return plan
+
+
+def _construir(tipo, plan, fila):
+    obj = object.__new__(tipo)
+    extra = None
+    for i, nombre, columna in plan:
+        if nombre is not None:
+            object.__setattr__(obj, nombre, fila[i])
+        else:
+            if extra is None:
+                extra = {}
+            extra[columna] = fila[i]
+    object.__setattr__(obj, "_extra", extra)
+    return obj
+
+
+def iterar_filas(cursor, tipo, tamano_lote=500):
+    """
+    Recorre el resultado de un cursor ya ejecutado creando filas tipadas
+    de forma perezosa (fetchmany por lotes, sin materializar toda la lista).
+    """
+    if cursor.description is None:
+        return
+    plan = _plan_columnas(cursor, tipo)
+    while True:
+        lote = cursor.fetchmany(tamano_lote)
+        if not lote:
+            break
+        for fila in lote:
+            yield _construir(tipo, plan, fila)
+
+
+def leer_filas(cursor, tipo):
+    """Lista de filas tipadas con todo el resultado del cursor"""
+    if cursor.description is None:
+        return []
+    plan = _plan_columnas(cursor, tipo)
+    return [_construir(tipo, plan, fila) for fila in cursor.fetchall()]
+
+
+def leer_fila(cursor, tipo):
+    """Primera fila del cursor como fila tipada, o None"""
+    fila = cursor.fetchone()
+    if fila is None:
+        return None
+    return _construir(tipo, _plan_columnas(cursor, tipo), fila)
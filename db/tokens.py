@@ -0,0 +1,312 @@
+"""
+Almacén de códigos de verificación del registro.
+
+Cada chat tiene como mucho un código pendiente, junto con el email, el tipo
+de usuario, la caducidad, los intentos fallidos y el bloqueo. Las búsquedas
+van a un dict por chat_id en memoria; cada cambio se replica en la tabla
+Tokens_verificacion a través del escritor, y al arrancar se cargan los que
+sigan vigentes, así que un reinicio del bot no obliga a repetir el paso del
+correo. Los caducados salen de un montículo ordenado por caducidad, sin
+recorrer todo el almacén. Del código solo se guarda su huella SHA-256.
+
+Con ESTADOS_COMPARTIDOS (varios procesos del bot detrás de un balanceador)
+no hay copia en memoria: cada operación lee y escribe la fila del chat en
+una transacción del escritor, que SQLite serializa también entre procesos,
+así que un código emitido en un proceso se puede verificar en otro y los
+intentos fallidos se cuentan una sola vez para todos.
+"""
+import os
+import sys
+import hmac
+import heapq
+import hashlib
+import secrets
+import threading
+import time
+import logging
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.conexion import conexion
+from db.consultas import ejecutar
+from db.escritor import ejecutar_escritura, encolar_escritura
+
+logger = logging.getLogger(__name__)
+
+DURACION_TOKEN = 180     # Segundos de validez de cada código
+MAX_INTENTOS = 5         # Códigos incorrectos antes de bloquear
+BLOQUEO = 15 * 60        # Segundos de bloqueo tras agotar los intentos
+MAX_TOKENS = 10000       # Registros pendientes como máximo en memoria
+
+# Resultados de verificar()
+VALIDO = "valido"
+INCORRECTO = "incorrecto"
+BLOQUEADO = "bloqueado"
+SIN_TOKEN = "sin_token"   # No se pidió código o ya caducó
+
+
+class TokenPendiente:
+    """Registro en curso de un chat"""
+
+    __slots__ = ("chat_id", "email", "tipo", "huella", "expira", "intentos", "bloqueado_hasta")
+
+    def __init__(self, chat_id, email, tipo, huella, expira, intentos=0, bloqueado_hasta=0.0):
+        self.chat_id = chat_id
+        self.email = email
+        self.tipo = tipo
+        self.huella = huella
+        self.expira = expira
+        self.intentos = intentos
+        self.bloqueado_hasta = bloqueado_hasta
+
+    @property
+    def caduca(self):
+        """Momento a partir del cual el registro ya no sirve (ni como bloqueo)"""
+        return max(self.expira, self.bloqueado_hasta)
+
+    def como_fila(self):
+        return (self.chat_id, self.email, self.tipo, self.huella, self.expira,
+                self.intentos, self.bloqueado_hasta, self.caduca)
+
+
+def _huella(chat_id, token):
+    return hashlib.sha256(f"{chat_id}:{token}".encode()).hexdigest()
+
+
+class AlmacenTokens:
+    """Códigos de verificación con caducidad, límite de intentos y persistencia opcional"""
+
+    def __init__(self, persistente=True, duracion=DURACION_TOKEN, max_intentos=MAX_INTENTOS,
+                 bloqueo=BLOQUEO, max_tokens=MAX_TOKENS, compartido=False):
+        self.compartido = compartido
+        self.persistente = persistente or compartido
+        self.duracion = duracion
+        self.max_intentos = max_intentos
+        self.bloqueo = bloqueo
+        self.max_tokens = max_tokens
+        self._datos = {}          # {chat_id: TokenPendiente}
+        self._monticulo = []      # [(caduca, chat_id)], con entradas obsoletas que se saltan al salir
+        self._lock = threading.Lock()
+        self._cargado = not self.persistente or compartido
+
+        # Contadores
+        self.emitidos = 0
+        self.validos = 0
+        self.fallidos = 0
+        self.bloqueos = 0
+        self.caducados = 0
+
+    # ===== PERSISTENCIA =====
+    def _cargar(self):
+        """Carga los registros vigentes de la tabla la primera vez que se usa el almacén"""
+        if self._cargado:
+            return
+        self._cargado = True
+        try:
+            with conexion() as conn:
+                filas = ejecutar(conn, "tokens.vigentes", (time.time(),)).fetchall()
+        except Exception as e:
+            logger.error(f"No se pudieron cargar los códigos de verificación: {e}")
+            return
+        for fila in filas:
+            self._poner(TokenPendiente(*fila))
+        if filas:
+            logger.info(f"Recuperados {len(filas)} códigos de verificación pendientes")
+
+    def _guardar(self, registro, cursor=None):
+        """Guarda el registro: en memoria y replicado, o solo en la tabla si hay cursor (compartido)"""
+        if cursor is not None:
+            ejecutar(cursor, "tokens.guardar", registro.como_fila())
+            return
+        self._poner(registro)
+        if self.persistente:
+            fila = registro.como_fila()
+            encolar_escritura(lambda conn, cursor: ejecutar(cursor, "tokens.guardar", fila))
+
+    def _borrar(self, chat_id, cursor=None):
+        if cursor is not None:
+            ejecutar(cursor, "tokens.borrar", (chat_id,))
+            return
+        self._datos.pop(chat_id, None)
+        if self.persistente:
+            encolar_escritura(lambda conn, cursor: ejecutar(cursor, "tokens.borrar", (chat_id,)))
+
+    # ===== MEMORIA =====
+    def _poner(self, registro):
+        self._datos[registro.chat_id] = registro
+        heapq.heappush(self._monticulo, (registro.caduca, registro.chat_id))
+
+    def _barrer(self, ahora):
+        """Retira los registros caducados; coste proporcional a los que salen"""
+        retirados = 0
+        while self._monticulo and self._monticulo[0][0] <= ahora:
+            caduca, chat_id = heapq.heappop(self._monticulo)
+            registro = self._datos.get(chat_id)
+            # La entrada puede ser obsoleta si el registro se renovó o ya se borró
+            if registro is not None and registro.caduca == caduca:
+                del self._datos[chat_id]
+                retirados += 1
+
+        # Montículo con demasiadas entradas obsoletas: reconstruirlo
+        if len(self._monticulo) > 2 * len(self._datos) + 64:
+            self._monticulo = [(r.caduca, c) for c, r in self._datos.items()]
+            heapq.heapify(self._monticulo)
+
+        if retirados:
+            self.caducados += retirados
+            if self.persistente:
+                encolar_escritura(lambda conn, cursor: ejecutar(cursor, "tokens.borrar_caducados", (ahora,)))
+        return retirados
+
+    def _vigente(self, chat_id, ahora, cursor=None):
+        if cursor is not None:
+            fila = ejecutar(cursor, "tokens.leer", (chat_id, ahora)).fetchone()
+            return TokenPendiente(*fila) if fila else None
+        self._cargar()
+        self._barrer(ahora)
+        return self._datos.get(chat_id)
+
+    def _operacion(self, funcion):
+        """
+        Ejecuta funcion(ahora, cursor) con el almacén bloqueado: en memoria,
+        con el lock del proceso y cursor None; compartido, dentro de una
+        transacción del escritor, que también excluye a los demás procesos.
+        """
+        ahora = time.time()
+        if self.compartido:
+            return ejecutar_escritura(lambda conn, cursor: funcion(ahora, cursor))
+        with self._lock:
+            return funcion(ahora, None)
+
+    def _leer(self, funcion):
+        """Como _operacion, pero las consultas compartidas van al pool sin pasar por el escritor"""
+        if not self.compartido:
+            return self._operacion(funcion)
+        with conexion() as conn:
+            return funcion(time.time(), conn)
+
+    # ===== OPERACIONES =====
+    def emitir(self, chat_id, email, tipo):
+        """
+        Genera un código nuevo para el chat (sustituye al anterior)
+
+        Returns:
+            str: Código de 6 dígitos, o None si el chat está bloqueado
+        """
+        def _emitir(ahora, cursor):
+            anterior = self._vigente(chat_id, ahora, cursor)
+            if anterior is not None and anterior.bloqueado_hasta > ahora:
+                return None
+
+            if cursor is not None:
+                # En la tabla los caducados no estorban (tokens.leer los ignora): se limpian aquí
+                self.caducados += ejecutar(cursor, "tokens.borrar_caducados", (ahora,)).rowcount
+            else:
+                # Lleno de registros vigentes: se descarta el que antes caduca
+                while len(self._datos) >= self.max_tokens and self._monticulo:
+                    caduca, expulsado = heapq.heappop(self._monticulo)
+                    registro = self._datos.get(expulsado)
+                    if registro is not None and registro.caduca == caduca:
+                        self._borrar(expulsado)
+
+            token = f"{secrets.randbelow(900000) + 100000}"
+            registro = TokenPendiente(chat_id, email, tipo, _huella(chat_id, token), ahora + self.duracion)
+            self._guardar(registro, cursor)
+            self.emitidos += 1
+            return token
+
+        return self._operacion(_emitir)
+
+    def verificar(self, chat_id, token):
+        """
+        Comprueba un código. El válido se consume; cada incorrecto cuenta un
+        intento y al llegar a max_intentos el chat queda bloqueado.
+
+        Returns:
+            tuple: (resultado, TokenPendiente o None)
+        """
+        def _verificar(ahora, cursor):
+            registro = self._vigente(chat_id, ahora, cursor)
+            if registro is None:
+                return SIN_TOKEN, None
+            if registro.bloqueado_hasta > ahora:
+                return BLOQUEADO, registro
+
+            if hmac.compare_digest(registro.huella, _huella(chat_id, token)):
+                self._borrar(chat_id, cursor)
+                self.validos += 1
+                return VALIDO, registro
+
+            self.fallidos += 1
+            registro.intentos += 1
+            if registro.intentos >= self.max_intentos:
+                # El código queda inutilizado y el registro se mantiene solo como bloqueo
+                registro.expira = ahora
+                registro.bloqueado_hasta = ahora + self.bloqueo
+                self.bloqueos += 1
+                self._guardar(registro, cursor)
+                return BLOQUEADO, registro
+            self._guardar(registro, cursor)
+            return INCORRECTO, registro
+
+        return self._operacion(_verificar)
+
+    def pendiente(self, chat_id):
+        """Registro con un código todavía utilizable, o None"""
+        def _pendiente(ahora, cursor):
+            registro = self._vigente(chat_id, ahora, cursor)
+            if registro is None or registro.expira <= ahora or registro.bloqueado_hasta > ahora:
+                return None
+            return registro
+
+        return self._leer(_pendiente)
+
+    def bloqueo_restante(self, chat_id):
+        """Segundos que le quedan al bloqueo del chat (0 si no está bloqueado)"""
+        def _restante(ahora, cursor):
+            registro = self._vigente(chat_id, ahora, cursor)
+            return max(0.0, registro.bloqueado_hasta - ahora) if registro else 0.0
+
+        return self._leer(_restante)
+
+    def descartar(self, chat_id):
+        """Anula el código pendiente del chat (los bloqueos se mantienen)"""
+        def _descartar(ahora, cursor):
+            registro = self._vigente(chat_id, ahora, cursor)
+            if registro is not None and registro.bloqueado_hasta <= ahora:
+                self._borrar(chat_id, cursor)
+
+        self._operacion(_descartar)
+
+    def estadisticas(self):
+        pendientes = self._leer(lambda ahora, cursor: ejecutar(cursor, "tokens.contar_vigentes", (ahora,))
+                                .fetchone()[0]) if self.compartido else None
+        with self._lock:
+            return {
+                "pendientes": len(self._datos) if pendientes is None else pendientes,
+                "emitidos": self.emitidos,
+                "validos": self.validos,
+                "fallidos": self.fallidos,
+                "bloqueos": self.bloqueos,
+                "caducados": self.caducados,
+            }
+
+
+# ===== ALMACÉN COMPARTIDO =====
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def get_almacen_tokens():
+    """Devuelve el almacén de códigos del proceso"""
+    global _almacen
+    if _almacen is None:
+        with _almacen_lock:
+            if _almacen is None:
+                try:
+                    from config import ESTADOS_COMPARTIDOS
+                except ImportError:
+                    ESTADOS_COMPARTIDOS = False
+                _almacen = AlmacenTokens(compartido=ESTADOS_COMPARTIDOS)
+    return _almacen
@@ -0,0 +1,215 @@
+"""
+Diagnóstico de las citas de tutoría (utils/citas.py) con reservas concurrentes.
+
+Crea una BD sintética en un directorio temporal (no toca tutoria_ugr.db) con
+unos pocos profesores y muchos más estudiantes que huecos, y lanza varios
+procesos, cada uno con varios hilos, que reservan a la vez los primeros
+huecos libres, se apuntan a listas de espera y anulan citas. Cada proceso
+tiene su propio escritor, como el bot principal y el de grupos.
+
+Al terminar comprueba sobre la tabla que:
+    - ningún hueco tiene dos citas y ninguna cita se solapa con otra del
+      mismo profesor o del mismo estudiante
+    - ningún estudiante pasa de CITAS_POR_PROFESOR citas con un profesor
+    - nadie sigue en la lista de espera de un profesor con el que ya está en el límite
+    - el número de citas cuadra con las reservas, promociones y anulaciones
+      que contaron los procesos (no hay reservas perdidas ni fantasma)
+
+También mide proximo_hueco() con la agenda casi llena.
+
+Devuelve código de salida 1 si alguna comprobación falla.
+
+Uso:
+    python diagnostico_citas.py [--procesos 4] [--hilos 4] [--operaciones 150]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import db.conexion
+import db.escritor
+from db.conexion import PoolConexiones
+from db.escritor import EscritorBD
+from db.models import ESQUEMA_SQL, INDICES
+from utils.citas import GestorCitas, RESERVADA, OCUPADA, EN_ESPERA
+
+PROFESORES = 3
+ESTUDIANTES = 60
+DIAS = 7
+# Lunes a viernes de 10:00 a 11:00: 4 huecos de 15 minutos por día
+FRANJAS = [(dia, 600, 660) for dia in range(5)]
+# Un lunes a las 00:00: todas las operaciones usan el mismo "ahora"
+MOMENTO = datetime(2030, 1, 7)
+
+
+def generar_bd(ruta):
+    conn = sqlite3.connect(ruta)
+    conn.executescript(ESQUEMA_SQL)
+    for nombre, tabla, columnas in INDICES:
+        conn.execute(f"CREATE INDEX {nombre} ON {tabla} ({columnas})")
+    for i in range(PROFESORES):
+        conn.execute("INSERT INTO Usuarios (Nombre, Tipo) VALUES (?, 'profesor')", (f"Profesor {i}",))
+    for i in range(ESTUDIANTES):
+        conn.execute("INSERT INTO Usuarios (Nombre, Tipo) VALUES (?, 'estudiante')", (f"Estudiante {i}",))
+    conn.executemany("INSERT INTO Franjas_horario (Id_usuario, Dia, Inicio, Fin) VALUES (?, ?, ?, ?)",
+                     [(p, dia, inicio, fin) for p in range(1, PROFESORES + 1) for dia, inicio, fin in FRANJAS])
+    conn.commit()
+    conn.close()
+
+
+def usar_bd(ruta):
+    """Apunta el pool y el escritor del proceso a la BD sintética"""
+    db.conexion._pool = PoolConexiones(ruta)
+    db.escritor._escritor = EscritorBD(ruta)
+    db.escritor._escritor.iniciar()
+
+
+def trabajador(semilla, operaciones, gestor):
+    """Reserva, se apunta a listas de espera y anula; devuelve sus contadores"""
+    rng = random.Random(semilla)
+    cuentas = {"reservas": 0, "promociones": 0, "cancelaciones": 0, "en_espera": 0, "ocupadas": 0}
+    for _ in range(operaciones):
+        profesor = rng.randint(1, PROFESORES)
+        estudiante = rng.randint(PROFESORES + 1, PROFESORES + ESTUDIANTES)
+        accion = rng.random()
+        if accion < 0.6:
+            # Los primeros huecos libres, para que varios hilos se peleen por el mismo
+            libres = gestor.huecos_libres(profesor, MOMENTO, limite=3)
+            if libres:
+                fecha, inicio, _ = rng.choice(libres)
+                estado, _ = gestor.reservar(profesor, estudiante, fecha, inicio, None, MOMENTO)
+                if estado == RESERVADA:
+                    cuentas["reservas"] += 1
+                elif estado == OCUPADA:
+                    cuentas["ocupadas"] += 1
+        elif accion < 0.8:
+            fecha = MOMENTO.date() + timedelta(days=rng.randrange(5))
+            estado, _ = gestor.apuntar_espera(profesor, estudiante, fecha, None, MOMENTO)
+            if estado == RESERVADA:
+                cuentas["reservas"] += 1
+            elif estado == EN_ESPERA:
+                cuentas["en_espera"] += 1
+        else:
+            citas = gestor.citas_pendientes(estudiante, False, MOMENTO)
+            if citas:
+                resultado = gestor.cancelar(rng.choice(citas)["Id_cita"], estudiante, MOMENTO)
+                if resultado is not None:
+                    cuentas["cancelaciones"] += 1
+                    cuentas["promociones"] += 1 if resultado["promovida"] else 0
+    return cuentas
+
+
+def proceso(args):
+    ruta, numero, hilos, operaciones = args
+    usar_bd(ruta)
+    gestor = GestorCitas(dias=DIAS)
+    with ThreadPoolExecutor(hilos) as ejecutor:
+        resultados = list(ejecutor.map(lambda h: trabajador(numero * 1000 + h, operaciones, gestor), range(hilos)))
+    db.escritor._escritor.detener()
+    total = {}
+    for cuentas in resultados:
+        for clave, valor in cuentas.items():
+            total[clave] = total.get(clave, 0) + valor
+    return total
+
+
+def comprobar(ruta, totales, por_profesor):
+    """Devuelve la lista de comprobaciones fallidas"""
+    conn = sqlite3.connect(ruta)
+    fallos = []
+
+    def ninguna(descripcion, sql):
+        filas = conn.execute(sql).fetchall()
+        if filas:
+            fallos.append(f"{descripcion}: {filas[:5]}")
+
+    ninguna("Huecos con dos citas", """
+        SELECT Id_profesor, Fecha, Inicio, COUNT(*) FROM Citas_tutoria
+        GROUP BY Id_profesor, Fecha, Inicio HAVING COUNT(*) > 1""")
+    ninguna("Citas solapadas de un profesor", """
+        SELECT a.Id_cita, b.Id_cita FROM Citas_tutoria a JOIN Citas_tutoria b
+        ON a.Id_profesor = b.Id_profesor AND a.Fecha = b.Fecha AND a.Id_cita < b.Id_cita
+        AND a.Inicio < b.Fin AND a.Fin > b.Inicio""")
+    ninguna("Citas solapadas de un estudiante", """
+        SELECT a.Id_cita, b.Id_cita FROM Citas_tutoria a JOIN Citas_tutoria b
+        ON a.Id_estudiante = b.Id_estudiante AND a.Fecha = b.Fecha AND a.Id_cita < b.Id_cita
+        AND a.Inicio < b.Fin AND a.Fin > b.Inicio""")
+    ninguna("Estudiantes por encima del límite de citas", f"""
+        SELECT Id_estudiante, Id_profesor, COUNT(*) FROM Citas_tutoria
+        GROUP BY Id_estudiante, Id_profesor HAVING COUNT(*) > {por_profesor}""")
+    ninguna("En lista de espera de un profesor con el que ya está en el límite", f"""
+        SELECT e.Id_espera FROM Lista_espera e JOIN (
+            SELECT Id_estudiante, Id_profesor FROM Citas_tutoria
+            GROUP BY Id_estudiante, Id_profesor HAVING COUNT(*) >= {por_profesor}
+        ) c ON c.Id_profesor = e.Id_profesor AND c.Id_estudiante = e.Id_estudiante""")
+
+    citas = conn.execute("SELECT COUNT(*) FROM Citas_tutoria").fetchone()[0]
+    esperadas = totales["reservas"] + totales["promociones"] - totales["cancelaciones"]
+    if citas != esperadas:
+        fallos.append(f"Hay {citas} citas y los procesos cuentan {esperadas}")
+    conn.close()
+    return fallos, citas
+
+
+def medir_proximo_hueco(ruta, repeticiones=2000):
+    usar_bd(ruta)
+    gestor = GestorCitas(dias=DIAS)
+    inicio = time.perf_counter()
+    for i in range(repeticiones):
+        gestor.proximo_hueco(i % PROFESORES + 1, MOMENTO)
+    return (time.perf_counter() - inicio) / repeticiones * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diagnóstico de reservas concurrentes de citas")
+    parser.add_argument("--procesos", type=int, default=4)
+    parser.add_argument("--hilos", type=int, default=4)
+    parser.add_argument("--operaciones", type=int, default=150)
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print(f"🔍 DIAGNÓSTICO de citas: {args.procesos} procesos x {args.hilos} hilos x "
+          f"{args.operaciones} operaciones")
+    print("=" * 70)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = os.path.join(tmp, "citas.db")
+        generar_bd(ruta)
+
+        inicio = time.perf_counter()
+        contexto = multiprocessing.get_context("spawn")
+        with contexto.Pool(args.procesos) as pool:
+            resultados = pool.map(proceso, [(ruta, n, args.hilos, args.operaciones)
+                                            for n in range(args.procesos)])
+        segundos = time.perf_counter() - inicio
+
+        totales = {}
+        for cuentas in resultados:
+            for clave, valor in cuentas.items():
+                totales[clave] = totales.get(clave, 0) + valor
+        print(f"Reservas: {totales['reservas']}, huecos ya ocupados: {totales['ocupadas']}, "
+              f"anulaciones: {totales['cancelaciones']}, promociones: {totales['promociones']}, "
+              f"apuntados a espera: {totales['en_espera']} ({segundos:.1f} s)")
+
+        fallos, citas = comprobar(ruta, totales, GestorCitas().por_profesor)
+        for fallo in fallos:
+            print(f"❌ {fallo}")
+        if not fallos:
+            print(f"✅ {citas} citas sin huecos dobles, solapes ni reservas perdidas")
+
+        print(f"⏱️  proximo_hueco: {medir_proximo_hueco(ruta):.0f} µs por consulta con la agenda casi llena")
+
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == "__main__":
+    main()
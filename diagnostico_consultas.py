@@ -0,0 +1,151 @@
+"""
+Auditoría de planes de consulta.
+
+Recorre el registro de consultas (db/consultas.py), ejecuta EXPLAIN QUERY
+PLAN sobre cada una y marca las que recorren una tabla completa (SCAN sin índice).
+Por defecto se audita el esquema de db/models.py en una base de datos en
+memoria (con los índices de la migración), así que se puede lanzar antes de
+desplegar sin tocar la base de datos real.
+
+Uso:
+    python diagnostico_consultas.py            # esquema de db/models.py
+    python diagnostico_consultas.py --db RUTA  # una base de datos concreta
+
+Devuelve código de salida 1 si encuentra recorridos completos no permitidos
+o consultas que ni siquiera se pueden preparar contra el esquema.
+"""
+import argparse
+import re
+import os
+import sqlite3
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from db.models import ESQUEMA_SQL, crear_indices
+from db.consultas import CONSULTAS
+
+# Recorridos completos que son intencionados (listados sin filtro)
+CONSULTAS_PERMITIDAS = {
+    "carreras.listar": "lista todas las carreras",
+    "grupos.listar": "los filtros se añaden dinámicamente; sin filtros lista todo",
+    "usuarios.listar": "listado completo por lotes (iterar_usuarios)",
+    "usuarios.por_tipo": "Tipo solo tiene dos valores; un índice no compensa",
+    "migracion.horarios_pendientes": "migración única de los horarios en texto al arrancar",
+    "gestion.tipo_sala_por_chat": "LIKE '%chat_id%' no puede usar índice",
+    "importacion.carreras": "la importación masiva carga la tabla una vez en memoria",
+    "importacion.asignaturas": "la importación masiva carga la tabla una vez en memoria",
+    "importacion.matriculas": "la importación masiva carga la tabla una vez en memoria",
+    "importacion.huellas": "la importación incremental compara todas las huellas",
+    "importacion.matriculas_excel": "la importación incremental compara las matrículas del Excel anterior",
+}
+
+# Valores de prueba para las plantillas del registro
+FORMATO_AUDITORIA = {
+    "placeholders": "?",
+    "set_clause": "rowid = ?",  # cualquier asignación válida sirve para el plan
+    "filtros": "",
+}
+
+PALABRAS_SQL = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+
+def extraer_consultas():
+    """
+    Devuelve las consultas del registro db/consultas.py listas para analizar
+
+    Returns:
+        list: Tuplas (nombre, sql)
+    """
+    consultas = []
+    for nombre, plantilla in CONSULTAS.items():
+        texto = plantilla.format(**FORMATO_AUDITORIA) if "{" in plantilla else plantilla
+        if texto.strip().upper().startswith(PALABRAS_SQL):
+            consultas.append((nombre, texto.strip()))
+    return sorted(consultas)
+
+
+def conexion_auditoria(db_path=None):
+    """Abre la BD indicada en solo lectura, o una BD en memoria con el esquema actual"""
+    if db_path:
+        return sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn = sqlite3.connect(":memory:")
+    conn.executescript(ESQUEMA_SQL)
+    crear_indices(conn)
+    return conn
+
+
+def _tablas_temporales(sql):
+    """Nombres (y alias) de las CTE de una consulta: recorrerlas no es recorrer una tabla"""
+    ctes = re.findall(r"(?:\bWITH|,)\s*(\w+)\s+AS\s*\(", sql, re.IGNORECASE)
+    if not ctes:
+        return set()
+    alias = re.findall(rf"\b(?:{'|'.join(ctes)})\s+(?:AS\s+)?(\w+)", sql, re.IGNORECASE)
+    return set(ctes) | {a for a in alias if a.upper() not in ("AS", "WHERE", "JOIN", "ON")}
+
+
+def analizar_plan(conn, sql):
+    """
+    Ejecuta EXPLAIN QUERY PLAN y devuelve (detalles, recorridos_completos)
+    """
+    parametros = [None] * sql.count("?")
+    filas = conn.execute(f"EXPLAIN QUERY PLAN {sql}", parametros).fetchall()
+    detalles = [fila[3] for fila in filas]
+    temporales = _tablas_temporales(sql)
+    recorridos = [
+        d for d in detalles
+        if d.startswith("SCAN ") and "USING" not in d and "CONSTANT ROW" not in d
+        and d.split()[1] not in temporales
+    ]
+    return detalles, recorridos
+
+
+def auditar(db_path=None, verbose=False):
+    """Audita todas las consultas y devuelve el número de problemas (recorridos no permitidos o SQL inválido)"""
+    conn = conexion_auditoria(db_path)
+    problemas = 0
+    invalidas = 0
+
+    print("=" * 60)
+    print("🔍 AUDITORÍA DE PLANES DE CONSULTA")
+    print("=" * 60)
+
+    for nombre, sql in extraer_consultas():
+        try:
+            detalles, recorridos = analizar_plan(conn, sql)
+        except sqlite3.Error as e:
+            invalidas += 1
+            print(f"❌ {nombre}: no se puede preparar ({e})")
+            continue
+
+        if recorridos and nombre not in CONSULTAS_PERMITIDAS:
+            problemas += 1
+            print(f"❌ {nombre}: {', '.join(recorridos)}")
+            for d in detalles:
+                print(f"      {d}")
+        elif recorridos:
+            print(f"ℹ️ {nombre}: {', '.join(recorridos)} "
+                  f"[permitido: {CONSULTAS_PERMITIDAS[nombre]}]")
+        else:
+            print(f"✅ {nombre}")
+            if verbose:
+                for d in detalles:
+                    print(f"      {d}")
+
+    conn.close()
+    print("=" * 60)
+    if problemas:
+        print(f"❌ {problemas} consultas recorren tablas completas")
+    else:
+        print("✅ Ninguna consulta recorre tablas completas sin permiso")
+    if invalidas:
+        print(f"❌ {invalidas} consultas no se pueden preparar contra el esquema")
+    return problemas + invalidas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Auditoría EXPLAIN QUERY PLAN del registro de consultas")
+    parser.add_argument("--db", help="Ruta a una base de datos concreta (solo lectura)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Mostrar el plan completo")
+    args = parser.parse_args()
+    sys.exit(1 if auditar(args.db, args.verbose) else 0)
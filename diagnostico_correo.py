@@ -0,0 +1,217 @@
+"""
+Diagnóstico de la bandeja de salida de correo (utils/correo.py).
+
+Levanta en local un servidor SMTP falso que responde según el destinatario
+y le manda correos con BandejaSalida (sin STARTTLS ni login). Comprueba que:
+    - un 451 al final de DATA se reintenta y el correo acaba entregado
+    - un 451 en RCPT (greylisting) también se reintenta
+    - un 550 en RCPT o en DATA falla a la primera, sin reintentos
+    - un lote de correos usa una conexión por hilo de envío, no una por correo
+
+El servidor es un socketserver de la biblioteca estándar: smtpd ya no está
+en Python 3.12 y aiosmtpd no es una dependencia del proyecto.
+
+Devuelve código de salida 1 si alguna comprobación falla.
+
+Uso:
+    python diagnostico_correo.py [--lote 40] [--hilos 2]
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+from collections import Counter
+from email.message import EmailMessage
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.correo import BandejaSalida
+
+ESPERA_BASE = 0.05   # Reintentos rápidos para que el diagnóstico no tarde
+
+
+class ServidorSMTPFalso(socketserver.ThreadingTCPServer):
+    """
+    Servidor SMTP mínimo. `fallos` dice, por destinatario, en qué orden
+    (RCPT o DATA) se responde con error, con qué código y cuántas veces.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, direccion, fallos):
+        super().__init__(direccion, _ManejadorSMTP)
+        self._lock = threading.Lock()
+        self.fallos = {destinatario: list(regla) for destinatario, regla in fallos.items()}
+        self.conexiones = 0
+        self.intentos = Counter()    # (orden, destinatario) -> veces recibido
+        self.entregados = Counter()  # destinatario -> correos aceptados
+
+    def responder(self, orden, destinatario):
+        """Código con el que se contesta a RCPT o al final de DATA"""
+        with self._lock:
+            self.intentos[(orden, destinatario)] += 1
+            regla = self.fallos.get(destinatario)
+            if regla and regla[0] == orden and regla[2] > 0:
+                regla[2] -= 1
+                return regla[1]
+            if orden == "DATA":
+                self.entregados[destinatario] += 1
+            return 250
+
+    def contar_conexion(self):
+        with self._lock:
+            self.conexiones += 1
+
+
+class _ManejadorSMTP(socketserver.StreamRequestHandler):
+    def enviar(self, linea):
+        self.wfile.write(linea.encode() + b"\r\n")
+
+    def handle(self):
+        self.server.contar_conexion()
+        self.enviar("220 diagnostico ESMTP")
+        destinatarios = []
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            orden = linea.decode(errors="replace").strip()
+            verbo = orden.split(" ", 1)[0].upper()
+            if verbo in ("EHLO", "HELO"):
+                self.enviar("250 diagnostico")
+            elif verbo == "MAIL":
+                destinatarios = []
+                self.enviar("250 OK")
+            elif verbo == "RCPT":
+                destinatario = orden.split(":", 1)[1].strip().strip("<>").lower()
+                codigo = self.server.responder("RCPT", destinatario)
+                if codigo == 250:
+                    destinatarios.append(destinatario)
+                self.enviar(f"{codigo} {'OK' if codigo == 250 else 'rechazado'}")
+            elif verbo == "DATA":
+                self.enviar("354 Fin con <CRLF>.<CRLF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                codigos = [self.server.responder("DATA", d) for d in destinatarios]
+                codigo = max(codigos, default=250)
+                self.enviar(f"{codigo} {'OK' if codigo == 250 else 'rechazado'}")
+            elif verbo in ("RSET", "NOOP"):
+                destinatarios = []
+                self.enviar("250 OK")
+            elif verbo == "QUIT":
+                self.enviar("221 Adiós")
+                return
+            else:
+                self.enviar("502 No implementado")
+
+
+def mensaje(destinatario):
+    correo = EmailMessage()
+    correo["From"] = "tutorias@correo.ugr.es"
+    correo["To"] = destinatario
+    correo["Subject"] = "Diagnóstico"
+    correo.set_content("Prueba de la bandeja de salida")
+    return correo
+
+
+def bandeja_para(servidor, hilos):
+    return BandejaSalida(servidor="127.0.0.1", puerto=servidor.server_address[1], usuario=None,
+                         password=None, hilos=hilos, max_intentos=3, usar_tls=False,
+                         espera_base=ESPERA_BASE)
+
+
+def esperar(futuro, timeout=10):
+    """Devuelve la excepción del futuro o None si se entregó"""
+    try:
+        futuro.result(timeout)
+        return None
+    except Exception as e:
+        return e
+
+
+def comprobar_errores(servidor):
+    """Un correo cada vez para que los reintentos se cuenten sin mezclarse"""
+    fallos = []
+    bandeja = bandeja_para(servidor, hilos=1)
+
+    casos = [
+        # destinatario, orden que falla, ¿se entrega?, intentos esperados
+        ("temporal@correo.ugr.es", "DATA", True, 2),
+        ("gris@correo.ugr.es", "RCPT", True, 2),
+        ("rechazado@correo.ugr.es", "RCPT", False, 1),
+        ("spam@correo.ugr.es", "DATA", False, 1),
+    ]
+    for destinatario, orden, entregado, intentos in casos:
+        reintentos_antes = bandeja.reintentos
+        error = esperar(bandeja.encolar(mensaje(destinatario)))
+        vistos = servidor.intentos[(orden, destinatario)]
+        reintentos = bandeja.reintentos - reintentos_antes
+        codigo = servidor.fallos[destinatario][1]
+        descripcion = f"{codigo} en {orden} para {destinatario}"
+        if (error is None) != entregado:
+            fallos.append(f"{descripcion}: {'no se entregó' if entregado else 'se dio por entregado'} ({error})")
+        elif vistos != intentos or reintentos != intentos - 1:
+            fallos.append(f"{descripcion}: {vistos} intentos y {reintentos} reintentos, "
+                          f"se esperaban {intentos} y {intentos - 1}")
+        else:
+            resultado = "entregado" if entregado else "descartado"
+            print(f"✅ {descripcion}: {resultado} tras {intentos} intento(s)")
+    bandeja.detener()
+    return fallos
+
+
+def comprobar_reutilizacion(servidor, lote, hilos):
+    """Un lote sin errores debe abrir como mucho una conexión por hilo"""
+    fallos = []
+    bandeja = bandeja_para(servidor, hilos=hilos)
+    conexiones_antes = servidor.conexiones
+    inicio = time.perf_counter()
+    futuros = [bandeja.encolar(mensaje(f"lote{i}@correo.ugr.es")) for i in range(lote)]
+    errores = [e for e in (esperar(f) for f in futuros) if e is not None]
+    segundos = time.perf_counter() - inicio
+    bandeja.detener()
+
+    conexiones = servidor.conexiones - conexiones_antes
+    if errores:
+        fallos.append(f"Lote: {len(errores)} correos sin entregar ({errores[0]})")
+    if conexiones > hilos or bandeja.conexiones != conexiones:
+        fallos.append(f"Lote de {lote}: {conexiones} conexiones en el servidor y {bandeja.conexiones} "
+                      f"en la bandeja, se esperaban como mucho {hilos}")
+    if not fallos:
+        print(f"✅ Lote de {lote} correos con {conexiones} conexión(es) para {hilos} hilo(s) "
+              f"({segundos * 1000:.0f} ms)")
+    return fallos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diagnóstico de la bandeja de salida de correo")
+    parser.add_argument("--lote", type=int, default=40)
+    parser.add_argument("--hilos", type=int, default=2)
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("🔍 DIAGNÓSTICO de la bandeja de correo con un servidor SMTP local")
+    print("=" * 70)
+
+    servidor = ServidorSMTPFalso(("127.0.0.1", 0), {
+        "temporal@correo.ugr.es": ("DATA", 451, 1),
+        "gris@correo.ugr.es": ("RCPT", 451, 1),
+        "rechazado@correo.ugr.es": ("RCPT", 550, 99),
+        "spam@correo.ugr.es": ("DATA", 550, 99),
+    })
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    try:
+        fallos = comprobar_errores(servidor) + comprobar_reutilizacion(servidor, args.lote, args.hilos)
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+
+    for fallo in fallos:
+        print(f"❌ {fallo}")
+    sys.exit(1 if fallos else 0)
+
+
+if __name__ == "__main__":
+    main()
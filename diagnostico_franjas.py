@@ -0,0 +1,169 @@
+"""
+Diagnóstico de los conjuntos de franjas (utils/franjas.py).
+
+Aplica secuencias aleatorias de operaciones (añadir, quitar, importar,
+copiar un día a otros, unión y diferencia) a la vez sobre HorarioSemanal y
+sobre un modelo ingenuo que guarda, para cada día, el conjunto de minutos
+ocupados. Después de cada operación comprueba que las franjas coinciden con
+las que salen del modelo y que solapa() y contiene() responden lo mismo que
+recorrer los minutos uno a uno. También compara hay_solapamiento() del
+editor de horarios con la comprobación por parejas que hacía antes.
+
+Devuelve código de salida 1 si encuentra alguna diferencia e imprime la
+semilla y la operación para reproducirla.
+
+Uso:
+    python diagnostico_franjas.py [--casos 300] [--operaciones 60] [--semilla 1]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.franjas import ConjuntoFranjas, HorarioSemanal, hay_solapamiento
+from utils.motor_horarios import formatear_franja
+
+PASO = 15   # Las franjas aleatorias caen en cuartos de hora para forzar solapes y contactos
+
+
+def franjas_del_modelo(minutos):
+    """Minutos ocupados -> franjas [inicio, fin) fusionadas"""
+    franjas = []
+    for minuto in sorted(minutos):
+        if franjas and franjas[-1][1] == minuto:
+            franjas[-1][1] = minuto + 1
+        else:
+            franjas.append([minuto, minuto + 1])
+    return [tuple(f) for f in franjas]
+
+
+def franja_aleatoria(rng):
+    inicio = rng.randrange(0, 24 * 60, PASO)
+    fin = min(24 * 60, inicio + rng.randrange(0, 6 * 60, PASO))
+    return inicio, fin
+
+
+def franja_valida(rng):
+    """Franja que el editor aceptaría (termina después de empezar)"""
+    while True:
+        inicio, fin = franja_aleatoria(rng)
+        if inicio < fin:
+            return inicio, fin
+
+
+def caso(rng, operaciones):
+    """Ejecuta una secuencia aleatoria; devuelve la descripción del primer fallo o None"""
+    horario = HorarioSemanal()
+    modelo = [set() for _ in range(7)]
+
+    for paso in range(operaciones):
+        op = rng.choice(("anadir", "anadir", "quitar", "importar", "copiar", "union", "diferencia"))
+        dia = rng.randrange(7)
+        if op == "anadir":
+            inicio, fin = franja_aleatoria(rng)
+            horario.anadir(dia, inicio, fin)
+            modelo[dia] |= set(range(inicio, fin))
+        elif op == "quitar":
+            inicio, fin = franja_aleatoria(rng)
+            horario.quitar(dia, inicio, fin)
+            modelo[dia] -= set(range(inicio, fin))
+        elif op == "importar":
+            filas = [(rng.randrange(7),) + franja_aleatoria(rng) for _ in range(rng.randint(1, 8))]
+            horario.importar(filas)
+            for d, inicio, fin in filas:
+                modelo[d] |= set(range(inicio, fin))
+        elif op == "copiar":
+            destinos = rng.sample(range(7), rng.randint(1, 6))
+            horario.copiar_dia(dia, destinos)
+            for d in destinos:
+                modelo[d] = set(modelo[dia])
+        else:
+            otro = ConjuntoFranjas([franja_aleatoria(rng) for _ in range(rng.randint(1, 4))])
+            minutos_otro = {m for inicio, fin in otro for m in range(inicio, fin)}
+            if op == "union":
+                horario.dias[dia] = horario.dias[dia].union(otro)
+                modelo[dia] |= minutos_otro
+            else:
+                horario.dias[dia] = horario.dias[dia].diferencia(otro)
+                modelo[dia] -= minutos_otro
+
+        for d in range(7):
+            esperado = franjas_del_modelo(modelo[d])
+            if list(horario.dias[d]) != esperado:
+                return f"paso {paso} ({op}): día {d} tiene {list(horario.dias[d])}, esperado {esperado}"
+            inicio, fin = franja_aleatoria(rng)
+            if horario.solapa(d, inicio, fin) != any(m in modelo[d] for m in range(inicio, fin)):
+                return f"paso {paso} ({op}): solapa({d}, {inicio}, {fin}) distinto del modelo"
+            minuto = rng.randrange(24 * 60)
+            if horario.dias[d].contiene(minuto) != (minuto in modelo[d]):
+                return f"paso {paso} ({op}): contiene({d}, {minuto}) distinto del modelo"
+    return None
+
+
+def solapamiento_por_parejas(existentes, nueva):
+    """Comprobación de hay_solapamiento antes de los conjuntos de franjas (sin el error = solape)"""
+    def minutos(hora):
+        h, m = map(int, hora.split(":"))
+        return h * 60 + m
+    inicio_nueva, fin_nueva = map(minutos, nueva.split("-"))
+    for franja in existentes:
+        inicio, fin = map(minutos, franja.split("-"))
+        if inicio_nueva < fin and fin_nueva > inicio:
+            return True
+    return False
+
+
+def comparar_editor(rng, casos):
+    """
+    hay_solapamiento() frente a la comprobación por parejas
+
+    Returns:
+        int: Número de diferencias
+    """
+    diferencias = 0
+    for _ in range(casos):
+        existentes = [formatear_franja(*franja_valida(rng)) for _ in range(rng.randint(0, 6))]
+        nueva = formatear_franja(*franja_valida(rng))
+        if hay_solapamiento(existentes, nueva) != solapamiento_por_parejas(existentes, nueva):
+            diferencias += 1
+            print(f"❌ hay_solapamiento({existentes}, {nueva!r}) no coincide")
+    if hay_solapamiento(["10:00-11:00", "basura"], "12:00-13:00"):
+        diferencias += 1
+        print("❌ Una franja existente mal escrita sigue contando como solapamiento")
+    return diferencias
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Diagnóstico de los conjuntos de franjas")
+    parser.add_argument("--casos", type=int, default=300)
+    parser.add_argument("--operaciones", type=int, default=60)
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print(f"🔍 DIAGNÓSTICO de franjas: {args.casos} casos de {args.operaciones} operaciones")
+    print("=" * 70)
+
+    inicio = time.perf_counter()
+    fallos = 0
+    for numero in range(args.casos):
+        semilla = args.semilla * 1000003 + numero
+        fallo = caso(random.Random(semilla), args.operaciones)
+        if fallo:
+            fallos += 1
+            print(f"❌ Semilla {semilla}: {fallo}")
+    print(f"{'✅' if not fallos else '❌'} HorarioSemanal frente al modelo de minutos: "
+          f"{args.casos - fallos}/{args.casos} casos correctos ({time.perf_counter() - inicio:.1f} s)")
+
+    diferencias = comparar_editor(random.Random(args.semilla), args.casos * 10)
+    if not diferencias:
+        print(f"✅ hay_solapamiento coincide con la comprobación por parejas en {args.casos * 10} casos")
+
+    sys.exit(1 if fallos or diferencias else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Envía updates de Telegram a un webhook local para probarlo sin Telegram.
+
+Lee updates grabados (WEBHOOK_GRABAR escribe uno en JSON por línea; también
+vale un fichero con una lista JSON) o genera mensajes sintéticos, los envía
+por POST al endpoint con varios hilos y resume los códigos de respuesta, la
+latencia y las métricas del despachador (GET /salud).
+
+Uso:
+    python enviar_updates.py http://localhost:8443/webhook/principal updates.jsonl
+    python enviar_updates.py http://localhost:8443/webhook/principal --sinteticos 2000 --chats 50
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+
+
+def leer_updates(ruta):
+    with open(ruta, encoding="utf-8") as f:
+        texto = f.read().strip()
+    if texto.startswith("["):
+        return json.loads(texto)
+    return [json.loads(linea) for linea in texto.splitlines() if linea.strip()]
+
+
+def updates_sinteticos(num, chats):
+    """Mensajes de texto de `chats` usuarios en privado, con el texto numerado por chat"""
+    updates = []
+    for i in range(num):
+        chat_id = 100000 + i % chats
+        usuario = {"id": chat_id, "is_bot": False, "first_name": f"Usuario{chat_id}"}
+        updates.append({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1, "date": int(time.time()), "from": usuario,
+                "chat": {"id": chat_id, "type": "private", "first_name": usuario["first_name"]},
+                "text": f"mensaje {i // chats}",
+            },
+        })
+    return updates
+
+
+def enviar(url, update, secreto):
+    cuerpo = json.dumps(update).encode()
+    peticion = urllib.request.Request(url, data=cuerpo, method="POST",
+                                      headers={"Content-Type": "application/json"})
+    if secreto:
+        peticion.add_header("X-Telegram-Bot-Api-Secret-Token", secreto)
+    try:
+        with urllib.request.urlopen(peticion, timeout=30) as respuesta:
+            return respuesta.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return "error"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Envía updates grabados a un webhook local")
+    parser.add_argument("url")
+    parser.add_argument("fichero", nargs="?", help="Updates grabados (JSON por línea o lista JSON)")
+    parser.add_argument("--sinteticos", type=int, default=0, help="Generar N mensajes en lugar de leer fichero")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--hilos", type=int, default=8)
+    parser.add_argument("--secreto", default=None)
+    args = parser.parse_args()
+
+    if args.fichero:
+        updates = leer_updates(args.fichero)
+    elif args.sinteticos:
+        updates = updates_sinteticos(args.sinteticos, args.chats)
+    else:
+        parser.error("indica un fichero de updates o --sinteticos N")
+
+    codigos = Counter()
+    latencias = []
+    lock = threading.Lock()
+    pendientes = iter(updates)
+
+    def trabajador():
+        while True:
+            with lock:
+                update = next(pendientes, None)
+            if update is None:
+                return
+            inicio = time.perf_counter()
+            codigo = enviar(args.url, update, args.secreto)
+            with lock:
+                codigos[codigo] += 1
+                latencias.append((time.perf_counter() - inicio) * 1000)
+
+    print(f"📤 Enviando {len(updates)} updates a {args.url} con {args.hilos} hilos...")
+    inicio = time.perf_counter()
+    hilos = [threading.Thread(target=trabajador) for _ in range(args.hilos)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    segundos = time.perf_counter() - inicio
+
+    latencias.sort()
+    print(f"⏱️  {segundos:.2f} s ({len(updates) / segundos:.0f} updates/s)")
+    print(f"📊 Respuestas: {dict(codigos)}")
+    if latencias:
+        print(f"📊 Latencia HTTP: p50 {latencias[len(latencias) // 2]:.1f} ms, "
+              f"p95 {latencias[int(len(latencias) * 0.95)]:.1f} ms")
+
+    partes = urllib.parse.urlsplit(args.url)
+    try:
+        with urllib.request.urlopen(f"{partes.scheme}://{partes.netloc}/salud", timeout=5) as respuesta:
+            print(f"🩺 Despachador: {json.loads(respuesta.read())}")
+    except OSError as e:
+        print(f"⚠️ No se pudieron leer las métricas: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@ import os
 # Añadir el directorio raíz al path para importar desde db
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from db.queries import get_db_connection
+from db.conexion import conectar
+from db.consultas import ejecutar
+from db.escritor import ejecutar_escritura
 
 import time
 import sqlite3
@@ -34,15 +37,10 @@ class GestionGrupos:
     
     def obtener_asignaturas_profesor(self, id_profesor: int):
         """Obtiene las asignaturas que imparte un profesor"""
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT a.id, a.nombre
-            FROM asignaturas a
-            JOIN profesor_asignatura pa ON a.id = pa.id_asignatura
-            WHERE pa.id_profesor = ?
-        ''', (id_profesor,))
+        ejecutar(cursor, "gestion.asignaturas_profesor", (id_profesor,))
         
         asignaturas = cursor.fetchall()
         conn.close()
@@ -52,25 +50,16 @@ class GestionGrupos:
                       id_asignatura: int = None, es_tutoria: bool = False):
         """Guarda la información del grupo en la base de datos"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             # Determinar el tipo de sala según es_tutoria
             tipo_sala = 'privada' if es_tutoria else 'pública'
             
             # Extraer el chat_id del enlace o usar un valor único
             chat_id = enlace_grupo.split('/')[-1] if '/' in enlace_grupo else enlace_grupo
             
-            cursor.execute('''
-                INSERT INTO Grupos_tutoria (
-                    Id_usuario, Nombre_sala, Tipo_sala, Id_asignatura, 
-                    Chat_id, Enlace_invitacion
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            ''', (id_profesor, nombre_grupo, tipo_sala, id_asignatura, chat_id, enlace_grupo))
-            
-            inserted_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
+            inserted_id = ejecutar_escritura(lambda conn, cursor: ejecutar(
+                cursor, "gestion.guardar_grupo",
+                (id_profesor, nombre_grupo, tipo_sala, id_asignatura, chat_id, enlace_grupo)
+            ).lastrowid)
             
             self.logger.info(f"Grupo guardado exitosamente: ID={inserted_id}, Nombre='{nombre_grupo}', " 
                              f"Profesor ID={id_profesor}, Asignatura ID={id_asignatura}, Es tutoria={es_tutoria}")
@@ -87,24 +76,16 @@ class GestionGrupos:
         - Lista de IDs de asignaturas con sala ya creada
         - Booleano indicando si ya tiene sala de tutorías
         """
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
         
         # Verificar salas por asignatura
-        cursor.execute('''
-            SELECT Id_asignatura 
-            FROM Grupos_tutoria 
-            WHERE Id_usuario = ? AND Tipo_sala = 'pública' AND Id_asignatura IS NOT NULL
-        ''', (id_profesor,))
+        ejecutar(cursor, "gestion.asignaturas_con_sala_publica", (id_profesor,))
         
         asignaturas_con_sala = [row[0] for row in cursor.fetchall()]
         
         # Verificar si tiene sala de tutorías
-        cursor.execute('''
-            SELECT COUNT(*) 
-            FROM Grupos_tutoria 
-            WHERE Id_usuario = ? AND Tipo_sala = 'privada'
-        ''', (id_profesor,))
+        ejecutar(cursor, "gestion.contar_salas_privadas", (id_profesor,))
         
         tiene_sala_tutoria = cursor.fetchone()[0] > 0
         
@@ -141,9 +122,9 @@ class GestionGrupos:
             self.guardar_grupo(nombre_grupo, enlace_grupo, id_profesor, id_asignatura, False)
             
             # Obtener nombre de la asignatura
-            conn = sqlite3.connect(self.db_path)
+            conn = conectar(self.db_path)
             cursor = conn.cursor()
-            cursor.execute("SELECT nombre FROM asignaturas WHERE id = ?", (id_asignatura,))
+            ejecutar(cursor, "gestion.nombre_asignatura", (id_asignatura,))
             nombre_asignatura = cursor.fetchone()[0]
             conn.close()
             
@@ -156,13 +137,10 @@ class GestionGrupos:
     
     def es_sala_tutoria(self, chat_id):
         """Verifica si un chat es una sala de tutoría"""
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT Tipo_sala FROM Grupos_tutoria
-            WHERE Chat_id LIKE ?
-        ''', (f"%{chat_id}%",))
+        ejecutar(cursor, "gestion.tipo_sala_por_chat", (f"%{chat_id}%",))
         
         result = cursor.fetchone()
         conn.close()
@@ -171,11 +149,11 @@ class GestionGrupos:
     
     def es_profesor(self, user_id):
         """Verifica si un usuario es profesor"""
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
         
         # Cambiado de 'rol' a 'Tipo' para ser consistente con el resto del código
-        cursor.execute('SELECT Tipo FROM Usuarios WHERE Telegram_id = ?', (user_id,))
+        ejecutar(cursor, "gestion.tipo_usuario", (user_id,))
         result = cursor.fetchone()
         conn.close()
         
@@ -439,14 +417,9 @@ class GestionGrupos:
             return ConversationHandler.END
         
         # Obtener salas del profesor
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT g.id_sala, g.Nombre_sala, a.nombre, g.Id_asignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN asignaturas a ON g.Id_asignatura = a.id
-            WHERE g.Id_usuario = ? AND g.Tipo_sala = 'pública'
-        ''', (user_id,))
+        ejecutar(cursor, "gestion.salas_publicas_profesor", (user_id,))
         
         salas = cursor.fetchall()
         conn.close()
@@ -488,18 +461,9 @@ class GestionGrupos:
             return ConversationHandler.END
         
         # Obtener salas del profesor
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
-        cursor.execute('''
-            SELECT g.id_sala, g.Nombre_sala, 
-                   CASE 
-                       WHEN g.Tipo_sala = 'privada' THEN 'Sala de Tutorías'
-                       ELSE a.nombre 
-                   END as tipo_o_asignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN asignaturas a ON g.Id_asignatura = a.id
-            WHERE g.Id_usuario = ?
-        ''', (user_id,))
+        ejecutar(cursor, "gestion.salas_profesor", (user_id,))
         
         salas = cursor.fetchall()
         conn.close()
@@ -588,9 +552,9 @@ class GestionGrupos:
         nueva_asignatura_id = int(query.data.split('_')[1])
         
         # Obtener nombre de la asignatura
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
-        cursor.execute("SELECT nombre FROM asignaturas WHERE id = ?", (nueva_asignatura_id,))
+        ejecutar(cursor, "gestion.nombre_asignatura", (nueva_asignatura_id,))
         nombre_asignatura = cursor.fetchone()[0]
         conn.close()
         
@@ -629,12 +593,12 @@ class GestionGrupos:
         nueva_asignatura_nombre = context.user_data['nueva_asignatura']['nombre']
         
         # Actualizar la asignatura en la base de datos
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
         
         try:
             # Obtener el chat_id de la sala
-            cursor.execute("SELECT Chat_id FROM Grupos_tutoria WHERE id_sala = ?", (sala_id,))
+            ejecutar(cursor, "gestion.chat_de_sala", (sala_id,))
             chat_id_result = cursor.fetchone()
             
             if not chat_id_result:
@@ -644,14 +608,12 @@ class GestionGrupos:
                 
             chat_id = chat_id_result[0]
             
-            # Actualizar la asignatura
-            cursor.execute(
-                "UPDATE Grupos_tutoria SET Id_asignatura = ? WHERE id_sala = ?", 
-                (nueva_asignatura_id, sala_id)
-            )
-            conn.commit()
             conn.close()
             
+            # Actualizar la asignatura
+            ejecutar_escritura(lambda conn, cursor: ejecutar(
+                cursor, "gestion.cambiar_asignatura_sala", (nueva_asignatura_id, sala_id)))
+            
             # Si se solicitó expulsar miembros, hacerlo
             if expulsar_miembros:
                 self.expulsar_todos_miembros(context.bot, chat_id, exclude_admins=True)
@@ -688,32 +650,41 @@ class GestionGrupos:
             if bot_id not in admins:
                 admins.append(bot_id)
             
-            # Obtener todos los miembros y expulsar a los que no son admin
+            # Obtener todos los miembros y expulsar a los que no son admin. Todo pasa por la
+            # cola de salida: las expulsiones y el aviso final van en orden por el chat del
+            # grupo y los avisos privados respetan el límite global de Telegram
+            from utils.mensajeria import get_cola_mensajes, MASIVO
+            cola = get_cola_mensajes(bot)
             chat_members = bot.get_chat_members(chat_id)
             expulsados = 0
             
+            def registrar_fallo(accion, user_id):
+                def comprobar(futuro):
+                    if futuro.exception() is not None:
+                        self.logger.warning(f"No se pudo {accion} a {user_id}: {futuro.exception()}")
+                return comprobar
+            
             for member in chat_members:
                 if member.user.id not in admins:
                     # Ban temporal (1 minuto)
                     until_date = int(time.time()) + 60
-                    bot.ban_chat_member(chat_id, member.user.id, until_date=until_date)
+                    cola.encolar(chat_id, "ban_chat_member", member.user.id, until_date=until_date,
+                                 prioridad=MASIVO, limitar_chat=False).add_done_callback(registrar_fallo("expulsar", member.user.id))
                     expulsados += 1
                     
-                    # Intentar enviar mensaje al usuario expulsado
-                    try:
-                        bot.send_message(
-                            chat_id=member.user.id,
-                            text="Has sido expulsado del grupo porque la configuración del mismo ha cambiado."
-                        )
-                    except:
-                        # Si no podemos enviar mensaje al usuario, lo ignoramos
-                        pass
-            
-            # Enviar mensaje al grupo
+                    # Avisar al usuario expulsado (puede que no haya abierto chat con el bot)
+                    cola.enviar_mensaje(
+                        member.user.id,
+                        "Has sido expulsado del grupo porque la configuración del mismo ha cambiado.",
+                        prioridad=MASIVO
+                    ).add_done_callback(registrar_fallo("avisar", member.user.id))
+            
+            # Enviar mensaje al grupo (sale después de las expulsiones)
             if expulsados > 0:
-                bot.send_message(
-                    chat_id=chat_id,
-                    text=f"La configuración de este grupo ha cambiado. Se han expulsado {expulsados} miembros."
+                cola.enviar_mensaje(
+                    chat_id,
+                    f"La configuración de este grupo ha cambiado. Se han expulsado {expulsados} miembros.",
+                    prioridad=MASIVO
                 )
                 
             return expulsados
@@ -735,20 +706,11 @@ class GestionGrupos:
         sala_id = int(query.data.split('_')[1])
         
         # Obtener información de la sala
-        conn = sqlite3.connect(self.db_path)
+        conn = conectar(self.db_path)
         cursor = conn.cursor()
         
         try:
-            cursor.execute('''
-                SELECT g.Nombre_sala, g.Chat_id,
-                       CASE 
-                           WHEN g.Tipo_sala = 'privada' THEN 'Sala de Tutorías'
-                           ELSE a.nombre 
-                       END as tipo_o_asignatura
-                FROM Grupos_tutoria g
-                LEFT JOIN asignaturas a ON g.Id_asignatura = a.id
-                WHERE g.id_sala = ?
-            ''', (sala_id,))
+            ejecutar(cursor, "gestion.detalle_sala", (sala_id,))
             
             sala_info = cursor.fetchone()
             
@@ -813,14 +775,9 @@ class GestionGrupos:
         expulsar_miembros = (accion == "expulsar")
         
         # Eliminar sala de la base de datos
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         try:
             # Eliminar de la BD
-            cursor.execute("DELETE FROM Grupos_tutoria WHERE id_sala = ?", (sala_id,))
-            conn.commit()
-            conn.close()
+            ejecutar_escritura(lambda conn, cursor: ejecutar(cursor, "gestion.eliminar_sala", (sala_id,)))
             
             # Si se solicitó expulsar miembros, hacerlo
             if expulsar_miembros and sala_info['chat_id']:
@@ -840,8 +797,6 @@ class GestionGrupos:
         except Exception as e:
             self.logger.error(f"Error al eliminar sala: {e}")
             query.edit_message_text("Ocurrió un error al eliminar la sala.")
-            if 'conn' in locals() and conn:
-                conn.close()
         
         return ConversationHandler.END
 
@@ -19,6 +19,7 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Ahora puedes importar desde db
 from db.queries import get_db_connection, get_user_by_telegram_id
+from db.consultas import ejecutar
 
 # Configurar logging
 logger = logging.getLogger(__name__)
@@ -83,7 +84,7 @@ def register_student_handlers(bot):
                 cursor = conn.cursor()
                 
                 # Verificar si el grupo es un grupo de tutorías
-                cursor.execute("SELECT * FROM Grupos_tutoria WHERE Chat_id = ?", (str(chat_id),))
+                ejecutar(cursor, "salas.por_chat_id", (str(chat_id),))
                 grupo = cursor.fetchone()
                 
                 try:
@@ -143,7 +144,7 @@ def register_student_handlers(bot):
                 # Verificar si el grupo es de tutorías
                 conn = get_db_connection()
                 cursor = conn.cursor()
-                cursor.execute("SELECT * FROM Grupos_tutoria WHERE Chat_id = ?", (str(chat_id),))
+                ejecutar(cursor, "salas.por_chat_id", (str(chat_id),))
                 grupo = cursor.fetchone()
                 
                 # Enviar mensaje de bienvenida siempre
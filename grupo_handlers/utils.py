@@ -9,24 +9,15 @@ import os
 from pathlib import Path
 from telebot import types
 import sqlite3
-import threading
 
 # Configurar paths para importaciones
 root_path = str(Path(__file__).parent.parent.absolute())
 if root_path not in sys.path:
     sys.path.insert(0, root_path)
 
-# Cargar state_manager usando importación dinámica para evitar problemas de rutas
-import importlib.util
-state_manager_path = Path(__file__).parent.parent / "utils" / "state_manager.py"
-spec = importlib.util.spec_from_file_location("state_manager", state_manager_path)
-state_manager = importlib.util.module_from_spec(spec)
-spec.loader.exec_module(state_manager)
-
-# Obtener las variables de estado
-user_states = state_manager.user_states
-user_data = state_manager.user_data
-estados_timestamp = state_manager.estados_timestamp
+# Variables de estado del almacén común (importación normal: cargarlo desde
+# la ruta del fichero creaba una segunda copia del módulo con otros estados)
+from utils.state_manager import user_states, user_data, estados_timestamp, limpiar_estados_caducados
 
 # Importar funciones de la base de datos compartidas
 from db.queries import (
@@ -36,9 +27,10 @@ from db.queries import (
     crear_grupo_tutoria,
     añadir_estudiante_grupo
 )
+from db.consultas import ejecutar
+from db.escritor import ejecutar_escritura
 
-# Constantes
-MAX_ESTADO_DURACION = 3600  # 1 hora en segundos
+# La duración máxima de un estado es ESTADOS_TTL (config.py, 1 hora por defecto)
 
 def configurar_logger():
     """Configura y devuelve el logger"""
@@ -108,54 +100,41 @@ def es_profesor(user_id):
     return False
 
 def limpiar_estados_obsoletos():
-    """Limpia estados de usuario obsoletos para evitar fugas de memoria."""
-    tiempo_actual = time.time()
-    usuarios_para_limpiar = []
-    
-    # Identificar estados obsoletos
-    for user_id, timestamp in estados_timestamp.items():
-        if tiempo_actual - timestamp > MAX_ESTADO_DURACION:
-            usuarios_para_limpiar.append(user_id)
-    
-    # Eliminar estados obsoletos
-    for user_id in usuarios_para_limpiar:
-        if user_id in user_states:
-            logger.info(f"Limpiando estado obsoleto para usuario {user_id}")
-            del user_states[user_id]
-        if user_id in estados_timestamp:
-            del estados_timestamp[user_id]
-    
-    if usuarios_para_limpiar:
-        logger.info(f"Limpiados {len(usuarios_para_limpiar)} estados obsoletos")
+    """
+    Limpia estados de usuario obsoletos para evitar fugas de memoria.
+    El almacén ya caduca cada conversación tras su TTL sin actividad; esto
+    solo adelanta el barrido, que mira el principio de las colas de caducidad
+    en lugar de recorrer todos los usuarios.
+    """
+    limpiados = limpiar_estados_caducados()
+    if limpiados:
+        logger.info(f"Limpiados {limpiados} estados obsoletos")
 
 # Funciones de base de datos
 def inicializar_tablas_grupo():
     """Inicializa las tablas necesarias para grupos"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Crear tabla Usuario_Grupo
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS Usuario_Grupo (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            Id_usuario INTEGER,
-            id_sala INTEGER,
-            fecha_union TEXT,
-            FOREIGN KEY (Id_usuario) REFERENCES Usuarios(Id_usuario),
-            FOREIGN KEY (id_sala) REFERENCES Grupos_tutoria(id_sala),
-            UNIQUE(Id_usuario, id_sala)
-        )
-    """)
-    
-    # Verificar columna chat_id en Grupos_tutoria
-    cursor.execute("PRAGMA table_info(Grupos_tutoria)")
-    columnas = [info[1] for info in cursor.fetchall()]
-    if "chat_id" not in columnas:
-        cursor.execute("ALTER TABLE Grupos_tutoria ADD COLUMN chat_id INTEGER")
-        logger.info("Añadida columna 'chat_id' a Grupos_tutoria")
+    def _crear_tablas(conn, cursor):
+        # Crear tabla Usuario_Grupo
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS Usuario_Grupo (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                Id_usuario INTEGER,
+                id_sala INTEGER,
+                fecha_union TEXT,
+                FOREIGN KEY (Id_usuario) REFERENCES Usuarios(Id_usuario),
+                FOREIGN KEY (id_sala) REFERENCES Grupos_tutoria(id_sala),
+                UNIQUE(Id_usuario, id_sala)
+            )
+        """)
+        
+        # Verificar columna chat_id en Grupos_tutoria
+        cursor.execute("PRAGMA table_info(Grupos_tutoria)")
+        columnas = [info[1].lower() for info in cursor.fetchall()]
+        if "chat_id" not in columnas:
+            cursor.execute("ALTER TABLE Grupos_tutoria ADD COLUMN chat_id INTEGER")
+            logger.info("Añadida columna 'chat_id' a Grupos_tutoria")
     
-    conn.commit()
-    conn.close()
+    ejecutar_escritura(_crear_tablas)
 
 def guardar_usuario_en_grupo(user_id, username, chat_id):
     """Guarda un usuario en un grupo específico"""
@@ -182,7 +161,7 @@ def guardar_usuario_en_grupo(user_id, username, chat_id):
         cursor = conn.cursor()
         
         # Buscar grupo por chat_id 
-        cursor.execute("SELECT id_sala FROM Grupos_tutoria WHERE chat_id = ?", (chat_id,))
+        ejecutar(cursor, "salas.id_por_chat_id", (chat_id,))
         grupo = cursor.fetchone()
         conn.close()
         
@@ -238,65 +217,3 @@ def send_markdown_message(bot, chat_id, text, reply_markup=None):
             parse_mode=None,
             reply_markup=reply_markup
         )
-
-# Un lock global para sincronizar acceso a la base de datos
-db_lock = threading.RLock()
-
-def execute_db_operation(operation_func, max_retries=5, retry_delay=0.5):
-    """
-    Ejecuta una operación de base de datos con reintentos y manejo de bloqueos.
-    
-    Args:
-        operation_func: Función que recibe una conexión y cursor y realiza operaciones DB
-        max_retries: Número máximo de intentos si hay bloqueo
-        retry_delay: Tiempo de espera entre reintentos
-    
-    Returns:
-        El resultado de operation_func o None si falla
-    """
-    from db.queries import get_db_connection
-    
-    retries = 0
-    while retries < max_retries:
-        conn = None
-        try:
-            # Adquirir lock para evitar competencia
-            with db_lock:
-                conn = get_db_connection()
-                # Configurar timeout más largo para esperar que se libere el bloqueo
-                conn.execute("PRAGMA busy_timeout = 5000")
-                cursor = conn.cursor()
-                
-                # Ejecutar la operación proporcionada
-                result = operation_func(conn, cursor)
-                
-                # Commit si todo salió bien
-                conn.commit()
-                return result
-                
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e):
-                retries += 1
-                logging.warning(f"Base de datos bloqueada, reintento {retries}/{max_retries}")
-                time.sleep(retry_delay)
-            else:
-                logging.error(f"Error de base de datos: {e}")
-                import traceback
-                traceback.print_exc()
-                return None
-        except Exception as e:
-            logging.error(f"Error ejecutando operación de BD: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
-        finally:
-            # Asegurar que siempre se cierra la conexión
-            if conn:
-                try:
-                    conn.close()
-                except:
-                    pass
-    
-    # Si llegamos aquí, se agotaron los reintentos
-    logging.error("Máximo de reintentos alcanzado para operación de BD")
-    return None
\ No newline at end of file
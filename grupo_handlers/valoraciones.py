@@ -8,12 +8,12 @@ import time
 # Añadir directorio padre al path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from db.queries import get_db_connection, get_user_by_telegram_id
+from db.consultas import ejecutar
+from db.escritor import ejecutar_escritura
 
 
-# Crear estas variables localmente en vez de importarlas
-user_states = {}
-user_data = {}
-estados_timestamp = {}
+# Estados del almacén común de conversaciones
+from utils.state_manager import user_states, user_data, estados_timestamp
 
 # Añadir timestamp cuando se establece un estado
 def set_user_state(chat_id, state):
@@ -48,15 +48,7 @@ def register_handlers(bot):
         cursor = conn.cursor()
         
         # Obtener profesores de las asignaturas del estudiante
-        cursor.execute("""
-            SELECT DISTINCT u.Id_usuario, u.Nombre
-            FROM Usuarios u
-            JOIN Matriculas mp ON u.Id_usuario = mp.Id_usuario
-            JOIN Asignaturas a ON mp.Id_asignatura = a.Id_asignatura
-            JOIN Matriculas me ON a.Id_asignatura = me.Id_asignatura
-            WHERE u.Tipo = 'profesor' AND me.Id_usuario = ?
-            ORDER BY u.Nombre
-        """, (user['Id_usuario'],))
+        ejecutar(cursor, "valoraciones.profesores_del_estudiante", (user['Id_usuario'],))
         
         profesores = cursor.fetchall()
         conn.close()
@@ -94,7 +86,7 @@ def register_handlers(bot):
         # Obtener datos del profesor
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT * FROM Usuarios WHERE Id_usuario = ?", (profesor_id,))
+        ejecutar(cursor, "usuarios.por_id", (profesor_id,))
         profesor = cursor.fetchone()
         conn.close()
         
@@ -196,9 +188,6 @@ def register_handlers(bot):
         user_data[chat_id]["es_anonimo"] = es_anonimo
         
         # Guardar valoración en la base de datos
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         try:
             evaluador_id = get_user_by_telegram_id(call.from_user.id)['Id_usuario']
             profesor_id = user_data[chat_id]["profesor_id"]
@@ -206,15 +195,10 @@ def register_handlers(bot):
             comentario = user_data[chat_id].get("comentario", "")
             fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             
-            cursor.execute(
-                """
-                INSERT INTO Valoraciones 
-                (evaluador_id, profesor_id, puntuacion, comentario, fecha, es_anonimo, id_sala) 
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                """,
-                (evaluador_id, profesor_id, puntuacion, comentario, fecha, es_anonimo, user_data[chat_id].get("sala_id"))
-            )
-            conn.commit()
+            sala_id = user_data[chat_id].get("sala_id")
+            ejecutar_escritura(lambda conn, cursor: ejecutar(cursor, "valoraciones.crear",
+                (evaluador_id, profesor_id, puntuacion, comentario, fecha, es_anonimo, sala_id)
+            ))
             
             bot.send_message(
                 chat_id,
@@ -232,7 +216,6 @@ def register_handlers(bot):
             )
         
         finally:
-            conn.close()
             user_states.pop(chat_id, None)
             user_data.pop(chat_id, None)
         
@@ -244,7 +227,7 @@ def iniciar_valoracion_profesor(bot, profesor_id, estudiante_id, sala_id=None):
     # Buscar usuario por id
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM Usuarios WHERE Id_usuario = ?", (estudiante_id,))
+    ejecutar(cursor, "usuarios.por_id", (estudiante_id,))
     estudiante = cursor.fetchone()
     
     # Si no hay TelegramID, no podemos enviar mensaje
@@ -254,7 +237,7 @@ def iniciar_valoracion_profesor(bot, profesor_id, estudiante_id, sala_id=None):
     chat_id = estudiante['TelegramID']
     
     # Obtener datos del profesor
-    cursor.execute("SELECT * FROM Usuarios WHERE Id_usuario = ?", (profesor_id,))
+    ejecutar(cursor, "usuarios.por_id", (profesor_id,))
     profesor = cursor.fetchone()
     
     if not profesor:
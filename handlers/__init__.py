@@ -12,8 +12,6 @@ Paquete de handlers para el bot de tutorías UGR.
 """
 # Este archivo debe ser simple para evitar importaciones circulares
 
-# Solo incluye variables compartidas si son necesarias
-user_states = {}
-user_data = {}
-estados_timestamp = {}
+# Las conversaciones son las del almacén común (utils/state_manager.py)
+from utils.state_manager import user_states, user_data, estados_timestamp
 
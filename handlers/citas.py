@@ -0,0 +1,304 @@
+"""
+Reserva de citas de tutoría desde el bot (motor en utils/citas.py).
+
+El estudiante llega aquí con el botón "📅 Reservar cita" que se le ofrece
+al solicitar una sala fuera del horario del profesor: ve los próximos
+huecos libres, reserva uno o, si un día está completo, se apunta a su
+lista de espera. /mis_citas lista las citas pendientes y permite anularlas.
+"""
+import sys
+import os
+import logging
+from datetime import datetime, date, timedelta
+from telebot import types
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.queries import get_user_by_telegram_id, get_user_by_id
+from utils.citas import (
+    get_gestor_citas, RESERVADA, OCUPADA, SOLAPADA, LIMITE, FUERA_DE_HORARIO, EN_ESPERA
+)
+from utils.motor_horarios import DIAS_SEMANA, formatear_franja
+from handlers.tutorias import escape_markdown
+
+logger = logging.getLogger(__name__)
+
+HUECOS_MOSTRADOS = 8     # Botones de huecos libres por mensaje
+DIAS_ESPERA = 3          # Días completos para los que se ofrece la lista de espera
+
+MENSAJES_ESTADO = {
+    OCUPADA: "⚠️ Ese hueco acaba de reservarlo otro estudiante. Elige otro:",
+    SOLAPADA: "⚠️ Ya tienes otra cita a esa hora.",
+    LIMITE: "⚠️ Ya tienes una cita pendiente con este profesor. Anúlala en /mis_citas si quieres cambiarla.",
+    FUERA_DE_HORARIO: "⚠️ Ese hueco ya no está en el horario del profesor.",
+}
+
+
+def formatear_cita(fecha, inicio, fin):
+    """Fecha (date o YYYY-MM-DD) y minutos -> Lunes 19/10 10:00-10:15"""
+    if isinstance(fecha, str):
+        fecha = date.fromisoformat(fecha)
+    return f"{DIAS_SEMANA[fecha.weekday()]} {fecha:%d/%m} {formatear_franja(inicio, fin)}"
+
+
+def nombre_completo(fila):
+    return f"{fila['Nombre']} {fila['Apellidos'] or ''}".strip()
+
+
+def markup_huecos(profesor_id, sala_id, momento=None):
+    """
+    Botones con los próximos huecos libres del profesor y, para los días con
+    horario pero sin huecos libres, para apuntarse a la lista de espera
+
+    Returns:
+        InlineKeyboardMarkup o None si el profesor no tiene huecos en los días reservables
+    """
+    gestor = get_gestor_citas()
+    if momento is None:
+        momento = datetime.now()
+    libres = gestor.huecos_libres(profesor_id, momento)
+
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    markup.add(*[
+        types.InlineKeyboardButton(
+            formatear_cita(fecha, inicio, fin),
+            callback_data=f"reservar_cita_{profesor_id}_{sala_id}_{fecha:%Y%m%d}_{inicio}"
+        )
+        for fecha, inicio, fin in libres[:HUECOS_MOSTRADOS]
+    ])
+
+    # Días con horario en los que ya no queda ningún hueco libre
+    con_libres = {fecha for fecha, _, _ in libres}
+    completos = []
+    for adelante in range(gestor.dias):
+        fecha = momento.date() + timedelta(days=adelante)
+        if fecha not in con_libres and gestor.huecos_reservables(profesor_id, fecha, momento):
+            completos.append(fecha)
+            if len(completos) >= DIAS_ESPERA:
+                break
+    for fecha in completos:
+        markup.add(types.InlineKeyboardButton(
+            f"⏳ Lista de espera {DIAS_SEMANA[fecha.weekday()]} {fecha:%d/%m}",
+            callback_data=f"espera_cita_{profesor_id}_{sala_id}_{fecha:%Y%m%d}"
+        ))
+
+    if not libres and not completos:
+        return None
+    return markup
+
+
+def register_handlers(bot):
+    """Registra los handlers de citas de tutoría"""
+
+    def enviar_huecos(chat_id, profesor_id, sala_id, texto, message_id=None):
+        """Muestra (o actualiza) el mensaje con los huecos libres"""
+        markup = markup_huecos(profesor_id, sala_id)
+        if markup is None:
+            texto = "❌ El profesor no tiene huecos de tutoría en los próximos días."
+        if message_id:
+            bot.edit_message_text(texto, chat_id=chat_id, message_id=message_id, reply_markup=markup)
+        else:
+            bot.send_message(chat_id, texto, reply_markup=markup)
+
+    def avisar_profesor(profesor_id, estudiante, fecha, inicio, fin, sala_id, texto="🔔 *Nueva cita de tutoría*"):
+        """Avisa al profesor de una cita; si es de una sala, con los botones para darle acceso"""
+        profesor = get_user_by_id(profesor_id)
+        if not profesor or not profesor['TelegramID']:
+            return
+        markup = None
+        if sala_id:
+            markup = types.InlineKeyboardMarkup(row_width=2)
+            markup.add(
+                types.InlineKeyboardButton("✅ Aprobar", callback_data=f"aprobar_tutoria_{sala_id}_{estudiante['Id_usuario']}"),
+                types.InlineKeyboardButton("❌ Rechazar", callback_data=f"rechazar_tutoria_{sala_id}_{estudiante['Id_usuario']}")
+            )
+        bot.send_message(
+            profesor['TelegramID'],
+            f"{texto}\n\n"
+            f"👤 Estudiante: {escape_markdown(nombre_completo(estudiante))}\n"
+            f"📅 {formatear_cita(fecha, inicio, fin)}"
+            + ("\n\nDa acceso a la sala al estudiante para la cita:" if sala_id else ""),
+            parse_mode="Markdown",
+            reply_markup=markup
+        )
+
+    def estudiante_de(call):
+        user = get_user_by_telegram_id(call.from_user.id)
+        if not user or user['Tipo'] != 'estudiante':
+            bot.answer_callback_query(call.id, "⚠️ Solo los estudiantes pueden reservar citas.")
+            return None
+        return user
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith("citas_"))
+    def handle_ver_huecos(call):
+        """Muestra los próximos huecos libres de un profesor"""
+        if not estudiante_de(call):
+            return
+        _, profesor_id, sala_id = call.data.split("_")
+        enviar_huecos(call.message.chat.id, int(profesor_id), int(sala_id), "📅 Elige un hueco para tu cita:")
+        bot.answer_callback_query(call.id)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith("reservar_cita_"))
+    def handle_reservar_cita(call):
+        """Reserva el hueco elegido"""
+        chat_id = call.message.chat.id
+        user = estudiante_de(call)
+        if not user:
+            return
+        profesor_id, sala_id, fecha, inicio = call.data.split("_")[2:]
+        profesor_id, sala_id, inicio = int(profesor_id), int(sala_id), int(inicio)
+        fecha = datetime.strptime(fecha, "%Y%m%d").date()
+
+        try:
+            estado, id_cita = get_gestor_citas().reservar(profesor_id, user['Id_usuario'], fecha, inicio,
+                                                          sala_id or None)
+        except Exception as e:
+            logger.error(f"Error al reservar cita: {e}")
+            bot.answer_callback_query(call.id, "❌ No se pudo reservar la cita")
+            return
+
+        if estado != RESERVADA:
+            bot.answer_callback_query(call.id, "⚠️ No se pudo reservar")
+            if estado == OCUPADA:
+                enviar_huecos(chat_id, profesor_id, sala_id, MENSAJES_ESTADO[OCUPADA], call.message.message_id)
+            else:
+                bot.send_message(chat_id, MENSAJES_ESTADO[estado])
+            return
+
+        fin = inicio + get_gestor_citas().duracion
+        bot.edit_message_text(
+            f"✅ Cita reservada: {formatear_cita(fecha, inicio, fin)}\n\n"
+            f"Puedes consultarla o anularla con /mis_citas.",
+            chat_id=chat_id,
+            message_id=call.message.message_id
+        )
+        bot.answer_callback_query(call.id, "✅ Cita reservada")
+        print(f"📅 Cita {id_cita} reservada: estudiante {user['Id_usuario']} con profesor {profesor_id}")
+        avisar_profesor(profesor_id, user, fecha, inicio, fin, sala_id or None)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith("espera_cita_"))
+    def handle_espera_cita(call):
+        """Apunta al estudiante a la lista de espera de un día completo"""
+        chat_id = call.message.chat.id
+        user = estudiante_de(call)
+        if not user:
+            return
+        profesor_id, sala_id, fecha = call.data.split("_")[2:]
+        profesor_id, sala_id = int(profesor_id), int(sala_id)
+        fecha = datetime.strptime(fecha, "%Y%m%d").date()
+
+        try:
+            estado, dato = get_gestor_citas().apuntar_espera(profesor_id, user['Id_usuario'], fecha, sala_id or None)
+        except Exception as e:
+            logger.error(f"Error al apuntar a la lista de espera: {e}")
+            bot.answer_callback_query(call.id, "❌ No se pudo completar la operación")
+            return
+
+        bot.answer_callback_query(call.id)
+        if estado == EN_ESPERA:
+            bot.send_message(
+                chat_id,
+                f"⏳ Estás en la lista de espera del {DIAS_SEMANA[fecha.weekday()]} {fecha:%d/%m} "
+                f"(posición {dato}). Si se libera un hueco te lo reservaremos y te avisaremos."
+            )
+        elif estado == RESERVADA:
+            # Se había liberado un hueco: reservado directamente
+            cita = next((c for c in get_gestor_citas().citas_pendientes(user['Id_usuario']) if c['Id_cita'] == dato), None)
+            texto = formatear_cita(cita['Fecha'], cita['Inicio'], cita['Fin']) if cita else f"{fecha:%d/%m}"
+            bot.send_message(chat_id, f"✅ Se acababa de liberar un hueco y es tuyo: {texto}")
+            if cita:
+                avisar_profesor(profesor_id, user, cita['Fecha'], cita['Inicio'], cita['Fin'], sala_id or None)
+        else:
+            bot.send_message(chat_id, MENSAJES_ESTADO[estado])
+
+    @bot.message_handler(commands=['mis_citas'])
+    def handle_mis_citas(message):
+        """Citas pendientes (y listas de espera del estudiante) con botones para anularlas"""
+        chat_id = message.chat.id
+        user = get_user_by_telegram_id(message.from_user.id)
+        if not user:
+            bot.send_message(chat_id, "❌ No estás registrado. Usa /start para registrarte.")
+            return
+
+        gestor = get_gestor_citas()
+        es_profesor = user['Tipo'] == 'profesor'
+        citas = gestor.citas_pendientes(user['Id_usuario'], es_profesor)
+        esperas = [] if es_profesor else gestor.esperas_estudiante(user['Id_usuario'])
+
+        if not citas and not esperas:
+            bot.send_message(chat_id, "📭 No tienes citas de tutoría pendientes.")
+            return
+
+        markup = types.InlineKeyboardMarkup(row_width=1)
+        lineas = ["📅 *Tus citas de tutoría:*\n"] if citas else []
+        for cita in citas:
+            cuando = formatear_cita(cita['Fecha'], cita['Inicio'], cita['Fin'])
+            lineas.append(f"• {cuando} con {escape_markdown(nombre_completo(cita))}")
+            markup.add(types.InlineKeyboardButton(f"❌ Anular {cuando}", callback_data=f"cancelar_cita_{cita['Id_cita']}"))
+        if esperas:
+            lineas.append("\n⏳ *Listas de espera:*\n")
+        for espera in esperas:
+            fecha = date.fromisoformat(espera['Fecha'])
+            dia = f"{DIAS_SEMANA[fecha.weekday()]} {fecha:%d/%m}"
+            lineas.append(f"• {dia} con {escape_markdown(nombre_completo(espera))}")
+            markup.add(types.InlineKeyboardButton(f"🚪 Salir de la lista del {dia}",
+                                                  callback_data=f"salir_espera_{espera['Id_espera']}"))
+
+        bot.send_message(chat_id, "\n".join(lineas), parse_mode="Markdown", reply_markup=markup)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith("cancelar_cita_"))
+    def handle_cancelar_cita(call):
+        """Anula una cita, avisa a la otra parte y, si alguien esperaba, le da el hueco"""
+        chat_id = call.message.chat.id
+        user = get_user_by_telegram_id(call.from_user.id)
+        if not user:
+            bot.answer_callback_query(call.id, "❌ No estás registrado en el sistema.")
+            return
+
+        try:
+            resultado = get_gestor_citas().cancelar(int(call.data.split("_")[2]), user['Id_usuario'])
+        except Exception as e:
+            logger.error(f"Error al anular cita: {e}")
+            bot.answer_callback_query(call.id, "❌ No se pudo anular la cita")
+            return
+        if resultado is None:
+            bot.answer_callback_query(call.id, "⚠️ La cita ya no existe")
+            return
+
+        cita = resultado['cita']
+        cuando = formatear_cita(cita['Fecha'], cita['Inicio'], cita['Fin'])
+        bot.edit_message_text(f"🗑️ Cita anulada: {cuando}", chat_id=chat_id, message_id=call.message.message_id)
+        bot.answer_callback_query(call.id, "✅ Cita anulada")
+
+        # Avisar a la otra parte
+        otro = get_user_by_id(cita['Id_profesor'] if user['Id_usuario'] == cita['Id_estudiante'] else cita['Id_estudiante'])
+        if otro and otro['TelegramID']:
+            bot.send_message(otro['TelegramID'], f"🗑️ {nombre_completo(user)} ha anulado la cita del {cuando}.")
+
+        promovida = resultado['promovida']
+        if promovida:
+            estudiante = get_user_by_id(promovida['Id_estudiante'])
+            if estudiante and estudiante['TelegramID']:
+                bot.send_message(
+                    estudiante['TelegramID'],
+                    f"🎉 Se ha liberado un hueco de la lista de espera y es tuyo: {cuando}\n\n"
+                    f"Puedes consultarla o anularla con /mis_citas."
+                )
+            if estudiante:
+                avisar_profesor(cita['Id_profesor'], estudiante, cita['Fecha'], cita['Inicio'], cita['Fin'],
+                                promovida['Id_sala'], texto="🔔 *Cita asignada desde la lista de espera*")
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith("salir_espera_"))
+    def handle_salir_espera(call):
+        """Quita al estudiante de una lista de espera"""
+        user = get_user_by_telegram_id(call.from_user.id)
+        if not user:
+            bot.answer_callback_query(call.id, "❌ No estás registrado en el sistema.")
+            return
+        if get_gestor_citas().salir_espera(int(call.data.split("_")[2]), user['Id_usuario']):
+            bot.edit_message_text("🚪 Has salido de la lista de espera.", chat_id=call.message.chat.id,
+                                  message_id=call.message.message_id)
+            bot.answer_callback_query(call.id, "✅ Hecho")
+        else:
+            bot.answer_callback_query(call.id, "⚠️ Ya no estabas en esa lista")
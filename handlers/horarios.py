@@ -9,9 +9,10 @@ import os
 # Add parent directory to system path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Now import after modifying the path
-from db.models import get_db_connection
-
-from db.queries import update_user, get_user_by_telegram_id, update_horario_profesor
+from db.queries import update_user, get_user_by_telegram_id, update_horario_profesor, get_franjas_profesor
+from utils.motor_horarios import franjas_por_dia, indice_dia, analizar_horario, formatear_franja, DIAS_SEMANA
+from utils.franjas import (HorarioSemanal, DIAS_LABORABLES, convertir_a_minutos, franjas_a_conjunto,
+                           hay_solapamiento)
 
 # Configuración del logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -24,11 +25,10 @@ INTRODUCIR_FRANJA = "introducir_franja"
 CONFIRMACION_GUARDAR = "confirmacion_guardar"
 POST_ANADIR_FRANJA = "post_anadir_franja"
 MODIFICAR_FRANJA = "modificar_franja"
+IMPORTAR_HORARIO = "importar_horario"
 
-# Diccionarios para almacenar estados y datos temporales
-user_states = {}
-user_data = {}
-estados_timestamp = {}  # Para timeout de estados
+# Estados y datos temporales: vistas sobre el almacén común de conversaciones
+from utils.state_manager import user_states, user_data, estados_timestamp
 
 # Tiempo de inactividad (30 minutos)
 TIMEOUT = 30 * 60
@@ -59,7 +59,8 @@ def formatear_horario_bonito(horario_dict):
         return "No hay horario configurado"
     
     resultado = []
-    for dia, franjas in sorted(horario_dict.items()):
+    # Días en orden de la semana (los nombres desconocidos al final)
+    for dia, franjas in sorted(horario_dict.items(), key=lambda d: (indice_dia(d[0]) is None, indice_dia(d[0]) or 0)):
         if franjas:
             lineas_hora = [f"• {hora}" for hora in sorted(franjas)]
             resultado.append(f"📅 *{dia}*:\n{chr(10).join(lineas_hora)}")
@@ -67,15 +68,17 @@ def formatear_horario_bonito(horario_dict):
     return "\n\n".join(resultado) if resultado else "No hay horario configurado"
 
 def guardar_horario_bd(chat_id, horario_dict):
-    """Guarda el horario en la base de datos"""
+    """Guarda el horario (dict día -> ["HH:MM-HH:MM", ...]) en Franjas_horario"""
     try:
-        # Convertir el diccionario a string para guardar en la BD
-        horario_str = ""
-        for dia, franjas in horario_dict.items():
-            for franja in franjas:
-                if horario_str:
-                    horario_str += ", "
-                horario_str += f"{dia} {franja}"
+        franjas = []
+        for dia, lista in horario_dict.items():
+            numero_dia = indice_dia(dia)
+            if numero_dia is None:
+                logger.warning(f"Día desconocido en el horario de {chat_id}: {dia}")
+                continue
+            for franja in lista:
+                inicio, fin = franja.split("-")
+                franjas.append((numero_dia, convertir_a_minutos(inicio), convertir_a_minutos(fin)))
         
         # Obtener el ID del usuario a partir del ID de Telegram
         user = get_user_by_telegram_id(chat_id)
@@ -83,123 +86,43 @@ def guardar_horario_bd(chat_id, horario_dict):
             logger.error(f"No se encontró usuario con telegram_id {chat_id}")
             return False
         
-        user_id = user['Id_usuario']  # Obtener el ID de usuario real
-        
-        # Actualizar en la base de datos usando la función específica
-        return update_horario_profesor(user_id, horario_str)
+        return update_horario_profesor(user['Id_usuario'], franjas)
         
     except Exception as e:
         logger.error(f"Error al guardar horario en BD: {e}")
         return False
 
 def cargar_horario_bd(chat_id):
-    """Carga el horario desde la base de datos"""
+    """Carga el horario de Franjas_horario como dict día -> ["HH:MM-HH:MM", ...]"""
     try:
-        # DIAGNÓSTICO: Imprimir valores para depuración
-        print(f"Intentando cargar horario para chat_id: {chat_id}")
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Asegurarse de que el cursor devuelva diccionarios en lugar de tuples
-        # Este paso es clave para acceder usando nombres de columnas
-        cursor.row_factory = lambda cursor, row: {col[0]: row[idx] for idx, col in enumerate(cursor.description)}
-        
-        # Verificar primero si el usuario existe
-        cursor.execute("SELECT Id_usuario, Horario FROM Usuarios WHERE TelegramID = ?", (chat_id,))
-        usuario = cursor.fetchone()
-        
-        if not usuario:
-            print(f"No se encontró usuario con telegram_id {chat_id}")
-            conn.close()
+        user = get_user_by_telegram_id(chat_id)
+        if not user:
+            logger.warning(f"No se encontró usuario con telegram_id {chat_id}")
             return {}
-        
-        # Ahora podemos acceder por nombre de columna
-        user_id = usuario['Id_usuario']
-        print(f"ID de usuario encontrado: {user_id}")
-        
-        # DIAGNÓSTICO: Verificar si hay un valor directo en el campo Horario
-        if usuario['Horario']:
-            print(f"Horario encontrado en campo Usuarios.Horario: {usuario['Horario']}")
-            # Intenta convertir el formato de cadena a diccionario
-            try:
-                horario_dict = {}
-                franjas_str = usuario['Horario'].split(',')
-                for franja in franjas_str:
-                    franja = franja.strip()
-                    if ' ' in franja:
-                        dia, horas = franja.split(' ', 1)
-                        if dia not in horario_dict:
-                            horario_dict[dia] = []
-                        horario_dict[dia].append(horas)
-                print(f"Horario convertido a diccionario: {horario_dict}")
-                return horario_dict
-            except Exception as e:
-                print(f"Error al convertir horario de cadena: {e}")
-        
-        # DIAGNÓSTICO: Si no hay horario en el campo directo, buscar en la tabla Horarios_Profesores
-        print("Buscando en tabla Horarios_Profesores...")
-        cursor.execute(
-            "SELECT dia, hora_inicio, hora_fin FROM Horarios_Profesores WHERE Id_usuario = ?",
-            (user_id,)
-        )
-        
-        horarios = cursor.fetchall()
-        print(f"Registros encontrados en Horarios_Profesores: {len(horarios) if horarios else 0}")
-        
-        conn.close()
-        
-        # Convertir a formato de diccionario
-        horario_dict = {}
-        for h in horarios:
-            dia = h['dia']
-            franja = f"{h['hora_inicio']}-{h['hora_fin']}"
-            
-            if dia not in horario_dict:
-                horario_dict[dia] = []
-                
-            horario_dict[dia].append(franja)
-            
-        print(f"Horario final recuperado: {horario_dict}")
-        return horario_dict
+        return franjas_por_dia(get_franjas_profesor(user['Id_usuario']))
     except Exception as e:
-        print(f"Error al cargar horario de BD: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"Error al cargar horario de BD: {e}")
         return {}
 
-def hay_solapamiento(franjas_existentes, nueva_franja):
-    """Verifica si una nueva franja horaria se solapa con las existentes"""
-    if not franjas_existentes:
-        return False
-        
-    try:
-        # Extraer horas de inicio y fin de la nueva franja
-        inicio_nueva, fin_nueva = nueva_franja.split("-")
-        hora_inicio_nueva = convertir_a_minutos(inicio_nueva)
-        hora_fin_nueva = convertir_a_minutos(fin_nueva)
-        
-        # Verificar solapamiento con cada franja existente
-        for franja in franjas_existentes:
-            inicio_existente, fin_existente = franja.split("-")
-            hora_inicio_existente = convertir_a_minutos(inicio_existente)
-            hora_fin_existente = convertir_a_minutos(fin_existente)
-            
-            # Verificar si hay solapamiento
-            if (hora_inicio_nueva < hora_fin_existente and 
-                hora_fin_nueva > hora_inicio_existente):
-                return True
-        
-        return False
-    except Exception as e:
-        logger.error(f"Error al verificar solapamiento: {e}")
-        # En caso de error, considerar que hay solapamiento para prevenir
-        return True
+def horario_a_semanal(horario_dict):
+    """Dict día -> ["HH:MM-HH:MM", ...] del editor -> HorarioSemanal"""
+    semanal = HorarioSemanal()
+    for dia, franjas in horario_dict.items():
+        numero_dia = indice_dia(dia)
+        if numero_dia is not None:
+            semanal.dias[numero_dia] = franjas_a_conjunto(franjas)
+    return semanal
 
-def convertir_a_minutos(hora_str):
-    """Convierte una hora en formato HH:MM a minutos para facilitar comparaciones"""
-    horas, minutos = map(int, hora_str.split(":"))
-    return horas * 60 + minutos
+def markup_dias():
+    """Botones de la selección de días del editor de horarios"""
+    markup = types.InlineKeyboardMarkup(row_width=2)
+    dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes"]
+    botones_dias = [types.InlineKeyboardButton(dia, callback_data=f"dia_{dia}") for dia in dias]
+    markup.add(*botones_dias)
+    markup.add(types.InlineKeyboardButton("📥 Importar horario completo", callback_data="importar_horario"))
+    markup.add(types.InlineKeyboardButton("💾 Guardar horario", callback_data="guardar_horario"))
+    markup.add(types.InlineKeyboardButton("❌ Cancelar", callback_data="cancelar_horario"))
+    return markup
 
 def register_handlers(bot):
     """Registra los manejadores para la configuración de horarios"""
@@ -229,12 +152,7 @@ def register_handlers(bot):
         user_data[chat_id]['horario'] = cargar_horario_bd(chat_id)
     
         # Mostrar opciones de días de la semana
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes"]
-        botones_dias = [types.InlineKeyboardButton(dia, callback_data=f"dia_{dia}") for dia in dias]
-        markup.add(*botones_dias)
-        markup.add(types.InlineKeyboardButton("💾 Guardar horario", callback_data="guardar_horario"))
-        markup.add(types.InlineKeyboardButton("❌ Cancelar", callback_data="cancelar_horario"))
+        markup = markup_dias()
         
         # Mostrar horario actual si existe
         if user_data[chat_id]['horario']:
@@ -268,6 +186,7 @@ def register_handlers(bot):
         markup.add(
             types.InlineKeyboardButton("➕ Añadir franja horaria", callback_data=f"add_franja_{dia}"),
             types.InlineKeyboardButton("🗑️ Eliminar franja horaria", callback_data=f"del_franja_{dia}"),
+            types.InlineKeyboardButton("📋 Copiar a toda la semana", callback_data=f"copiar_dia_{dia}"),
             types.InlineKeyboardButton("🔙 Volver a selección de días", callback_data="volver_dias")
         )
         
@@ -287,12 +206,7 @@ def register_handlers(bot):
         chat_id = call.message.chat.id
         
         # Mostrar opciones de días de la semana nuevamente
-        markup = types.InlineKeyboardMarkup(row_width=2)
-        dias = ["Lunes", "Martes", "Miércoles", "Jueves", "Viernes"]
-        botones_dias = [types.InlineKeyboardButton(dia, callback_data=f"dia_{dia}") for dia in dias]
-        markup.add(*botones_dias)
-        markup.add(types.InlineKeyboardButton("💾 Guardar horario", callback_data="guardar_horario"))
-        markup.add(types.InlineKeyboardButton("❌ Cancelar", callback_data="cancelar_horario"))
+        markup = markup_dias()
         
         # Mostrar horario actual si existe
         if user_data[chat_id]['horario']:
@@ -383,6 +297,7 @@ def register_handlers(bot):
         markup.add(
             types.InlineKeyboardButton("➕ Añadir franja horaria", callback_data=f"add_franja_{dia}"),
             types.InlineKeyboardButton("🗑️ Eliminar franja horaria", callback_data=f"del_franja_{dia}"),
+            types.InlineKeyboardButton("📋 Copiar a toda la semana", callback_data=f"copiar_dia_{dia}"),
             types.InlineKeyboardButton("🔙 Volver a selección de días", callback_data="volver_dias")
         )
         
@@ -427,6 +342,79 @@ def register_handlers(bot):
             logger.error(f"Error al eliminar franja: {e}")
             bot.answer_callback_query(call.id, text="❌ Error al eliminar la franja")
     
+    @bot.callback_query_handler(func=lambda call: call.data.startswith("copiar_dia_"))
+    def handle_copiar_dia(call):
+        """Copia las franjas de un día al resto de días laborables"""
+        chat_id = call.message.chat.id
+        dia = call.data.split("_", 2)[2]
+        origen = indice_dia(dia)
+        
+        if origen is None or not user_data[chat_id]["horario"].get(dia):
+            bot.answer_callback_query(call.id, text="No hay franjas que copiar en este día")
+            return
+        
+        semanal = horario_a_semanal(user_data[chat_id]["horario"])
+        semanal.copiar_dia(origen, DIAS_LABORABLES)
+        for destino in DIAS_LABORABLES:
+            if destino != origen:
+                user_data[chat_id]["horario"][DIAS_SEMANA[destino]] = [
+                    formatear_franja(inicio, fin) for inicio, fin in semanal.dias[destino]
+                ]
+        
+        horario_formateado = formatear_horario_bonito(user_data[chat_id]["horario"])
+        bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=call.message.message_id,
+            text=f"📋 Franjas de *{dia}* copiadas a toda la semana:\n\n{horario_formateado}\n\nSelecciona un día para configurar:",
+            reply_markup=markup_dias(),
+            parse_mode="Markdown"
+        )
+        set_state(chat_id, SELECCIONANDO_DIA)
+        bot.answer_callback_query(call.id, text="✅ Copiado (recuerda guardar el horario)")
+    
+    @bot.callback_query_handler(func=lambda call: call.data == "importar_horario" and user_states.get(call.message.chat.id) == SELECCIONANDO_DIA)
+    def handle_importar_horario(call):
+        """Pide un horario completo en un solo mensaje"""
+        chat_id = call.message.chat.id
+        
+        bot.send_message(
+            chat_id,
+            "Envía tu horario completo en un mensaje, por ejemplo:\n"
+            "Lunes 10:00-12:00, Martes 09:00-11:00, Jueves 16:00-18:00\n\n"
+            "Sustituirá al horario que estás editando. Escribe 'cancelar' para volver."
+        )
+        set_state(chat_id, IMPORTAR_HORARIO)
+        bot.answer_callback_query(call.id)
+    
+    @bot.message_handler(func=lambda m: user_states.get(m.chat.id) == IMPORTAR_HORARIO)
+    def handle_texto_importar(message):
+        """Sustituye el horario en edición por el que envía el profesor"""
+        chat_id = message.chat.id
+        texto = (message.text or "").strip()
+        
+        if texto.lower() != "cancelar":
+            franjas = [f for f in analizar_horario(texto) if f[1] < f[2]]
+            if not franjas:
+                bot.send_message(
+                    chat_id,
+                    "⚠️ No he encontrado ninguna franja. Usa el formato Día HH:MM-HH:MM separado por comas, "
+                    "o escribe 'cancelar'."
+                )
+                return
+            
+            # Las franjas que se solapan o se tocan se fusionan en una sola
+            semanal = HorarioSemanal.desde_franjas(franjas)
+            user_data[chat_id]["horario"] = franjas_por_dia(semanal.franjas())
+            fusionadas = len(franjas) - len(semanal.franjas())
+            aviso = f"\n\n(Se han unido {fusionadas} franjas que se solapaban o eran seguidas)" if fusionadas else ""
+            mensaje = (f"📥 Horario importado:\n\n{formatear_horario_bonito(user_data[chat_id]['horario'])}"
+                       f"{aviso}\n\nRevísalo y pulsa 💾 Guardar horario:")
+        else:
+            mensaje = "Selecciona un día para configurar:"
+        
+        bot.send_message(chat_id, mensaje, reply_markup=markup_dias(), parse_mode="Markdown")
+        set_state(chat_id, SELECCIONANDO_DIA)
+    
     @bot.callback_query_handler(func=lambda call: call.data == "guardar_horario")
     def handle_guardar_horario(call):
         """Guarda el horario configurado en la base de datos"""
@@ -489,6 +477,7 @@ def register_handlers(bot):
             markup.add(
                 types.InlineKeyboardButton("➕ Añadir franja horaria", callback_data=f"add_franja_{dia}"),
                 types.InlineKeyboardButton("🗑️ Eliminar franja horaria", callback_data=f"del_franja_{dia}"),
+                types.InlineKeyboardButton("📋 Copiar a toda la semana", callback_data=f"copiar_dia_{dia}"),
                 types.InlineKeyboardButton("🔙 Volver a selección de días", callback_data="volver_dias")
             )
             
@@ -618,23 +607,12 @@ def register_handlers(bot):
         
         # Obtener el horario de la base de datos
         try:
-            horario_str = user.get('Horario', '')
+            horario_dict = franjas_por_dia(get_franjas_profesor(user['Id_usuario']))
             
-            if not horario_str:
+            if not horario_dict:
                 bot.send_message(chat_id, "No tienes un horario configurado. Usa /configurar_horario para establecerlo.")
                 return
             
-            # Convertir string a diccionario
-            horario_dict = {}
-            franjas = horario_str.split(',')
-            for franja in franjas:
-                franja = franja.strip()
-                if ' ' in franja:
-                    dia, hora = franja.split(' ', 1)
-                    if dia not in horario_dict:
-                        horario_dict[dia] = []
-                    horario_dict[dia].append(hora)
-            
             horario_formateado = formatear_horario_bonito(horario_dict)
             bot.send_message(chat_id, f"📅 *Tu horario de tutorías*\n\n{horario_formateado}", parse_mode="Markdown")
             
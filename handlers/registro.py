@@ -4,11 +4,9 @@ import re
 import sys
 import os
 import time
-import random
 import logging
 from datetime import datetime
 from email.message import EmailMessage
-import smtplib
 from pathlib import Path
 
 # Añadir directorio raíz al path para resolver importaciones
@@ -26,16 +24,19 @@ from db.queries import (
     crear_matricula,  
     get_db_connection,
     update_user,
-    get_o_crear_carrera
+    get_o_crear_carrera,
+    invalidar_usuario
 )
+from db.consultas import ejecutar, ejecutar_muchos
+from db.escritor import ejecutar_escritura
+from utils.correo import encolar_correo
+from db import tokens
 
 # Añadir al inicio del archivo
 from utils.state_manager import get_state, set_state, clear_state, user_data, user_states, estados_timestamp
 
-# Variables para seguridad de token
-token_intentos_fallidos = {}  # {chat_id: número de intentos}
-token_bloqueados = {}  # {chat_id: tiempo de desbloqueo}
-token_usados = set()  # Conjunto de tokens ya utilizados
+# Códigos de verificación pendientes (caducidad, intentos y bloqueos; sobreviven a reinicios)
+almacen_tokens = tokens.get_almacen_tokens()
 
 # Estados del proceso de registro
 STATE_EMAIL = "registro_email"
@@ -76,8 +77,12 @@ def register_handlers(bot):
         user = get_user_by_telegram_id(chat_id)
         return user is not None
     
-    def send_verification_email(email, token):
-        """Envía un correo electrónico con el token de verificación"""
+    def send_verification_email(email, token, chat_id=None):
+        """
+        Prepara el correo con el token de verificación y lo deja en la bandeja
+        de salida, sin esperar al servidor SMTP. Si se indica chat_id y el
+        envío falla definitivamente, se avisa al usuario desde la bandeja.
+        """
         # Cargar credenciales sin valores predeterminados para datos sensibles
         smtp_server = os.getenv("SMTP_SERVER")
         sender_email = os.getenv("SMTP_EMAIL")
@@ -122,22 +127,43 @@ def register_handlers(bot):
         msg.set_content("Tu código de verificación es: " + token)
         msg.add_alternative(html_content, subtype='html')
 
+        futuro = encolar_correo(msg)
+        
+        # También registramos el token en el log/consola para desarrollo
+        logger.info(f"TOKEN DE VERIFICACIÓN encolado para {email}: {token}")
+        print(f"TOKEN DE VERIFICACIÓN encolado para {email}: {token}")
+        
+        if chat_id is not None:
+            futuro.add_done_callback(lambda f: aviso_envio_fallido(f, chat_id, email, token))
+        return True
+
+    def aviso_envio_fallido(futuro, chat_id, email, token):
+        """Callback de la bandeja de salida: avisa si el correo no se pudo entregar"""
+        error = futuro.exception()
+        if error is None:
+            logger.info(f"Correo de verificación entregado a {email}")
+            return
+        
+        logger.error(f"Error en el envío del correo a {email}: {error}")
+        print(f"Error en el envío del correo: {error}")
+        
+        # Solo si el usuario sigue esperando este mismo código
+        registro = almacen_tokens.pendiente(chat_id)
+        if registro is None or registro.huella != tokens._huella(chat_id, token):
+            return
+        almacen_tokens.descartar(chat_id)
         try:
-            with smtplib.SMTP(str(smtp_server), 587) as server:
-                server.ehlo()
-                server.starttls()
-                # Add explicit type assertion since we've already validated these aren't None
-                server.login(str(sender_email), str(password))
-                server.send_message(msg)
-            
-            # También registramos el token en el log/consola para desarrollo
-            logger.info(f"TOKEN DE VERIFICACIÓN enviado a {email}: {token}")
-            print(f"TOKEN DE VERIFICACIÓN enviado a {email}: {token}")
-            return True
+            bot.send_message(
+                chat_id, 
+                "❌ *Error al enviar el código de verificación*\n\n"
+                "No ha sido posible enviar el email con tu código.\n"
+                "Por favor, intenta nuevamente más tarde o contacta con soporte.\n\n"
+                "_Para desarrollo: revisa los logs y la configuración SMTP._",
+                parse_mode="Markdown"
+            )
         except Exception as e:
-            logger.error(f"Error en el envío del correo a {email}: {e}")
-            print(f"Error en el envío del correo: {e}")
-            return False
+            logger.error(f"No se pudo avisar a {chat_id} del fallo de envío: {e}")
+        clear_state(chat_id)
 
     def is_valid_email(email):
         """Verifica si el correo es válido (institucional UGR)"""
@@ -148,7 +174,7 @@ def register_handlers(bot):
         """Verifica si el correo existe en la tabla Usuarios de la base de datos"""
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT Id_usuario FROM Usuarios WHERE Email_UGR = ?", (email,))
+        ejecutar(cursor, "usuarios.id_por_email", (email,))
         resultado = cursor.fetchone()
         conn.close()
         return resultado is not None
@@ -159,6 +185,12 @@ def register_handlers(bot):
         # Por ahora siempre devuelve False
         return False
     
+    def asignar_carrera(carrera_id, asignatura_ids):
+        """Asegura que las asignaturas elegidas estén asociadas a la carrera"""
+        if asignatura_ids:
+            ejecutar_escritura(lambda conn, cursor: ejecutar_muchos(
+                cursor, "asignaturas.asignar_carrera", [(carrera_id, a) for a in asignatura_ids]))
+    
     def completar_registro(chat_id):
         """Completa el registro del usuario"""
         try:
@@ -183,23 +215,13 @@ def register_handlers(bot):
             if user_data[chat_id]['tipo'] == 'estudiante':
                 for asignatura_id in user_data[chat_id].get('asignaturas_seleccionadas', []):
                     crear_matricula(user_id, asignatura_id)
-                    # Asegurarse de que la asignatura esté asociada a la carrera
-                    cursor = get_db_connection().cursor()
-                    cursor.execute("UPDATE Asignaturas SET Id_carrera = ? WHERE Id_asignatura = ? AND Id_carrera IS NULL", 
-                                  (carrera_id, asignatura_id))
-                    cursor.connection.commit()
-                    cursor.connection.close()
+                asignar_carrera(carrera_id, user_data[chat_id].get('asignaturas_seleccionadas', []))
                     
             # Para profesores, crear asignaturas impartidas
             elif user_data[chat_id]['tipo'] == 'profesor':
                 for asignatura_id in user_data[chat_id].get('asignaturas_seleccionadas', []):
                     crear_matricula(user_id, asignatura_id, 'profesor')
-                    # Asegurarse de que la asignatura esté asociada a la carrera
-                    cursor = get_db_connection().cursor()
-                    cursor.execute("UPDATE Asignaturas SET Id_carrera = ? WHERE Id_asignatura = ? AND Id_carrera IS NULL", 
-                                  (carrera_id, asignatura_id))
-                    cursor.connection.commit()
-                    cursor.connection.close()
+                asignar_carrera(carrera_id, user_data[chat_id].get('asignaturas_seleccionadas', []))
         
             # Llamar a la función para enviar mensaje de bienvenida
             tipo = user_data[chat_id]['tipo']
@@ -283,21 +305,15 @@ def register_handlers(bot):
         text = message.text.strip()
         
         # Comprobar si está bloqueado
-        if chat_id in token_bloqueados:
-            if time.time() < token_bloqueados[chat_id]:
-                tiempo_restante = int((token_bloqueados[chat_id] - time.time()) / 60)
-                bot.send_message(
-                    chat_id,
-                    f"⛔ Tu cuenta está bloqueada temporalmente.\n"
-                    f"Debes esperar {tiempo_restante} minutos antes de intentarlo de nuevo.",
-                    reply_markup=telebot.types.ReplyKeyboardRemove()
-                )
-                return
-            else:
-                # Ya pasó el tiempo de bloqueo
-                del token_bloqueados[chat_id]
-                if chat_id in token_intentos_fallidos:
-                    del token_intentos_fallidos[chat_id]
+        restante = almacen_tokens.bloqueo_restante(chat_id)
+        if restante > 0:
+            bot.send_message(
+                chat_id,
+                f"⛔ Tu cuenta está bloqueada temporalmente.\n"
+                f"Debes esperar {int(restante // 60) + 1} minutos antes de intentarlo de nuevo.",
+                reply_markup=telebot.types.ReplyKeyboardRemove()
+            )
+            return
         
         # Validar el email
         email = text.lower()
@@ -333,19 +349,21 @@ def register_handlers(bot):
             return
         
         # Guardar el email
-        user_data[chat_id]["email"] = email
-        
-        # Generar token seguro de 6 dígitos
-        token = str(random.randint(100000, 999999))
-        user_data[chat_id]["token"] = token
-        user_data[chat_id]["token_expiry"] = time.time() + 180  # Token válido por 3 minutos
+        user_data.setdefault(chat_id, {})["email"] = email
         
         # Determinar tipo de usuario por el correo
         es_estudiante = email.endswith("@correo.ugr.es")
         user_data[chat_id]["tipo"] = "estudiante" if es_estudiante else "profesor"
         
+        # Generar token seguro de 6 dígitos (válido 3 minutos)
+        token = almacen_tokens.emitir(chat_id, email, user_data[chat_id]["tipo"])
+        if token is None:
+            bot.send_message(chat_id, "⛔ Tu cuenta está bloqueada temporalmente. Inténtalo más tarde.")
+            clear_state(chat_id)
+            return
+        
         # Enviar token de verificación
-        if send_verification_email(email, token):
+        if send_verification_email(email, token, chat_id):
             # Botón para cancelar
             markup = types.InlineKeyboardMarkup()
             markup.add(types.InlineKeyboardButton("❌ Cancelar", callback_data="cancelar_registro"))
@@ -353,7 +371,7 @@ def register_handlers(bot):
             bot.send_message(
                 chat_id, 
                 "🔑 *Verificación de Cuenta*\n\n"
-                "Se ha enviado un código de 6 dígitos a tu correo.\n"
+                "Te estamos enviando un código de 6 dígitos a tu correo.\n"
                 "Por favor, introduce el código que has recibido.\n\n"
                 "⏱️ *El código expirará en 3 minutos*\n\n"
                 "_Si no lo recibes, verifica tu carpeta de spam._",
@@ -371,6 +389,7 @@ def register_handlers(bot):
                 "_Para desarrollo: revisa los logs y la configuración SMTP._",
                 parse_mode="Markdown"
             )
+            almacen_tokens.descartar(chat_id)
             clear_state(chat_id)
 
     def mostrar_menu_principal(message):
@@ -411,26 +430,43 @@ def register_handlers(bot):
             parse_mode="Markdown"
         )
 
-    @bot.message_handler(func=lambda message: get_state(message.chat.id) == STATE_VERIFY_TOKEN)
+    def esperando_token(message):
+        """En verificación, o con un código pendiente de antes de un reinicio del bot"""
+        if get_state(message.chat.id) == STATE_VERIFY_TOKEN:
+            return True
+        return (message.chat.id not in user_states and bool(message.text)
+                and message.text.strip().isdigit()
+                and almacen_tokens.pendiente(message.chat.id) is not None)
+
+    @bot.message_handler(func=esperando_token)
     def verificar_token(message):
         chat_id = message.chat.id
         token_ingresado = message.text.strip()
         
         # Validar el token
-        es_valido = False
-        if chat_id in user_data and "token" in user_data[chat_id]:
-            token_almacenado = user_data[chat_id].get("token")
-            token_expiry = user_data[chat_id].get("token_expiry", 0)
-            
-            if token_ingresado == token_almacenado and time.time() < token_expiry:
-                es_valido = True
-            elif time.time() >= token_expiry:
-                bot.send_message(chat_id, "⚠️ El código ha expirado. Por favor, solicita uno nuevo con /start")
-                clear_state(chat_id)
-                return
-            else:
-                bot.send_message(chat_id, "❌ Código incorrecto. Inténtalo de nuevo o cancela con /cancelar")
-                return
+        resultado, registro = almacen_tokens.verificar(chat_id, token_ingresado)
+        es_valido = resultado == tokens.VALIDO
+        if resultado == tokens.SIN_TOKEN:
+            bot.send_message(chat_id, "⚠️ El código ha expirado. Por favor, solicita uno nuevo con /start")
+            clear_state(chat_id)
+            return
+        elif resultado == tokens.BLOQUEADO:
+            bot.send_message(
+                chat_id,
+                f"⛔ Demasiados intentos fallidos. Tu cuenta queda bloqueada "
+                f"{tokens.BLOQUEO // 60} minutos.",
+                reply_markup=telebot.types.ReplyKeyboardRemove()
+            )
+            clear_state(chat_id)
+            return
+        elif resultado == tokens.INCORRECTO:
+            restantes = almacen_tokens.max_intentos - registro.intentos
+            bot.send_message(chat_id, f"❌ Código incorrecto ({restantes} intentos restantes). "
+                                      f"Inténtalo de nuevo o cancela con /cancelar")
+            return
+        
+        # Tras un reinicio user_data está vacío: recuperar los datos del registro en curso
+        user_data.setdefault(chat_id, {}).update(email=registro.email, tipo=registro.tipo)
     
         if es_valido:
             try:
@@ -440,25 +476,20 @@ def register_handlers(bot):
                 
                 if email:
                     # Actualizar la base de datos: cambiar Registrado a SI y guardar el TelegramID
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "UPDATE Usuarios SET Registrado = 'SI', TelegramID = ? WHERE Email_UGR = ?", 
-                        (message.from_user.id, email)
-                    )
+                    actualizadas = ejecutar_escritura(lambda conn, cursor: ejecutar(
+                        cursor, "usuarios.marcar_registrado", (message.from_user.id, email)
+                    ).rowcount)
                     
                     # Verificar que se actualizó alguna fila
-                    if cursor.rowcount == 0:
+                    if actualizadas == 0:
                         bot.send_message(chat_id, "❌ No se encontró tu correo en la base de datos.")
                         logger.error(f"No se encontró el email {email} en la base de datos")
                     else:
-                        conn.commit()
+                        invalidar_usuario(telegram_id=message.from_user.id)
                         logger.info(f"Usuario {email} verificado correctamente. TelegramID actualizado.")
                         
                         # Enviar mensaje de bienvenida
                         handle_registration_completion(chat_id, tipo_usuario)
-                        
-                    conn.close()
                 else:
                     logger.error("No se encontró email en user_data para la verificación")
             except Exception as e:
@@ -481,6 +512,7 @@ def register_handlers(bot):
             "Registro cancelado. Puedes iniciarlo nuevamente con /start cuando lo desees.",
             reply_markup=telebot.types.ReplyKeyboardRemove()
         )
+        almacen_tokens.descartar(chat_id)
         clear_state(chat_id)
         bot.answer_callback_query(call.id)
 
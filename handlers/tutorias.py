@@ -21,8 +21,13 @@ from db.queries import (
     get_db_connection,
     get_matriculas_usuario,
     get_profesores_asignatura,
-    get_salas_profesor_asignatura
+    get_salas_profesor_asignatura,
+    obtener_arbol_tutorias,
+    obtener_profesores_estudiante,
+    verificar_disponibilidad_profesor
 )
+from db.consultas import ejecutar
+from db.escritor import ejecutar_escritura
 
 # Añadir la función directamente en este archivo
 def escape_markdown(text: str) -> str:
@@ -45,10 +50,10 @@ def escape_markdown(text: str) -> str:
 
 
 
-# Referencias externas necesarias
-user_states = {}
-user_data = {}
-estados_timestamp = {}  
+# Referencias externas necesarias (almacén común de conversaciones)
+from utils.state_manager import user_states, user_data, estados_timestamp
+from utils.motor_horarios import esta_disponible
+from utils.disponibilidad import get_indice_disponibilidad, MAX_HORAS
 
 def register_handlers(bot):
     """Registra todos los handlers de tutorías"""
@@ -65,33 +70,6 @@ def register_handlers(bot):
         # Obtener información del usuario
         user = get_user_by_telegram_id(user_id)
         
-        # Diagnóstico: Verificar si hay salas en la base de datos
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Contar todas las salas
-        cursor.execute("SELECT COUNT(*) as total FROM Grupos_tutoria")
-        total_salas = cursor.fetchone()['total']
-        print(f"Total de salas en la BD: {total_salas}")
-        
-        # Mostrar detalles de algunas salas para diagnóstico
-        if total_salas > 0:
-            cursor.execute("""
-                SELECT 
-                    g.id_sala, g.Id_usuario, g.Nombre_sala, g.Proposito_sala, 
-                    g.Tipo_sala, g.Id_asignatura, a.Nombre as NombreAsignatura
-                FROM Grupos_tutoria g
-                LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-                LIMIT 5
-            """)
-            
-            print("Primeras 5 salas en la BD:")
-            for sala in cursor.fetchall():
-                print(f"  - ID: {sala['id_sala']}, Nombre: {sala['Nombre_sala']}")
-                print(f"    Profesor: {sala['Id_usuario']}, Asignatura: {sala['Id_asignatura']} ({sala['NombreAsignatura']})")
-                print(f"    Tipo: {sala['Tipo_sala']}, Propósito: {sala['Proposito_sala']}")
-                print("    ---")
-        
         if not user:
             bot.send_message(chat_id, "❌ No estás registrado. Usa /start para registrarte.")
             print("❌ Usuario no registrado")
@@ -104,168 +82,16 @@ def register_handlers(bot):
         
         print(f"✅ Estudiante: {user['Nombre']} {user['Apellidos'] or ''}")
         
-        # Obtener las asignaturas del estudiante
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            SELECT a.Id_asignatura, a.Nombre as Asignatura
-            FROM Matriculas m
-            JOIN Asignaturas a ON m.Id_asignatura = a.Id_asignatura
-            WHERE m.Id_usuario = ?
-        """, (user['Id_usuario'],))
-        
-        asignaturas = cursor.fetchall()
+        # Asignaturas, profesores y salas en un número fijo de consultas
+        asignaturas, profesores = obtener_arbol_tutorias(user['Id_usuario'])
         
         if not asignaturas:
             bot.send_message(chat_id, "❌ No estás matriculado en ninguna asignatura.")
-            conn.close()
             print("❌ Estudiante sin asignaturas")
             return
         
         print(f"✅ Asignaturas encontradas: {len(asignaturas)}")
-        
-        # Obtener IDs de asignaturas para usar en consultas
-        asignaturas_ids = [a['Id_asignatura'] for a in asignaturas]
-        placeholders = ','.join(['?'] * len(asignaturas_ids))
-        
-        # Obtener profesores que tienen grupos de tutoría para estas asignaturas
-        # O profesores que son de estas asignaturas según las matrículas (donde son docentes)
-        cursor.execute(f"""
-            SELECT DISTINCT 
-                u.Id_usuario, 
-                u.Nombre, 
-                u.Apellidos, 
-                u.Email_UGR, 
-                u.horario
-            FROM Usuarios u
-            WHERE u.Tipo = 'profesor' 
-            AND (
-                -- Profesores que han creado grupos para estas asignaturas
-                u.Id_usuario IN (
-                    SELECT DISTINCT g.Id_usuario 
-                    FROM Grupos_tutoria g 
-                    WHERE g.Id_asignatura IN ({placeholders})
-                )
-                OR
-                -- O profesores que tienen matrículas como docentes en estas asignaturas
-                u.Id_usuario IN (
-                    SELECT DISTINCT m.Id_usuario 
-                    FROM Matriculas m 
-                    WHERE m.Id_asignatura IN ({placeholders}) AND m.Tipo = 'docente'
-                )
-            )
-            ORDER BY u.Apellidos, u.Nombre
-        """, asignaturas_ids + asignaturas_ids)
-        
-        profesores_raw = cursor.fetchall()
-        print(f"✅ Profesores encontrados: {len(profesores_raw)}")
-        
-        # Convertir a diccionario para facilitar el acceso
-        profesores = {}
-        for profesor in profesores_raw:
-            prof_id = profesor['Id_usuario']
-            profesores[prof_id] = {
-                'id': prof_id,
-                'nombre': f"{profesor['Nombre']} {profesor['Apellidos'] or ''}".strip(),
-                'email': profesor['Email_UGR'],
-                'horario': profesor['horario'] or 'No especificado',
-                'asignaturas': {}
-            }
-        
-        # Obtener asignaturas por profesor (basado en matrículas de tipo 'docente' y en grupos creados)
-        for profesor_id in profesores:
-            # Buscar asignaturas por matrículas donde es docente
-            cursor.execute(f"""
-                SELECT DISTINCT
-                    a.Id_asignatura,
-                    a.Nombre as NombreAsignatura,
-                    a.Codigo_Asignatura as Codigo
-                FROM Matriculas m
-                JOIN Asignaturas a ON m.Id_asignatura = a.Id_asignatura
-                WHERE m.Id_usuario = ? AND m.Tipo = 'docente' AND m.Id_asignatura IN ({placeholders})
-                
-                UNION
-                
-                -- Asignaturas por grupos que ha creado
-                SELECT DISTINCT
-                    a.Id_asignatura,
-                    a.Nombre as NombreAsignatura,
-                    a.Codigo_Asignatura as Codigo
-                FROM Grupos_tutoria g
-                JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-                WHERE g.Id_usuario = ? AND g.Id_asignatura IN ({placeholders})
-            """, [profesor_id] + asignaturas_ids + [profesor_id] + asignaturas_ids)
-            
-            asignaturas_profesor = cursor.fetchall()
-            
-            for asig in asignaturas_profesor:
-                if asig['Id_asignatura'] is not None:  # Si la asignatura existe
-                    profesores[profesor_id]['asignaturas'][asig['Id_asignatura']] = {
-                        'id': asig['Id_asignatura'],
-                        'nombre': asig['NombreAsignatura'],
-                        'codigo': asig['Codigo'],
-                        'salas': []
-
-                    }
-        
-        # Inicializar la categoría general para cada profesor
-        for profesor_id in profesores:
-            profesores[profesor_id]['asignaturas']['general'] = {
-                'id': 'general',
-                'nombre': 'General',
-                'salas': []
-            }
-        
-        # Obtener todas las salas de cada profesor
-        for profesor_id in profesores:
-            cursor.execute("""
-                SELECT 
-                    g.id_sala,
-                    g.Nombre_sala,
-                    g.Proposito_sala,
-                    g.Chat_id,
-                    g.Tipo_sala,
-                    g.Id_asignatura,
-                    g.Enlace_invitacion,
-                    a.Nombre as NombreAsignatura
-                FROM Grupos_tutoria g
-                LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-                WHERE g.Id_usuario = ?
-            """, (profesor_id,))
-            
-            salas = cursor.fetchall()
-            print(f"Encontradas {len(salas)} salas para el profesor {profesor_id}")
-            
-            # Clasificar las salas por asignatura
-            for sala in salas:
-                sala_data = {
-                    'id': sala['id_sala'],
-                    'nombre': sala['Nombre_sala'],
-                    'proposito': sala['Proposito_sala'],
-                    'tipo': sala['Tipo_sala'],
-                    'enlace': sala['Enlace_invitacion'],
-                    'chat_id': sala['Chat_id'],
-                    'asignatura': sala['NombreAsignatura']
-                }
-                
-                # Asignar la sala a su asignatura correspondiente (o a general si no tiene)
-                if sala['Id_asignatura'] is not None:
-                    asignatura_id = sala['Id_asignatura']
-                    # Verificar que la asignatura existe en el diccionario del profesor
-                    if asignatura_id in profesores[profesor_id]['asignaturas']:
-                        profesores[profesor_id]['asignaturas'][asignatura_id]['salas'].append(sala_data)
-                        print(f"Asignada sala '{sala['Nombre_sala']}' a asignatura ID {asignatura_id}")
-                    else:
-                        # Si por alguna razón la asignatura no está en el diccionario, asignar a general
-                        profesores[profesor_id]['asignaturas']['general']['salas'].append(sala_data)
-                        print(f"Sala '{sala['Nombre_sala']}' asignada a 'general' (asignatura ID {asignatura_id} no encontrada)")
-                else:
-                    # Si la sala no tiene asignatura, agregarla a la categoría "general"
-                    profesores[profesor_id]['asignaturas']['general']['salas'].append(sala_data)
-                    print(f"Sala '{sala['Nombre_sala']}' asignada a 'general' (sin asignatura asociada)")
-
-        conn.close()
+        print(f"✅ Profesores encontrados: {len(profesores)}")
         
         # Si no se encontró ningún profesor, mostrar mensaje y terminar
         if not profesores:
@@ -395,6 +221,61 @@ def register_handlers(bot):
                         disable_web_page_preview=True
                     )
             
+    @bot.message_handler(commands=['disponibles'])
+    def handle_disponibles_command(message):
+        """Profesores de las asignaturas del estudiante en horario de tutoría ahora o en las próximas horas"""
+        from config import DISPONIBLES_HORAS
+        chat_id = message.chat.id
+
+        user = get_user_by_telegram_id(message.from_user.id)
+        if not user:
+            bot.send_message(chat_id, "❌ No estás registrado. Usa /start para registrarte.")
+            return
+        if user['Tipo'] != 'estudiante':
+            bot.send_message(chat_id, "⚠️ Esta funcionalidad está disponible solo para estudiantes.")
+            return
+
+        # /disponibles [horas]
+        partes = (message.text or "").split()
+        try:
+            horas = float(partes[1].replace(",", ".")) if len(partes) > 1 else DISPONIBLES_HORAS
+        except ValueError:
+            bot.send_message(chat_id, "⚠️ Uso: /disponibles [horas], por ejemplo /disponibles 3")
+            return
+        horas = min(max(horas, 0), MAX_HORAS)
+
+        profesores = {fila['Id_usuario']: fila for fila in obtener_profesores_estudiante(user['Id_usuario'])}
+        if not profesores:
+            bot.send_message(chat_id, "❌ No se encontraron profesores para tus asignaturas.")
+            return
+
+        ahora = datetime.datetime.now().replace(second=0, microsecond=0)
+        proximos = get_indice_disponibilidad().disponibles_en(horas, profesores, ahora)
+
+        def linea(profesor_id):
+            prof = profesores[profesor_id]
+            nombre = escape_markdown(f"{prof['Nombre']} {prof['Apellidos'] or ''}".strip())
+            return f"• {nombre} ({escape_markdown(prof['Asignaturas'] or '')})"
+
+        ya = sorted((p for p, empieza in proximos.items() if empieza <= ahora), key=lambda p: profesores[p]['Apellidos'] or '')
+        luego = sorted((p for p, empieza in proximos.items() if empieza > ahora), key=lambda p: proximos[p])
+
+        mensaje = "🟢 *En horario de tutoría ahora:*\n"
+        mensaje += "\n".join(linea(p) for p in ya) if ya else "Ninguno de tus profesores."
+        if horas:
+            mensaje += f"\n\n🕒 *En las próximas {horas:g} h:*\n"
+            if luego:
+                mensaje += "\n".join(
+                    f"{linea(p)} desde las {proximos[p]:%H:%M}"
+                    + ("" if proximos[p].date() == ahora.date() else f" del {proximos[p]:%d/%m}")
+                    for p in luego
+                )
+            else:
+                mensaje += "Ninguno más."
+        mensaje += "\n\nUsa /tutoria para ver sus salas y solicitar una tutoría."
+
+        bot.send_message(chat_id, mensaje, parse_mode="Markdown")
+
     # Aquí añadimos el resto de handlers para tutorias
     
     @bot.callback_query_handler(func=lambda call: call.data.startswith("solicitar_sala_"))
@@ -427,19 +308,7 @@ def register_handlers(bot):
             # 2. Obtener información de la sala y del profesor
             conn = get_db_connection()
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT 
-                    g.*,
-                    u.Nombre as NombreProfesor,
-                    u.Apellidos as ApellidosProfesor,
-                    u.TelegramID as ProfesorTelegramID,
-                    u.Horario as HorarioProfesor,
-                    a.Nombre as NombreAsignatura
-                FROM Grupos_tutoria g
-                JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
-                LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-                WHERE g.id_sala = ? AND g.Id_usuario = ?
-            """, (sala_id, profesor_id))
+            ejecutar(cursor, "salas.detalle_solicitud", (sala_id, profesor_id))
             
             sala = cursor.fetchone()
             conn.close()
@@ -452,22 +321,27 @@ def register_handlers(bot):
             print(f"Verificando horario de tutoría para profesor_id={profesor_id}")
             print(f"Horario del profesor: {sala['HorarioProfesor']}")
             
-            es_horario_tutoria = verificar_horario_tutoria(sala['HorarioProfesor'])
+            es_horario_tutoria = verificar_disponibilidad_profesor(profesor_id)
             print(f"¿Está en horario de tutoría? {es_horario_tutoria}")
             
             if not es_horario_tutoria:
                 # No estamos en horario de tutoría
                 bot.answer_callback_query(call.id, "⏰ No es horario de tutoría del profesor.")
                 
-                # Informar al estudiante con más detalle
+                # Informar al estudiante con más detalle y ofrecerle reservar una cita
+                markup_cita = types.InlineKeyboardMarkup()
+                markup_cita.add(types.InlineKeyboardButton(
+                    "📅 Reservar cita", callback_data=f"citas_{profesor_id}_{sala_id}"
+                ))
                 bot.send_message(
                     chat_id,
                     f"⏰ *No es horario de tutoría*\n\n"
                     f"El profesor {escape_markdown(sala['NombreProfesor'])} {escape_markdown(sala['ApellidosProfesor'] or '')} "
                     f"tiene el siguiente horario de tutorías:\n\n"
                     f"{escape_markdown(sala['HorarioProfesor'])}\n\n"
-                    f"Por favor, intenta solicitar acceso durante estos horarios.",
-                    parse_mode="Markdown"
+                    f"Por favor, intenta solicitar acceso durante estos horarios o reserva una cita.",
+                    parse_mode="Markdown",
+                    reply_markup=markup_cita
                 )
                 return
             
@@ -579,14 +453,7 @@ def register_handlers(bot):
             cursor = conn.cursor()
             
             # Verificar que la sala pertenece al profesor
-            cursor.execute("""
-                SELECT g.*, u.Nombre as NombreProfesor, u.Apellidos as ApellidosProfesor
-                FROM Grupos_tutoria g
-                JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
-                WHERE g.id_sala = ? AND g.Id_usuario = (
-                    SELECT Id_usuario FROM Usuarios WHERE TelegramID = ?
-                )
-            """, (sala_id, user_id))
+            ejecutar(cursor, "salas.por_id_y_profesor_telegram", (sala_id, user_id))
             
             sala = cursor.fetchone()
             
@@ -596,11 +463,7 @@ def register_handlers(bot):
                 return
             
             # 3. Obtener información del estudiante
-            cursor.execute("""
-                SELECT * 
-                FROM Usuarios 
-                WHERE Id_usuario = ? AND Tipo = 'estudiante'
-            """, (estudiante_id,))
+            ejecutar(cursor, "usuarios.estudiante_por_id", (estudiante_id,))
             
             estudiante = cursor.fetchone()
             
@@ -609,29 +472,16 @@ def register_handlers(bot):
                 conn.close()
                 return
             
-            # 4. Verificar si el estudiante ya es miembro de la sala
-            cursor.execute("""
-                SELECT * FROM Miembros_Grupo 
-                WHERE id_sala = ? AND Id_usuario = ?
-            """, (sala_id, estudiante_id))
-            
-            miembro_existente = cursor.fetchone()
-            
-            if miembro_existente:
-                # Actualizar estado a activo si estaba inactivo
-                cursor.execute("""
-                    UPDATE Miembros_Grupo 
-                    SET Estado = 'activo' 
-                    WHERE id_sala = ? AND Id_usuario = ?
-                """, (sala_id, estudiante_id))
-            else:
-                # Añadir al estudiante como miembro de la sala
-                cursor.execute("""
-                    INSERT INTO Miembros_Grupo (id_sala, Id_usuario, Estado)
-                    VALUES (?, ?, 'activo')
-                """, (sala_id, estudiante_id))
-        
-            conn.commit()
+            conn.close()
+            
+            # 4. Dar de alta al estudiante en la sala (o reactivarlo si ya era miembro)
+            def _activar_miembro(conn, cursor):
+                if ejecutar(cursor, "miembros.buscar", (sala_id, estudiante_id)).fetchone():
+                    ejecutar(cursor, "miembros.activar", (sala_id, estudiante_id))
+                else:
+                    ejecutar(cursor, "miembros.crear_activo", (sala_id, estudiante_id))
+            
+            ejecutar_escritura(_activar_miembro)
             
             # 5. Enviar enlace de invitación al estudiante
             if sala['Enlace_invitacion'] and estudiante['TelegramID']:
@@ -717,14 +567,10 @@ def register_handlers(bot):
             conn = get_db_connection()
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT * FROM Usuarios WHERE Id_usuario = ?
-            """, (estudiante_id,))
+            ejecutar(cursor, "usuarios.por_id", (estudiante_id,))
             estudiante = cursor.fetchone()
             
-            cursor.execute("""
-                SELECT * FROM Grupos_tutoria WHERE id_sala = ?
-            """, (sala_id,))
+            ejecutar(cursor, "salas.por_id", (sala_id,))
             sala = cursor.fetchone()
             
             conn.close()
@@ -777,7 +623,7 @@ def register_handlers(bot):
         print("### FIN RECHAZAR_TUTORIA ###\n")
 # Funciones auxiliares para el manejo de solicitudes de tutoría
 
-def verificar_horario_tutoria(horario_str):
+def verificar_horario_tutoria(horario_str, momento=None):
     """
     Verifica si estamos en horario de tutoría del profesor
     
@@ -785,125 +631,14 @@ def verificar_horario_tutoria(horario_str):
         horario_str: cadena con formatos como:
         - "Lunes de 10:00 a 12:00"
         - "Miércoles 09:00-12:00"
+        - "Lunes: 10:00-12:00, 16:00-18:00; Martes: 09:00-11:00"
+        momento: datetime a comprobar (por defecto, ahora)
         
     Returns:
         bool: True si la hora actual está dentro del horario de tutorías
     """
-    import re
-    from datetime import datetime, time
-    
-    # Si no hay horario definido, no se puede verificar
-    if not horario_str or horario_str.strip() == '':
-        print("No hay horario definido")
-        return False
-        
-    # Obtener día y hora actual
-    ahora = datetime.now()
-    
-    # Nombres de días en español e inglés para hacer la verificación más robusta
-    dias_semana = {
-        0: ['lunes', 'monday'],
-        1: ['martes', 'tuesday'],
-        2: ['miércoles', 'miercoles', 'wednesday'],
-        3: ['jueves', 'thursday'],
-        4: ['viernes', 'friday'],
-        5: ['sábado', 'sabado', 'saturday'],
-        6: ['domingo', 'sunday']
-    }
-    
-    # Obtener día actual (0=lunes, 1=martes, etc.)
-    dia_semana_actual = ahora.weekday()
-    nombres_dia_actual = dias_semana[dia_semana_actual]
-    
-    # Crear objeto time para comparar horas
-    hora_actual = time(ahora.hour, ahora.minute)
-    
-    # Convertir todo a minúsculas para comparación insensible a mayúsculas
-    horario_lower = horario_str.lower()
-    
-    # Debug: Mostrar información para diagnóstico
-    print(f"Verificando horario: {horario_str}")
-    print(f"Día actual: {ahora.strftime('%A')} ({dia_semana_actual})")
-    print(f"Hora actual: {hora_actual}")
-    print(f"Nombres para el día actual: {nombres_dia_actual}")
-    
-    # Buscar patrones de horario:
-    # 1. Formato "Lunes de 10:00 a 12:00"
-    patron1 = r'(lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo)\s+de\s+(\d{1,2}):?(\d{2})?\s+a\s+(\d{1,2}):?(\d{2})?'
-    
-    # 2. Formato "Miércoles 09:00-12:00"
-    patron2 = r'(lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo)\s+(\d{1,2}):?(\d{2})?-(\d{1,2}):?(\d{2})?'
-    
-    # Flag para indicar si encontramos algún horario que coincida
-    encontrado = False
-    
-    # Comprobar el primer formato (Día de HH:MM a HH:MM)
-    for match in re.finditer(patron1, horario_lower):
-        dia_horario = match.group(1)
-        
-        # Comprobar si el día coincide con el actual
-        es_hoy = any(dia_nombre in dia_horario for dia_nombre in nombres_dia_actual)
-        
-        if not es_hoy:
-            continue
-            
-        # Extraer hora inicio y fin
-        hora_inicio = int(match.group(2))
-        minuto_inicio = int(match.group(3) or 0)
-        hora_fin = int(match.group(4))
-        minuto_fin = int(match.group(5) or 0)
-        
-        # Crear objetos time para comparar
-        tiempo_inicio = time(hora_inicio, minuto_inicio)
-        tiempo_fin = time(hora_fin, minuto_fin)
-        
-        # Debug: Mostrar cada horario encontrado para diagnóstico
-        print(f"Formato 1 - Horario encontrado: {dia_horario} de {tiempo_inicio} a {tiempo_fin}")
-        encontrado = True
-        
-        # Verificar si la hora actual está en el rango
-        if tiempo_inicio <= hora_actual <= tiempo_fin:
-            print(f"✅ Dentro de horario: {tiempo_inicio} <= {hora_actual} <= {tiempo_fin}")
-            return True
-        else:
-            print(f"❌ Fuera de horario: {hora_actual} no está entre {tiempo_inicio} y {tiempo_fin}")
-    
-    # Comprobar el segundo formato (Día HH:MM-HH:MM)
-    for match in re.finditer(patron2, horario_lower):
-        dia_horario = match.group(1)
-        
-        # Comprobar si el día coincide con el actual
-        es_hoy = any(dia_nombre in dia_horario for dia_nombre in nombres_dia_actual)
-        
-        if not es_hoy:
-            continue
-            
-        # Extraer hora inicio y fin
-        hora_inicio = int(match.group(2))
-        minuto_inicio = int(match.group(3) or 0)
-        hora_fin = int(match.group(4))
-        minuto_fin = int(match.group(5) or 0)
-        
-        # Crear objetos time para comparar
-        tiempo_inicio = time(hora_inicio, minuto_inicio)
-        tiempo_fin = time(hora_fin, minuto_fin)
-        
-        # Debug: Mostrar cada horario encontrado para diagnóstico
-        print(f"Formato 2 - Horario encontrado: {dia_horario} {tiempo_inicio}-{tiempo_fin}")
-        encontrado = True
-        
-        # Verificar si la hora actual está en el rango
-        if tiempo_inicio <= hora_actual <= tiempo_fin:
-            print(f"✅ Dentro de horario: {tiempo_inicio} <= {hora_actual} <= {tiempo_fin}")
-            return True
-        else:
-            print(f"❌ Fuera de horario: {hora_actual} no está entre {tiempo_inicio} y {tiempo_fin}")
-    
-    # Si no se encontró ninguna coincidencia para el día actual, informarlo
-    if not encontrado:
-        print(f"No se encontraron horarios para el día actual ({ahora.strftime('%A')})")
-    
-    return False
+    # El horario se analiza una vez y se cachea (utils/motor_horarios.py)
+    return esta_disponible(horario_str, momento)
 
 
 def registrar_solicitud_tutoria(estudiante_id, profesor_id, sala_id):
@@ -915,13 +650,9 @@ def registrar_solicitud_tutoria(estudiante_id, profesor_id, sala_id):
         profesor_id (int): ID del profesor
         sala_id (int): ID de la sala solicitada
     """
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
+    def _registrar(conn, cursor):
         # Verificar si ya existe un registro de este estudiante en esta sala
-        cursor.execute(
-            "SELECT id_miembro FROM Miembros_Grupo WHERE id_sala = ? AND Id_usuario = ?",
+        ejecutar(cursor, "miembros.id_por_sala_usuario",
             (sala_id, estudiante_id)
         )
         
@@ -929,22 +660,17 @@ def registrar_solicitud_tutoria(estudiante_id, profesor_id, sala_id):
         
         if miembro:
             # Si ya existe, actualizar su estado a activo si no lo está
-            cursor.execute(
-                "UPDATE Miembros_Grupo SET Estado = 'activo' WHERE id_miembro = ?",
+            ejecutar(cursor, "miembros.activar_por_id",
                 (miembro['id_miembro'],)
             )
         else:
             # Si no existe, crear un nuevo registro
-            cursor.execute(
-                """
-                INSERT INTO Miembros_Grupo (id_sala, Id_usuario, Estado)
-                VALUES (?, ?, 'pendiente')
-                """,
+            ejecutar(cursor, "miembros.crear_pendiente",
                 (sala_id, estudiante_id)
             )
-        
-        conn.commit()
-        conn.close()
+    
+    try:
+        ejecutar_escritura(_registrar)
         print(f"✅ Solicitud registrada: Estudiante {estudiante_id} para sala {sala_id}")
         
     except Exception as e:
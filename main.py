@@ -4,17 +4,25 @@ import threading
 from telebot import types
 import os
 import sys
-from config import TOKEN, DB_PATH,EXCEL_PATH
+import html
+from config import TOKEN, DB_PATH,EXCEL_PATH, ESTADOS_COMPARTIDOS, EJECUCION_BOT
 
 # Importar funciones para manejar estados
-from utils.state_manager import get_state, set_state, clear_state, user_states, user_data
+from utils.state_manager import get_state, set_state, clear_state, user_states, user_data, instalar_sesiones
 
 # Importar funciones para manejar el Excel
 from utils.excel_manager import cargar_excel, importar_datos_desde_excel
 from db.queries import get_db_connection
+from db.escritor import ejecutar_escritura
+from db.consultas import ejecutar
 # Reemplaza todos los handlers universales por este ÚNICO handler al final
 # Inicializar el bot de Telegram
-bot = telebot.TeleBot(TOKEN) 
+if EJECUCION_BOT == "asyncio":
+    # AsyncTeleBot con la interfaz de TeleBot que usan los handlers (utils/asincrono.py)
+    from utils.asincrono import crear_bot_asincrono
+    bot = crear_bot_asincrono(TOKEN)
+else:
+    bot = telebot.TeleBot(TOKEN, use_class_middlewares=ESTADOS_COMPARTIDOS)
 
 def escape_markdown(text):
     """Escapa caracteres especiales de Markdown"""
@@ -37,6 +45,8 @@ def setup_commands():
             telebot.types.BotCommand("/start", "Inicia el bot y el registro"),
             telebot.types.BotCommand("/help", "Muestra la ayuda del bot"),
             telebot.types.BotCommand("/tutoria", "Ver profesores disponibles para tutoría"),
+            telebot.types.BotCommand("/disponibles", "Profesores en horario de tutoría ahora"),
+            telebot.types.BotCommand("/mis_citas", "Ver y anular tus citas de tutoría"),
             telebot.types.BotCommand("/crear_grupo_tutoria", "Crea un grupo de tutoría"),
             telebot.types.BotCommand("/configurar_horario", "Configura tu horario de tutorías"),
             telebot.types.BotCommand("/ver_misdatos", "Ver tus datos registrados")
@@ -68,6 +78,8 @@ def handle_help(message):
         "/start - Inicia el bot y el proceso de registro\n"
         "/help - Muestra este mensaje de ayuda\n"
         "/tutoria - Ver profesores disponibles para tutoría\n"
+        "/disponibles [horas] - Profesores en horario de tutoría ahora o en las próximas horas\n"
+        "/mis_citas - Ver y anular tus citas de tutoría\n"
         "/ver_misdatos - Ver tus datos registrados\n"
     )
     
@@ -144,14 +156,7 @@ def handle_ver_misdatos(message):
         cursor = conn.cursor()
         
         # Consultar todas las salas creadas por este profesor
-        cursor.execute("""
-            SELECT g.Nombre_sala, g.Proposito_sala, g.Tipo_sala, g.Fecha_creacion, 
-                   g.id_sala, g.Chat_id, a.Nombre as NombreAsignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-            WHERE g.Id_usuario = ?
-            ORDER BY g.Fecha_creacion DESC
-        """, (user['Id_usuario'],))
+        ejecutar(cursor, "salas.de_profesor", (user['Id_usuario'],))
         
         salas = cursor.fetchall()
         conn.close()
@@ -211,13 +216,100 @@ def handle_ver_misdatos(message):
         print(f"Error al enviar datos de usuario: {e}")
         bot.send_message(chat_id, user_info.replace('*', ''), parse_mode=None)
 
+@bot.message_handler(commands=['estadisticas_bd'])
+def handle_estadisticas_bd(message):
+    """Vuelca las métricas de consultas, pool, caché y escritor (solo administradores)"""
+    from config import ADMIN_IDS
+    from db.consultas import volcar_estadisticas
+    from db.conexion import estadisticas_pool
+    from db.escritor import get_escritor
+    from db.queries import estadisticas_cache_usuarios, estadisticas_cache_horarios, estadisticas_invalidaciones
+    from utils import motor_horarios
+    from utils.disponibilidad import get_indice_disponibilidad
+    from utils.citas import get_gestor_citas
+    from utils.excel_manager import estadisticas_excel
+    from utils.correo import get_bandeja
+    from db.tokens import get_almacen_tokens
+    from utils.state_manager import estadisticas_estados
+    from utils.despachador import estadisticas_despachador
+    from utils.mensajeria import get_cola_mensajes
+    from utils.difusion import get_motor_difusion
+
+    if message.from_user.id not in ADMIN_IDS:
+        bot.send_message(message.chat.id, "❌ Comando reservado a administradores.")
+        return
+
+    pool = estadisticas_pool()
+    cache = estadisticas_cache_usuarios()
+    cache_horarios = estadisticas_cache_horarios()
+    invalidaciones = estadisticas_invalidaciones()
+    horarios = motor_horarios.estadisticas()
+    indice = get_indice_disponibilidad().estadisticas()
+    citas = get_gestor_citas().estadisticas()
+    escritor = get_escritor().estadisticas()
+    excel = estadisticas_excel()
+    correo = get_bandeja().estadisticas()
+    codigos = get_almacen_tokens().estadisticas()
+    estados = estadisticas_estados()
+    despachador = estadisticas_despachador()
+    salida = get_cola_mensajes(bot).estadisticas()
+    difusion = get_motor_difusion(bot).estadisticas()
+    texto = (
+        f"Pool: {pool['en_uso']}/{pool['tamano_max']} en uso, {pool['esperas']} esperas "
+        f"(máx {pool['espera_max_ms']:.1f} ms), {pool['desbordes']} desbordes\n"
+        f"Caché usuarios: {cache['entradas']} entradas, {cache['tasa_aciertos']:.0%} aciertos; "
+        f"invalidaciones {invalidaciones['publicadas']} publicadas, {invalidaciones['recibidas']} recibidas\n"
+        f"Horarios: {cache_horarios['entradas']} profesores en caché, {cache_horarios['tasa_aciertos']:.0%} aciertos, "
+        f"{horarios['compilaciones']} compilados, {horarios['consultas']} consultas; "
+        f"índice {indice['profesores']} profesores, {indice['actualizaciones']} actualizaciones, "
+        f"{indice['consultas']} consultas\n"
+        f"Citas: {citas['reservas']} reservadas, {citas['conflictos']} huecos ya ocupados, "
+        f"{citas['cancelaciones']} anuladas, {citas['promociones']} desde la lista de espera "
+        f"({citas['en_espera']} apuntados)\n"
+        f"Escritor: {escritor['tareas']} tareas en {escritor['lotes']} lotes, "
+        f"{escritor['pendientes']} pendientes, {escritor['errores']} errores\n"
+        f"Excel: {excel['usuarios']} emails (cargado {excel['ultima_carga']}), "
+        f"{excel['recargas']} recargas, {excel['errores']} errores\n"
+        f"Correo: {correo['enviados']}/{correo['encolados']} enviados, {correo['pendientes']} pendientes, "
+        f"{correo['reintentos']} reintentos, {correo['fallidos']} fallidos, "
+        f"p95 {correo['latencia_p95_ms']:.0f} ms\n"
+        f"Telegram: {salida['enviados']}/{salida['encolados']} enviados, "
+        f"{salida['pendientes_interactivo']}+{salida['pendientes_masivo']} pendientes, "
+        f"{salida['limitados_429']} 429, {salida['fallidos']} fallidos, "
+        f"p95 masivo {salida['latencia_masivo_p95_ms']:.0f} ms\n"
+        f"Difusión: {difusion['completados']}/{difusion['creados']} trabajos, "
+        f"{difusion['reanudados']} reanudados, {difusion['enviados']} enviados, "
+        f"{difusion['fallidos']} fallidos\n"
+        f"Códigos: {codigos['pendientes']} pendientes, {codigos['validos']}/{codigos['emitidos']} verificados, "
+        f"{codigos['fallidos']} fallos, {codigos['bloqueos']} bloqueos\n"
+        f"Conversaciones: {estados['conversaciones']}/{estados['max_conversaciones']}, "
+        f"{estados['caducadas']} caducadas, {estados['expulsadas']} expulsadas, "
+        f"{estados['sesiones']} sesiones compartidas ({estados['esperas_agotadas']} sin cerrojo)\n"
+        + (f"Despachador: {despachador['en_cola']} en cola (máx {despachador['profundidad_max']}), "
+           f"p95 {despachador['latencia_p95_ms']:.0f} ms, fragmento más lento {despachador['fragmento_mas_lento']} "
+           f"({despachador['en_curso_max_ms']:.0f} ms en curso)\n" if despachador else "")
+        + "\n"
+        f"{volcar_estadisticas(limite=25)}"
+    )
+    print(f"📊 Estadísticas de BD:\n{texto}")
+
+    # Los mensajes de Telegram admiten 4096 caracteres
+    for inicio in range(0, len(texto), 4000):
+        bot.send_message(message.chat.id, f"<pre>{html.escape(texto[inicio:inicio + 4000])}</pre>",
+                         parse_mode="HTML")
+
 # Importar y configurar los handlers desde los módulos
 from handlers.registro import register_handlers as register_registro_handlers
 from handlers.tutorias import register_handlers as register_tutorias_handlers
 from handlers.horarios import register_handlers as register_horarios_handlers
+from handlers.citas import register_handlers as register_citas_handlers
 from utils.excel_manager import verificar_excel_disponible
 from grupo_handlers.grupos import GestionGrupos
 
+# Crear la base de datos si no existe y aplicar migraciones pendientes (índices)
+from db import init_db
+init_db()
+
 # Verificar si es la primera ejecución
 MARKER_FILE = os.path.join(os.path.dirname(DB_PATH), ".initialized")
 primera_ejecucion = not os.path.exists(MARKER_FILE)
@@ -242,6 +334,7 @@ else:
 register_registro_handlers(bot)
 register_tutorias_handlers(bot)
 register_horarios_handlers(bot)
+register_citas_handlers(bot)
 
 
 # Handlers para cambio de propósito de salas de tutoría
@@ -268,15 +361,7 @@ def handle_edit_sala(call):
         conn = get_db_connection()
         cursor = conn.cursor()
         print(f"🔍 Consultando detalles de sala ID {sala_id}")
-        cursor.execute(
-            """
-            SELECT g.*, a.Nombre as NombreAsignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-            WHERE g.id_sala = ? AND g.Id_usuario = ?  
-            """, 
-            (sala_id, user['Id_usuario'])
-        )
+        ejecutar(cursor, "salas.con_asignatura_de_profesor", (sala_id, user['Id_usuario']))
         sala = cursor.fetchone()
         conn.close()
         
@@ -357,22 +442,11 @@ def handle_cambiar_proposito(call):
     # Obtener datos de la sala
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT g.*, a.Nombre as NombreAsignatura
-        FROM Grupos_tutoria g
-        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-        WHERE g.id_sala = ? AND g.Id_usuario = ?  
-        """, 
-        (sala_id, user['Id_usuario'])
-    )
+    ejecutar(cursor, "salas.con_asignatura_de_profesor", (sala_id, user['Id_usuario']))
     sala = cursor.fetchone()
     
     # Contar miembros actuales
-    cursor.execute(
-        "SELECT COUNT(*) as total FROM Miembros_Grupo WHERE id_sala = ? AND Estado = 'activo'",  # cambiar chat_id por id_sala
-        (sala_id,)
-    )
+    ejecutar(cursor, "miembros.contar_activos", (sala_id,))
     miembros = cursor.fetchone()
     conn.close()
     
@@ -473,16 +547,7 @@ def handle_confirmar_cambio(call):
     
     try:
         # Obtener información de la sala
-        cursor.execute(
-            """
-            SELECT g.*, a.Nombre as NombreAsignatura, u.Nombre as NombreProfesor
-            FROM Grupos_tutoria g
-            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-            LEFT JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
-            WHERE g.id_sala = ?
-            """, 
-            (sala_id,)
-        )
+        ejecutar(cursor, "salas.con_asignatura_y_profesor", (sala_id,))
         sala = cursor.fetchone()
         
         if not sala:
@@ -490,34 +555,34 @@ def handle_confirmar_cambio(call):
             conn.close()
             return
         
-        # 1. Actualizar el propósito de la sala
-        cursor.execute(
-            "UPDATE Grupos_tutoria SET Proposito_sala = ? WHERE id_sala = ? AND Id_usuario = ?",
-            (nuevo_proposito, sala_id, user['Id_usuario'])
-        )
-        
-        # 2. Actualizar el tipo de sala según el propósito
+        # Nuevo tipo y nombre según el propósito
         tipo_sala = 'pública' if nuevo_proposito == 'avisos' else 'privada'
-        cursor.execute(
-            "UPDATE Grupos_tutoria SET Tipo_sala = ? WHERE id_sala = ?",
-            (tipo_sala, sala_id)
-        )
-        
-        # 3. Generar y actualizar el nuevo nombre según el propósito
         nuevo_nombre = None
         if nuevo_proposito == 'avisos':
             nuevo_nombre = f"Avisos: {sala['NombreAsignatura']}"
         elif nuevo_proposito == 'individual':
             nuevo_nombre = f"Tutoría Privada - Prof. {sala['NombreProfesor']}"
         
-        # Actualizar el nombre en la BD
-        if nuevo_nombre:
-            cursor.execute(
-                "UPDATE Grupos_tutoria SET Nombre_sala = ? WHERE id_sala = ?",
-                (nuevo_nombre, sala_id)
-            )
+        def _cambiar_proposito(conn, cursor):
+            # 1. Actualizar el propósito de la sala
+            ejecutar(cursor, "salas.actualizar_proposito", (nuevo_proposito, sala_id, user['Id_usuario']))
             
-            # Intentar cambiar el nombre en Telegram
+            # 2. Actualizar el tipo de sala según el propósito
+            ejecutar(cursor, "salas.actualizar_tipo", (tipo_sala, sala_id))
+            
+            # 3. Actualizar el nombre en la BD
+            if nuevo_nombre:
+                ejecutar(cursor, "salas.actualizar_nombre", (nuevo_nombre, sala_id))
+            
+            # 4. Gestionar miembros según la decisión
+            if decision_miembros == "eliminar":
+                # Eliminar todos los miembros excepto el profesor creador
+                ejecutar(cursor, "miembros.eliminar_salvo_creador", (sala_id, sala_id))
+        
+        ejecutar_escritura(_cambiar_proposito)
+        
+        # Intentar cambiar el nombre en Telegram
+        if nuevo_nombre:
             telegram_chat_id = sala['Chat_id']
             
             # Primero intentar con el bot actual (aunque probablemente fallará)
@@ -540,38 +605,12 @@ def handle_confirmar_cambio(call):
                 except Exception as e:
                     print(f"❌ Error al intentar utilizar la función del bot de grupos: {e}")
         
-        # 4. Gestionar miembros según la decisión
-        if decision_miembros == "eliminar":
-            # Eliminar todos los miembros excepto el profesor creador
-            cursor.execute(
-                """
-                DELETE FROM Miembros_Grupo 
-                WHERE id_sala = ? AND Id_usuario != (
-                    SELECT Id_usuario FROM Grupos_tutoria WHERE id_sala = ?
-                )
-                """,
-                (sala_id, sala_id)
-            )
-        
-        conn.commit()
-        
         # Obtener información actualizada de la sala
-        cursor.execute(
-            """
-            SELECT g.*, a.Nombre as NombreAsignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-            WHERE g.id_sala = ?
-            """, 
-            (sala_id,)
-        )
+        ejecutar(cursor, "salas.con_asignatura", (sala_id,))
         sala = cursor.fetchone()
         
         # Contar miembros restantes
-        cursor.execute(
-            "SELECT COUNT(*) as total FROM Miembros_Grupo WHERE id_sala = ? AND Estado = 'activo'",
-            (sala_id,)
-        )
+        ejecutar(cursor, "miembros.contar_activos", (sala_id,))
         miembros = cursor.fetchone()
         total_miembros = miembros['total'] if miembros else 0
         
@@ -608,7 +647,7 @@ def handle_confirmar_cambio(call):
                 "Se ha notificado a los miembros del cambio de propósito."
             )
             # Notificar a los miembros del cambio
-            notificar_cambio_sala(sala_id, nuevo_proposito)
+            notificar_cambio_sala(sala_id, nuevo_proposito, solicitante=chat_id)
         
         # Editar mensaje con confirmación
         try:
@@ -652,24 +691,12 @@ def handle_ver_miembros(call):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute(
-        """
-        SELECT u.Nombre, u.Apellidos, u.Email_UGR, mg.Fecha_union, mg.Estado
-        FROM Miembros_Grupo mg
-        JOIN Usuarios u ON mg.Id_usuario = u.Id_usuario
-        WHERE mg.id_sala = ? AND mg.Estado = 'activo'
-        ORDER BY mg.Fecha_union DESC
-        """,
-        (sala_id,)
-    )
+    ejecutar(cursor, "miembros.activos_con_usuario", (sala_id,))
     
     miembros = cursor.fetchall()
     
     # Obtener información de la sala
-    cursor.execute(
-        "SELECT Nombre_sala FROM Grupos_tutoria WHERE id_sala = ?",
-        (sala_id,)
-    )
+    ejecutar(cursor, "salas.nombre", (sala_id,))
     sala = cursor.fetchone()
     conn.close()
     
@@ -726,41 +753,22 @@ def handle_cancelar_edicion(call):
     )
     bot.answer_callback_query(call.id)
 
-def notificar_cambio_sala(sala_id, nuevo_proposito):
-    """Notifica a los miembros de la sala sobre el cambio de propósito"""
+def notificar_cambio_sala(sala_id, nuevo_proposito, solicitante=None):
+    """
+    Crea el trabajo que avisa a los miembros de la sala del cambio de propósito.
+    El envío lo hace utils/difusion.py en segundo plano; solicitante recibe el resumen.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
     
     # Obtener datos de la sala
-    cursor.execute(
-        """
-        SELECT g.*, u.Nombre as NombreProfesor, a.Nombre as NombreAsignatura
-        FROM Grupos_tutoria g
-        JOIN Usuarios u ON g.Id_usuario = u.Id_usuario
-        LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-        WHERE g.id_sala = ?  
-        """, 
-        (sala_id,)
-    )
+    ejecutar(cursor, "salas.con_asignatura_y_profesor", (sala_id,))
     sala = cursor.fetchone()
+    conn.close()
     
     if not sala:
-        conn.close()
         return
     
-    # Obtener miembros de la sala
-    cursor.execute(
-        """
-        SELECT u.*
-        FROM Miembros_Grupo mg
-        JOIN Usuarios u ON mg.Id_usuario = u.Id_usuario
-        WHERE mg.id_sala = ? AND u.Tipo = 'estudiante' AND mg.Estado = 'activo'  
-        """, 
-        (sala_id,)
-    )
-    miembros = cursor.fetchall()
-    conn.close()
-    
     # Textos para los propósitos (simplificado)
     propositos = {
         'individual': 'Tutorías individuales',
@@ -779,24 +787,25 @@ def notificar_cambio_sala(sala_id, nuevo_proposito):
         )
     }
     
-    # Notificar a cada miembro
-    for miembro in miembros:
-        if miembro['TelegramID']:
-            try:
-                bot.send_message(
-                    miembro['TelegramID'],
-                    f"ℹ️ *Cambio en sala de tutoría*\n\n"
-                    f"El profesor *{sala['NombreProfesor']}* ha modificado el propósito "
-                    f"de la sala *{sala['Nombre_sala']}*.\n\n"
-                    f"*Nuevo propósito:* {propositos.get(nuevo_proposito, 'General')}\n"
-                    f"*Asignatura:* {sala['NombreAsignatura'] or 'General'}\n\n"
-                    f"{explicaciones.get(nuevo_proposito, '')}\n\n"
-                    f"Tu acceso a la sala se mantiene, pero la forma de interactuar "
-                    f"podría cambiar según el nuevo propósito.",
-                    parse_mode="Markdown"
-                )
-            except Exception as e:
-                print(f"Error al notificar a usuario {miembro['Id_usuario']}: {e}")
+    texto = (
+        f"ℹ️ *Cambio en sala de tutoría*\n\n"
+        f"El profesor *{sala['NombreProfesor']}* ha modificado el propósito "
+        f"de la sala *{sala['Nombre_sala']}*.\n\n"
+        f"*Nuevo propósito:* {propositos.get(nuevo_proposito, 'General')}\n"
+        f"*Asignatura:* {sala['NombreAsignatura'] or 'General'}\n\n"
+        f"{explicaciones.get(nuevo_proposito, '')}\n\n"
+        f"Tu acceso a la sala se mantiene, pero la forma de interactuar "
+        f"podría cambiar según el nuevo propósito."
+    )
+    
+    # Los destinatarios se leen por páginas y el avance queda en Trabajos_difusion
+    from utils.difusion import crear_difusion
+    crear_difusion(
+        bot, "cambio_sala", sala_id, texto,
+        solicitante=solicitante,
+        descripcion=f"cambio de propósito de la sala {sala['Nombre_sala']}",
+        parse_mode="Markdown"
+    )
 
 def realizar_cambio_proposito(chat_id, message_id, sala_id, nuevo_proposito, user_id):
     """Realiza el cambio de propósito cuando no hay miembros que gestionar"""
@@ -805,15 +814,7 @@ def realizar_cambio_proposito(chat_id, message_id, sala_id, nuevo_proposito, use
     
     try:
         # Obtener datos actuales de la sala
-        cursor.execute(
-            """
-            SELECT g.*, a.Nombre as NombreAsignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-            WHERE g.id_sala = ?
-            """, 
-            (sala_id,)
-        )
+        ejecutar(cursor, "salas.con_asignatura", (sala_id,))
         sala = cursor.fetchone()
         
         if not sala:
@@ -825,33 +826,28 @@ def realizar_cambio_proposito(chat_id, message_id, sala_id, nuevo_proposito, use
             conn.close()
             return
         
-        # Actualizar propósito
-        cursor.execute(
-            "UPDATE Grupos_tutoria SET Proposito_sala = ? WHERE id_sala = ? AND Id_usuario = ?",
-            (nuevo_proposito, sala_id, user_id)
-        )
-        
-        # Actualizar tipo
+        # Generar nuevo tipo y nombre según el propósito
         tipo_sala = 'pública' if nuevo_proposito == 'avisos' else 'privada'
-        cursor.execute(
-            "UPDATE Grupos_tutoria SET Tipo_sala = ? WHERE id_sala = ?",
-            (tipo_sala, sala_id)
-        )
-        
-        # Generar nuevo nombre según el propósito
         nuevo_nombre = None
         if nuevo_proposito == 'avisos':
             nuevo_nombre = f"Avisos: {sala['NombreAsignatura']}"
         elif nuevo_proposito == 'individual':
             nuevo_nombre = f"Tutoría Privada - Prof. {obtener_nombre_profesor(user_id)}"
         
-        # Si se generó un nuevo nombre, actualizar en la base de datos
-        if nuevo_nombre:
-            cursor.execute(
-                "UPDATE Grupos_tutoria SET Nombre_sala = ? WHERE id_sala = ?",
-                (nuevo_nombre, sala_id)
-            )
+        def _actualizar_sala(conn, cursor):
+            # Actualizar propósito
+            ejecutar(cursor, "salas.actualizar_proposito", (nuevo_proposito, sala_id, user_id))
+            
+            # Actualizar tipo
+            ejecutar(cursor, "salas.actualizar_tipo", (tipo_sala, sala_id))
             
+            # Si se generó un nuevo nombre, actualizar en la base de datos
+            if nuevo_nombre:
+                ejecutar(cursor, "salas.actualizar_nombre", (nuevo_nombre, sala_id))
+        
+        ejecutar_escritura(_actualizar_sala)
+        
+        if nuevo_nombre:
             # Intentar cambiar el nombre del grupo en Telegram
             telegram_chat_id = sala['Chat_id']
             
@@ -875,18 +871,8 @@ def realizar_cambio_proposito(chat_id, message_id, sala_id, nuevo_proposito, use
                 except Exception as e:
                     print(f"❌ Error al intentar utilizar la función del bot de grupos: {e}")
         
-        conn.commit()
-        
         # Obtener info actualizada
-        cursor.execute(
-            """
-            SELECT g.*, a.Nombre as NombreAsignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-            WHERE g.id_sala = ?
-            """, 
-            (sala_id,)
-        )
+        ejecutar(cursor, "salas.con_asignatura", (sala_id,))
         sala_actualizada = cursor.fetchone()
         
         # Textos para los propósitos
@@ -918,7 +904,7 @@ def obtener_nombre_profesor(user_id):
     """Obtiene el nombre del profesor a partir del id de usuario"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT Nombre FROM Usuarios WHERE Id_usuario = ?", (user_id,))
+    ejecutar(cursor, "usuarios.nombre", (user_id,))
     resultado = cursor.fetchone()
     conn.close()
     return resultado['Nombre'] if resultado else "Profesor"
@@ -946,15 +932,7 @@ def handle_eliminar_sala(call):
         # Obtener datos de la sala
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT g.*, a.Nombre as NombreAsignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-            WHERE g.id_sala = ? AND g.Id_usuario = ?  
-            """, 
-            (sala_id, user['Id_usuario'])
-        )
+        ejecutar(cursor, "salas.con_asignatura_de_profesor", (sala_id, user['Id_usuario']))
         sala = cursor.fetchone()
         
         if not sala:
@@ -966,10 +944,7 @@ def handle_eliminar_sala(call):
         print(f"✅ Sala encontrada: {sala['Nombre_sala']} (Chat ID: {sala['Chat_id']})")
         
         # Contar miembros actuales
-        cursor.execute(
-            "SELECT COUNT(*) as total FROM Miembros_Grupo WHERE id_sala = ? AND Estado = 'activo'",
-            (sala_id,)
-        )
+        ejecutar(cursor, "miembros.contar_activos", (sala_id,))
         miembros = cursor.fetchone()
         total_miembros = miembros['total'] if miembros else 0
         conn.close()
@@ -1034,15 +1009,7 @@ def handle_confirmar_eliminar(call):
         # Obtener datos de la sala
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT g.*, a.Nombre as NombreAsignatura
-            FROM Grupos_tutoria g
-            LEFT JOIN Asignaturas a ON g.Id_asignatura = a.Id_asignatura
-            WHERE g.id_sala = ? AND g.Id_usuario = ?  
-            """, 
-            (sala_id, user['Id_usuario'])
-        )
+        ejecutar(cursor, "salas.con_asignatura_de_profesor", (sala_id, user['Id_usuario']))
         sala = cursor.fetchone()
         
         if not sala:
@@ -1055,25 +1022,21 @@ def handle_confirmar_eliminar(call):
         telegram_chat_id = sala['Chat_id']
         print(f"✅ Ejecutando eliminación de sala: {nombre_sala} (ID: {sala_id}, Chat ID: {telegram_chat_id})")
         
-        # 1. Eliminar todos los miembros de la sala
-        print("1️⃣ Eliminando miembros...")
-        cursor.execute(
-            "DELETE FROM Miembros_Grupo WHERE id_sala = ?",
-            (sala_id,)
-        )
-        print(f"  ✓ Miembros eliminados de la BD")
+        conn.close()
         
-        # 2. Eliminar la sala de la base de datos
-        print("2️⃣ Eliminando registro de sala...")
-        cursor.execute(
-            "DELETE FROM Grupos_tutoria WHERE id_sala = ? AND Id_usuario = ?",
-            (sala_id, user['Id_usuario'])
-        )
-        print(f"  ✓ Sala eliminada de la BD")
+        def _eliminar_sala(conn, cursor):
+            # 1. Eliminar todos los miembros de la sala
+            print("1️⃣ Eliminando miembros...")
+            ejecutar(cursor, "miembros.eliminar_de_sala", (sala_id,))
+            print(f"  ✓ Miembros eliminados de la BD")
+            
+            # 2. Eliminar la sala de la base de datos
+            print("2️⃣ Eliminando registro de sala...")
+            ejecutar(cursor, "salas.eliminar_de_profesor", (sala_id, user['Id_usuario']))
+            print(f"  ✓ Sala eliminada de la BD")
         
-        # Confirmar cambios en la base de datos
-        conn.commit()
-        conn.close()
+        # Los dos borrados se confirman juntos en el hilo escritor
+        ejecutar_escritura(_eliminar_sala)
         print("✅ Cambios en BD confirmados")
         
         # 3. Intentar salir del grupo de Telegram
@@ -1379,34 +1342,47 @@ def handler_volver_instrucciones(call):
 def setup_polling():
     """Configura el polling para el bot y maneja errores"""
     print("🤖 Iniciando el bot...")
-    try:
-        # Configurar comandos disponibles
-        if setup_commands():
-            print("✅ Comandos configurados correctamente")
-        else:
-            print("⚠️ Error al configurar comandos")
-        
-        # Agregar esta línea:
-        print("⚙️ Configurando polling con eventos de grupo...")
-        
-        # Modificar esta línea:
-        bot.infinity_polling(
-            timeout=10, 
-            long_polling_timeout=5,
-            allowed_updates=["message", "callback_query", "my_chat_member", "chat_member"]
-        )
-    except KeyboardInterrupt:
-        print("👋 Bot detenido manualmente")
-        sys.exit(0)
-    except Exception as e:
-        print(f"❌ Error fatal: {e}")
-        import traceback
-        traceback.print_exc()
-        
-        # Reintentar después de un tiempo
-        print("🔄 Reintentando en 10 segundos...")
-        time.sleep(10)
-        setup_polling()
+    # Configurar comandos disponibles
+    if setup_commands():
+        print("✅ Comandos configurados correctamente")
+    else:
+        print("⚠️ Error al configurar comandos")
+    
+    while True:
+        try:
+            print("⚙️ Configurando polling con eventos de grupo...")
+            bot.infinity_polling(
+                timeout=10, 
+                long_polling_timeout=5,
+                allowed_updates=["message", "callback_query", "my_chat_member", "chat_member"]
+            )
+            return
+        except KeyboardInterrupt:
+            print("👋 Bot detenido manualmente")
+            sys.exit(0)
+        except Exception as e:
+            print(f"❌ Error fatal: {e}")
+            import traceback
+            traceback.print_exc()
+            
+            # Reintentar después de un tiempo (en un bucle: sin recursión ni límite de pila)
+            print("🔄 Reintentando en 10 segundos...")
+            time.sleep(10)
+
+def setup_webhook():
+    """Atiende los updates por webhook con el despachador de utils/webhook.py"""
+    from config import (WEBHOOK_URL, WEBHOOK_HOST, WEBHOOK_PUERTO, WEBHOOK_SECRETO,
+                        WEBHOOK_GRABAR)
+    from utils.webhook import servir_webhook
+    
+    print("🤖 Iniciando el bot en modo webhook...")
+    if setup_commands():
+        print("✅ Comandos configurados correctamente")
+    servir_webhook(
+        bot, WEBHOOK_URL, host=WEBHOOK_HOST, puerto=WEBHOOK_PUERTO, ruta="/webhook/principal",
+        secreto=WEBHOOK_SECRETO, grabar=WEBHOOK_GRABAR,
+        allowed_updates=["message", "callback_query", "my_chat_member", "chat_member"]
+    )
 
 if __name__ == "__main__":
     print("="*50)
@@ -1417,5 +1393,40 @@ if __name__ == "__main__":
     print(f"📊 Excel de datos: {EXCEL_PATH}")
     print("="*50)
     
-    # Iniciar el bot
-    setup_polling()
+    # kill -USR1 <pid> vuelca las estadísticas de consultas al log
+    from db.consultas import instalar_senal_volcado
+    instalar_senal_volcado()
+    
+    # Recargar el índice de emails cuando se sustituya data/usuarios.xlsx
+    from utils.excel_manager import iniciar_vigilancia_excel
+    iniciar_vigilancia_excel()
+    
+    # Reanudar los avisos masivos que quedaron a medias en la última ejecución
+    from utils.difusion import get_motor_difusion
+    get_motor_difusion(bot).iniciar()
+    
+    # Con estado compartido, cada update se procesa con el cerrojo de su chat
+    if instalar_sesiones(bot):
+        print("✅ Sesiones de conversación compartidas activadas")
+    
+    from config import MODO_BOT
+    if MODO_BOT == "webhook":
+        # Varios procesos pueden recibir updates a la vez detrás de un balanceador
+        setup_webhook()
+    else:
+        # Un solo proceso hace polling; los demás esperan en reserva para tomar el relevo
+        import atexit
+        from utils.backend_estado import CerrojoLider
+        cerrojo_polling = CerrojoLider("polling:bot_principal", al_perder=bot.stop_polling)
+        if not cerrojo_polling.adquirir():
+            print("⏳ Otra instancia está haciendo polling: esperando en reserva...")
+            cerrojo_polling.adquirir(esperar=True)
+        atexit.register(cerrojo_polling.liberar)
+        
+        # Handlers en orden dentro de cada chat y en paralelo entre chats
+        from config import DESPACHADOR_HILOS, DESPACHADOR_CAPACIDAD
+        from utils.despachador import instalar_despachador
+        instalar_despachador(bot, hilos=DESPACHADOR_HILOS, capacidad=DESPACHADOR_CAPACIDAD)
+        
+        # Iniciar el bot
+        setup_polling()
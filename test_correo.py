@@ -0,0 +1,116 @@
+"""
+Pruebas de la bandeja de salida de correo (utils/correo.py).
+
+Usan el servidor SMTP falso de diagnostico_correo.py, que escucha en
+127.0.0.1 y responde según el destinatario, así que no salen correos reales.
+
+Uso:
+    python -m pytest -q test_correo.py
+"""
+import os
+import smtplib
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from diagnostico_correo import ServidorSMTPFalso, bandeja_para, esperar, mensaje
+from utils.correo import _es_permanente
+
+FALLOS = {
+    "temporal@correo.ugr.es": ("DATA", 451, 1),
+    "gris@correo.ugr.es": ("RCPT", 451, 1),
+    "ocupado@correo.ugr.es": ("DATA", 451, 99),
+    "rechazado@correo.ugr.es": ("RCPT", 550, 99),
+    "spam@correo.ugr.es": ("DATA", 550, 99),
+}
+
+
+@pytest.fixture
+def servidor():
+    servidor = ServidorSMTPFalso(("127.0.0.1", 0), FALLOS)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    yield servidor
+    servidor.shutdown()
+    servidor.server_close()
+
+
+@pytest.fixture
+def bandeja(servidor):
+    bandeja = bandeja_para(servidor, hilos=1)
+    yield bandeja
+    bandeja.detener()
+
+
+# ===== REINTENTOS =====
+@pytest.mark.parametrize("destinatario, orden", [
+    ("temporal@correo.ugr.es", "DATA"),
+    ("gris@correo.ugr.es", "RCPT"),
+])
+def test_error_temporal_se_reintenta_y_se_entrega(servidor, bandeja, destinatario, orden):
+    assert esperar(bandeja.encolar(mensaje(destinatario))) is None
+    assert servidor.intentos[(orden, destinatario)] == 2
+    assert servidor.entregados[destinatario] == 1
+    assert bandeja.reintentos == 1
+    assert bandeja.enviados == 1
+
+
+@pytest.mark.parametrize("destinatario, orden, excepcion", [
+    ("rechazado@correo.ugr.es", "RCPT", smtplib.SMTPRecipientsRefused),
+    ("spam@correo.ugr.es", "DATA", smtplib.SMTPDataError),
+])
+def test_error_permanente_falla_sin_reintentar(servidor, bandeja, destinatario, orden, excepcion):
+    error = esperar(bandeja.encolar(mensaje(destinatario)))
+    assert isinstance(error, excepcion)
+    assert servidor.intentos[(orden, destinatario)] == 1
+    assert servidor.entregados[destinatario] == 0
+    assert bandeja.reintentos == 0
+    assert bandeja.fallidos == 1
+
+
+def test_error_temporal_persistente_agota_los_intentos(servidor, bandeja):
+    error = esperar(bandeja.encolar(mensaje("ocupado@correo.ugr.es")))
+    assert isinstance(error, smtplib.SMTPDataError)
+    assert error.smtp_code == 451
+    assert servidor.intentos[("DATA", "ocupado@correo.ugr.es")] == bandeja.max_intentos
+    assert bandeja.reintentos == bandeja.max_intentos - 1
+
+
+# ===== CLASIFICACIÓN DE ERRORES =====
+@pytest.mark.parametrize("error, permanente", [
+    (smtplib.SMTPAuthenticationError(535, b"credenciales"), True),
+    (smtplib.SMTPRecipientsRefused({"a@correo.ugr.es": (550, b"no existe")}), True),
+    (smtplib.SMTPRecipientsRefused({"a@correo.ugr.es": (451, b"greylisting")}), False),
+    (smtplib.SMTPRecipientsRefused({"a@correo.ugr.es": (451, b"greylisting"),
+                                    "b@correo.ugr.es": (550, b"no existe")}), True),
+    (smtplib.SMTPDataError(554, b"spam"), True),
+    (smtplib.SMTPDataError(451, b"temporal"), False),
+    (smtplib.SMTPSenderRefused(421, b"ocupado", "tutorias@correo.ugr.es"), False),
+    (smtplib.SMTPServerDisconnected("cerrada"), False),
+    (ConnectionRefusedError(), False),
+])
+def test_es_permanente(error, permanente):
+    assert _es_permanente(error) is permanente
+
+
+# ===== REUTILIZACIÓN DE CONEXIONES =====
+@pytest.mark.parametrize("hilos", [1, 2])
+def test_lote_reutiliza_una_conexion_por_hilo(servidor, hilos):
+    bandeja = bandeja_para(servidor, hilos=hilos)
+    try:
+        futuros = [bandeja.encolar(mensaje(f"lote{i}@correo.ugr.es")) for i in range(30)]
+        assert [esperar(f) for f in futuros] == [None] * 30
+    finally:
+        bandeja.detener()
+    assert sum(servidor.entregados.values()) == 30
+    assert 1 <= servidor.conexiones <= hilos
+    assert bandeja.conexiones == servidor.conexiones
+
+
+def test_tras_un_error_se_abre_una_conexion_nueva(servidor, bandeja):
+    """La conexión que dio error se cierra: el siguiente correo no hereda una sesión a medias"""
+    assert isinstance(esperar(bandeja.encolar(mensaje("spam@correo.ugr.es"))), smtplib.SMTPDataError)
+    assert esperar(bandeja.encolar(mensaje("lote@correo.ugr.es"))) is None
+    assert bandeja.conexiones == servidor.conexiones == 2
@@ -0,0 +1,53 @@
+"""
+Pruebas de propiedades de utils/franjas.py.
+
+Reutilizan los generadores de diagnostico_franjas.py: comparan
+HorarioSemanal y hay_solapamiento() con modelos ingenuos (minutos ocupados
+y comprobación por parejas) sobre casos aleatorios con semilla fija, así
+que un fallo se reproduce con la misma semilla.
+
+Uso:
+    python -m pytest -q test_franjas.py
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from diagnostico_franjas import caso, franja_valida, solapamiento_por_parejas
+from utils.franjas import convertir_a_minutos, franjas_a_conjunto, hay_solapamiento
+from utils.motor_horarios import formatear_franja
+
+SEMILLAS = range(40)
+
+
+@pytest.mark.parametrize("semilla", SEMILLAS)
+def test_horario_semanal_coincide_con_modelo_de_minutos(semilla):
+    assert caso(random.Random(semilla), operaciones=60) is None
+
+
+@pytest.mark.parametrize("semilla", SEMILLAS)
+def test_hay_solapamiento_coincide_con_comprobacion_por_parejas(semilla):
+    rng = random.Random(semilla)
+    for _ in range(100):
+        existentes = [formatear_franja(*franja_valida(rng)) for _ in range(rng.randint(0, 6))]
+        nueva = formatear_franja(*franja_valida(rng))
+        assert hay_solapamiento(existentes, nueva) == solapamiento_por_parejas(existentes, nueva), \
+            (existentes, nueva)
+
+
+def test_franjas_que_se_tocan_no_se_solapan():
+    assert not hay_solapamiento(["10:00-11:00"], "11:00-12:00")
+    assert not hay_solapamiento(["11:00-12:00"], "10:00-11:00")
+    assert hay_solapamiento(["10:00-11:00"], "10:59-12:00")
+
+
+def test_franjas_mal_escritas_no_cuentan():
+    assert not hay_solapamiento(["10:00-11:00", "basura"], "12:00-13:00")
+    assert not hay_solapamiento(["10:00-11:00"], "basura")
+    assert list(franjas_a_conjunto(["09:00-10:00", "10:00", "10:00-11:30"])) == [
+        (convertir_a_minutos("09:00"), convertir_a_minutos("11:30"))
+    ]
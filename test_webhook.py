@@ -0,0 +1,216 @@
+"""
+Pruebas de la aplicación WSGI del webhook (utils/webhook.py).
+
+Llaman a AplicacionWebhook directamente con un environ WSGI, sin servidor
+HTTP ni Telegram, y le pasan updates grabados en el formato de
+WEBHOOK_GRABAR (un JSON por línea, el que lee enviar_updates.py).
+
+Uso:
+    python -m pytest -q test_webhook.py
+"""
+import io
+import json
+import os
+import sys
+import threading
+from collections import defaultdict
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from enviar_updates import leer_updates, updates_sinteticos
+from utils.despachador import DespachadorUpdates
+from utils.webhook import AplicacionWebhook, MAX_CUERPO
+
+RUTA = "/webhook/principal"
+SECRETO = "secreto-de-prueba"
+
+# Updates tal y como los graba WEBHOOK_GRABAR: mensaje privado, callback y mensaje de grupo
+GRABADOS = """\
+{"update_id": 501, "message": {"message_id": 10, "date": 1730000000, "from": {"id": 6437090930, "is_bot": false, "first_name": "Alberto"}, "chat": {"id": 6437090930, "type": "private", "first_name": "Alberto"}, "text": "/start"}}
+{"update_id": 502, "callback_query": {"id": "4471", "from": {"id": 6437090930, "is_bot": false, "first_name": "Alberto"}, "message": {"message_id": 11, "date": 1730000001, "chat": {"id": 6437090930, "type": "private"}, "text": "Menú"}, "chat_instance": "88", "data": "ver_horario"}}
+{"update_id": 503, "message": {"message_id": 3, "date": 1730000002, "from": {"id": 7001, "is_bot": false, "first_name": "Lucía"}, "chat": {"id": -1001234567890, "type": "supergroup", "title": "Tutorías"}, "text": "Hola"}}
+"""
+
+
+def peticion(aplicacion, metodo="POST", ruta=RUTA, cuerpo=b"", secreto=SECRETO, longitud=None):
+    """Llama a la aplicación WSGI; devuelve (código, cabeceras, cuerpo)"""
+    environ = {
+        "REQUEST_METHOD": metodo,
+        "PATH_INFO": ruta,
+        "CONTENT_LENGTH": str(len(cuerpo) if longitud is None else longitud),
+        "CONTENT_TYPE": "application/json",
+        "wsgi.input": io.BytesIO(cuerpo),
+    }
+    if secreto is not None:
+        environ["HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN"] = secreto
+    respuesta = {}
+
+    def start_response(estado, cabeceras):
+        respuesta["codigo"] = int(estado.split()[0])
+        respuesta["cabeceras"] = dict(cabeceras)
+
+    cuerpo_respuesta = b"".join(aplicacion(environ, start_response))
+    return respuesta["codigo"], respuesta["cabeceras"], cuerpo_respuesta
+
+
+def enviar(aplicacion, update, **kwargs):
+    return peticion(aplicacion, cuerpo=json.dumps(update).encode(), **kwargs)[0]
+
+
+@pytest.fixture
+def grabados(tmp_path):
+    ruta = tmp_path / "updates.jsonl"
+    ruta.write_text(GRABADOS, encoding="utf-8")
+    return leer_updates(ruta)
+
+
+@pytest.fixture
+def procesados():
+    return []
+
+
+@pytest.fixture
+def despachador(procesados):
+    despachador = DespachadorUpdates(procesados.append, hilos=2, capacidad=100, espera=0)
+    despachador.iniciar()
+    yield despachador
+    despachador.detener(timeout=5)
+
+
+@pytest.fixture
+def aplicacion(despachador):
+    return AplicacionWebhook(despachador, ruta=RUTA, secreto=SECRETO)
+
+
+# ===== CÓDIGOS DE RESPUESTA =====
+def test_updates_grabados_se_aceptan_y_se_procesan(aplicacion, despachador, procesados, grabados):
+    assert [enviar(aplicacion, update) for update in grabados] == [200] * len(grabados)
+    assert despachador.detener(timeout=5) == 0
+    assert sorted(u["update_id"] for u in procesados) == [501, 502, 503]
+    assert aplicacion.invalidos == 0
+
+
+@pytest.mark.parametrize("cuerpo", [
+    b"{no es json",
+    b'{"message": {"text": "sin update_id"}}',
+    b'[{"update_id": 1}]',
+    "ñ".encode("latin-1"),
+])
+def test_cuerpo_invalido_da_400(aplicacion, procesados, cuerpo):
+    assert peticion(aplicacion, cuerpo=cuerpo)[0] == 400
+    assert aplicacion.invalidos == 1
+    assert procesados == []
+
+
+@pytest.mark.parametrize("longitud", [0, MAX_CUERPO + 1, "abc"])
+def test_longitud_invalida_da_400(aplicacion, longitud):
+    assert peticion(aplicacion, cuerpo=b'{"update_id": 1}', longitud=longitud)[0] == 400
+
+
+@pytest.mark.parametrize("secreto", [None, "", "otro-secreto"])
+def test_secreto_incorrecto_da_403(aplicacion, procesados, grabados, secreto):
+    assert enviar(aplicacion, grabados[0], secreto=secreto) == 403
+    assert procesados == []
+
+
+def test_sin_secreto_configurado_no_se_comprueba(despachador, grabados):
+    aplicacion = AplicacionWebhook(despachador, ruta=RUTA)
+    assert enviar(aplicacion, grabados[0], secreto=None) == 200
+
+
+@pytest.mark.parametrize("metodo, ruta", [("POST", "/webhook"), ("POST", RUTA + "/"), ("GET", "/")])
+def test_ruta_desconocida_da_404(aplicacion, metodo, ruta):
+    assert peticion(aplicacion, metodo=metodo, ruta=ruta)[0] == 404
+
+
+@pytest.mark.parametrize("metodo", ["GET", "PUT", "HEAD"])
+def test_metodo_distinto_de_post_da_405(aplicacion, metodo):
+    assert peticion(aplicacion, metodo=metodo)[0] == 405
+
+
+def test_salud_devuelve_metricas_del_despachador(aplicacion, grabados):
+    enviar(aplicacion, grabados[0])
+    codigo, cabeceras, cuerpo = peticion(aplicacion, metodo="GET", ruta="/salud")
+    assert codigo == 200
+    assert cabeceras["Content-Type"] == "application/json"
+    metricas = json.loads(cuerpo)
+    assert metricas["recibidos"] == 1
+    assert len(metricas["fragmentos"]) == 2
+
+
+# ===== DESPACHADOR LLENO =====
+def test_despachador_lleno_da_503(grabados):
+    liberar = threading.Event()
+    empezado = threading.Event()
+
+    def procesar(update):
+        empezado.set()
+        liberar.wait(5)
+
+    # Una sola cola de capacidad 1 y sin espera: un update en proceso y otro en cola la llenan
+    despachador = DespachadorUpdates(procesar, hilos=1, capacidad=1, espera=0)
+    despachador.iniciar()
+    aplicacion = AplicacionWebhook(despachador, ruta=RUTA, secreto=SECRETO)
+    try:
+        assert enviar(aplicacion, grabados[0]) == 200
+        assert empezado.wait(5)
+        assert enviar(aplicacion, grabados[1]) == 200
+        codigo, cabeceras, _ = peticion(aplicacion, cuerpo=json.dumps(grabados[2]).encode())
+        assert codigo == 503
+        assert cabeceras["Retry-After"] == "5"
+        assert despachador.rechazados == 1
+    finally:
+        liberar.set()
+        despachador.detener(timeout=5)
+    assert despachador.procesados == 2
+
+
+def test_despachador_detenido_da_503(aplicacion, despachador, grabados):
+    despachador.detener(timeout=5)
+    assert enviar(aplicacion, grabados[0]) == 503
+
+
+# ===== ORDEN POR CHAT =====
+def test_updates_de_un_chat_se_procesan_en_orden():
+    por_chat = defaultdict(list)
+    lock = threading.Lock()
+
+    def procesar(update):
+        chat = update["message"]["chat"]["id"]
+        with lock:
+            por_chat[chat].append(update["update_id"])
+
+    despachador = DespachadorUpdates(procesar, hilos=4, capacidad=1000, espera=None)
+    despachador.iniciar()
+    aplicacion = AplicacionWebhook(despachador, ruta=RUTA, secreto=SECRETO)
+    updates = updates_sinteticos(600, chats=12)
+
+    # Cuatro clientes envían a la vez, cada uno con los updates de sus chats en orden
+    def cliente(indice):
+        for update in updates:
+            if update["message"]["chat"]["id"] % 4 == indice:
+                assert enviar(aplicacion, update) == 200
+
+    clientes = [threading.Thread(target=cliente, args=(i,)) for i in range(4)]
+    for hilo in clientes:
+        hilo.start()
+    for hilo in clientes:
+        hilo.join()
+    assert despachador.detener(timeout=10) == 0
+
+    assert sum(len(ids) for ids in por_chat.values()) == 600
+    assert len(por_chat) == 12
+    for chat, ids in por_chat.items():
+        assert ids == sorted(ids), f"chat {chat} fuera de orden"
+
+
+def test_grabar_escribe_los_updates_aceptados(despachador, grabados, tmp_path):
+    fichero = tmp_path / "grabados.jsonl"
+    aplicacion = AplicacionWebhook(despachador, ruta=RUTA, secreto=SECRETO, grabar=str(fichero))
+    for update in grabados:
+        assert enviar(aplicacion, update) == 200
+    assert peticion(aplicacion, cuerpo=b"{roto")[0] == 400
+    aplicacion._grabar.close()
+    assert leer_updates(fichero) == grabados
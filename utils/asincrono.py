@@ -0,0 +1,363 @@
+"""
+Modo asyncio de los bots (EJECUCION_BOT=asyncio).
+
+En el modo por hilos cada llamada a la API de Telegram ocupa un hilo
+mientras espera la respuesta. Aquí un AsyncTeleBot hace todas las llamadas
+HTTP desde un único bucle de eventos, en un hilo propio, con una sesión
+aiohttp compartida, y los updates se reparten como tareas de asyncio: miles
+de updates pueden estar en curso a la vez sin un hilo por cada uno.
+
+Los módulos de handlers/ y grupo_handlers/ no cambian. BotSincrono ofrece
+la interfaz de telebot.TeleBot que usan (decoradores de handlers,
+send_message, edit_message_text...) sobre el AsyncTeleBot:
+
+- Los handlers síncronos se ejecutan en un grupo de hilos acotado
+  (ASYNC_HILOS_HANDLERS); sus llamadas a la API se pasan al bucle y el
+  hilo solo espera la respuesta.
+- Los handlers definidos con async def se ejecutan directamente en el
+  bucle y usan bot.asincrono (el AsyncTeleBot) y db/asincrona.py.
+- Con middlewares (sesiones de ESTADOS_COMPARTIDOS) cada update se procesa
+  dentro de su sesión, como en TeleBot: los filtros que miran user_states
+  ya ven la conversación traída del backend.
+
+El DespachadorAsincrono mantiene la garantía del despachador por hilos:
+los updates de un mismo chat se procesan en orden y los de chats distintos
+en paralelo, con un máximo de updates en curso (ASYNC_EN_VUELO).
+"""
+import os
+import sys
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.consultas import percentil
+from utils.despachador import chat_del_update, registrar_despachador
+
+logger = logging.getLogger(__name__)
+
+HILOS_HANDLERS = 64     # Handlers síncronos ejecutándose a la vez
+EN_VUELO = 5000         # Updates aceptados y sin terminar como máximo
+CONEXIONES_API = 100    # Conexiones HTTP simultáneas con la Bot API
+ESPERA_COLA = 2.0       # Segundos que encolar() espera por sitio antes de rechazar (webhook)
+
+
+class DespachadorAsincrono:
+    """
+    Despachador con orden por chat sobre tareas de asyncio. Tiene la misma
+    interfaz que DespachadorUpdates (encolar, iniciar, detener, estadisticas),
+    así que el webhook lo usa sin cambios. Todo su estado se modifica solo
+    desde el bucle de eventos.
+    """
+
+    def __init__(self, loop, procesar, capacidad=EN_VUELO, espera=ESPERA_COLA):
+        """
+        Args:
+            loop: Bucle de eventos donde se procesan los updates
+            procesar: Corrutina que recibe un update y lo atiende
+            capacidad: Updates en curso como máximo
+            espera: Segundos que encolar() espera por sitio antes de rechazar
+        """
+        self.loop = loop
+        self.procesar = procesar
+        self.capacidad = capacidad
+        self.espera = espera
+        self._plazas = None          # asyncio.Semaphore, se crea dentro del bucle
+        self._orden_lotes = None     # asyncio.Lock para que los lotes del polling no se adelanten
+        self._chats = {}             # {clave: deque de (update, encolado)} con tarea en marcha
+        self._en_curso = {}          # {clave: inicio del handler en curso}
+        self._tareas = set()
+        self._aceptando = False
+
+        # Métricas
+        self.recibidos = 0
+        self.procesados = 0
+        self.rechazados = 0
+        self.errores = 0
+        self.en_vuelo = 0
+        self.en_vuelo_max = 0
+        self._latencias = deque(maxlen=1024)  # ms desde que se encola hasta que termina
+
+    def iniciar(self):
+        if self._plazas is None:
+            asyncio.run_coroutine_threadsafe(self._preparar(), self.loop).result()
+        self._aceptando = True
+        registrar_despachador(self)
+
+    async def _preparar(self):
+        self._plazas = asyncio.Semaphore(self.capacidad)
+        self._orden_lotes = asyncio.Lock()
+
+    async def admitir(self, update, clave, espera=None):
+        """Desde el bucle: encola el update en su chat; espera=None aguarda sitio sin límite"""
+        if not self._aceptando:
+            self.rechazados += 1
+            return False
+        try:
+            await asyncio.wait_for(self._plazas.acquire(), espera)
+        except asyncio.TimeoutError:
+            self.rechazados += 1
+            logger.warning(f"Despachador asíncrono lleno: update de {clave} rechazado")
+            return False
+
+        self.recibidos += 1
+        self.en_vuelo += 1
+        if self.en_vuelo > self.en_vuelo_max:
+            self.en_vuelo_max = self.en_vuelo
+        cola = self._chats.get(clave)
+        if cola is None:
+            cola = self._chats[clave] = deque()
+            tarea = asyncio.create_task(self._atender(clave, cola))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._tareas.discard)
+        cola.append((update, time.monotonic()))
+        return True
+
+    async def admitir_lote(self, updates):
+        """Desde el bucle (polling): encola un lote en orden, esperando sitio si hace falta"""
+        async with self._orden_lotes:
+            for update in updates:
+                clave = chat_del_update(update)
+                await self.admitir(update, update.update_id if clave is None else clave)
+
+    def encolar(self, update, clave):
+        """
+        Desde otro hilo (webhook): encola el update en su chat
+
+        Returns:
+            bool: False si está parado o sigue lleno tras la espera
+        """
+        return asyncio.run_coroutine_threadsafe(self.admitir(update, clave, self.espera), self.loop).result()
+
+    async def _atender(self, clave, cola):
+        # Una tarea por chat con updates pendientes: procesa su cola en orden y termina
+        while cola:
+            update, encolado = cola.popleft()
+            self._en_curso[clave] = time.monotonic()
+            try:
+                await self.procesar(update)
+                self.procesados += 1
+            except Exception as e:
+                self.errores += 1
+                logger.error(f"Error procesando update: {e}", exc_info=True)
+            finally:
+                del self._en_curso[clave]
+                self.en_vuelo -= 1
+                self._plazas.release()
+                self._latencias.append((time.monotonic() - encolado) * 1000)
+        del self._chats[clave]
+
+    def detener(self, timeout=30):
+        """Deja de aceptar updates y espera a que terminen los que están en curso"""
+        self._aceptando = False
+        limite = time.monotonic() + timeout
+        while self.en_vuelo and time.monotonic() < limite:
+            time.sleep(0.05)
+        return self.en_vuelo
+
+    def estadisticas(self, por_fragmento=False):
+        latencias = sorted(self._latencias)
+        ahora = time.monotonic()
+        en_curso = sorted(((ahora - inicio) * 1000, clave) for clave, inicio in list(self._en_curso.items()))
+        estadisticas = {
+            "en_vuelo": self.en_vuelo,
+            "en_cola": self.en_vuelo - len(en_curso),
+            "profundidad_max": self.en_vuelo_max,
+            "capacidad": self.capacidad,
+            "chats_activos": len(self._chats),
+            "recibidos": self.recibidos,
+            "procesados": self.procesados,
+            "rechazados": self.rechazados,
+            "errores": self.errores,
+            "latencia_p50_ms": percentil(latencias, 0.50),
+            "latencia_p95_ms": percentil(latencias, 0.95),
+            # Aquí cada chat es su propio "fragmento": el del handler en curso más largo
+            "fragmento_mas_lento": en_curso[-1][1] if en_curso else None,
+            "en_curso_max_ms": en_curso[-1][0] if en_curso else 0.0,
+        }
+        if por_fragmento:
+            estadisticas["fragmentos"] = [{"chat": clave, "en_curso_ms": ms} for ms, clave in en_curso[-10:]]
+        return estadisticas
+
+
+class BotSincrono:
+    """
+    Interfaz síncrona de telebot.TeleBot sobre un AsyncTeleBot que corre en
+    su propio bucle de eventos. Lo que no se redefine aquí se toma del
+    AsyncTeleBot: las corrutinas (métodos de la API) se convierten en
+    llamadas bloqueantes para los hilos de los handlers.
+    """
+
+    def __init__(self, token, hilos=HILOS_HANDLERS, en_vuelo=EN_VUELO, conexiones=CONEXIONES_API):
+        from telebot import asyncio_helper
+        from telebot.async_telebot import AsyncTeleBot
+
+        asyncio_helper.REQUEST_LIMIT = conexiones
+        self.asincrono = AsyncTeleBot(token)
+        self.loop = asyncio.new_event_loop()
+        self._hilo_bucle = threading.Thread(target=self.loop.run_forever, name="bucle-asyncio", daemon=True)
+        self._hilo_bucle.start()
+        self._hilos = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="handler-async")
+        self._hilos_sesion = None   # Solo con middlewares: hilos que abren la sesión de cada update
+        self._middlewares = []
+
+        # Updates del polling: al despachador, que respeta el orden por chat
+        self._procesar_lote = self.asincrono.process_new_updates
+        self.despachador = DespachadorAsincrono(self.loop, self._procesar, capacidad=en_vuelo)
+        self.asincrono.process_new_updates = self.despachador.admitir_lote
+
+    async def _procesar(self, update):
+        if isinstance(update, dict):   # Llega así por el webhook
+            from telebot import types
+            update = types.Update.de_json(update)
+        if self._middlewares:
+            # Como en TeleBot, los middlewares van antes que los filtros de los handlers:
+            # un filtro como user_states.get(...) == ESTADO necesita la sesión ya cargada
+            await self.loop.run_in_executor(self._hilos_sesion, self._procesar_en_sesion, update)
+        else:
+            await self._procesar_lote([update])
+
+    def _procesar_en_sesion(self, update):
+        """En un hilo de sesión: middlewares síncronos alrededor de filtros y handler del update"""
+        activos = []
+        for middleware in self._middlewares:
+            objeto = next((getattr(update, tipo) for tipo in (middleware.update_types or ())
+                           if getattr(update, tipo, None) is not None), None)
+            if objeto is not None:
+                activos.append((middleware, objeto))
+        data = {}
+        for middleware, objeto in activos:
+            middleware.pre_process(objeto, data)
+        error = None
+        try:
+            # El bucle evalúa los filtros y lanza el handler en self._hilos; este hilo espera
+            asyncio.run_coroutine_threadsafe(self._procesar_lote([update]), self.loop).result()
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            for middleware, objeto in reversed(activos):
+                middleware.post_process(objeto, data, error)
+
+    # ===== LLAMADAS A LA API =====
+    def _esperar(self, corrutina):
+        if threading.current_thread() is self._hilo_bucle:
+            corrutina.close()
+            raise RuntimeError("Llamada síncrona a la API desde el bucle de eventos: usa await bot.asincrono")
+        from telebot import apihelper, asyncio_helper
+        try:
+            return asyncio.run_coroutine_threadsafe(corrutina, self.loop).result()
+        except asyncio_helper.ApiTelegramException as e:
+            # Los handlers capturan la excepción de la API síncrona
+            raise apihelper.ApiTelegramException(e.function_name, e.result, e.result_json) from e
+
+    def __getattr__(self, nombre):
+        if nombre == "asincrono":
+            raise AttributeError(nombre)
+        atributo = getattr(self.asincrono, nombre)
+        if nombre.endswith("_handler") and not nombre.startswith("_"):
+            return self._registrador(nombre, atributo)
+        if not inspect.iscoroutinefunction(atributo):
+            return atributo
+
+        def llamada(*args, **kwargs):
+            return self._esperar(atributo(*args, **kwargs))
+        llamada.__name__ = nombre
+        setattr(self, nombre, llamada)
+        return llamada
+
+    # ===== HANDLERS =====
+    def _registrador(self, nombre, registrar):
+        """message_handler(...) y register_message_handler(callback, ...) con la función envuelta"""
+        if nombre.startswith("register_"):
+            def registrar_callback(callback, *args, **kwargs):
+                return registrar(self._envolver(callback), *args, **kwargs)
+            return registrar_callback
+
+        def decorador_con_filtros(*args, **kwargs):
+            def decorador(funcion):
+                registrar(*args, **kwargs)(self._envolver(funcion))
+                return funcion
+            return decorador
+        return decorador_con_filtros
+
+    def _envolver(self, funcion):
+        if inspect.iscoroutinefunction(funcion):
+            return funcion
+        loop = self.loop
+
+        async def handler(objeto):
+            return await loop.run_in_executor(self._hilos, funcion, objeto)
+        handler.__name__ = getattr(funcion, "__name__", "handler")
+        return handler
+
+    def setup_middleware(self, middleware):
+        """
+        Middlewares de clase de telebot (síncronos). Se ejecutan en un hilo de
+        sesión que envuelve todo el update, filtros incluidos; el handler sigue
+        en su propio hilo, así que cada update con middlewares ocupa dos.
+        """
+        if self._hilos_sesion is None:
+            self._hilos_sesion = ThreadPoolExecutor(max_workers=self._hilos._max_workers,
+                                                    thread_name_prefix="sesion-async")
+        self._middlewares.append(middleware)
+
+    # ===== RECEPCIÓN =====
+    def _ejecutar_polling(self, corrutina):
+        self.despachador.iniciar()
+        futuro = asyncio.run_coroutine_threadsafe(corrutina, self.loop)
+        try:
+            return futuro.result()
+        except KeyboardInterrupt:
+            self.asincrono.stop_polling()
+            futuro.cancel()
+            raise
+        finally:
+            asyncio.run_coroutine_threadsafe(self.asincrono.close_session(), self.loop).result(5)
+
+    @staticmethod
+    def _parametros_polling(kwargs):
+        # En TeleBot timeout es el de la petición HTTP y long_polling_timeout el de getUpdates;
+        # en AsyncTeleBot son request_timeout y timeout
+        if "long_polling_timeout" in kwargs:
+            kwargs["request_timeout"] = kwargs.pop("timeout", None)
+            kwargs["timeout"] = kwargs.pop("long_polling_timeout")
+        if "none_stop" in kwargs:
+            kwargs["non_stop"] = kwargs.pop("none_stop")
+        return kwargs
+
+    def polling(self, **kwargs):
+        return self._ejecutar_polling(self.asincrono.polling(**self._parametros_polling(kwargs)))
+
+    def infinity_polling(self, **kwargs):
+        return self._ejecutar_polling(self.asincrono.infinity_polling(**self._parametros_polling(kwargs)))
+
+    def cerrar(self):
+        """Cierra la sesión HTTP y para el bucle de eventos y los hilos de handlers"""
+        asyncio.run_coroutine_threadsafe(self.asincrono.close_session(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._hilos.shutdown(wait=False)
+        if self._hilos_sesion is not None:
+            self._hilos_sesion.shutdown(wait=False)
+
+    def estadisticas(self):
+        return {
+            "hilos_handlers": self._hilos._max_workers,
+            "despachador": self.despachador.estadisticas(),
+        }
+
+
+def crear_bot_asincrono(token):
+    """BotSincrono con los límites de config.py"""
+    try:
+        from config import ASYNC_HILOS_HANDLERS, ASYNC_EN_VUELO, ASYNC_CONEXIONES_API
+    except ImportError:
+        return BotSincrono(token)
+    return BotSincrono(token, hilos=ASYNC_HILOS_HANDLERS, en_vuelo=ASYNC_EN_VUELO,
+                       conexiones=ASYNC_CONEXIONES_API)
@@ -0,0 +1,392 @@
+"""
+Backend de estado compartido y cerrojos entre procesos.
+
+Los bots guardan aquí lo que tiene que verse desde varios procesos: las
+conversaciones en curso (utils/state_manager.py), los cerrojos por chat o
+de instancia única y las invalidaciones de las cachés de cada proceso
+(CanalInvalidaciones). La interfaz imita a la de Redis (GET/SET con TTL,
+SCAN por prefijo, SET NX PX para cerrojos), así que un backend Redis solo
+tendría que implementar los mismos métodos de BackendEstado:
+
+    leer, escribir, escribir_varios, borrar, borrar_varios, escanear,
+    adquirir, renovar, liberar, limpiar_caducados
+
+De momento hay dos implementaciones: BackendMemoria (un solo proceso,
+útil en desarrollo) y BackendSQLite, que usa la misma base de datos del
+bot, escribe a través del escritor único y lee del pool.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import itertools
+import logging
+import threading
+from contextlib import contextmanager
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logger = logging.getLogger(__name__)
+
+TTL_INVALIDACION = 900.0  # Segundos que se guarda una invalidación (más que el TTL de cualquier caché)
+TTL_CERROJO = 60.0        # Segundos que dura un cerrojo si su dueño muere sin liberarlo
+ESPERA_CERROJO = 30.0     # Segundos máximos esperando un cerrojo ocupado
+
+
+def propietario_actual():
+    """Identificador de quien pide un cerrojo: máquina, proceso e hilo"""
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def _fin_prefijo(prefijo):
+    """Menor cadena mayor que todas las que empiezan por prefijo (rango para el índice)"""
+    return prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
+
+
+class BackendEstado:
+    """Interfaz de los backends. Los valores son cadenas (JSON) y los TTL, segundos."""
+
+    def leer(self, clave):
+        raise NotImplementedError
+
+    def escribir(self, clave, valor, ttl):
+        raise NotImplementedError
+
+    def escribir_varios(self, entradas):
+        """entradas: [(clave, valor, ttl)], sin esperar a que se confirmen"""
+        for clave, valor, ttl in entradas:
+            self.escribir(clave, valor, ttl)
+
+    def borrar(self, clave):
+        raise NotImplementedError
+
+    def borrar_varios(self, claves):
+        for clave in claves:
+            self.borrar(clave)
+
+    def escanear(self, prefijo):
+        """[(clave, valor, ttl_restante)] de las claves vigentes que empiezan por prefijo"""
+        raise NotImplementedError
+
+    def adquirir(self, nombre, propietario, ttl):
+        """Toma el cerrojo si está libre, caducado o ya es suyo; True si lo tiene"""
+        raise NotImplementedError
+
+    def renovar(self, nombre, propietario, ttl):
+        """Alarga el cerrojo; False si ya no es suyo"""
+        raise NotImplementedError
+
+    def liberar(self, nombre, propietario):
+        raise NotImplementedError
+
+    def limpiar_caducados(self):
+        raise NotImplementedError
+
+    # ===== AYUDAS COMUNES =====
+    def esperar_cerrojo(self, nombre, propietario, ttl=TTL_CERROJO, timeout=ESPERA_CERROJO):
+        """Intenta adquirir el cerrojo con espera exponencial hasta timeout; True si lo consigue"""
+        limite = time.monotonic() + timeout
+        espera = 0.005
+        while True:
+            if self.adquirir(nombre, propietario, ttl):
+                return True
+            if time.monotonic() >= limite:
+                return False
+            time.sleep(espera)
+            espera = min(espera * 2, 0.2)
+
+    @contextmanager
+    def cerrojo(self, nombre, ttl=TTL_CERROJO, timeout=ESPERA_CERROJO):
+        """
+        Bloque con el cerrojo tomado. Devuelve si se consiguió: si se agota la
+        espera el bloque se ejecuta igualmente y quien llama decide.
+        """
+        propietario = propietario_actual()
+        adquirido = self.esperar_cerrojo(nombre, propietario, ttl, timeout)
+        if not adquirido:
+            logger.warning(f"Cerrojo {nombre} ocupado tras {timeout:.0f} s")
+        try:
+            yield adquirido
+        finally:
+            if adquirido:
+                self.liberar(nombre, propietario)
+
+
+class BackendMemoria(BackendEstado):
+    """Backend en memoria del proceso (no se comparte entre procesos)"""
+
+    def __init__(self):
+        self._valores = {}    # {clave: (valor, caduca)}
+        self._cerrojos = {}   # {nombre: (propietario, caduca)}
+        self._lock = threading.Lock()
+
+    def leer(self, clave):
+        with self._lock:
+            valor, caduca = self._valores.get(clave, (None, 0.0))
+            return valor if caduca > time.time() else None
+
+    def escribir(self, clave, valor, ttl):
+        with self._lock:
+            self._valores[clave] = (valor, time.time() + ttl)
+
+    def borrar(self, clave):
+        with self._lock:
+            self._valores.pop(clave, None)
+
+    def escanear(self, prefijo):
+        ahora = time.time()
+        with self._lock:
+            return [(clave, valor, caduca - ahora) for clave, (valor, caduca) in self._valores.items()
+                    if clave.startswith(prefijo) and caduca > ahora]
+
+    def adquirir(self, nombre, propietario, ttl):
+        ahora = time.time()
+        with self._lock:
+            actual, caduca = self._cerrojos.get(nombre, (None, 0.0))
+            if actual not in (None, propietario) and caduca > ahora:
+                return False
+            self._cerrojos[nombre] = (propietario, ahora + ttl)
+            return True
+
+    def renovar(self, nombre, propietario, ttl):
+        with self._lock:
+            actual, _ = self._cerrojos.get(nombre, (None, 0.0))
+            if actual != propietario:
+                return False
+            self._cerrojos[nombre] = (propietario, time.time() + ttl)
+            return True
+
+    def liberar(self, nombre, propietario):
+        with self._lock:
+            if self._cerrojos.get(nombre, (None,))[0] == propietario:
+                del self._cerrojos[nombre]
+
+    def limpiar_caducados(self):
+        ahora = time.time()
+        with self._lock:
+            for tabla in (self._valores, self._cerrojos):
+                for clave in [c for c, (_, caduca) in tabla.items() if caduca <= ahora]:
+                    del tabla[clave]
+
+
+class BackendSQLite(BackendEstado):
+    """
+    Backend sobre las tablas Estado_compartido y Cerrojos. Las escrituras van
+    por el escritor único del proceso; entre procesos las serializa SQLite
+    (BEGIN IMMEDIATE + busy_timeout), así que adquirir un cerrojo es atómico.
+    """
+
+    def leer(self, clave):
+        from db.conexion import conexion
+        from db.consultas import ejecutar
+
+        with conexion() as conn:
+            fila = ejecutar(conn, "compartido.leer", (clave, time.time())).fetchone()
+        return fila[0] if fila else None
+
+    def escribir(self, clave, valor, ttl):
+        from db.consultas import ejecutar
+        from db.escritor import ejecutar_escritura
+
+        fila = (clave, valor, time.time() + ttl)
+        ejecutar_escritura(lambda conn, cursor: ejecutar(cursor, "compartido.escribir", fila))
+
+    def escribir_varios(self, entradas):
+        from db.consultas import ejecutar_muchos
+        from db.escritor import encolar_escritura
+
+        ahora = time.time()
+        filas = [(clave, valor, ahora + ttl) for clave, valor, ttl in entradas]
+        if filas:
+            encolar_escritura(lambda conn, cursor: ejecutar_muchos(cursor, "compartido.escribir", filas))
+
+    def borrar(self, clave):
+        from db.consultas import ejecutar
+        from db.escritor import ejecutar_escritura
+
+        ejecutar_escritura(lambda conn, cursor: ejecutar(cursor, "compartido.borrar", (clave,)))
+
+    def borrar_varios(self, claves):
+        from db.consultas import ejecutar_muchos
+        from db.escritor import encolar_escritura
+
+        filas = [(clave,) for clave in claves]
+        if filas:
+            encolar_escritura(lambda conn, cursor: ejecutar_muchos(cursor, "compartido.borrar", filas))
+
+    def escanear(self, prefijo):
+        from db.conexion import conexion
+        from db.consultas import ejecutar
+
+        ahora = time.time()
+        with conexion() as conn:
+            filas = ejecutar(conn, "compartido.escanear", (prefijo, _fin_prefijo(prefijo), ahora)).fetchall()
+        return [(clave, valor, caduca - ahora) for clave, valor, caduca in filas]
+
+    def _escribir_cerrojo(self, nombre_consulta, parametros):
+        from db.consultas import ejecutar
+        from db.escritor import ejecutar_escritura
+
+        return ejecutar_escritura(lambda conn, cursor: ejecutar(cursor, nombre_consulta, parametros).rowcount)
+
+    def adquirir(self, nombre, propietario, ttl):
+        ahora = time.time()
+        return self._escribir_cerrojo("cerrojos.adquirir", (nombre, propietario, ahora + ttl, ahora)) == 1
+
+    def renovar(self, nombre, propietario, ttl):
+        return self._escribir_cerrojo("cerrojos.renovar", (time.time() + ttl, nombre, propietario)) == 1
+
+    def liberar(self, nombre, propietario):
+        self._escribir_cerrojo("cerrojos.liberar", (nombre, propietario))
+
+    def limpiar_caducados(self):
+        from db.consultas import ejecutar
+        from db.escritor import encolar_escritura
+
+        ahora = time.time()
+
+        def _limpiar(conn, cursor):
+            ejecutar(cursor, "compartido.borrar_caducados", (ahora,))
+            ejecutar(cursor, "cerrojos.borrar_caducados", (ahora,))
+
+        encolar_escritura(_limpiar)
+
+
+class CerrojoLider:
+    """
+    Cerrojo de instancia única con latido: quien lo tiene lo renueva cada
+    ttl/3 y, si alguna vez no puede, llama a al_perder. Sustituye al socket
+    UDP en un puerto fijo, que solo funcionaba dentro de una misma máquina.
+    """
+
+    def __init__(self, nombre, backend=None, ttl=30.0, al_perder=None):
+        self.nombre = nombre
+        self.backend = backend or get_backend()
+        self.ttl = ttl
+        self.al_perder = al_perder
+        self.propietario = f"{socket.gethostname()}:{os.getpid()}:lider"
+        self._parar = threading.Event()
+        self._hilo = None
+
+    def adquirir(self, esperar=False):
+        """Toma el cerrojo; con esperar=True se queda en reserva hasta conseguirlo"""
+        while not self.backend.adquirir(self.nombre, self.propietario, self.ttl):
+            if not esperar:
+                return False
+            self._parar.wait(self.ttl / 2)
+        self._hilo = threading.Thread(target=self._latido, name=f"lider-{self.nombre}", daemon=True)
+        self._hilo.start()
+        return True
+
+    def _latido(self):
+        while not self._parar.wait(self.ttl / 3):
+            try:
+                vigente = self.backend.renovar(self.nombre, self.propietario, self.ttl)
+            except Exception as e:
+                logger.error(f"Error renovando el cerrojo {self.nombre}: {e}")
+                vigente = False
+            if not vigente:
+                logger.critical(f"Se ha perdido el cerrojo {self.nombre}")
+                if self.al_perder:
+                    self.al_perder()
+                return
+
+    def liberar(self):
+        self._parar.set()
+        try:
+            self.backend.liberar(self.nombre, self.propietario)
+        except Exception as e:
+            logger.error(f"Error liberando el cerrojo {self.nombre}: {e}")
+
+
+class CanalInvalidaciones:
+    """
+    Invalidaciones de cachés entre procesos. publicar() deja un mensaje en el
+    backend con TTL y recibir() devuelve los que han dejado los demás
+    procesos, mirando el backend como mucho cada `intervalo` segundos, así
+    que una caché de otro proceso queda desfasada como mucho ese tiempo.
+    """
+
+    def __init__(self, prefijo="inval:", intervalo=2.0, backend=None, ttl=TTL_INVALIDACION):
+        self.prefijo = prefijo
+        self.intervalo = intervalo
+        self.ttl = ttl
+        self._backend = backend
+        self.origen = f"{socket.gethostname()}:{os.getpid()}"
+        self._numero = itertools.count()
+        self._vistas = {}          # clave -> monotonic en que caduca en el backend
+        self._siguiente = 0.0      # monotonic de la próxima lectura del backend
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.publicadas = 0
+        self.recibidas = 0
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = get_backend()
+        return self._backend
+
+    def publicar(self, mensaje):
+        """Publica un mensaje (dict serializable a JSON) para los demás procesos"""
+        clave = f"{self.prefijo}{time.time():.6f}:{self.origen}:{next(self._numero)}"
+        try:
+            self.backend.escribir(clave, json.dumps(mensaje), self.ttl)
+            self.publicadas += 1
+        except Exception as e:
+            logger.error(f"No se pudo publicar la invalidación {mensaje}: {e}")
+
+    def recibir(self):
+        """Mensajes de otros procesos aún no vistos, en orden; [] si aún no toca mirar"""
+        ahora = time.monotonic()
+        if ahora < self._siguiente:
+            return []
+        with self._lock:
+            if ahora < self._siguiente:
+                return []
+            self._siguiente = ahora + self.intervalo
+            try:
+                entradas = sorted(self.backend.escanear(self.prefijo))
+            except Exception as e:
+                logger.error(f"No se pudieron leer las invalidaciones: {e}")
+                return []
+
+            mensajes = []
+            propias = f":{self.origen}:"
+            for clave, valor, ttl in entradas:
+                if clave in self._vistas:
+                    continue
+                self._vistas[clave] = ahora + ttl
+                if propias not in clave:
+                    mensajes.append(json.loads(valor))
+            # Olvidar las que ya han caducado en el backend: no volverán a aparecer
+            self._vistas = {clave: caduca for clave, caduca in self._vistas.items() if caduca > ahora}
+            self.recibidas += len(mensajes)
+            return mensajes
+
+
+# ===== BACKEND DEL PROCESO =====
+BACKENDS = {
+    "memoria": BackendMemoria,
+    "sqlite": BackendSQLite,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Backend configurado en ESTADOS_BACKEND (sqlite por defecto)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                try:
+                    from config import ESTADOS_BACKEND
+                except ImportError:
+                    ESTADOS_BACKEND = "sqlite"
+                _backend = BACKENDS[ESTADOS_BACKEND]()
+    return _backend
@@ -0,0 +1,343 @@
+"""
+Citas de tutoría: huecos reservables dentro del horario de cada profesor.
+
+Cada franja del horario (Franjas_horario) se parte en huecos de
+CITA_MINUTOS minutos contados desde su inicio; un hueco que no cabe entero
+al final de la franja no se ofrece. Una cita es una fila de Citas_tutoria
+y la restricción UNIQUE(Id_profesor, Fecha, Inicio) impide que un hueco se
+reserve dos veces.
+
+Todas las escrituras pasan por el escritor único (db/escritor.py), que
+ejecuta cada tarea dentro de una transacción BEGIN IMMEDIATE: comprobar que
+el hueco sigue libre e insertar la cita ocurren sin que otra reserva se
+cuele entre medias, aunque lleguen a la vez dos callbacks del mismo hueco o
+escriba otro proceso. La restricción UNIQUE queda como última red.
+
+Si un día no quedan huecos, el estudiante se apunta a la lista de espera de
+ese profesor y ese día. Al cancelarse una cita, en la misma transacción el
+hueco pasa al primero de la lista que pueda ocuparlo.
+
+Buscar huecos libres lee con una sola consulta las citas de los próximos
+días (por el índice de la restricción UNIQUE) y las recorre a la vez que
+los huecos del horario, ya ordenados.
+"""
+import os
+import sys
+import time
+import sqlite3
+import logging
+import threading
+from datetime import date, datetime, timedelta
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import CITA_MINUTOS, CITAS_DIAS, CITAS_POR_PROFESOR
+from db.conexion import conexion
+from db.consultas import ejecutar
+from db.escritor import ejecutar_escritura
+from db.queries import horarios_compilados
+
+logger = logging.getLogger(__name__)
+
+# Resultados de reservar() y apuntar_espera()
+RESERVADA = "reservada"
+OCUPADA = "ocupada"                  # Otro estudiante se ha adelantado
+SOLAPADA = "solapada"                # El estudiante ya tiene otra cita a esa hora
+LIMITE = "limite"                    # Ya tiene CITAS_POR_PROFESOR citas pendientes con ese profesor
+FUERA_DE_HORARIO = "fuera_de_horario"
+EN_ESPERA = "en_espera"
+
+
+def huecos_del_dia(horario, dia, duracion=CITA_MINUTOS):
+    """Huecos (inicio, fin) en que se parten las franjas de un día de un HorarioCompilado"""
+    huecos = []
+    for inicio, fin in horario.franjas(dia):
+        for hueco in range(inicio, fin - duracion + 1, duracion):
+            huecos.append((hueco, hueco + duracion))
+    return huecos
+
+
+def _minuto(momento):
+    return momento.hour * 60 + momento.minute
+
+
+class GestorCitas:
+    """Reservas de huecos, cancelaciones y lista de espera"""
+
+    def __init__(self, duracion=CITA_MINUTOS, dias=CITAS_DIAS, por_profesor=CITAS_POR_PROFESOR):
+        self.duracion = duracion
+        self.dias = dias
+        self.por_profesor = por_profesor
+        self._lock = threading.Lock()
+
+        # Métricas
+        self.reservas = 0
+        self.conflictos = 0      # Huecos que otro reservó antes
+        self.cancelaciones = 0
+        self.promociones = 0     # Huecos que pasaron a la lista de espera
+        self.en_espera = 0
+        self.busquedas = 0
+
+    def _contar(self, metrica):
+        with self._lock:
+            setattr(self, metrica, getattr(self, metrica) + 1)
+
+    # ===== HUECOS =====
+    def huecos(self, profesor_id, fecha):
+        """Huecos (inicio, fin) del horario de un profesor para una fecha, libres u ocupados"""
+        horario = horarios_compilados([profesor_id])[profesor_id]
+        return huecos_del_dia(horario, fecha.weekday(), self.duracion)
+
+    def huecos_reservables(self, profesor_id, fecha, momento):
+        """Huecos de la fecha que aún no han empezado y caen dentro de los días reservables"""
+        hoy = momento.date()
+        if fecha < hoy or fecha >= hoy + timedelta(days=self.dias):
+            return []
+        huecos = self.huecos(profesor_id, fecha)
+        if fecha == hoy:
+            huecos = [(inicio, fin) for inicio, fin in huecos if inicio >= _minuto(momento)]
+        return huecos
+
+    def huecos_libres(self, profesor_id, momento=None, dias=None, limite=None):
+        """
+        Huecos libres de un profesor desde `momento` (por defecto, ahora)
+
+        Args:
+            profesor_id: ID del profesor
+            momento: datetime desde el que buscar; los huecos ya empezados no cuentan
+            dias: Días por delante (por defecto, CITAS_DIAS)
+            limite: Número máximo de huecos a devolver
+
+        Returns:
+            list: Tuplas (fecha, inicio, fin) ordenadas, con fecha como date
+        """
+        if momento is None:
+            momento = datetime.now()
+        dias = self.dias if dias is None else dias
+        self._contar("busquedas")
+        horario = horarios_compilados([profesor_id])[profesor_id]
+        if not horario:
+            return []
+
+        hoy = momento.date()
+        with conexion() as conn:
+            filas = ejecutar(conn, "citas.ocupadas", (profesor_id, hoy.isoformat(),
+                                                      (hoy + timedelta(days=dias - 1)).isoformat())).fetchall()
+        ocupadas = {}
+        for fecha, inicio, fin in filas:
+            ocupadas.setdefault(fecha, []).append((inicio, fin))
+
+        libres = []
+        for adelante in range(dias):
+            fecha = hoy + timedelta(days=adelante)
+            citas = ocupadas.get(fecha.isoformat(), ())
+            i = 0
+            for inicio, fin in huecos_del_dia(horario, fecha.weekday(), self.duracion):
+                if adelante == 0 and inicio < _minuto(momento):
+                    continue
+                # Las citas de un día no se solapan: ordenadas por inicio, también lo están por fin
+                while i < len(citas) and citas[i][1] <= inicio:
+                    i += 1
+                if i < len(citas) and citas[i][0] < fin:
+                    continue
+                libres.append((fecha, inicio, fin))
+                if limite and len(libres) >= limite:
+                    return libres
+        return libres
+
+    def proximo_hueco(self, profesor_id, momento=None):
+        """Primer hueco libre (fecha, inicio, fin) de un profesor, o None"""
+        libres = self.huecos_libres(profesor_id, momento, limite=1)
+        return libres[0] if libres else None
+
+    # ===== RESERVAS =====
+    def _pendientes(self, cursor, profesor_id, estudiante_id, momento):
+        """Citas del estudiante con el profesor que aún no han terminado"""
+        hoy = momento.date().isoformat()
+        return ejecutar(cursor, "citas.contar_pendientes",
+                        (estudiante_id, profesor_id, hoy, hoy, _minuto(momento))).fetchone()[0]
+
+    def _insertar_cita(self, cursor, profesor_id, estudiante_id, fecha, inicio, fin, sala_id, momento):
+        """Comprueba e inserta una cita; se llama dentro de una tarea del escritor"""
+        dia = fecha.isoformat()
+        if ejecutar(cursor, "citas.solapa_profesor", (profesor_id, dia, fin, inicio)).fetchone():
+            return OCUPADA, None
+        if ejecutar(cursor, "citas.solapa_estudiante", (estudiante_id, dia, fin, inicio)).fetchone():
+            return SOLAPADA, None
+        pendientes = self._pendientes(cursor, profesor_id, estudiante_id, momento)
+        if pendientes >= self.por_profesor:
+            return LIMITE, None
+        try:
+            ejecutar(cursor, "citas.insertar",
+                     (profesor_id, dia, inicio, fin, estudiante_id, sala_id, time.time()))
+        except sqlite3.IntegrityError:
+            # Solo si alguien escribe en Citas_tutoria sin pasar por el escritor
+            return OCUPADA, None
+        id_cita = cursor.lastrowid
+        if pendientes + 1 >= self.por_profesor:
+            # En el límite: deja de esperar en todas las listas de ese profesor
+            ejecutar(cursor, "espera.quitar_estudiante_profesor", (estudiante_id, profesor_id))
+        else:
+            ejecutar(cursor, "espera.quitar_estudiante", (profesor_id, dia, estudiante_id))
+        return RESERVADA, id_cita
+
+    def reservar(self, profesor_id, estudiante_id, fecha, inicio, sala_id=None, momento=None):
+        """
+        Reserva el hueco del profesor que empieza a `inicio` minutos el día `fecha`
+
+        Returns:
+            tuple: (estado, Id_cita o None), con estado RESERVADA, OCUPADA,
+            SOLAPADA, LIMITE o FUERA_DE_HORARIO
+        """
+        if momento is None:
+            momento = datetime.now()
+        hueco = next((h for h in self.huecos_reservables(profesor_id, fecha, momento) if h[0] == inicio), None)
+        if hueco is None:
+            return FUERA_DE_HORARIO, None
+
+        def _reservar(conn, cursor):
+            return self._insertar_cita(cursor, profesor_id, estudiante_id, fecha, inicio, hueco[1],
+                                       sala_id, momento)
+
+        estado, id_cita = ejecutar_escritura(_reservar)
+        if estado == RESERVADA:
+            self._contar("reservas")
+            logger.info(f"Cita {id_cita}: estudiante {estudiante_id} con profesor {profesor_id} "
+                        f"el {fecha} a las {inicio // 60:02d}:{inicio % 60:02d}")
+        elif estado == OCUPADA:
+            self._contar("conflictos")
+        return estado, id_cita
+
+    def cancelar(self, id_cita, usuario_id, momento=None):
+        """
+        Anula una cita (puede hacerlo su estudiante o su profesor) y, si el hueco
+        aún no ha empezado, se lo da al primero de la lista de espera que pueda ocuparlo
+
+        Returns:
+            dict: {"cita": datos de la cita anulada, "promovida": {"Id_cita", "Id_estudiante",
+            "Id_sala"} o None}, o None si la cita no existe o no es del usuario
+        """
+        if momento is None:
+            momento = datetime.now()
+        with conexion() as conn:
+            cita = ejecutar(conn, "citas.por_id", (id_cita,)).fetchone()
+        if cita is None or usuario_id not in (cita["Id_estudiante"], cita["Id_profesor"]):
+            return None
+        cita = dict(cita)
+        fecha = date.fromisoformat(cita["Fecha"])
+        # Solo se promueve si el hueco sigue siendo del horario (el profesor pudo cambiarlo)
+        hueco = (cita["Inicio"], cita["Fin"])
+        promover = hueco in self.huecos_reservables(cita["Id_profesor"], fecha, momento)
+
+        def _cancelar(conn, cursor):
+            ejecutar(cursor, "citas.borrar", (id_cita,))
+            if cursor.rowcount == 0:
+                return None   # Ya la anuló otro
+            if not promover:
+                return {"cita": cita, "promovida": None}
+            for espera in ejecutar(cursor, "espera.cola", (cita["Id_profesor"], cita["Fecha"])).fetchall():
+                estado, id_nueva = self._insertar_cita(cursor, cita["Id_profesor"], espera["Id_estudiante"],
+                                                       fecha, hueco[0], hueco[1], espera["Id_sala"], momento)
+                if estado == RESERVADA:
+                    return {"cita": cita, "promovida": {"Id_cita": id_nueva,
+                                                        "Id_estudiante": espera["Id_estudiante"],
+                                                        "Id_sala": espera["Id_sala"]}}
+                # Con otra cita a esa hora o en el límite: sigue en la lista para otro hueco
+            return {"cita": cita, "promovida": None}
+
+        resultado = ejecutar_escritura(_cancelar)
+        if resultado is not None:
+            self._contar("cancelaciones")
+            if resultado["promovida"]:
+                self._contar("promociones")
+                logger.info(f"Cita {id_cita} anulada; hueco para el estudiante "
+                            f"{resultado['promovida']['Id_estudiante']} de la lista de espera")
+        return resultado
+
+    # ===== LISTA DE ESPERA =====
+    def apuntar_espera(self, profesor_id, estudiante_id, fecha, sala_id=None, momento=None):
+        """
+        Apunta al estudiante a la lista de espera del profesor para `fecha`. Si
+        para entonces ha quedado un hueco libre ese día, se le reserva directamente
+
+        Returns:
+            tuple: (RESERVADA, Id_cita), (EN_ESPERA, posición en la lista) o
+            (LIMITE | FUERA_DE_HORARIO, None)
+        """
+        if momento is None:
+            momento = datetime.now()
+        huecos = self.huecos_reservables(profesor_id, fecha, momento)
+        if not huecos:
+            return FUERA_DE_HORARIO, None
+        dia = fecha.isoformat()
+
+        def _apuntar(conn, cursor):
+            if self._pendientes(cursor, profesor_id, estudiante_id, momento) >= self.por_profesor:
+                return LIMITE, None
+            for inicio, fin in huecos:
+                estado, id_cita = self._insertar_cita(cursor, profesor_id, estudiante_id, fecha,
+                                                      inicio, fin, sala_id, momento)
+                if estado == RESERVADA:
+                    return estado, id_cita
+            ejecutar(cursor, "espera.purgar", (momento.date().isoformat(),))
+            ejecutar(cursor, "espera.insertar", (profesor_id, dia, estudiante_id, sala_id, time.time()))
+            cola = [fila["Id_estudiante"] for fila in ejecutar(cursor, "espera.cola", (profesor_id, dia))]
+            return EN_ESPERA, cola.index(estudiante_id) + 1
+
+        estado, dato = ejecutar_escritura(_apuntar)
+        if estado == RESERVADA:
+            self._contar("reservas")
+        elif estado == EN_ESPERA:
+            self._contar("en_espera")
+        return estado, dato
+
+    def salir_espera(self, id_espera, estudiante_id):
+        """Quita al estudiante de una lista de espera; True si estaba"""
+        def _salir(conn, cursor):
+            ejecutar(cursor, "espera.borrar_de_estudiante", (id_espera, estudiante_id))
+            return cursor.rowcount > 0
+        return ejecutar_escritura(_salir)
+
+    # ===== CONSULTAS =====
+    def citas_pendientes(self, usuario_id, es_profesor=False, momento=None):
+        """Citas que aún no han terminado, con el nombre y TelegramID de la otra persona"""
+        if momento is None:
+            momento = datetime.now()
+        hoy = momento.date().isoformat()
+        nombre = "citas.pendientes_profesor" if es_profesor else "citas.pendientes_estudiante"
+        with conexion() as conn:
+            return [dict(fila) for fila in ejecutar(conn, nombre, (usuario_id, hoy, hoy, _minuto(momento)))]
+
+    def esperas_estudiante(self, estudiante_id, momento=None):
+        """Listas de espera en las que está el estudiante (de hoy en adelante)"""
+        if momento is None:
+            momento = datetime.now()
+        with conexion() as conn:
+            return [dict(fila) for fila in ejecutar(conn, "espera.de_estudiante",
+                                                    (estudiante_id, momento.date().isoformat()))]
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "reservas": self.reservas,
+                "conflictos": self.conflictos,
+                "cancelaciones": self.cancelaciones,
+                "promociones": self.promociones,
+                "en_espera": self.en_espera,
+                "busquedas": self.busquedas,
+            }
+
+
+_gestor = None
+_gestor_lock = threading.Lock()
+
+
+def get_gestor_citas():
+    """Devuelve el gestor de citas del proceso, creándolo la primera vez"""
+    global _gestor
+    if _gestor is None:
+        with _gestor_lock:
+            if _gestor is None:
+                _gestor = GestorCitas()
+    return _gestor
@@ -0,0 +1,226 @@
+"""
+Bandeja de salida de correo.
+
+Los handlers no hablan con el servidor SMTP: construyen el mensaje y lo
+encolan aquí, que devuelve un Future al instante. Un pequeño grupo de hilos
+envía la cola, cada uno con su propia conexión SMTP ya autenticada
+(STARTTLS + login una sola vez) que se reutiliza entre mensajes y se
+cierra tras un rato sin actividad. Los errores temporales se reintentan
+con espera exponencial; los permanentes (códigos 5xx, destinatario
+rechazado, credenciales) fallan sin reintentar.
+"""
+import os
+import sys
+import time
+import queue
+import random
+import smtplib
+import threading
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import (SMTP_SERVER, SMTP_EMAIL, SMTP_PASSWORD, SMTP_PUERTO, SMTP_HILOS,
+                    SMTP_REINTENTOS)
+from db.consultas import percentil
+
+logger = logging.getLogger(__name__)
+
+ESPERA_BASE = 2.0      # Segundos antes del primer reintento (se duplica en cada uno)
+INACTIVIDAD = 60.0     # Segundos sin correos tras los que se cierra la conexión
+TIMEOUT_SMTP = 20.0    # Timeout de socket de cada conexión
+
+
+def _es_permanente(error):
+    """Errores que no se arreglan reintentando"""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return True
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        # Un 4xx en RCPT (greylisting) se arregla esperando; un 5xx no
+        return any(codigo >= 500 for codigo, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return False
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class BandejaSalida:
+    """Cola de correos con hilos de envío y conexiones SMTP persistentes"""
+
+    def __init__(self, servidor=SMTP_SERVER, puerto=SMTP_PUERTO, usuario=SMTP_EMAIL,
+                 password=SMTP_PASSWORD, hilos=SMTP_HILOS, max_intentos=SMTP_REINTENTOS,
+                 usar_tls=True, espera_base=ESPERA_BASE, inactividad=INACTIVIDAD):
+        self.servidor = servidor
+        self.puerto = puerto
+        self.usuario = usuario
+        self.password = password
+        self.num_hilos = hilos
+        self.max_intentos = max_intentos
+        self.usar_tls = usar_tls
+        self.espera_base = espera_base
+        self.inactividad = inactividad
+        self._cola = queue.Queue()
+        self._hilos = []
+        self._lock = threading.Lock()
+        self._parar = object()
+        self._cerrando = threading.Event()
+
+        # Métricas
+        self.encolados = 0
+        self.enviados = 0
+        self.fallidos = 0
+        self.reintentos = 0
+        self.conexiones = 0
+        self._latencias = deque(maxlen=1024)  # ms desde que se encola hasta que se entrega
+
+    def iniciar(self):
+        """Arranca los hilos de envío si no están corriendo"""
+        with self._lock:
+            self._hilos = [h for h in self._hilos if h.is_alive()]
+            self._cerrando.clear()
+            for i in range(len(self._hilos), self.num_hilos):
+                hilo = threading.Thread(target=self._bucle, name=f"correo-{i}", daemon=True)
+                hilo.start()
+                self._hilos.append(hilo)
+
+    def detener(self, timeout=10):
+        """Envía lo pendiente (sin esperar reintentos largos) y detiene los hilos"""
+        with self._lock:
+            hilos = [h for h in self._hilos if h.is_alive()]
+            self._cerrando.set()
+            for _ in hilos:
+                self._cola.put(self._parar)
+        for hilo in hilos:
+            hilo.join(timeout)
+
+    def encolar(self, mensaje):
+        """
+        Encola un correo sin esperar a que se envíe
+
+        Args:
+            mensaje: email.message.EmailMessage con From/To ya rellenos
+
+        Returns:
+            Future: Se resuelve con True al entregarlo o con la última excepción
+        """
+        futuro = Future()
+        self.iniciar()
+        self.encolados += 1
+        self._cola.put((mensaje, futuro, time.monotonic()))
+        return futuro
+
+    # ===== HILOS DE ENVÍO =====
+    def _conectar(self):
+        conexion = smtplib.SMTP(str(self.servidor), self.puerto, timeout=TIMEOUT_SMTP)
+        try:
+            conexion.ehlo()
+            if self.usar_tls:
+                conexion.starttls()
+                conexion.ehlo()
+            if self.usuario and self.password:
+                conexion.login(str(self.usuario), str(self.password))
+        except BaseException:
+            self._cerrar(conexion)
+            raise
+        self.conexiones += 1
+        return conexion
+
+    @staticmethod
+    def _cerrar(conexion):
+        """Cierra una conexión ignorando errores; devuelve None para reasignar"""
+        if conexion is not None:
+            try:
+                conexion.quit()
+            except (smtplib.SMTPException, OSError):
+                conexion.close()
+        return None
+
+    def _enviar(self, conexion, mensaje):
+        """
+        Envía un mensaje con reintentos. Devuelve (conexion, error); error es
+        None si se entregó.
+        """
+        intento = 1
+        while True:
+            reutilizada = conexion is not None
+            try:
+                if conexion is None:
+                    conexion = self._conectar()
+                conexion.send_message(mensaje)
+                return conexion, None
+            except (smtplib.SMTPException, OSError) as e:
+                conexion = self._cerrar(conexion)
+                if reutilizada and isinstance(e, smtplib.SMTPServerDisconnected):
+                    # El servidor cerró la conexión inactiva: reconectar sin gastar intento
+                    continue
+                if _es_permanente(e) or intento >= self.max_intentos or self._cerrando.is_set():
+                    return conexion, e
+
+                espera = self.espera_base * 2 ** (intento - 1) * random.uniform(0.8, 1.2)
+                logger.warning(f"Error enviando correo a {mensaje['To']} (intento {intento}): {e}. "
+                               f"Reintento en {espera:.1f} s")
+                self.reintentos += 1
+                intento += 1
+                if self._cerrando.wait(espera):
+                    return conexion, e
+
+    def _bucle(self):
+        conexion = None
+        while True:
+            try:
+                tarea = self._cola.get(timeout=self.inactividad)
+            except queue.Empty:
+                conexion = self._cerrar(conexion)
+                continue
+            if tarea is self._parar:
+                break
+
+            mensaje, futuro, encolado = tarea
+            conexion, error = self._enviar(conexion, mensaje)
+            if error is None:
+                self.enviados += 1
+                self._latencias.append((time.monotonic() - encolado) * 1000)
+                futuro.set_result(True)
+            else:
+                self.fallidos += 1
+                logger.error(f"Correo a {mensaje['To']} descartado: {error}")
+                futuro.set_exception(error)
+
+        self._cerrar(conexion)
+
+    def estadisticas(self):
+        latencias = sorted(self._latencias)
+        return {
+            "pendientes": self._cola.qsize(),
+            "hilos": sum(1 for h in self._hilos if h.is_alive()),
+            "encolados": self.encolados,
+            "enviados": self.enviados,
+            "fallidos": self.fallidos,
+            "reintentos": self.reintentos,
+            "conexiones": self.conexiones,
+            "latencia_p50_ms": percentil(latencias, 0.50),
+            "latencia_p95_ms": percentil(latencias, 0.95),
+        }
+
+
+# ===== BANDEJA COMPARTIDA =====
+_bandeja = None
+_bandeja_lock = threading.Lock()
+
+
+def get_bandeja():
+    """Devuelve la bandeja de salida del proceso, arrancándola la primera vez"""
+    global _bandeja
+    if _bandeja is None:
+        with _bandeja_lock:
+            if _bandeja is None:
+                _bandeja = BandejaSalida()
+                _bandeja.iniciar()
+    return _bandeja
+
+
+def encolar_correo(mensaje):
+    """Encola un correo en la bandeja compartida (devuelve un Future)"""
+    return get_bandeja().encolar(mensaje)
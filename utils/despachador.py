@@ -0,0 +1,282 @@
+"""
+Despachador de updates de Telegram.
+
+Reparte los updates entre un número fijo de fragmentos (cola + hilo) según
+su chat: todos los updates de un chat caen en el mismo fragmento y se
+procesan en orden, así que dos pulsaciones seguidas del mismo botón ya no
+corren a la vez sobre las mismas filas, mientras que los chats de
+fragmentos distintos avanzan en paralelo. Un handler lento solo retrasa a
+los chats de su fragmento.
+
+Las colas tienen capacidad limitada. En modo webhook, cuando se llenan,
+encolar() espera un poco y después rechaza el update para que Telegram lo
+reenvíe más tarde. En polling, TeleBot calcula el offset del siguiente
+getUpdates con last_update_id, que su process_new_updates solo avanza al
+procesar; aquí se avanza al encolar, para que ningún update se pida ni se
+encole dos veces, y encolar() espera lo que haga falta, así que el polling
+se frena solo.
+
+Cada fragmento mide su espera en cola y su tiempo de proceso por separado,
+y cuánto lleva el handler en curso, para localizar handlers lentos.
+"""
+import os
+import sys
+import time
+import queue
+import logging
+import threading
+from collections import deque
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.consultas import percentil
+
+logger = logging.getLogger(__name__)
+
+HILOS = 8            # Colas (y hilos) del despachador
+CAPACIDAD = 1000     # Updates en espera como máximo, repartidos entre las colas
+ESPERA_COLA = 2.0    # Segundos que encolar() espera a que haya sitio antes de rechazar
+
+# Tipos de update que llevan el chat en update[tipo]["chat"]
+_CON_CHAT = ("message", "edited_message", "channel_post", "edited_channel_post",
+             "chat_member", "my_chat_member", "chat_join_request")
+
+
+def chat_del_update(update):
+    """
+    Chat al que pertenece un update (dict JSON o telebot.types.Update), o
+    None si no tiene. Los callbacks van al chat del mensaje con el botón,
+    igual que los mensajes.
+    """
+    if not isinstance(update, dict):
+        return _chat_del_objeto(update)
+    for tipo in _CON_CHAT:
+        if tipo in update:
+            return update[tipo].get("chat", {}).get("id")
+    callback = update.get("callback_query")
+    if callback is not None:
+        mensaje = callback.get("message") or {}
+        return mensaje.get("chat", {}).get("id") or callback.get("from", {}).get("id")
+    for contenido in update.values():
+        if isinstance(contenido, dict) and "from" in contenido:
+            return contenido["from"].get("id")
+    return None
+
+
+def _chat_del_objeto(update):
+    for tipo in _CON_CHAT:
+        contenido = getattr(update, tipo, None)
+        if contenido is not None:
+            return contenido.chat.id
+    callback = getattr(update, "callback_query", None)
+    if callback is not None:
+        return callback.message.chat.id if callback.message is not None else callback.from_user.id
+    for tipo in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query"):
+        contenido = getattr(update, tipo, None)
+        if contenido is not None:
+            return contenido.from_user.id
+    return None
+
+
+class _Fragmento:
+    """Cola de un grupo de chats con su hilo y sus métricas"""
+
+    def __init__(self, indice, capacidad):
+        self.indice = indice
+        self.cola = queue.Queue(maxsize=capacidad)
+        self.hilo = None
+        self.procesados = 0
+        self.en_curso_desde = None                # monotonic del inicio del handler en curso
+        self.esperas = deque(maxlen=512)          # ms en cola
+        self.procesos = deque(maxlen=512)         # ms de handler
+
+    def estadisticas(self):
+        esperas = sorted(self.esperas)
+        procesos = sorted(self.procesos)
+        en_curso = self.en_curso_desde
+        return {
+            "fragmento": self.indice,
+            "en_cola": self.cola.qsize(),
+            "procesados": self.procesados,
+            "espera_p50_ms": percentil(esperas, 0.50),
+            "espera_p95_ms": percentil(esperas, 0.95),
+            "proceso_p50_ms": percentil(procesos, 0.50),
+            "proceso_p95_ms": percentil(procesos, 0.95),
+            "proceso_max_ms": procesos[-1] if procesos else 0.0,
+            "en_curso_ms": (time.monotonic() - en_curso) * 1000 if en_curso is not None else 0.0,
+        }
+
+
+class DespachadorUpdates:
+    """Pool de hilos acotado con orden por chat"""
+
+    def __init__(self, procesar, hilos=HILOS, capacidad=CAPACIDAD, espera=ESPERA_COLA):
+        """
+        Args:
+            procesar: Función que recibe un update y lo atiende
+            hilos: Número de colas, cada una con su hilo
+            capacidad: Updates en espera como máximo entre todas las colas
+            espera: Segundos que se espera por sitio antes de rechazar (None: sin límite)
+        """
+        self.procesar = procesar
+        self.num_hilos = hilos
+        self.espera = espera
+        self._fragmentos = [_Fragmento(i, max(1, capacidad // hilos)) for i in range(hilos)]
+        self._lock = threading.Lock()
+        self._parar = object()
+        self._aceptando = False
+
+        # Métricas
+        self.recibidos = 0
+        self.procesados = 0
+        self.rechazados = 0
+        self.errores = 0
+        self.profundidad_max = 0
+        self._latencias = deque(maxlen=1024)  # ms desde que se encola hasta que termina
+
+    def iniciar(self):
+        with self._lock:
+            if self._aceptando:
+                return
+            for fragmento in self._fragmentos:
+                fragmento.hilo = threading.Thread(target=self._bucle, args=(fragmento,),
+                                                  name=f"despachador-{fragmento.indice}", daemon=True)
+                fragmento.hilo.start()
+            self._aceptando = True
+        registrar_despachador(self)
+
+    def _fragmento_de(self, clave):
+        return self._fragmentos[hash(clave) % self.num_hilos]
+
+    def encolar(self, update, clave):
+        """
+        Encola un update en la cola de su chat (clave)
+
+        Returns:
+            bool: False si el despachador está parado o la cola sigue llena tras la espera
+        """
+        if not self._aceptando:
+            self.rechazados += 1
+            return False
+        cola = self._fragmento_de(clave).cola
+        try:
+            cola.put((update, time.monotonic()), timeout=self.espera)
+        except queue.Full:
+            self.rechazados += 1
+            logger.warning(f"Cola del despachador llena: update de {clave} rechazado")
+            return False
+        self.recibidos += 1
+        profundidad = cola.qsize()
+        if profundidad > self.profundidad_max:
+            self.profundidad_max = profundidad
+        return True
+
+    def _bucle(self, fragmento):
+        while True:
+            tarea = fragmento.cola.get()
+            if tarea is self._parar:
+                break
+            update, encolado = tarea
+            inicio = fragmento.en_curso_desde = time.monotonic()
+            try:
+                self.procesar(update)
+                self.procesados += 1
+            except Exception as e:
+                self.errores += 1
+                logger.error(f"Error procesando update: {e}", exc_info=True)
+            fin = time.monotonic()
+            fragmento.en_curso_desde = None
+            fragmento.procesados += 1
+            fragmento.esperas.append((inicio - encolado) * 1000)
+            fragmento.procesos.append((fin - inicio) * 1000)
+            self._latencias.append((fin - encolado) * 1000)
+
+    def detener(self, timeout=30):
+        """
+        Deja de aceptar updates, termina los que ya estaban encolados y para
+        los hilos. Devuelve cuántos quedaron sin procesar si se agota timeout.
+        """
+        with self._lock:
+            self._aceptando = False
+        # Cada marca de parada va detrás de lo pendiente en su cola
+        for fragmento in self._fragmentos:
+            fragmento.cola.put(self._parar)
+        limite = time.monotonic() + timeout
+        for fragmento in self._fragmentos:
+            if fragmento.hilo is not None:
+                fragmento.hilo.join(max(0.0, limite - time.monotonic()))
+        return sum(f.cola.qsize() for f in self._fragmentos)
+
+    def estadisticas(self, por_fragmento=False):
+        latencias = sorted(self._latencias)
+        fragmentos = [f.estadisticas() for f in self._fragmentos]
+        estadisticas = {
+            "hilos": sum(1 for f in self._fragmentos if f.hilo is not None and f.hilo.is_alive()),
+            "en_cola": sum(f["en_cola"] for f in fragmentos),
+            "profundidad_por_cola": [f["en_cola"] for f in fragmentos],
+            "profundidad_max": self.profundidad_max,
+            "capacidad": sum(f.cola.maxsize for f in self._fragmentos),
+            "recibidos": self.recibidos,
+            "procesados": self.procesados,
+            "rechazados": self.rechazados,
+            "errores": self.errores,
+            "latencia_p50_ms": percentil(latencias, 0.50),
+            "latencia_p95_ms": percentil(latencias, 0.95),
+            # Fragmento con el handler en curso más largo: el que está frenando a sus chats
+            "fragmento_mas_lento": max(fragmentos, key=lambda f: f["en_curso_ms"])["fragmento"],
+            "en_curso_max_ms": max(f["en_curso_ms"] for f in fragmentos),
+        }
+        if por_fragmento:
+            estadisticas["fragmentos"] = fragmentos
+        return estadisticas
+
+
+# ===== INTEGRACIÓN CON TELEBOT =====
+_activo = None
+
+
+def instalar_despachador(bot, hilos=HILOS, capacidad=CAPACIDAD):
+    """
+    Sustituye el pool de hilos de telebot (que ejecuta a la vez handlers del
+    mismo chat) por un DespachadorUpdates. Sirve para polling: el bot sigue
+    llamando a process_new_updates con cada lote y aquí se reparte por chat.
+    En polling no se rechaza nada: si las colas se llenan, se espera.
+
+    Returns:
+        DespachadorUpdates: El despachador ya iniciado
+    """
+    propio = getattr(bot, "despachador", None)
+    if propio is not None:
+        # El bot asíncrono ya reparte por chat en su bucle de eventos (utils/asincrono.py)
+        propio.iniciar()
+        return propio
+    procesar_lote = bot.process_new_updates
+    bot.threaded = False
+    despachador = DespachadorUpdates(lambda update: procesar_lote([update]), hilos=hilos,
+                                     capacidad=capacidad, espera=None)
+    despachador.iniciar()
+
+    def process_new_updates(updates):
+        for update in updates:
+            # Confirmar ya el update: si no, el siguiente getUpdates lo vuelve a traer
+            # mientras espera en la cola y sus handlers se ejecutan dos veces
+            if update.update_id > bot.last_update_id:
+                bot.last_update_id = update.update_id
+            clave = chat_del_update(update)
+            if not despachador.encolar(update, update.update_id if clave is None else clave):
+                logger.error(f"Update {update.update_id} descartado: despachador detenido")
+
+    bot.process_new_updates = process_new_updates
+    return despachador
+
+
+def registrar_despachador(despachador):
+    """Marca el despachador cuyas métricas devuelve estadisticas_despachador()"""
+    global _activo
+    _activo = despachador
+
+
+def estadisticas_despachador(por_fragmento=False):
+    """Métricas del último despachador iniciado en el proceso, o None"""
+    return _activo.estadisticas(por_fragmento) if _activo is not None else None
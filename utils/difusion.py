@@ -0,0 +1,243 @@
+"""
+Trabajos de difusión: avisos a todos los miembros de una sala.
+
+Un handler no envía el aviso a cada estudiante: crea un trabajo (una fila
+en Trabajos_difusion con el texto y a quién va dirigido) y responde. Un
+hilo del bot lo procesa por páginas de destinatarios leídas de la base de
+datos desde el último Id_usuario entregado (Cursor), las pasa al carril
+MASIVO de la cola de salida y, cuando la página termina, guarda el avance
+y los contadores. Al acabar, quien lo pidió recibe un resumen con cuántos
+lo han recibido.
+
+Si el bot se cae a mitad, el trabajo sigue 'en_curso' en la tabla y al
+arrancar se reanuda desde el cursor guardado: como mucho se repite la
+página que estaba saliendo. Un cerrojo por trabajo (utils/backend_estado)
+impide que dos procesos del bot envíen el mismo aviso a la vez.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from concurrent.futures import wait
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.conexion import conexion
+from db.consultas import ejecutar
+from db.escritor import ejecutar_escritura
+from utils.backend_estado import get_backend, propietario_actual
+from utils.mensajeria import get_cola_mensajes, INTERACTIVO, MASIVO
+
+logger = logging.getLogger(__name__)
+
+PAGINA = 100          # Destinatarios leídos y encolados de cada vez
+TTL_TRABAJO = 60.0    # Segundos del cerrojo de un trabajo (se renueva mientras avanza)
+REVISION = 60.0       # Segundos entre búsquedas de trabajos abandonados por otro proceso
+
+# Tipo de trabajo -> (consulta de destinatarios por páginas, consulta que los cuenta).
+# La primera recibe (Filtro, Cursor, PAGINA) y devuelve (Id_usuario, TelegramID).
+TIPOS = {
+    "cambio_sala": ("difusion.estudiantes_sala", "difusion.contar_estudiantes_sala"),
+}
+
+
+class MotorDifusion:
+    """Procesa en segundo plano los trabajos de difusión de un bot"""
+
+    def __init__(self, bot, pagina=PAGINA, ttl=TTL_TRABAJO, revision=REVISION):
+        self.bot = bot
+        self.pagina = pagina
+        self.ttl = ttl
+        self.revision = revision
+        self._despertar = threading.Event()
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._parar = False
+
+        # Métricas
+        self.creados = 0
+        self.completados = 0
+        self.reanudados = 0
+        self.enviados = 0
+        self.fallidos = 0
+        self.en_curso = None   # Id del trabajo que se está enviando
+
+    def iniciar(self):
+        """Arranca el hilo (si no lo estaba) y le avisa de que revise los trabajos pendientes"""
+        with self._lock:
+            if self._hilo is None or not self._hilo.is_alive():
+                self._parar = False
+                self._hilo = threading.Thread(target=self._bucle, name="difusion", daemon=True)
+                self._hilo.start()
+        self._despertar.set()
+
+    def detener(self, timeout=30):
+        """Para tras la página en curso; lo que falte se reanuda en el próximo arranque"""
+        self._parar = True
+        self._despertar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout)
+
+    def crear(self, tipo, filtro, texto, solicitante=None, descripcion=None, parse_mode=None):
+        """
+        Registra un trabajo y despierta al hilo que lo envía. Solo cuesta una
+        escritura en la base de datos, así que se puede llamar desde un handler.
+
+        Args:
+            tipo: Clave de TIPOS que indica a quién va dirigido
+            filtro: Argumento de la consulta de destinatarios (id_sala)
+            texto: Mensaje que recibe cada destinatario
+            solicitante: Chat al que enviar el resumen al terminar
+            descripcion: Qué se ha avisado, para el resumen
+            parse_mode: Formato del texto ("Markdown", "HTML" o None)
+
+        Returns:
+            int: Id_trabajo
+        """
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo de difusión desconocido: {tipo}")
+        ahora = time.time()
+        fila = (tipo, filtro, texto, parse_mode, descripcion, solicitante, ahora, ahora)
+        id_trabajo = ejecutar_escritura(
+            lambda conn, cursor: ejecutar(cursor, "difusion.crear", fila).lastrowid
+        )
+        self.creados += 1
+        self.iniciar()
+        return id_trabajo
+
+    # ===== HILO DE ENVÍO =====
+    def _bucle(self):
+        while not self._parar:
+            self._despertar.clear()
+            try:
+                with conexion() as conn:
+                    trabajos = ejecutar(conn, "difusion.pendientes").fetchall()
+            except Exception as e:
+                logger.error(f"No se pudieron leer los trabajos de difusión: {e}")
+                trabajos = []
+            for trabajo in trabajos:
+                if self._parar:
+                    break
+                self._procesar(trabajo)
+            self._despertar.wait(self.revision)
+
+    def _procesar(self, trabajo):
+        (id_trabajo, tipo, filtro, texto, formato, descripcion, solicitante,
+         cursor, total, enviados, fallidos) = trabajo
+        backend = get_backend()
+        nombre = f"difusion:{id_trabajo}"
+        propietario = propietario_actual()
+        if not backend.adquirir(nombre, propietario, self.ttl):
+            return  # Lo está enviando otro proceso
+
+        self.en_curso = id_trabajo
+        try:
+            if tipo not in TIPOS:
+                logger.error(f"Trabajo de difusión {id_trabajo} con tipo desconocido '{tipo}': se descarta")
+                self._terminar(id_trabajo)
+                return
+            consulta, contar = TIPOS[tipo]
+
+            if total is None:
+                with conexion() as conn:
+                    total = ejecutar(conn, contar, (filtro,)).fetchone()[0]
+                ejecutar_escritura(lambda conn, c: ejecutar(c, "difusion.fijar_total",
+                                                            (total, time.time(), id_trabajo)))
+            else:
+                self.reanudados += 1
+                print(f"🔁 Reanudando difusión {id_trabajo}: {enviados + fallidos}/{total} procesados")
+
+            cola = get_cola_mensajes(self.bot)
+            while not self._parar:
+                with conexion() as conn:
+                    pagina = ejecutar(conn, consulta, (filtro, cursor, self.pagina)).fetchall()
+                if not pagina:
+                    break
+
+                futuros = {cola.enviar_mensaje(telegram_id, texto, prioridad=MASIVO, parse_mode=formato): id_usuario
+                           for id_usuario, telegram_id in pagina}
+                pendientes = set(futuros)
+                while pendientes:
+                    _, pendientes = wait(pendientes, timeout=self.ttl / 3)
+                    if not backend.renovar(nombre, propietario, self.ttl):
+                        logger.warning(f"Difusión {id_trabajo}: cerrojo perdido, se deja a otro proceso")
+                        return
+
+                correctos = errores = 0
+                for futuro, id_usuario in futuros.items():
+                    if futuro.exception() is None:
+                        correctos += 1
+                    else:
+                        errores += 1
+                        logger.warning(f"Difusión {id_trabajo}: no se pudo avisar al usuario "
+                                       f"{id_usuario}: {futuro.exception()}")
+
+                # El cursor avanza solo cuando toda la página ha salido
+                cursor = pagina[-1][0]
+                avance = (cursor, correctos, errores, time.time(), id_trabajo)
+                ejecutar_escritura(lambda conn, c: ejecutar(c, "difusion.avanzar", avance))
+                enviados += correctos
+                fallidos += errores
+                self.enviados += correctos
+                self.fallidos += errores
+
+            if self._parar:
+                return
+            self._terminar(id_trabajo)
+            print(f"📬 Difusión {id_trabajo} completada: {enviados}/{total} enviados, {fallidos} fallidos")
+            if solicitante:
+                self._resumir(solicitante, descripcion, total, enviados, fallidos)
+        except Exception as e:
+            logger.error(f"Error en el trabajo de difusión {id_trabajo}: {e}", exc_info=True)
+        finally:
+            self.en_curso = None
+            backend.liberar(nombre, propietario)
+
+    def _terminar(self, id_trabajo):
+        ejecutar_escritura(lambda conn, c: ejecutar(c, "difusion.terminar", (time.time(), id_trabajo)))
+        self.completados += 1
+
+    def _resumir(self, solicitante, descripcion, total, enviados, fallidos):
+        """Resumen para quien creó el trabajo (texto plano: la descripción lleva nombres de sala)"""
+        texto = "📬 Aviso enviado"
+        if descripcion:
+            texto += f": {descripcion}"
+        texto += f"\n\n✅ Lo han recibido {enviados} de {total} estudiantes."
+        if fallidos:
+            texto += f"\n⚠️ {fallidos} no lo han recibido (han bloqueado el bot o su cuenta ya no existe)."
+        get_cola_mensajes(self.bot).enviar_mensaje(solicitante, texto, prioridad=INTERACTIVO)
+
+    def estadisticas(self):
+        return {
+            "activo": self._hilo is not None and self._hilo.is_alive(),
+            "en_curso": self.en_curso,
+            "creados": self.creados,
+            "completados": self.completados,
+            "reanudados": self.reanudados,
+            "enviados": self.enviados,
+            "fallidos": self.fallidos,
+        }
+
+
+# ===== MOTORES COMPARTIDOS =====
+_motores = {}
+_motores_lock = threading.Lock()
+
+
+def get_motor_difusion(bot):
+    """Devuelve el motor de difusión de un bot, creándolo la primera vez (sin arrancarlo)"""
+    motor = _motores.get(id(bot))
+    if motor is None:
+        with _motores_lock:
+            motor = _motores.get(id(bot))
+            if motor is None:
+                motor = _motores[id(bot)] = MotorDifusion(bot)
+    return motor
+
+
+def crear_difusion(bot, tipo, filtro, texto, solicitante=None, descripcion=None, parse_mode=None):
+    """Registra un trabajo de difusión en el motor del bot (devuelve su Id_trabajo)"""
+    return get_motor_difusion(bot).crear(tipo, filtro, texto, solicitante=solicitante,
+                                         descripcion=descripcion, parse_mode=parse_mode)
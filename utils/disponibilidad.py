@@ -0,0 +1,235 @@
+"""
+Índice semanal de disponibilidad de todos los profesores.
+
+Para cada día de la semana hay un mapa de bits por minuto: el bit i del
+minuto m está a 1 si el profesor que ocupa la posición i está en horario
+de tutoría en ese minuto. Además se guarda un mapa por hora (el OR de sus
+60 minutos) para que las ventanas largas se recorran de hora en hora.
+
+"¿Quién de estos profesores está disponible ahora?" es un AND entre el
+mapa del minuto actual y la máscara de los profesores que interesan, y
+"¿quién lo estará en las próximas N horas?" es el OR de los mapas de la
+ventana. El índice se construye con una consulta la primera vez que se usa
+y, al guardar un horario (update_horario_profesor), solo se reescriben los
+bits de ese profesor. Los horarios que guardan otros procesos llegan como
+invalidaciones (sincronizar_caches en db/queries.py), que se aplican antes
+de cada consulta; además el índice se reconstruye entero cada
+DISPONIBILIDAD_TTL segundos por si alguien escribe sin avisar.
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from itertools import groupby
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.conexion import conexion
+from db.consultas import ejecutar
+from utils.motor_horarios import compilar_franjas
+
+logger = logging.getLogger(__name__)
+
+MINUTOS_DIA = 24 * 60
+MAX_HORAS = 7 * 24   # Ventana máxima de una consulta
+TTL_INDICE = float(os.getenv("DISPONIBILIDAD_TTL", "600"))   # Segundos hasta reconstruirlo entero
+
+
+class IndiceDisponibilidad:
+    """Mapas de bits por día y minuto con los profesores en horario de tutoría"""
+
+    def __init__(self, ttl=TTL_INDICE):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._minutos = [[0] * MINUTOS_DIA for _ in range(7)]
+        self._horas = [[0] * 24 for _ in range(7)]
+        self._bit = {}        # profesor_id -> posición de su bit
+        self._profesor = {}   # posición -> profesor_id
+        self._libres = []     # Posiciones de profesores que se quedaron sin horario
+        self._horarios = {}   # profesor_id -> HorarioCompilado indexado
+        self._construido = False
+        self._construido_en = 0.0   # monotonic de la última construcción
+
+        # Métricas
+        self.construcciones = 0
+        self.construccion_ms = 0.0
+        self.actualizaciones = 0
+        self.consultas = 0
+
+    # ===== CONSTRUCCIÓN =====
+    def construir(self):
+        """Reconstruye el índice completo con los horarios de la base de datos"""
+        inicio = time.perf_counter()
+        with self._lock:
+            self._minutos = [[0] * MINUTOS_DIA for _ in range(7)]
+            self._horas = [[0] * 24 for _ in range(7)]
+            self._bit.clear()
+            self._profesor.clear()
+            self._libres.clear()
+            self._horarios.clear()
+            with conexion() as conn:
+                filas = ejecutar(conn, "franjas.todas").fetchall()
+            for profesor_id, franjas in groupby(filas, key=lambda fila: fila[0]):
+                self._poner(profesor_id, compilar_franjas([(dia, inicio, fin) for _, dia, inicio, fin in franjas]))
+            self._construido = True
+            self._construido_en = time.monotonic()
+            self.construcciones += 1
+        self.construccion_ms = (time.perf_counter() - inicio) * 1000
+        print(f"🗓️ Índice de disponibilidad: {len(self._bit)} profesores en {self.construccion_ms:.0f} ms")
+
+    def _vigente(self):
+        return self._construido and time.monotonic() - self._construido_en < self.ttl
+
+    def _asegurar(self):
+        # Import diferido: db/queries.py importa este módulo
+        from db.queries import sincronizar_caches
+        sincronizar_caches()
+        if not self._vigente():
+            with self._lock:
+                if not self._vigente():
+                    self.construir()
+
+    def invalidar(self):
+        """Marca el índice para reconstruirlo entero en la próxima consulta (importaciones masivas)"""
+        with self._lock:
+            self._construido = False
+
+    def actualizar(self, profesor_id, horario):
+        """Sustituye los bits de un profesor por los de su nuevo horario (HorarioCompilado)"""
+        with self._lock:
+            if not self._construido:
+                return  # Se leerá de la BD al construirlo
+            anterior = self._horarios.get(profesor_id)
+            if anterior is not None and anterior.fuente == horario.fuente:
+                return
+            if anterior is not None:
+                self._quitar(profesor_id)
+            self._poner(profesor_id, horario)
+            self.actualizaciones += 1
+
+    def _poner(self, profesor_id, horario):
+        if not horario:
+            return
+        # Las posiciones ocupadas son siempre 0..n-1 salvo las que quedan libres
+        posicion = self._libres.pop() if self._libres else len(self._profesor)
+        self._bit[profesor_id] = posicion
+        self._profesor[posicion] = profesor_id
+        self._horarios[profesor_id] = horario
+        self._marcar(horario, 1 << posicion, True)
+
+    def _quitar(self, profesor_id):
+        posicion = self._bit.pop(profesor_id)
+        del self._profesor[posicion]
+        self._libres.append(posicion)
+        self._marcar(self._horarios.pop(profesor_id), 1 << posicion, False)
+
+    def _marcar(self, horario, bit, poner):
+        for dia in range(7):
+            minutos, horas = self._minutos[dia], self._horas[dia]
+            for inicio, fin in horario.franjas(dia):
+                # Franjas semiabiertas [inicio, fin): el minuto `fin` ya no está en horario
+                fin = min(fin, MINUTOS_DIA)
+                if fin <= inicio:
+                    continue
+                for minuto in range(inicio, fin):
+                    minutos[minuto] = (minutos[minuto] | bit) if poner else (minutos[minuto] & ~bit)
+                for hora in range(inicio // 60, (fin - 1) // 60 + 1):
+                    horas[hora] = (horas[hora] | bit) if poner else (horas[hora] & ~bit)
+
+    # ===== CONSULTAS =====
+    def _mascara(self, profesor_ids):
+        if profesor_ids is None:
+            return -1
+        mascara = 0
+        for profesor_id in profesor_ids:
+            posicion = self._bit.get(profesor_id)
+            if posicion is not None:
+                mascara |= 1 << posicion
+        return mascara
+
+    def _ids(self, bits):
+        resultado = []
+        while bits:
+            bajo = bits & -bits
+            resultado.append(self._profesor[bajo.bit_length() - 1])
+            bits ^= bajo
+        return resultado
+
+    def disponibles_ahora(self, profesor_ids=None, momento=None):
+        """Ids de los profesores (de profesor_ids, o todos) en horario de tutoría en `momento`"""
+        if momento is None:
+            momento = datetime.now()
+        self._asegurar()
+        with self._lock:
+            self.consultas += 1
+            bits = self._minutos[momento.weekday()][momento.hour * 60 + momento.minute]
+            return self._ids(bits & self._mascara(profesor_ids))
+
+    def disponibles_en(self, horas, profesor_ids=None, momento=None):
+        """
+        Profesores que estarán en horario de tutoría en algún momento de las
+        próximas `horas` horas
+
+        Returns:
+            dict {profesor_id: datetime en que empieza (o sigue) su franja}; los que
+            están disponibles ya tienen `momento` como valor
+        """
+        if momento is None:
+            momento = datetime.now()
+        momento = momento.replace(second=0, microsecond=0)
+        minutos_ventana = int(min(max(horas, 0), MAX_HORAS) * 60)
+        self._asegurar()
+        with self._lock:
+            self.consultas += 1
+            mascara = self._mascara(profesor_ids)
+            dia, minuto = momento.weekday(), momento.hour * 60 + momento.minute
+            bits = 0
+            restante = max(minutos_ventana, 1)   # Ventana [momento, momento + horas), al menos el minuto actual
+            while restante > 0 and bits & mascara != mascara:
+                if minuto % 60 == 0 and restante >= 60:
+                    bits |= self._horas[dia][minuto // 60]
+                    paso = 60
+                else:
+                    bits |= self._minutos[dia][minuto]
+                    paso = 1
+                restante -= paso
+                minuto += paso
+                if minuto >= MINUTOS_DIA:
+                    dia, minuto = (dia + 1) % 7, 0
+
+            resultado = {}
+            medianoche = momento.replace(hour=0, minute=0)
+            for profesor_id in self._ids(bits & mascara):
+                adelante, inicio, _ = self._horarios[profesor_id].proxima_franja(
+                    momento.weekday(), momento.hour * 60 + momento.minute)
+                empieza = medianoche + timedelta(days=adelante, minutes=inicio)
+                resultado[profesor_id] = max(empieza, momento)
+            return resultado
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "construido": self._construido,
+                "profesores": len(self._bit),
+                "construcciones": self.construcciones,
+                "construccion_ms": self.construccion_ms,
+                "actualizaciones": self.actualizaciones,
+                "consultas": self.consultas,
+            }
+
+
+_indice = None
+_indice_lock = threading.Lock()
+
+
+def get_indice_disponibilidad():
+    """Devuelve el índice del proceso, creándolo la primera vez (se construye al usarlo)"""
+    global _indice
+    if _indice is None:
+        with _indice_lock:
+            if _indice is None:
+                _indice = IndiceDisponibilidad()
+    return _indice
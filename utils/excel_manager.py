@@ -2,6 +2,9 @@ import pandas as pd
 import os
 import sys
 import logging
+import time
+import hashlib
+import threading
 import traceback
 from pathlib import Path
 import sqlite3
@@ -10,81 +13,91 @@ import openpyxl
 
 # Añadir directorio raíz al path
 sys.path.append(str(Path(__file__).parent.parent))
-from db.queries import get_db_connection, get_o_crear_carrera
+from db.queries import get_db_connection, get_o_crear_carrera, invalidar_cache_usuarios
+from db.escritor import ejecutar_escritura
 
 # Configurar logger
 logger = logging.getLogger(__name__)
 
 # Variables globales para almacenar datos
+# usuarios_excel nunca se modifica una vez publicado: cada recarga construye un
+# dict nuevo y reasigna la referencia, así que los lectores no necesitan lock
 usuarios_excel = {}  # {email: {datos...}}
 excel_cargado = False
 excel_last_updated = None
+_firma_excel = None  # (mtime_ns, tamaño) del fichero que hay en usuarios_excel
+_lock_recarga = threading.Lock()  # Solo lo toman las cargas, nunca los lectores
 
-def cargar_excel_en_memoria():
-    """Carga todo el Excel en memoria una vez"""
-    global usuarios_excel, excel_cargado, excel_last_updated
+def _encabezados(fila):
+    """Nombres de columna de la primera fila (Column_N si la celda está vacía)"""
+    return [str(valor).strip() if valor else f"Column_{i + 1}" for i, valor in enumerate(fila)]
+
+def leer_indice_emails(excel_path):
+    """
+    Lee el Excel en modo streaming y devuelve el índice {email: {datos...}}.
+
+    Usa openpyxl en modo read_only con iter_rows(values_only=True): las filas
+    llegan como tuplas de valores y nunca se crean objetos celda, así que la
+    memoria no depende del tamaño de la hoja. Devuelve None si no hay
+    columna de email.
+    """
+    workbook = openpyxl.load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        filas = workbook.active.iter_rows(values_only=True)
+        headers = _encabezados(next(filas, ()))
+
+        # Encontrar columna de email
+        email_col = next((i for i, h in enumerate(headers) if 'mail' in h.lower()), None)
+        if email_col is None:
+            return None
+
+        indice = {}
+        for fila in filas:
+            if email_col >= len(fila) or not fila[email_col]:
+                continue
+            email = str(fila[email_col]).lower().strip()
+            # Solo las celdas con valor, como en la carga anterior
+            indice[email] = {headers[i]: str(valor) for i, valor in enumerate(fila[:len(headers)]) if valor}
+        return indice
+    finally:
+        # En modo read_only el fichero queda abierto hasta cerrar el libro
+        workbook.close()
+
+def _firma_fichero(ruta):
+    """(mtime_ns, tamaño) del fichero, o None si no existe"""
+    try:
+        estado = os.stat(ruta)
+    except OSError:
+        return None
+    return (estado.st_mtime_ns, estado.st_size)
+
+def _cargar_indice(excel_path):
+    """Construye el índice fuera de usuarios_excel y lo publica de una vez (llamar con _lock_recarga)"""
+    global usuarios_excel, excel_cargado, excel_last_updated, _firma_excel
     
     try:
-        # Buscar el Excel
-        excel_path = Path(__file__).parent.parent / "data" / "usuarios.xlsx"
-        
         if not os.path.exists(excel_path):
             print("❌ Excel no encontrado")
             return False
         
-        # Cargar el Excel
-        workbook = openpyxl.load_workbook(excel_path)
-        sheet = workbook.active
-        
-        # Obtener encabezados
-        headers = []
-        for col in range(1, sheet.max_column + 1):
-            header = sheet.cell(row=1, column=col).value
-            if header:
-                headers.append(header.strip())
-            else:
-                headers.append(f"Column_{col}")
-        
-        # Encontrar columna de email
-        email_col = None
-        for i, header in enumerate(headers):
-            if 'mail' in header.lower():
-                email_col = i + 1  # +1 porque las columnas en openpyxl empiezan en 1
-                break
-        
-        if not email_col:
+        # La firma se toma antes de leer: si el fichero cambia durante la
+        # lectura, la siguiente comprobación del vigilante lo volverá a cargar
+        firma = _firma_fichero(excel_path)
+        inicio = time.perf_counter()
+        indice = leer_indice_emails(excel_path)
+        if indice is None:
             print("❌ No se encontró columna de email")
             return False
         
-        # Cargar todos los datos
-        usuarios_excel.clear()
-        total_usuarios = 0
-        
-        for row in range(2, sheet.max_row + 1):
-            # Obtener email (columna encontrada)
-            email_value = sheet.cell(row=row, column=email_col).value
-            
-            if not email_value:
-                continue
-                
-            email = str(email_value).lower().strip()
-            
-            # Crear diccionario con todos los datos de la fila
-            datos = {}
-            for col in range(1, sheet.max_column + 1):
-                value = sheet.cell(row=row, column=col).value
-                if value:
-                    datos[headers[col-1]] = str(value)
-            
-            # Guardar en el diccionario global
-            usuarios_excel[email] = datos
-            total_usuarios += 1
+        # Intercambio atómico: los lectores ven el índice anterior o el nuevo completo
+        usuarios_excel = indice
+        _firma_excel = firma
         
-        print(f"✅ Excel cargado en memoria: {total_usuarios} usuarios")
-        print(f"📧 Emails cargados: {list(usuarios_excel.keys())}")
+        segundos = time.perf_counter() - inicio
+        print(f"✅ Excel cargado en memoria: {len(indice)} usuarios en {segundos:.2f} s")
+        logger.info(f"Excel cargado en memoria: {len(indice)} usuarios en {segundos:.2f} s")
         
         excel_cargado = True
-        from datetime import datetime
         excel_last_updated = datetime.now().strftime("%Y-%m-%d %H:%M")
         
         return True
@@ -94,29 +107,40 @@ def cargar_excel_en_memoria():
         print(traceback.format_exc())
         return False
 
+def cargar_excel_en_memoria(excel_path=None):
+    """Carga (o recarga) el índice de emails del Excel en memoria"""
+    from config import EXCEL_PATH
+    
+    with _lock_recarga:
+        return _cargar_indice(excel_path or EXCEL_PATH)
+
+def _asegurar_excel_cargado():
+    """Primera carga perezosa; si varios hilos llegan a la vez solo carga uno"""
+    if excel_cargado:
+        return
+    from config import EXCEL_PATH
+    
+    with _lock_recarga:
+        if not excel_cargado:
+            _cargar_indice(EXCEL_PATH)
+
 def verificar_email_en_excel(email):
     """Verifica si un email está en los datos cargados (muy simple ahora)"""
-    global usuarios_excel, excel_cargado
-    
     # Si no está cargado, intentar cargar
-    if not excel_cargado:
-        cargar_excel_en_memoria()
+    _asegurar_excel_cargado()
     
     # Normalizar email
     email_norm = email.lower().strip()
     
-    # Verificar si existe
+    # Verificar si existe (la referencia al índice se lee una sola vez)
     existe = email_norm in usuarios_excel
     print(f"🔍 Verificando '{email_norm}': {'✅ ENCONTRADO' if existe else '❌ NO ENCONTRADO'}")
     return existe
 
 def obtener_datos_por_email(email):
     """Obtiene los datos de un usuario por su email"""
-    global usuarios_excel, excel_cargado
-    
     # Si no está cargado, intentar cargar
-    if not excel_cargado:
-        cargar_excel_en_memoria()
+    _asegurar_excel_cargado()
     
     # Normalizar email
     email_norm = email.lower().strip()
@@ -124,8 +148,107 @@ def obtener_datos_por_email(email):
     # Retornar datos o None
     return usuarios_excel.get(email_norm)
 
-def cargar_excel(ruta_excel=None):
-    """Carga el archivo Excel y devuelve un DataFrame"""
+# ===== RECARGA EN CALIENTE =====
+class VigilanteExcel(threading.Thread):
+    """
+    Hilo que sondea el mtime y el tamaño del Excel y recarga usuarios_excel
+    cuando cambian. Solo recarga cuando la firma se mantiene igual durante
+    un intervalo completo, para no leer un fichero que se está copiando.
+    Si la carga falla se conserva el índice anterior y no se reintenta
+    hasta que el fichero vuelva a cambiar.
+    """
+    
+    def __init__(self, excel_path=None, intervalo=30.0):
+        from config import EXCEL_PATH
+        
+        super().__init__(name="VigilanteExcel", daemon=True)
+        self.excel_path = excel_path or EXCEL_PATH
+        self.intervalo = intervalo
+        self._parar = threading.Event()
+        self._pendiente = None  # Firma vista en la comprobación anterior
+        self._fallida = None    # Firma cuya carga falló
+        
+        # Contadores
+        self.comprobaciones = 0
+        self.recargas = 0
+        self.errores = 0
+    
+    def run(self):
+        logger.info(f"Vigilando {self.excel_path} cada {self.intervalo:.0f} s")
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.comprobar()
+            except Exception as e:
+                self.errores += 1
+                logger.error(f"Error vigilando el Excel: {e}")
+    
+    def comprobar(self):
+        """Recarga el índice si el fichero ha cambiado y ya es estable; True si recargó"""
+        self.comprobaciones += 1
+        firma = _firma_fichero(self.excel_path)
+        if firma is None or firma == _firma_excel or firma == self._fallida:
+            self._pendiente = None
+            return False
+        
+        if firma != self._pendiente:
+            # Cambio nuevo: esperar a la siguiente comprobación por si aún se está escribiendo
+            self._pendiente = firma
+            return False
+        
+        self._pendiente = None
+        print(f"🔄 Cambios en {self.excel_path}, recargando índice de emails...")
+        with _lock_recarga:
+            recargado = _cargar_indice(self.excel_path)
+        
+        if recargado:
+            self.recargas += 1
+        else:
+            self.errores += 1
+            self._fallida = firma
+        return recargado
+    
+    def detener(self, timeout=5):
+        self._parar.set()
+        if self.is_alive():
+            self.join(timeout)
+    
+    def estadisticas(self):
+        return {
+            "excel": str(self.excel_path),
+            "intervalo": self.intervalo,
+            "comprobaciones": self.comprobaciones,
+            "recargas": self.recargas,
+            "errores": self.errores,
+        }
+
+_vigilante = None
+
+def iniciar_vigilancia_excel(intervalo=None):
+    """Arranca (una sola vez) el hilo que recarga el Excel cuando cambia"""
+    global _vigilante
+    from config import EXCEL_RECARGA_SEGUNDOS
+    
+    if _vigilante is None or not _vigilante.is_alive():
+        _vigilante = VigilanteExcel(intervalo=intervalo or EXCEL_RECARGA_SEGUNDOS)
+        _vigilante.start()
+    return _vigilante
+
+def detener_vigilancia_excel():
+    global _vigilante
+    if _vigilante is not None:
+        _vigilante.detener()
+        _vigilante = None
+
+def estadisticas_excel():
+    """Estado del índice de emails y, si está arrancado, del vigilante"""
+    estado = {"usuarios": len(usuarios_excel), "ultima_carga": excel_last_updated,
+              "recargas": 0, "errores": 0}
+    if _vigilante is not None:
+        estado.update(_vigilante.estadisticas())
+    return estado
+
+def cargar_excel(ruta_excel=None, como_texto=False):
+    """Carga el archivo Excel y devuelve un DataFrame (todo como texto si como_texto)"""
     import pandas as pd
     from config import EXCEL_PATH
     
@@ -134,7 +257,7 @@ def cargar_excel(ruta_excel=None):
         ruta_excel = EXCEL_PATH
     
     try:
-        df = pd.read_excel(ruta_excel)
+        df = pd.read_excel(ruta_excel, dtype=str if como_texto else None)
         print(f"✅ Excel cargado correctamente: {ruta_excel}")
         return df
     except Exception as e:
@@ -169,121 +292,123 @@ def cargar_excel_a_base_de_datos():
         # Mostrar primeras filas para diagnóstico
         print(f"Muestra de datos:\n{df.head(1).to_string()}")
         
-        # Contadores para estadísticas
-        usuarios_procesados = 0
-        asignaturas_procesadas = 0
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        # Verificar datos mínimos necesarios
+        if 'Email' not in df.columns:
+            print(f"❌ Error: Columna 'Email' no encontrada en el Excel. Columnas disponibles: {list(df.columns)}")
+            return False
         
-        # Procesar cada fila del Excel
-        for i, row in df.iterrows():
-            try:
-                # Verificar datos mínimos necesarios
-                if 'Email' not in df.columns:
-                    print(f"❌ Error: Columna 'Email' no encontrada en el Excel. Columnas disponibles: {list(df.columns)}")
-                    return False
-                    
-                nombre = row.get('Nombre', '').strip()
-                email = row.get('Email', '').strip().lower()
+        def _cargar_filas(conn, cursor):
+            # Contadores para estadísticas: usuarios y asignaturas procesados
+            contadores = [0, 0]
+            
+            # Procesar cada fila del Excel
+            for i, row in df.iterrows():
+                try:
+                    nombre = row.get('Nombre', '').strip()
+                    email = row.get('Email', '').strip().lower()
                 
-                if not nombre or not email:
-                    print(f"⚠️ Fila {i+1}: Saltada por falta de nombre o email")
-                    continue
+                    if not nombre or not email:
+                        print(f"⚠️ Fila {i+1}: Saltada por falta de nombre o email")
+                        continue
                 
-                # Datos adicionales
-                apellidos = row.get('Apellidos', '').strip()
-                dni = row.get('DNI', '').strip()
-                tipo = row.get('Tipo', 'estudiante').strip().lower()
-                carrera = row.get('Carrera', '').strip()
+                    # Datos adicionales
+                    apellidos = row.get('Apellidos', '').strip()
+                    dni = row.get('DNI', '').strip()
+                    tipo = row.get('Tipo', 'estudiante').strip().lower()
+                    carrera = row.get('Carrera', '').strip()
                 
-                # Comprobar si el usuario ya existe
-                cursor.execute("SELECT Id_usuario FROM Usuarios WHERE Email_UGR = ?", (email,))
-                usuario_existente = cursor.fetchone()
+                    # Comprobar si el usuario ya existe
+                    cursor.execute("SELECT Id_usuario FROM Usuarios WHERE Email_UGR = ?", (email,))
+                    usuario_existente = cursor.fetchone()
                 
-                if usuario_existente:
-                    # Actualizar usuario existente
-                    cursor.execute("""
-                        UPDATE Usuarios 
-                        SET Nombre=?, Apellidos=?, DNI=?, Tipo=?, Carrera=?
-                        WHERE Email_UGR=?
-                    """, (nombre, apellidos, dni, tipo, carrera, email))
-                    user_id = usuario_existente[0]
-                    print(f"✓ Usuario actualizado: {nombre} ({email})")
-                else:
-                    # Crear nuevo usuario
-                    cursor.execute("""
-                        INSERT INTO Usuarios (Nombre, Apellidos, DNI, Email_UGR, Tipo, Carrera)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (nombre, apellidos, dni, email, tipo, carrera))
-                    user_id = cursor.lastrowid
-                    print(f"✓ Usuario creado: {nombre} ({email}) con ID: {user_id}")
+                    if usuario_existente:
+                        # Actualizar usuario existente
+                        cursor.execute("""
+                            UPDATE Usuarios 
+                            SET Nombre=?, Apellidos=?, DNI=?, Tipo=?, Carrera=?
+                            WHERE Email_UGR=?
+                        """, (nombre, apellidos, dni, tipo, carrera, email))
+                        user_id = usuario_existente[0]
+                        print(f"✓ Usuario actualizado: {nombre} ({email})")
+                    else:
+                        # Crear nuevo usuario
+                        cursor.execute("""
+                            INSERT INTO Usuarios (Nombre, Apellidos, DNI, Email_UGR, Tipo, Carrera)
+                            VALUES (?, ?, ?, ?, ?, ?)
+                        """, (nombre, apellidos, dni, email, tipo, carrera))
+                        user_id = cursor.lastrowid
+                        print(f"✓ Usuario creado: {nombre} ({email}) con ID: {user_id}")
                 
-                usuarios_procesados += 1
+                    contadores[0] += 1
                 
-                # Procesar carrera
-                if carrera:
-                    carrera_id = get_o_crear_carrera(carrera)
-                else:
-                    carrera_id = None
+                    # Procesar carrera
+                    if carrera:
+                        carrera_id = get_o_crear_carrera(carrera)
+                    else:
+                        carrera_id = None
                 
-                # Procesar asignaturas - buscando en ambas columnas posibles
-                asignaturas = []
-                for col_name in ['Asignaturas', 'Asignatura']:
-                    if col_name in df.columns and not pd.isna(row.get(col_name)):
-                        asig_text = str(row.get(col_name)).strip()
-                        if ";" in asig_text:
-                            asignaturas.extend([a.strip() for a in asig_text.split(";")])
-                        elif "," in asig_text:
-                            asignaturas.extend([a.strip() for a in asig_text.split(",")])
-                        else:
-                            asignaturas.append(asig_text)
+                    # Procesar asignaturas - buscando en ambas columnas posibles
+                    asignaturas = []
+                    for col_name in ['Asignaturas', 'Asignatura']:
+                        if col_name in df.columns and not pd.isna(row.get(col_name)):
+                            asig_text = str(row.get(col_name)).strip()
+                            if ";" in asig_text:
+                                asignaturas.extend([a.strip() for a in asig_text.split(";")])
+                            elif "," in asig_text:
+                                asignaturas.extend([a.strip() for a in asig_text.split(",")])
+                            else:
+                                asignaturas.append(asig_text)
                 
-                # Si hay columnas ST, SRC, RIM como booleanos, convertirlas a asignaturas
-                for asig_col in ['ST', 'SRC', 'RIM']:
-                    if asig_col in df.columns and str(row.get(asig_col)).lower() in ['1', 'true', 'yes', 'si', 'sí']:
-                        asignaturas.append(asig_col)
+                    # Si hay columnas ST, SRC, RIM como booleanos, convertirlas a asignaturas
+                    for asig_col in ['ST', 'SRC', 'RIM']:
+                        if asig_col in df.columns and str(row.get(asig_col)).lower() in ['1', 'true', 'yes', 'si', 'sí']:
+                            asignaturas.append(asig_col)
                 
-                # Procesar cada asignatura
-                for asig_nombre in asignaturas:
-                    if not asig_nombre.strip():
-                        continue
+                    # Procesar cada asignatura
+                    for asig_nombre in asignaturas:
+                        if not asig_nombre.strip():
+                            continue
                     
-                    # Buscar o crear asignatura
-                    cursor.execute("SELECT Id_asignatura FROM Asignaturas WHERE Nombre = ?", (asig_nombre,))
-                    asig = cursor.fetchone()
+                        # Buscar o crear asignatura
+                        cursor.execute("SELECT Id_asignatura FROM Asignaturas WHERE Nombre = ?", (asig_nombre,))
+                        asig = cursor.fetchone()
                     
-                    if not asig:
-                        cursor.execute("""
-                            INSERT INTO Asignaturas (Nombre, Id_carrera) 
-                            VALUES (?, ?)
-                        """, (asig_nombre, carrera_id))
-                        asig_id = cursor.lastrowid
-                    else:
-                        asig_id = asig[0]
-                        
-                        # Actualizar carrera si es necesario
-                        if carrera_id:
+                        if not asig:
                             cursor.execute("""
-                                UPDATE Asignaturas SET Id_carrera = ? 
-                                WHERE Id_asignatura = ? AND (Id_carrera IS NULL OR Id_carrera = '')
-                            """, (carrera_id, asig_id))
+                                INSERT INTO Asignaturas (Nombre, Id_carrera) 
+                                VALUES (?, ?)
+                            """, (asig_nombre, carrera_id))
+                            asig_id = cursor.lastrowid
+                        else:
+                            asig_id = asig[0]
+                        
+                            # Actualizar carrera si es necesario
+                            if carrera_id:
+                                cursor.execute("""
+                                    UPDATE Asignaturas SET Id_carrera = ? 
+                                    WHERE Id_asignatura = ? AND (Id_carrera IS NULL OR Id_carrera = '')
+                                """, (carrera_id, asig_id))
                     
-                    # Crear matrícula
-                    cursor.execute("""
-                        INSERT OR IGNORE INTO Matriculas (Id_usuario, Id_asignatura, Tipo) 
-                        VALUES (?, ?, ?)
-                    """, (user_id, asig_id, tipo))
+                        # Crear matrícula
+                        cursor.execute("""
+                            INSERT OR IGNORE INTO Matriculas (Id_usuario, Id_asignatura, Tipo) 
+                            VALUES (?, ?, ?)
+                        """, (user_id, asig_id, tipo))
                     
-                    asignaturas_procesadas += 1
-                    print(f"  ✓ Asignatura: {asig_nombre} - ID: {asig_id}")
+                        contadores[1] += 1
+                        print(f"  ✓ Asignatura: {asig_nombre} - ID: {asig_id}")
             
-            except Exception as e:
-                print(f"❌ Error en fila {i+1}: {e}")
-                continue
+                except Exception as e:
+                    print(f"❌ Error en fila {i+1}: {e}")
+                    continue
         
-        conn.commit()
-        conn.close()
+            return contadores
+        
+        # Todas las filas se escriben en una sola tarea del hilo escritor
+        usuarios_procesados, asignaturas_procesadas = ejecutar_escritura(_cargar_filas)
+        
+        # Se han actualizado usuarios existentes: descartar los datos cacheados
+        invalidar_cache_usuarios()
         global excel_last_updated
         excel_last_updated = datetime.now().strftime("%Y-%m-%d %H:%M")
         
@@ -347,7 +472,7 @@ def importar_datos_por_email(email):
         
         # Diagnóstico detallado
         print(f"🔍 Buscando: '{email_norm}'")
-        print(f"📧 Emails en Excel: {df['Email'].tolist()}")
+        print(f"📧 Emails en Excel: {len(df)}")
         
         # Buscar usuario
         user_row = df[df['Email'] == email_norm]
@@ -411,17 +536,9 @@ def importar_datos_por_email(email):
                 if col in user_data and str(user_data.get(col)).lower() in ['1', 'true', 'yes', 'si', 'sí']:
                     asignaturas.append(col)
             
-            # Añadir cada asignatura
-            for asig_nombre in asignaturas:
-                if not asig_nombre.strip():
-                    continue
-                    
-                # Procesamiento especial para asignaturas separadas por comas en el mismo campo
-                asig_parts = [a.strip() for a in asig_nombre.split(',') if a.strip()]
-                for asig in asig_parts:
-                    conn = get_db_connection()
-                    cursor = conn.cursor()
-                    
+            def _matricular(asig):
+                """Tarea de escritura: busca o crea la asignatura y matricula al usuario"""
+                def tarea(conn, cursor):
                     # Buscar o crear asignatura
                     cursor.execute("SELECT Id_asignatura FROM Asignaturas WHERE Nombre = ?", (asig,))
                     asig_row = cursor.fetchone()
@@ -440,9 +557,17 @@ def importar_datos_por_email(email):
                         INSERT OR IGNORE INTO Matriculas (Id_usuario, Id_asignatura, Tipo)
                         VALUES (?, ?, ?)
                     """, (user_id, asig_id, user_data.get('Tipo', 'estudiante')))
+                return tarea
+            
+            # Añadir cada asignatura
+            for asig_nombre in asignaturas:
+                if not asig_nombre.strip():
+                    continue
                     
-                    conn.commit()
-                    conn.close()
+                # Procesamiento especial para asignaturas separadas por comas en el mismo campo
+                asig_parts = [a.strip() for a in asig_nombre.split(',') if a.strip()]
+                for asig in asig_parts:
+                    ejecutar_escritura(_matricular(asig))
                     print(f"  ✓ Asignatura registrada: {asig}")
         
         return True
@@ -459,191 +584,340 @@ def verificar_excel_disponible():
     
     return os.path.exists(EXCEL_PATH)
 
+# ===== IMPORTACIÓN MASIVA =====
+COLUMNAS_IMPORTACION = ['Email', 'Nombre', 'Apellidos', 'DNI', 'Tipo', 'Area', 'Carrera', 'Asignaturas']
+TIPOS_VALIDOS = ('estudiante', 'profesor')
+
+def normalizar_columnas(df):
+    """Renombra las columnas del Excel a los nombres que usa la importación"""
+    column_mapping = {}
+    for col in df.columns:
+        col_lower = str(col).lower().strip()
+        if 'email' in col_lower: column_mapping[col] = 'Email'
+        elif 'nombre' in col_lower: column_mapping[col] = 'Nombre'
+        elif 'apellido' in col_lower: column_mapping[col] = 'Apellidos'
+        elif 'dni' in col_lower: column_mapping[col] = 'DNI'
+        elif 'tipo' in col_lower: column_mapping[col] = 'Tipo'
+        elif 'area' in col_lower or 'área' in col_lower: column_mapping[col] = 'Area'
+        elif 'carrera' in col_lower: column_mapping[col] = 'Carrera'
+        elif 'asignatura' in col_lower: column_mapping[col] = 'Asignaturas'
+    
+    if column_mapping:
+        df = df.rename(columns=column_mapping)
+    return df
+
+def preparar_datos_importacion(df):
+    """
+    Normaliza el DataFrame con operaciones vectorizadas de pandas
+    
+    Returns:
+        tuple: (usuarios, matriculas, ignorados) donde usuarios es un DataFrame
+               con una fila por email y matriculas un DataFrame (Email, Asignatura)
+    """
+    df = normalizar_columnas(df)
+    df = df.reindex(columns=COLUMNAS_IMPORTACION)
+    total = len(df)
+    
+    # Todo como texto sin espacios; vacíos y NaN pasan a NA
+    for col in COLUMNAS_IMPORTACION:
+        df[col] = df[col].astype('string').str.strip().replace('', pd.NA)
+    
+    df['Email'] = df['Email'].str.lower()
+    df['Tipo'] = df['Tipo'].str.lower().fillna('estudiante')
+    
+    # Filas válidas: con email y nombre y un tipo que admite la tabla Usuarios
+    df = df[df['Email'].notna() & df['Nombre'].notna() & df['Tipo'].isin(TIPOS_VALIDOS)]
+    # Si un email se repite, gana la última fila (como al procesar fila a fila)
+    df = df.drop_duplicates(subset='Email', keep='last')
+    ignorados = total - len(df)
+    
+    # Asignaturas: separadas por ';' o, si no hay ';', por ','
+    asignaturas = df['Asignaturas']
+    asignaturas = asignaturas.where(
+        asignaturas.str.contains(';', regex=False),
+        asignaturas.str.replace(',', ';', regex=False)
+    )
+    matriculas = (
+        pd.DataFrame({'Email': df['Email'], 'Asignatura': asignaturas.str.split(';')})
+        .explode('Asignatura')
+    )
+    matriculas['Asignatura'] = matriculas['Asignatura'].str.strip()
+    matriculas = matriculas[matriculas['Asignatura'].notna() & (matriculas['Asignatura'] != '')]
+    matriculas = matriculas.drop_duplicates()
+    
+    return df, matriculas, ignorados
+
+def _filas_sqlite(df, columnas):
+    """Tuplas listas para executemany (NA -> None, todo lo demás str)"""
+    datos = df[columnas].astype(object).where(df[columnas].notna(), None)
+    return list(datos.itertuples(index=False, name=None))
+
+def _importar_en_transaccion(usuarios, matriculas, solo_nuevos, importados, eliminados=()):
+    """
+    Tarea para el hilo escritor: vuelca usuarios, carreras, asignaturas y
+    matrículas con executemany dentro de la transacción del lote.
+    
+    Args:
+        importados: Emails que ya venían del Excel en la importación anterior
+        eliminados: Emails que han desaparecido del Excel (pierden sus matrículas del Excel)
+    
+    El resultado incluye "emails_aplicados", los usuarios cuya fila se ha
+    escrito en Usuarios (solo de esos se deben guardar las huellas).
+    """
+    from db.consultas import ejecutar, ejecutar_muchos
+    
+    def _importar(conn, cursor):
+        resultado = {"usuarios_nuevos": 0, "asignaturas_nuevas": 0, "asignaturas_creadas": 0,
+                     "asignaturas_quitadas": 0}
+        
+        # 1. Usuarios (upsert por Email_UGR)
+        ejecutar(cursor, "importacion.usuarios")
+        ids_usuario = dict(cursor.fetchall())
+        existentes = usuarios['Email'].isin(ids_usuario.keys())
+        resultado["usuarios_nuevos"] = int((~existentes).sum())
+        
+        if solo_nuevos:
+            # Un usuario que ya estaba en la BD solo se actualiza si su fila viene
+            # del Excel anterior y ha cambiado; los dados de alta por otra vía no se tocan
+            aplicar = usuarios[~existentes | usuarios['Email'].isin(importados)]
+        else:
+            aplicar = usuarios
+        ejecutar_muchos(cursor, "importacion.upsert_usuario", _filas_sqlite(
+            aplicar, ['Nombre', 'Apellidos', 'DNI', 'Email', 'Tipo', 'Area', 'Carrera']
+        ))
+        resultado["emails_aplicados"] = set(aplicar['Email'])
+        ejecutar(cursor, "importacion.usuarios")
+        ids_usuario = dict(cursor.fetchall())
+        
+        # 2. Carreras
+        carreras_usuario = dict(zip(usuarios['Email'], usuarios['Carrera']))
+        nombres_carrera = {c for c in carreras_usuario.values() if isinstance(c, str)}
+        ejecutar_muchos(cursor, "importacion.crear_carrera", [(c,) for c in sorted(nombres_carrera)])
+        ejecutar(cursor, "importacion.carreras")
+        ids_carrera = dict(cursor.fetchall())
+        
+        # 3. Asignaturas (si hay nombres repetidos en la tabla se usa la primera)
+        ejecutar(cursor, "importacion.asignaturas")
+        ids_asignatura = {}
+        for nombre, id_asignatura in cursor.fetchall():
+            ids_asignatura.setdefault(nombre, id_asignatura)
+        
+        carrera_asignatura = {}
+        for email, asignatura in zip(matriculas['Email'], matriculas['Asignatura']):
+            carrera = ids_carrera.get(carreras_usuario.get(email))
+            if carrera is not None:
+                carrera_asignatura.setdefault(asignatura, carrera)
+        
+        nuevas = [a for a in dict.fromkeys(matriculas['Asignatura']) if a not in ids_asignatura]
+        if nuevas:
+            ejecutar_muchos(cursor, "importacion.crear_asignatura",
+                            [(a, carrera_asignatura.get(a)) for a in nuevas])
+            ejecutar(cursor, "importacion.asignaturas")
+            for nombre, id_asignatura in cursor.fetchall():
+                ids_asignatura.setdefault(nombre, id_asignatura)
+            resultado["asignaturas_creadas"] = len(nuevas)
+        
+        ejecutar_muchos(cursor, "asignaturas.asignar_carrera", [
+            (carrera, ids_asignatura[a]) for a, carrera in carrera_asignatura.items()
+        ])
+        
+        # 4. Matrículas que aún no existen
+        ejecutar(cursor, "importacion.matriculas")
+        existentes = {tuple(fila) for fila in cursor.fetchall()}
+        nuevas_matriculas = []
+        for email, asignatura in zip(matriculas['Email'], matriculas['Asignatura']):
+            par = (ids_usuario.get(email), ids_asignatura.get(asignatura))
+            if None not in par and par not in existentes:
+                existentes.add(par)
+                nuevas_matriculas.append(par + ('estudiante',))
+        ejecutar_muchos(cursor, "matriculas.crear", nuevas_matriculas)
+        resultado["asignaturas_nuevas"] = len(nuevas_matriculas)
+        
+        # 5. Asignaturas que han desaparecido de la fila de cada usuario procesado
+        #    (solo las matrículas que puso el Excel; las del bot se conservan)
+        procesados = set(usuarios['Email']) | set(eliminados)
+        actuales = {(email, ids_asignatura[asignatura])
+                     for email, asignatura in zip(matriculas['Email'], matriculas['Asignatura'])
+                     if asignatura in ids_asignatura}
+        ejecutar(cursor, "importacion.matriculas_excel")
+        anteriores = {(email, asignatura) for email, asignatura in cursor.fetchall() if email in procesados}
+        quitadas = sorted(anteriores - actuales)
+        ejecutar_muchos(cursor, "importacion.borrar_matricula", [
+            (ids_usuario[email], asignatura) for email, asignatura in quitadas if email in ids_usuario
+        ])
+        ejecutar_muchos(cursor, "importacion.borrar_matricula_excel", quitadas)
+        ejecutar_muchos(cursor, "importacion.guardar_matricula_excel", sorted(actuales - anteriores))
+        resultado["asignaturas_quitadas"] = len(quitadas)
+        
+        return resultado
+    
+    return _importar
+
+# ===== IMPORTACIÓN INCREMENTAL =====
+COLUMNAS_HUELLA = ['Nombre', 'Apellidos', 'DNI', 'Tipo', 'Area', 'Carrera', 'Asignaturas']
+
+def hash_fichero(ruta, tamano_bloque=1 << 20):
+    """SHA-256 del contenido de un fichero"""
+    h = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def calcular_huellas(usuarios):
+    """Huella de 64 bits por email calculada sobre las columnas normalizadas"""
+    huellas = pd.util.hash_pandas_object(usuarios[COLUMNAS_HUELLA], index=False)
+    return dict(zip(usuarios['Email'], huellas.astype('int64').tolist()))
+
+def _leer_estado_importacion(nombre_consulta, parametros=()):
+    """Lee las tablas de importación (vacías si la BD aún no las tiene)"""
+    from db.consultas import ejecutar
+    
+    conn = get_db_connection()
+    try:
+        return ejecutar(conn, nombre_consulta, parametros).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    finally:
+        conn.close()
+
+def _hash_guardado(ruta):
+    """Hash del Excel en la última importación, o None"""
+    filas = _leer_estado_importacion("importacion.hash", (ruta,))
+    return filas[0][0] if filas else None
+
+def _huellas_guardadas():
+    """{email: huella} de la última importación"""
+    return dict(_leer_estado_importacion("importacion.huellas"))
+
+def _tarea_importacion(usuarios, matriculas, solo_nuevos, huellas, importados, eliminados, ruta, hash_actual):
+    """
+    Tarea del hilo escritor que aplica en una transacción los usuarios nuevos
+    o modificados, las bajas y las huellas/hash de esta importación.
+    """
+    from db.consultas import ejecutar, ejecutar_muchos
+    importar = _importar_en_transaccion(usuarios, matriculas, solo_nuevos, importados, eliminados)
+    
+    def _tarea(conn, cursor):
+        resultado = {"usuarios_nuevos": 0, "asignaturas_nuevas": 0, "asignaturas_creadas": 0,
+                     "asignaturas_quitadas": 0}
+        aplicados = set()
+        if not usuarios.empty or eliminados:
+            resultado = importar(conn, cursor)
+            aplicados = resultado.pop("emails_aplicados")
+        
+        # Bajas: solo se borran usuarios que nunca llegaron a registrarse en el bot
+        bajas = [(email,) for email in sorted(eliminados)]
+        ejecutar_muchos(cursor, "importacion.borrar_matriculas_no_registrado", bajas)
+        ejecutar_muchos(cursor, "importacion.borrar_usuario_no_registrado", bajas)
+        resultado["usuarios_eliminados"] = max(cursor.rowcount, 0)
+        ejecutar_muchos(cursor, "importacion.borrar_huella", bajas)
+        ejecutar_muchos(cursor, "importacion.borrar_matriculas_excel", bajas)
+        
+        # Una fila que no se ha escrito no guarda huella: si no, su cambio se perdería
+        ejecutar_muchos(cursor, "importacion.guardar_huella", [
+            (email, huellas[email]) for email in sorted(aplicados)
+        ])
+        if ruta is not None:
+            ejecutar(cursor, "importacion.guardar_hash", (ruta, hash_actual))
+        return resultado
+    
+    return _tarea
+
 def importar_datos_desde_excel(df=None, solo_nuevos=True):
     """
-    Importa datos del Excel a la BD - solo añade información nueva
+    Importa datos del Excel a la BD en bloque y de forma incremental
+    
+    Si el fichero tiene el mismo hash que en la última importación no se
+    hace nada. Si no, se comparan las huellas por fila y solo se aplican
+    las filas nuevas, las modificadas y las que han desaparecido. La
+    escritura va con executemany en una única transacción del hilo escritor.
     
     Args:
-        df: DataFrame opcional
-        solo_nuevos: Si es True, solo importa usuarios/asignaturas que no existan
+        df: DataFrame opcional (sin hash de fichero, solo comparación por filas)
+        solo_nuevos: Si es True, solo se procesan las filas nuevas o
+                     modificadas; los usuarios que ya estaban en la BD sin
+                     venir del Excel no se modifican (sí sus matrículas).
+                     Si es False se procesan todas las filas aunque no
+                     hayan cambiado.
     """
-    from db.queries import create_user, update_user, get_matriculas_usuario, crear_matricula
-    import pandas as pd
     from config import EXCEL_PATH
-    import logging
-    
-    # Configurar logging
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger('excel_import')
     
     # Estadísticas
     stats = {
         "usuarios_nuevos": 0,
         "asignaturas_nuevas": 0,
-        "ignorados": 0
+        "ignorados": 0,
+        "filas_cambiadas": 0,
+        "usuarios_eliminados": 0,
+        "asignaturas_quitadas": 0,
+        "sin_cambios": False
     }
     
+    inicio = time.perf_counter()
+    ruta = hash_actual = None
+    
     # Cargar Excel si no se proporciona DataFrame
     if df is None:
+        ruta = str(EXCEL_PATH)
+        try:
+            hash_actual = hash_fichero(ruta)
+        except OSError as e:
+            print(f"❌ No se puede leer el Excel: {e}")
+            return stats
+        if solo_nuevos and hash_actual == _hash_guardado(ruta):
+            stats["sin_cambios"] = True
+            print(f"⏩ Excel sin cambios desde la última importación "
+                  f"({(time.perf_counter() - inicio) * 1000:.1f} ms)")
+            return stats
+        
         print(f"📊 Cargando datos desde: {EXCEL_PATH}")
-        df = cargar_excel(EXCEL_PATH)
+        df = cargar_excel(EXCEL_PATH, como_texto=True)
         if df is None:
             return stats
     
-    # Normalizar nombres de columnas
-    column_mapping = {}
-    for col in df.columns:
-        col_lower = col.lower().strip()
-        if 'email' in col_lower: column_mapping[col] = 'Email'
-        elif 'nombre' in col_lower: column_mapping[col] = 'Nombre'
-        elif 'apellido' in col_lower: column_mapping[col] = 'Apellidos'
-        elif 'dni' in col_lower: column_mapping[col] = 'DNI'
-        elif 'tipo' in col_lower: column_mapping[col] = 'Tipo'
-        elif 'area' in col_lower or 'área' in col_lower: column_mapping[col] = 'Area'
-        elif 'carrera' in col_lower: column_mapping[col] = 'Carrera'
-        elif 'asignatura' in col_lower: column_mapping[col] = 'Asignaturas'
+    usuarios, matriculas, stats["ignorados"] = preparar_datos_importacion(df)
+    huellas = calcular_huellas(usuarios)
+    huellas_guardadas = _huellas_guardadas()
+    # Las bajas solo se deducen del Excel completo, no de un DataFrame parcial
+    eliminados = huellas_guardadas.keys() - huellas.keys() if ruta is not None else set()
     
-    # Aplicar mapping
-    if column_mapping:
-        df = df.rename(columns=column_mapping)
+    if solo_nuevos:
+        # Solo las filas nuevas o cuya huella ha cambiado
+        cambiados = [email for email, huella in huellas.items() if huellas_guardadas.get(email) != huella]
+        usuarios = usuarios[usuarios['Email'].isin(cambiados)]
+        matriculas = matriculas[matriculas['Email'].isin(cambiados)]
+    stats["filas_cambiadas"] = len(usuarios)
     
-    # Obtener conexión a BD
-    from db.queries import get_db_connection
-    conn = get_db_connection()
+    try:
+        resultado = ejecutar_escritura(_tarea_importacion(
+            usuarios, matriculas, solo_nuevos, huellas, huellas_guardadas.keys(), eliminados, ruta, hash_actual
+        ))
+    except Exception as e:
+        logger.error(f"Error en la importación masiva: {e}")
+        print(f"❌ Error al importar el Excel (no se ha guardado nada): {e}")
+        return stats
     
-    # Procesar filas
-    for index, row in df.iterrows():
-        try:
-            email = row.get('Email')
-            nombre = row.get('Nombre')
-            
-            if not email or pd.isna(email) or not nombre or pd.isna(nombre):
-                continue
-                
-            # Verificar si el usuario ya existe
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM Usuarios WHERE Email_UGR = ?", (email,))
-            usuario = cursor.fetchone()
-            
-            # Si existe y solo queremos nuevos, solo procesamos asignaturas
-            if usuario and solo_nuevos:
-                user_id = usuario['Id_usuario']
-                # print(f"⏩ Usuario ya existe: {nombre} ({email})")
-            else:
-                # Si no existe, o queremos actualizar, creamos/actualizamos
-                tipo = str(row.get('Tipo', 'estudiante')).lower().strip()
-                apellidos = row.get('Apellidos')
-                dni = row.get('DNI')
-                area = row.get('Area')
-                carrera = row.get('Carrera')
-                
-                if usuario:
-                    # Actualizar si lo queremos
-                    if not solo_nuevos:
-                        update_user(
-                            user_id=usuario['Id_usuario'],
-                            Nombre=nombre,
-                            Apellidos=apellidos,
-                            DNI=dni,
-                            Area=area,
-                            Carrera=carrera
-                        )
-                    user_id = usuario['Id_usuario']
-                else:
-                    # Crear nuevo
-                    user_id = create_user(
-                        nombre=nombre,
-                        tipo=tipo,
-                        email=email,
-                        telegram_id=None,
-                        apellidos=apellidos,
-                        dni=dni,
-                        Area=area,
-                        carrera=carrera,
-                        registrado="NO"
-                    )
-                    stats["usuarios_nuevos"] += 1
-                    print(f"➕ Nuevo usuario: {nombre} ({email})")
-            
-            # Procesar asignaturas para todos los usuarios
-            if user_id:
-                # Obtener asignaturas ya matriculadas
-                asignaturas_actuales = get_matriculas_usuario(user_id)
-                ids_existentes = set()
-                if asignaturas_actuales:
-                    for m in asignaturas_actuales:
-                        ids_existentes.add(m['Id_asignatura'])
-                
-                # Procesar nuevas asignaturas
-                asignaturas_texto = row.get('Asignaturas')
-                if asignaturas_texto and not pd.isna(asignaturas_texto):
-                    # Detectar separador: ; o ,
-                    separadores = [';', ',']
-                    asignaturas_lista = None
-                    for sep in separadores:
-                        if sep in str(asignaturas_texto):
-                            asignaturas_lista = [a.strip() for a in str(asignaturas_texto).split(sep)]
-                            break
-                    
-                    # Si no hay separador, es una sola asignatura
-                    if not asignaturas_lista:
-                        asignaturas_lista = [str(asignaturas_texto).strip()]
-                    
-                    # Procesar cada asignatura
-                    for asig_nombre in asignaturas_lista:
-                        if not asig_nombre.strip():
-                            continue
-                        
-                        try:
-                            # Buscar ID de la asignatura
-                            cursor.execute(
-                                "SELECT Id_asignatura FROM Asignaturas WHERE Nombre = ?", 
-                                (asig_nombre,)
-                            )
-                            result = cursor.fetchone()
-                            
-                            if result:
-                                asig_id = result['Id_asignatura']
-                            else:
-                                # Crear la asignatura automáticamente si no existe
-                                from db.queries import crear_asignatura
-                                asig_id = crear_asignatura(nombre=asig_nombre)
-                                print(f"  ➕ Asignatura creada automáticamente: {asig_nombre}")
-                            
-
-                            # Verificar que se obtuvo un ID válido
-                            if asig_id:
-                                # Guardar tipo localmente en caso de que usuario sea None
-                                tipo_usuario = tipo if isinstance(usuario, dict) and 'Tipo' in usuario else 'estudiante'
-                                
-                                # Crear matrícula con el tipo almacenado
-                                # Solo añadir si no está ya matriculado
-                                crear_matricula(user_id, asig_id, tipo_usuario, verificar_duplicados=solo_nuevos)
-                                
-                                # Si estamos en modo solo_nuevos, debemos verificar duplicados
-                                if solo_nuevos:
-                                    stats["asignaturas_nuevas"] += 1
-                                    print(f"  ➕ Verificada asignatura: {asig_nombre}")
-                                else:
-                                    # Si estamos en modo completo, agregamos todo sin verificar
-                                    stats["asignaturas_nuevas"] += 1
-                                    print(f"  ➕ Nueva asignatura: {asig_nombre}")
-                                
-                                # Procesar la siguiente asignatura (SRC, RIM, etc.)
-                        except Exception as e:
-                            print(f"  ⚠️ Error procesando asignatura {asig_nombre}: {e}")
-                            continue  # Continuar con la siguiente asignatura
-        
-        except Exception as e:
-            print(f"Error en fila {index+1}: {e}")
-    
-    # Cerrar conexión
-    conn.close()
+    stats.update(resultado)
+    duracion = time.perf_counter() - inicio
+    stats["filas"] = len(df)
+    stats["segundos"] = duracion
+    stats["filas_por_segundo"] = len(df) / duracion if duracion > 0 else 0.0
+    
+    if stats["filas_cambiadas"] or stats["usuarios_eliminados"] or stats["asignaturas_quitadas"]:
+        # Usuarios existentes actualizados o borrados: descartar los datos cacheados
+        invalidar_cache_usuarios()
+    global excel_last_updated
+    excel_last_updated = datetime.now().strftime("%Y-%m-%d %H:%M")
     
     # Mostrar estadísticas finales
     print("\n📊 RESULTADOS:")
+    print(f"🔄 Filas nuevas o modificadas: {stats['filas_cambiadas']} de {stats['filas']}")
     print(f"✅ Usuarios nuevos: {stats['usuarios_nuevos']}")
     print(f"✅ Asignaturas añadidas: {stats['asignaturas_nuevas']}")
-    print(f"⏩ Datos ignorados (ya existentes): {stats['ignorados']}")
+    print(f"➖ Asignaturas quitadas de su fila del Excel: {stats['asignaturas_quitadas']}")
+    print(f"🗑️ Usuarios sin registrar eliminados del Excel: {stats['usuarios_eliminados']}")
+    print(f"⏩ Datos ignorados (filas sin email, nombre o tipo válido): {stats['ignorados']}")
+    print(f"⏱️ {stats['filas']} filas en {duracion:.2f} s ({stats['filas_por_segundo']:.0f} filas/s)")
     
     return stats
@@ -0,0 +1,229 @@
+"""
+Conjuntos de franjas horarias para el editor de horarios.
+
+ConjuntoFranjas guarda las franjas de un día como dos listas ordenadas de
+inicios y fines (minutos desde las 00:00) ya fusionadas: nunca hay dos
+franjas que se solapen ni que se toquen. Las franjas son semiabiertas,
+[inicio, fin): 10:00-11:00 y 11:00-12:00 no se solapan y al añadirlas
+quedan como 10:00-12:00.
+
+Buscar dónde cae una franja es una búsqueda binaria (bisect). Añadir o
+quitar sustituye el tramo afectado de las listas, que desplaza los
+elementos siguientes: O(n), no O(log n). Se deja así a propósito: franjas
+fusionadas de al menos un minuto caben como mucho 720 en un día, y mover
+720 referencias es una copia de memoria que cuesta menos de 1 µs, menos que
+recorrer los nodos de un árbol equilibrado en Python. HorarioSemanal junta
+siete conjuntos (0 = lunes) y añade las operaciones en bloque del editor:
+copiar un día a otros e importar un horario completo.
+
+El editor trabaja con franjas en texto ("HH:MM-HH:MM"); franjas_a_conjunto()
+y hay_solapamiento() las pasan a ConjuntoFranjas. Están aquí y no en
+handlers/horarios.py para poder probarlas sin telebot.
+
+diagnostico_franjas.py compara estas operaciones con un modelo ingenuo
+(el conjunto de minutos ocupados) sobre secuencias aleatorias.
+"""
+import logging
+from bisect import bisect_left, bisect_right
+
+from utils.motor_horarios import DIAS_SEMANA
+
+logger = logging.getLogger(__name__)
+
+DIAS_LABORABLES = (0, 1, 2, 3, 4)
+
+
+class ConjuntoFranjas:
+    """Franjas [inicio, fin) de un día, ordenadas y fusionadas"""
+
+    __slots__ = ("_inicios", "_fines")
+
+    def __init__(self, franjas=()):
+        self._inicios = []
+        self._fines = []
+        if franjas:
+            self.importar(franjas)
+
+    def __len__(self):
+        return len(self._inicios)
+
+    def __bool__(self):
+        return bool(self._inicios)
+
+    def __iter__(self):
+        return zip(self._inicios, self._fines)
+
+    def __eq__(self, otro):
+        return isinstance(otro, ConjuntoFranjas) and list(self) == list(otro)
+
+    def __repr__(self):
+        return f"ConjuntoFranjas({list(self)!r})"
+
+    def copia(self):
+        nuevo = ConjuntoFranjas()
+        nuevo._inicios = list(self._inicios)
+        nuevo._fines = list(self._fines)
+        return nuevo
+
+    def minutos(self):
+        """Minutos cubiertos en total"""
+        return sum(fin - inicio for inicio, fin in self)
+
+    # ===== CONSULTAS =====
+    def contiene(self, minuto):
+        """True si el minuto cae dentro de alguna franja"""
+        i = bisect_right(self._inicios, minuto) - 1
+        return i >= 0 and minuto < self._fines[i]
+
+    def solapa(self, inicio, fin):
+        """True si [inicio, fin) comparte algún minuto con el conjunto"""
+        if inicio >= fin:
+            return False
+        i = bisect_right(self._fines, inicio)   # Primera franja que acaba después de `inicio`
+        return i < len(self._inicios) and self._inicios[i] < fin
+
+    def solapadas(self, inicio, fin):
+        """Franjas del conjunto que comparten algún minuto con [inicio, fin)"""
+        if inicio >= fin:
+            return []
+        desde = bisect_right(self._fines, inicio)
+        hasta = bisect_left(self._inicios, fin)
+        return list(zip(self._inicios[desde:hasta], self._fines[desde:hasta]))
+
+    # ===== MODIFICACIÓN =====
+    def anadir(self, inicio, fin):
+        """Añade [inicio, fin) fusionándola con las franjas que solape o toque (O(log n) + desplazamiento)"""
+        if inicio >= fin:
+            return
+        desde = bisect_left(self._fines, inicio)     # Acaban en `inicio` o después
+        hasta = bisect_right(self._inicios, fin)     # Empiezan en `fin` o antes
+        if desde < hasta:
+            inicio = min(inicio, self._inicios[desde])
+            fin = max(fin, self._fines[hasta - 1])
+        self._inicios[desde:hasta] = [inicio]
+        self._fines[desde:hasta] = [fin]
+
+    def quitar(self, inicio, fin):
+        """Quita [inicio, fin), recortando o partiendo las franjas afectadas (O(log n) + desplazamiento)"""
+        if inicio >= fin:
+            return
+        desde = bisect_right(self._fines, inicio)
+        hasta = bisect_left(self._inicios, fin)
+        if desde >= hasta:
+            return
+        inicios, fines = [], []
+        if self._inicios[desde] < inicio:
+            inicios.append(self._inicios[desde])
+            fines.append(inicio)
+        if self._fines[hasta - 1] > fin:
+            inicios.append(fin)
+            fines.append(self._fines[hasta - 1])
+        self._inicios[desde:hasta] = inicios
+        self._fines[desde:hasta] = fines
+
+    def importar(self, franjas):
+        """Añade muchas franjas de una vez: se ordenan y fusionan en una pasada"""
+        todas = sorted([(i, f) for i, f in franjas if i < f] + list(self))
+        self._inicios, self._fines = [], []
+        for inicio, fin in todas:
+            if self._fines and inicio <= self._fines[-1]:
+                if fin > self._fines[-1]:
+                    self._fines[-1] = fin
+            else:
+                self._inicios.append(inicio)
+                self._fines.append(fin)
+
+    def union(self, otro):
+        nuevo = self.copia()
+        nuevo.importar(otro)
+        return nuevo
+
+    def diferencia(self, otro):
+        nuevo = self.copia()
+        for inicio, fin in otro:
+            nuevo.quitar(inicio, fin)
+        return nuevo
+
+
+class HorarioSemanal:
+    """Un ConjuntoFranjas por día de la semana (0 = lunes)"""
+
+    __slots__ = ("dias",)
+
+    def __init__(self):
+        self.dias = [ConjuntoFranjas() for _ in DIAS_SEMANA]
+
+    @classmethod
+    def desde_franjas(cls, franjas):
+        """Horario a partir de filas (día, inicio, fin), como las de Franjas_horario"""
+        horario = cls()
+        horario.importar(franjas)
+        return horario
+
+    def __eq__(self, otro):
+        return isinstance(otro, HorarioSemanal) and self.dias == otro.dias
+
+    def __bool__(self):
+        return any(self.dias)
+
+    def franjas(self):
+        """Filas (día, inicio, fin) ordenadas"""
+        return [(dia, inicio, fin) for dia, conjunto in enumerate(self.dias) for inicio, fin in conjunto]
+
+    def anadir(self, dia, inicio, fin):
+        self.dias[dia].anadir(inicio, fin)
+
+    def quitar(self, dia, inicio, fin):
+        self.dias[dia].quitar(inicio, fin)
+
+    def solapa(self, dia, inicio, fin):
+        return self.dias[dia].solapa(inicio, fin)
+
+    def importar(self, franjas):
+        """Añade un horario completo (filas (día, inicio, fin)) en una pasada por día"""
+        por_dia = [[] for _ in DIAS_SEMANA]
+        for dia, inicio, fin in franjas:
+            por_dia[dia].append((inicio, fin))
+        for dia, lista in enumerate(por_dia):
+            if lista:
+                self.dias[dia].importar(lista)
+
+    def copiar_dia(self, origen, destinos=DIAS_LABORABLES):
+        """Sustituye las franjas de los días `destinos` por las de `origen`"""
+        for destino in destinos:
+            if destino != origen:
+                self.dias[destino] = self.dias[origen].copia()
+
+
+def convertir_a_minutos(hora_str):
+    """Convierte una hora en formato HH:MM a minutos para facilitar comparaciones"""
+    horas, minutos = map(int, hora_str.split(":"))
+    return horas * 60 + minutos
+
+
+def franjas_a_conjunto(franjas):
+    """Lista de "HH:MM-HH:MM" -> ConjuntoFranjas; las franjas mal escritas se ignoran con un aviso"""
+    validas = []
+    for franja in franjas:
+        try:
+            inicio, fin = franja.split("-")
+            validas.append((convertir_a_minutos(inicio), convertir_a_minutos(fin)))
+        except ValueError:
+            logger.warning(f"Franja mal escrita ignorada: {franja!r}")
+    return ConjuntoFranjas(validas)
+
+
+def hay_solapamiento(franjas_existentes, nueva_franja):
+    """Verifica si una nueva franja horaria se solapa con las existentes"""
+    if not franjas_existentes:
+        return False
+
+    try:
+        inicio_nueva, fin_nueva = nueva_franja.split("-")
+        inicio, fin = convertir_a_minutos(inicio_nueva), convertir_a_minutos(fin_nueva)
+    except ValueError as e:
+        # El formato se valida antes; una franja ilegible no es un solapamiento
+        logger.error(f"Franja nueva mal escrita {nueva_franja!r}: {e}")
+        return False
+
+    return franjas_a_conjunto(franjas_existentes).solapa(inicio, fin)
@@ -0,0 +1,396 @@
+"""
+Cola de salida de mensajes de Telegram.
+
+Telegram limita los envíos de un bot: unos 30 mensajes por segundo en
+total, alrededor de uno por segundo a cada chat privado y 20 por minuto a
+cada grupo. Al superarlo responde 429 con retry_after. En lugar de llamar a
+bot.send_message en un bucle, los handlers encolan aquí las llamadas y
+reciben un Future al instante.
+
+Un hilo planificador decide qué se envía y cuándo con cubos de tokens
+(global, por chat privado y por grupo), y un pequeño grupo de hilos hace
+las llamadas a la API. Hay dos carriles: INTERACTIVO (respuestas a lo que
+acaba de hacer un usuario) y MASIVO (avisos a muchos miembros). El masivo
+no puede gastar la reserva de tokens globales del interactivo, así que un
+aviso a 300 estudiantes no retrasa la respuesta a quien está usando el bot
+(la reserva también deja margen a las respuestas que se envían directamente).
+
+Las llamadas a un mismo chat salen en el orden en que se encolaron. Un 429
+pausa ese chat durante retry_after y frena un momento todos los envíos (si
+es el límite global, insistir solo lo alarga) y reduce el ritmo global,
+que se recupera poco a poco con los envíos que salen bien; los errores de red o 5xx se reintentan
+con espera exponencial y los 4xx (usuario que ha bloqueado el bot, chat
+inexistente...) fallan sin reintentar y quedan en el log.
+"""
+import os
+import sys
+import time
+import heapq
+import itertools
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.consultas import percentil
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVO = 0
+MASIVO = 1
+CARRILES = (INTERACTIVO, MASIVO)
+
+ESPERA_BASE = 1.0      # Segundos antes del primer reintento por error temporal (se duplica)
+MAX_INTENTOS = 4       # Intentos por llamada ante errores temporales
+RESERVA = 0.2          # Fracción del cubo global que el carril masivo no puede gastar
+PAUSA_GLOBAL = 1.0     # Segundos máximos que un 429 frena todos los envíos
+FRENADO = 0.8          # Factor del ritmo global tras un 429 (se recupera poco a poco al enviar)
+
+
+def _codigo_error(error):
+    """Código HTTP de un error de la API (telebot o python-telegram-bot), o None"""
+    codigo = getattr(error, "error_code", None)
+    if codigo is None and getattr(error, "retry_after", None) is not None:
+        codigo = 429
+    return codigo
+
+
+def _retry_after(error):
+    """Segundos que pide esperar un 429 (por defecto 1)"""
+    segundos = getattr(error, "retry_after", None)
+    if segundos is None:
+        resultado = getattr(error, "result_json", None) or {}
+        segundos = (resultado.get("parameters") or {}).get("retry_after")
+    return float(segundos or 1)
+
+
+class CuboTokens:
+    """Cubo de tokens: hasta `capacidad` llamadas seguidas y `ritmo` por segundo a la larga"""
+
+    __slots__ = ("capacidad", "ritmo", "tokens", "actualizado")
+
+    def __init__(self, capacidad, ritmo, ahora=None):
+        self.capacidad = capacidad
+        self.ritmo = ritmo
+        self.tokens = float(capacidad)
+        self.actualizado = time.monotonic() if ahora is None else ahora
+
+    def _rellenar(self, ahora):
+        if ahora > self.actualizado:
+            self.tokens = min(self.capacidad, self.tokens + (ahora - self.actualizado) * self.ritmo)
+            self.actualizado = ahora
+
+    def falta(self, ahora, reserva=0.0):
+        """Segundos hasta que haya un token sin tocar la reserva (0 si ya lo hay)"""
+        self._rellenar(ahora)
+        necesarios = 1.0 + reserva - self.tokens
+        return 0.0 if necesarios <= 0 else necesarios / self.ritmo
+
+    def consumir(self, ahora):
+        self._rellenar(ahora)
+        self.tokens -= 1.0
+
+    def vaciar(self, ahora, segundos):
+        """Deja el cubo sin tokens durante los próximos `segundos`"""
+        self._rellenar(ahora)
+        self.tokens = min(self.tokens, -segundos * self.ritmo)
+
+    def lleno(self, ahora):
+        self._rellenar(ahora)
+        return self.tokens >= self.capacidad
+
+
+class _Llamada:
+    __slots__ = ("metodo", "args", "kwargs", "prioridad", "limitar_chat", "futuro", "encolada", "intentos")
+
+    def __init__(self, metodo, args, kwargs, prioridad, limitar_chat):
+        self.metodo = metodo
+        self.args = args
+        self.kwargs = kwargs
+        self.prioridad = prioridad
+        self.limitar_chat = limitar_chat
+        self.futuro = Future()
+        self.encolada = time.monotonic()
+        self.intentos = 0
+
+
+class _Chat:
+    __slots__ = ("pendientes", "cubo", "listo", "en_vuelo")
+
+    def __init__(self, cubo):
+        self.pendientes = deque()
+        self.cubo = cubo
+        self.listo = 0.0        # monotonic a partir del cual puede salir (tras un 429 o un reintento)
+        self.en_vuelo = False   # Hay una llamada a la API en curso para este chat
+
+
+class ColaMensajes:
+    """Cola de llamadas a la API de Telegram con límites de ritmo y dos carriles"""
+
+    def __init__(self, bot, por_segundo=30, por_chat_segundo=1.0, por_grupo_minuto=20, hilos=4,
+                 max_intentos=MAX_INTENTOS, espera_base=ESPERA_BASE, reserva=RESERVA):
+        self.bot = bot
+        self.por_chat_segundo = por_chat_segundo
+        self.por_grupo_minuto = por_grupo_minuto
+        self.max_intentos = max_intentos
+        self.espera_base = espera_base
+        self.reserva = por_segundo * reserva
+        self.num_hilos = hilos
+        # Capacidad + ritmo = por_segundo: en ningún intervalo de un segundo salen más. El masivo
+        # solo envía con el cubo por encima de la reserva, así que su ritmo es el del relleno
+        capacidad = self.reserva + 1
+        self._global = CuboTokens(capacidad, por_segundo - capacidad)
+        self._ritmo_max = self._global.ritmo
+        self._chats = {}                          # {chat_id: _Chat}
+        self._listos = {c: [] for c in CARRILES}  # {carril: [(listo, orden, chat_id)]}
+        self._orden = itertools.count()
+        self._cond = threading.Condition()
+        self._hilo = None
+        self._envios = None
+        self._parar = False
+
+        # Métricas
+        self.encolados = 0
+        self.enviados = 0
+        self.fallidos = 0
+        self.reintentos = 0
+        self.limitados = 0   # Respuestas 429
+        self._latencias = {c: deque(maxlen=1024) for c in CARRILES}
+
+    # ===== API =====
+    def encolar(self, chat_id, metodo, *args, prioridad=MASIVO, limitar_chat=True, **kwargs):
+        """
+        Encola bot.<metodo>(chat_id, *args, **kwargs) sin esperar
+
+        Args:
+            limitar_chat: Si cuenta para el límite del chat; False para llamadas que no
+                son mensajes (expulsiones, permisos), que solo cuentan para el global
+
+        Returns:
+            Future: Se resuelve con lo que devuelva la API o con el error definitivo
+        """
+        llamada = _Llamada(metodo, (chat_id,) + args, kwargs, prioridad, limitar_chat)
+        with self._cond:
+            self._iniciar()
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(self._cubo_para(chat_id))
+            chat.pendientes.append(llamada)
+            self.encolados += 1
+            if len(chat.pendientes) == 1 and not chat.en_vuelo:
+                self._programar(chat_id, chat)
+            self._cond.notify()
+        return llamada.futuro
+
+    def enviar_mensaje(self, chat_id, texto, prioridad=MASIVO, **kwargs):
+        return self.encolar(chat_id, "send_message", texto, prioridad=prioridad, **kwargs)
+
+    def detener(self, timeout=30):
+        """Espera a que se vacíe la cola (como mucho timeout) y para los hilos"""
+        limite = time.monotonic() + timeout
+        with self._cond:
+            while self._pendientes() and time.monotonic() < limite:
+                self._cond.wait(0.1)
+            self._parar = True
+            self._cond.notify_all()
+        if self._hilo is not None:
+            self._hilo.join(max(0.0, limite - time.monotonic()))
+        if self._envios is not None:
+            self._envios.shutdown(wait=True)
+
+    # ===== PLANIFICACIÓN =====
+    def _cubo_para(self, chat_id):
+        # Los grupos y supergrupos tienen id negativo
+        if isinstance(chat_id, int) and chat_id < 0:
+            return CuboTokens(3, self.por_grupo_minuto / 60.0)
+        return CuboTokens(1, self.por_chat_segundo)
+
+    def _iniciar(self):
+        if self._hilo is None or not self._hilo.is_alive():
+            self._parar = False
+            self._envios = ThreadPoolExecutor(max_workers=self.num_hilos, thread_name_prefix="telegram-envio")
+            self._hilo = threading.Thread(target=self._planificar, name="telegram-planificador", daemon=True)
+            self._hilo.start()
+
+    def _programar(self, chat_id, chat):
+        """Pone el chat en el carril de su primera llamada pendiente"""
+        carril = chat.pendientes[0].prioridad
+        heapq.heappush(self._listos[carril], (chat.listo, next(self._orden), chat_id))
+
+    def _pendientes(self):
+        return any(c.pendientes or c.en_vuelo for c in self._chats.values())
+
+    def _siguiente(self, ahora):
+        """
+        Elige la próxima llamada que puede salir ya. Devuelve (chat_id, None)
+        o (None, segundos que esperar como mucho antes de volver a mirar).
+        """
+        espera = None
+        for carril in CARRILES:
+            listos = self._listos[carril]
+            while listos:
+                listo, _, chat_id = listos[0]
+                if listo > ahora:
+                    espera = listo - ahora if espera is None else min(espera, listo - ahora)
+                    break
+                chat = self._chats[chat_id]
+                limitar_chat = chat.pendientes[0].limitar_chat
+                falta = chat.cubo.falta(ahora) if limitar_chat else 0.0
+                if falta > 0:
+                    # Su cubo está vacío: se vuelve a mirar cuando tenga token
+                    heapq.heapreplace(listos, (ahora + falta, next(self._orden), chat_id))
+                    continue
+                falta = self._global.falta(ahora, 0.0 if carril == INTERACTIVO else self.reserva)
+                if falta > 0:
+                    espera = falta if espera is None else min(espera, falta)
+                    break
+                heapq.heappop(listos)
+                if limitar_chat:
+                    chat.cubo.consumir(ahora)
+                self._global.consumir(ahora)
+                return chat_id, None
+        return None, espera
+
+    def _planificar(self):
+        ultima_poda = time.monotonic()
+        with self._cond:
+            while not self._parar:
+                ahora = time.monotonic()
+                chat_id, espera = self._siguiente(ahora)
+                if chat_id is None:
+                    if ahora - ultima_poda > 60:
+                        self._podar(ahora)
+                        ultima_poda = ahora
+                    self._cond.wait(espera)
+                    continue
+                chat = self._chats[chat_id]
+                llamada = chat.pendientes.popleft()
+                chat.en_vuelo = True
+                self._envios.submit(self._enviar, chat_id, llamada)
+
+    def _podar(self, ahora):
+        """Olvida los chats sin nada pendiente cuyo cubo ya se ha rellenado"""
+        for chat_id in [c for c, chat in self._chats.items()
+                        if not chat.pendientes and not chat.en_vuelo and chat.cubo.lleno(ahora)
+                        and chat.listo <= ahora]:
+            del self._chats[chat_id]
+
+    # ===== ENVÍO =====
+    def _enviar(self, chat_id, llamada):
+        llamada.intentos += 1
+        try:
+            resultado = getattr(self.bot, llamada.metodo)(*llamada.args, **llamada.kwargs)
+        except Exception as e:
+            self._fallo(chat_id, llamada, e)
+            return
+        with self._cond:
+            self.enviados += 1
+            if self._global.ritmo < self._ritmo_max:
+                self._global.ritmo = min(self._ritmo_max, self._global.ritmo + 0.01)
+            self._latencias[llamada.prioridad].append((time.monotonic() - llamada.encolada) * 1000)
+            self._liberar(chat_id)
+        llamada.futuro.set_result(resultado)
+
+    def _fallo(self, chat_id, llamada, error):
+        codigo = _codigo_error(error)
+        if codigo == 429:
+            retraso = _retry_after(error)
+            self.limitados += 1
+        elif (codigo is None or codigo >= 500) and llamada.intentos < self.max_intentos:
+            retraso = self.espera_base * 2 ** (llamada.intentos - 1)
+            self.reintentos += 1
+        else:
+            with self._cond:
+                self.fallidos += 1
+                self._liberar(chat_id)
+            logger.warning(f"{llamada.metodo} a {chat_id} descartado: {error}")
+            llamada.futuro.set_exception(error)
+            return
+
+        # Vuelve al principio de su chat para no adelantar a las siguientes
+        logger.info(f"{llamada.metodo} a {chat_id}: {error}. Reintento en {retraso:.1f} s")
+        with self._cond:
+            if codigo == 429:
+                self._global.vaciar(time.monotonic(), min(retraso, PAUSA_GLOBAL))
+                self._global.ritmo = max(1.0, self._global.ritmo * FRENADO)
+            chat = self._chats[chat_id]
+            chat.pendientes.appendleft(llamada)
+            chat.listo = time.monotonic() + retraso
+            self._liberar(chat_id)
+
+    def _liberar(self, chat_id):
+        """Tras una llamada: el chat puede volver a programarse (con el lock tomado)"""
+        chat = self._chats[chat_id]
+        chat.en_vuelo = False
+        if chat.pendientes:
+            self._programar(chat_id, chat)
+        self._cond.notify_all()
+
+    def estadisticas(self):
+        with self._cond:
+            pendientes = {c: 0 for c in CARRILES}
+            for chat in self._chats.values():
+                for llamada in chat.pendientes:
+                    pendientes[llamada.prioridad] += 1
+            latencias = {c: sorted(v) for c, v in self._latencias.items()}
+            return {
+                "pendientes_interactivo": pendientes[INTERACTIVO],
+                "pendientes_masivo": pendientes[MASIVO],
+                "chats": len(self._chats),
+                "encolados": self.encolados,
+                "enviados": self.enviados,
+                "fallidos": self.fallidos,
+                "reintentos": self.reintentos,
+                "limitados_429": self.limitados,
+                "ritmo_global": self._global.ritmo,
+                "latencia_interactivo_p95_ms": percentil(latencias[INTERACTIVO], 0.95),
+                "latencia_masivo_p50_ms": percentil(latencias[MASIVO], 0.50),
+                "latencia_masivo_p95_ms": percentil(latencias[MASIVO], 0.95),
+            }
+
+
+# ===== COLAS COMPARTIDAS =====
+_colas = {}
+_colas_lock = threading.Lock()
+
+
+def get_cola_mensajes(bot):
+    """Devuelve la cola de salida de un bot, creándola la primera vez"""
+    cola = _colas.get(id(bot))
+    if cola is None:
+        with _colas_lock:
+            cola = _colas.get(id(bot))
+            if cola is None:
+                try:
+                    from config import (TELEGRAM_MSG_SEGUNDO, TELEGRAM_MSG_CHAT_SEGUNDO,
+                                        TELEGRAM_MSG_GRUPO_MINUTO, TELEGRAM_HILOS_ENVIO)
+                    cola = ColaMensajes(bot, por_segundo=TELEGRAM_MSG_SEGUNDO,
+                                        por_chat_segundo=TELEGRAM_MSG_CHAT_SEGUNDO,
+                                        por_grupo_minuto=TELEGRAM_MSG_GRUPO_MINUTO,
+                                        hilos=TELEGRAM_HILOS_ENVIO)
+                except ImportError:
+                    cola = ColaMensajes(bot)
+                _colas[id(bot)] = cola
+    return cola
+
+
+def enviar_mensaje(bot, chat_id, texto, prioridad=MASIVO, **kwargs):
+    """Encola un send_message (devuelve un Future)"""
+    return get_cola_mensajes(bot).enviar_mensaje(chat_id, texto, prioridad=prioridad, **kwargs)
+
+
+def enviar_a_muchos(bot, chat_ids, texto, prioridad=MASIVO, **kwargs):
+    """Encola el mismo mensaje para varios chats; devuelve {chat_id: Future}"""
+    cola = get_cola_mensajes(bot)
+    return {chat_id: cola.enviar_mensaje(chat_id, texto, prioridad=prioridad, **kwargs)
+            for chat_id in chat_ids}
+
+
+def estadisticas_mensajeria():
+    """Métricas de todas las colas de salida del proceso"""
+    with _colas_lock:
+        colas = list(_colas.values())
+    return [cola.estadisticas() for cola in colas]
@@ -0,0 +1,250 @@
+"""
+Motor de horarios: cada horario de tutorías se analiza una sola vez.
+
+Los horarios se guardan como filas (día, inicio, fin) en minutos en la tabla
+Franjas_horario; compilar_franjas() las convierte en un HorarioCompilado:
+para cada día de la semana, una lista ordenada de franjas ya fusionadas.
+Saber si un profesor está disponible en un momento es entonces una
+búsqueda binaria en la lista del día.
+
+Las franjas son semiabiertas, [inicio, fin), en todo el proyecto (también
+en utils/franjas.py, utils/disponibilidad.py y utils/citas.py): con
+"Lunes 10:00-12:00" se está en horario de 10:00 a 11:59 y a las 12:00 ya no.
+
+Los horarios en texto solo se analizan al escribirlos o al migrar los
+antiguos, que llegaron a tener tres formatos:
+
+    "Lunes de 10:00 a 12:00"                         (Horarios_Profesores)
+    "Lunes 10:00-12:00, Miércoles 09:00-11:00"      (Usuarios.Horario)
+    "Lunes: 10:00-12:00, 16:00-18:00; Martes: 9-11"  (antiguo horarios_utils)
+
+compilar_horario() hace lo mismo desde el texto y se cachea por texto, que
+hace de versión del horario. La caché por profesor está en db/queries.py.
+"""
+import re
+from bisect import bisect_right
+from datetime import datetime
+from functools import lru_cache
+
+DIAS_SEMANA = ("Lunes", "Martes", "Miércoles", "Jueves", "Viernes", "Sábado", "Domingo")
+
+# Nombre (en minúsculas) -> día de la semana (0 = lunes, como datetime.weekday())
+_INDICE_DIA = {
+    "lunes": 0, "martes": 1, "miércoles": 2, "miercoles": 2, "jueves": 3,
+    "viernes": 4, "sábado": 5, "sabado": 5, "domingo": 6,
+}
+
+# Un día o una franja; las franjas se asignan al último día leído, de modo que
+# "Lunes: 10-12, 16-18" y "Lunes 10:00-12:00, Martes 09:00-11:00" salen igual
+_PATRON = re.compile(
+    r"(?P<dia>lunes|martes|mi[eé]rcoles|jueves|viernes|s[aá]bado|domingo)"
+    r"|(?P<h1>\d{1,2}):?(?P<m1>\d{2})?\s*(?:-|\ba\b)\s*(?P<h2>\d{1,2}):?(?P<m2>\d{2})?"
+)
+
+MAX_HORARIOS = 4096   # Textos distintos compilados que se mantienen en memoria
+
+_compilaciones = 0
+_consultas = 0
+
+
+class HorarioCompilado:
+    """Franjas de un horario por día de la semana, en minutos y ordenadas"""
+
+    __slots__ = ("fuente", "_inicios", "_fines")
+
+    def __init__(self, fuente, franjas_por_dia):
+        self.fuente = fuente
+        self._inicios = tuple(tuple(inicio for inicio, _ in franjas) for franjas in franjas_por_dia)
+        self._fines = tuple(tuple(fin for _, fin in franjas) for franjas in franjas_por_dia)
+
+    def __bool__(self):
+        return any(self._inicios)
+
+    def __repr__(self):
+        return f"HorarioCompilado({self.fuente!r})"
+
+    def franjas(self, dia):
+        """Lista de (inicio, fin) en minutos del día dado (0 = lunes)"""
+        return list(zip(self._inicios[dia], self._fines[dia]))
+
+    def disponible_en(self, dia, minuto):
+        """True si el minuto del día cae dentro de alguna franja [inicio, fin)"""
+        inicios = self._inicios[dia]
+        i = bisect_right(inicios, minuto) - 1
+        return i >= 0 and minuto < self._fines[dia][i]
+
+    def proxima_franja(self, dia, minuto):
+        """
+        Primera franja que está en curso o empieza a partir de (dia, minuto),
+        buscando hasta una semana por delante
+
+        Returns:
+            tuple: (días por delante, inicio, fin) o None si el horario está vacío
+        """
+        for adelante in range(8):
+            d = (dia + adelante) % 7
+            inicios = self._inicios[d]
+            if not inicios:
+                continue
+            if adelante == 0:
+                i = bisect_right(inicios, minuto) - 1
+                if i >= 0 and minuto < self._fines[d][i]:
+                    return 0, inicios[i], self._fines[d][i]
+                i += 1
+                if i < len(inicios):
+                    return 0, inicios[i], self._fines[d][i]
+            else:
+                return adelante, inicios[0], self._fines[d][0]
+        return None
+
+    def disponible(self, momento=None):
+        """True si el profesor está en horario de tutoría en `momento` (por defecto, ahora)"""
+        global _consultas
+        if momento is None:
+            momento = datetime.now()
+        _consultas += 1
+        return self.disponible_en(momento.weekday(), momento.hour * 60 + momento.minute)
+
+
+def _a_minutos(hora, minuto):
+    hora = int(hora)
+    minuto = int(minuto or 0)
+    if hora > 24 or minuto > 59 or (hora == 24 and minuto):
+        return None
+    return hora * 60 + minuto
+
+
+def fusionar_franjas(franjas):
+    """Ordena las franjas (inicio, fin) y fusiona las que se solapan o se tocan; descarta las vacías"""
+    fusionadas = []
+    for inicio, fin in sorted(franjas):
+        if fin <= inicio:
+            continue
+        if fusionadas and inicio <= fusionadas[-1][1]:
+            if fin > fusionadas[-1][1]:
+                fusionadas[-1] = (fusionadas[-1][0], fin)
+        else:
+            fusionadas.append((inicio, fin))
+    return fusionadas
+
+
+def analizar_horario(horario_str):
+    """
+    Convierte un horario en texto (cualquiera de los formatos del módulo) en
+    una lista ordenada y sin repetidos de franjas (día, inicio, fin) en minutos
+
+    Las franjas sin día delante, con horas imposibles o que no terminan
+    después de empezar se ignoran. Solo se usa al escribir un horario o al migrar los
+    antiguos: las lecturas van a la tabla Franjas_horario.
+    """
+    franjas = set()
+    dia = None
+    for coincidencia in _PATRON.finditer((horario_str or "").lower()):
+        if coincidencia.group("dia"):
+            dia = _INDICE_DIA[coincidencia.group("dia")]
+            continue
+        if dia is None:
+            continue
+        inicio = _a_minutos(coincidencia.group("h1"), coincidencia.group("m1"))
+        fin = _a_minutos(coincidencia.group("h2"), coincidencia.group("m2"))
+        if inicio is None or fin is None or fin <= inicio:
+            continue
+        franjas.add((dia, inicio, fin))
+    return sorted(franjas)
+
+
+def compilar_franjas(franjas):
+    """HorarioCompilado a partir de filas (día, inicio, fin), sin analizar texto"""
+    por_dia = [[] for _ in DIAS_SEMANA]
+    for dia, inicio, fin in franjas:
+        por_dia[dia].append((inicio, fin))
+    return HorarioCompilado(horario_a_texto(franjas), [fusionar_franjas(f) for f in por_dia])
+
+
+@lru_cache(maxsize=MAX_HORARIOS)
+def compilar_horario(horario_str):
+    """
+    Analiza un horario en texto (cualquiera de los formatos del módulo)
+
+    Returns:
+        HorarioCompilado: vacío (falso) si no hay ninguna franja válida
+    """
+    global _compilaciones
+    _compilaciones += 1
+
+    por_dia = [[] for _ in DIAS_SEMANA]
+    for dia, inicio, fin in analizar_horario(horario_str):
+        por_dia[dia].append((inicio, fin))
+    return HorarioCompilado(horario_str, [fusionar_franjas(franjas) for franjas in por_dia])
+
+
+# ===== FORMATO =====
+def indice_dia(nombre):
+    """Día de la semana (0 = lunes) de un nombre como "Miércoles" o "miercoles", o None"""
+    return _INDICE_DIA.get((nombre or "").strip().lower())
+
+
+def formatear_minuto(minuto):
+    """Minutos desde las 00:00 en formato HH:MM (540 -> 09:00)"""
+    return f"{minuto // 60:02d}:{minuto % 60:02d}"
+
+
+def formatear_franja(inicio, fin):
+    """Franja en formato HH:MM-HH:MM ((540, 660) -> 09:00-11:00)"""
+    return f"{formatear_minuto(inicio)}-{formatear_minuto(fin)}"
+
+
+def horario_a_texto(franjas):
+    """Filas (día, inicio, fin) -> "Lunes 10:00-12:00, Martes 09:00-11:00" (Usuarios.Horario)"""
+    return ", ".join(f"{DIAS_SEMANA[dia]} {formatear_franja(inicio, fin)}"
+                     for dia, inicio, fin in sorted(franjas))
+
+
+def franjas_por_dia(franjas):
+    """Filas (día, inicio, fin) -> {"Lunes": ["10:00-12:00"], ...} en orden de la semana"""
+    resultado = {}
+    for dia, inicio, fin in sorted(franjas):
+        resultado.setdefault(DIAS_SEMANA[dia], []).append(formatear_franja(inicio, fin))
+    return resultado
+
+
+def esta_disponible(horario_str, momento=None):
+    """True si `momento` (por defecto, ahora) cae dentro del horario en texto"""
+    if not horario_str or not horario_str.strip():
+        return False
+    return compilar_horario(horario_str).disponible(momento)
+
+
+def disponibles(horarios, momento=None):
+    """
+    Disponibilidad de muchos profesores en el mismo instante
+
+    Args:
+        horarios: dict {profesor_id: horario en texto o HorarioCompilado}
+        momento: datetime a comprobar (por defecto, ahora)
+
+    Returns:
+        dict {profesor_id: bool}
+    """
+    if momento is None:
+        momento = datetime.now()
+    dia, minuto = momento.weekday(), momento.hour * 60 + momento.minute
+    resultado = {}
+    for profesor_id, horario in horarios.items():
+        if not horario:
+            resultado[profesor_id] = False
+            continue
+        if isinstance(horario, str):
+            horario = compilar_horario(horario)
+        resultado[profesor_id] = horario.disponible_en(dia, minuto)
+    return resultado
+
+
+def estadisticas():
+    info = compilar_horario.cache_info()
+    return {
+        "compilaciones": _compilaciones,
+        "consultas": _consultas,
+        "horarios_en_memoria": info.currsize,
+        "aciertos": info.hits,
+    }
@@ -1,25 +1,582 @@
-import time  # Añadir importación de time
+"""
+Estado de las conversaciones de los bots (compartido entre módulos).
 
-# Estados de usuario y datos temporales (compartidos entre módulos)
-user_states = {}
-user_data = {}
-estados_timestamp = {}  # Añadir esta variable
+Todas las conversaciones viven en un único AlmacenEstados: por chat, el
+estado actual, sus datos temporales y la marca de la última interacción.
+Cada entrada caduca tras su TTL sin actividad y el almacén tiene un tamaño
+máximo, así que la memoria no crece con los usuarios que abandonan una
+conversación a medias.
+
+Las entradas con el mismo TTL se guardan en una cola ordenada por la última
+vez que se tocaron (que es también su orden de caducidad), de modo que
+renovar, caducar o expulsar una entrada cuesta O(1) amortizado y el
+barrido solo recorre lo que de verdad caduca.
+
+user_states, user_data y estados_timestamp siguen funcionando como
+diccionarios, pero son vistas sobre el almacén: cualquier handler que los
+importe de aquí comparte las mismas conversaciones.
+
+Con ESTADOS_COMPARTIDOS las conversaciones viven en el backend de
+utils/backend_estado.py y varios procesos del mismo bot pueden atender
+updates: cada update se procesa dentro de sesion(), que toma el cerrojo del
+chat, trae su conversación del backend y la devuelve al terminar.
+"""
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from collections.abc import MutableMapping
+
+logger = logging.getLogger(__name__)
+
+ESTADO_INICIAL = 'INICIO'
+TTL_ESTADO = 3600             # Segundos sin actividad tras los que se olvida una conversación
+MAX_CONVERSACIONES = 50000    # Conversaciones como máximo en memoria
+INTERVALO_VOLCADO = 5.0       # Segundos entre volcados al backend (solo si es persistente)
+PREFIJO_CLAVE = "conv:"       # Claves de las conversaciones en el backend
+
+class _Conversacion:
+    __slots__ = ("estado", "datos", "marca", "ttl", "caduca")
+
+    def __init__(self, ttl):
+        self.estado = None
+        self.datos = None
+        self.marca = None
+        self.ttl = ttl
+        self.caduca = 0.0
+
+    def vacia(self):
+        return self.estado is None and self.datos is None
+
+    def serializar(self):
+        return json.dumps({"estado": self.estado, "datos": self.datos, "marca": self.marca,
+                           "ttl": self.ttl, "caduca": self.caduca})
+
+    @classmethod
+    def deserializar(cls, valor):
+        campos = json.loads(valor)
+        conv = cls(campos["ttl"])
+        conv.estado = campos["estado"]
+        conv.datos = campos["datos"]
+        conv.marca = campos["marca"]
+        conv.caduca = campos["caduca"]
+        return conv
+
+
+def _clave(chat_id):
+    return f"{PREFIJO_CLAVE}{chat_id}"
+
+
+class AlmacenEstados:
+    """Estado y datos de conversación por chat, acotado y con caducidad por entrada"""
+
+    def __init__(self, ttl=TTL_ESTADO, max_entradas=MAX_CONVERSACIONES, persistente=False,
+                 compartido=False, backend=None):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        # Compartido ya guarda cada conversación al final de su sesión: no hace falta el volcado
+        self.compartido = compartido
+        self.persistente = persistente and not compartido
+        self._backend = backend
+        self._entradas = {}   # {chat_id: _Conversacion}
+        self._colas = {}      # {ttl: OrderedDict(chat_id -> None)} en orden de caducidad
+        self._lock = threading.RLock()
+        self._sucias = set()  # chat_id pendientes de volcar a la BD
+        self._borradas = set()
+        self._hilo = None
+        self._cargado = not self.persistente
+        self._local = threading.local()   # chat_id con sesión abierta en cada hilo
+
+        # Contadores
+        self.caducadas = 0
+        self.expulsadas = 0
+        self.sesiones = 0
+        self.esperas_agotadas = 0
+
+    # ===== ENTRADAS =====
+    def _tocar(self, chat_id, conv, ahora, ttl=None):
+        """Renueva la caducidad y mueve la entrada al final de la cola de su TTL"""
+        if ttl is not None and ttl != conv.ttl:
+            self._colas.get(conv.ttl, {}).pop(chat_id, None)
+            conv.ttl = ttl
+        conv.caduca = ahora + conv.ttl
+        cola = self._colas.get(conv.ttl)
+        if cola is None:
+            cola = self._colas[conv.ttl] = OrderedDict()
+        cola[chat_id] = None
+        cola.move_to_end(chat_id)
+        if self.persistente:
+            self._sucias.add(chat_id)
+
+    def _quitar(self, chat_id):
+        conv = self._entradas.pop(chat_id, None)
+        if conv is not None:
+            self._colas.get(conv.ttl, {}).pop(chat_id, None)
+            if self.persistente:
+                self._sucias.discard(chat_id)
+                self._borradas.add(chat_id)
+        return conv
+
+    def _entrada(self, chat_id, crear=False, ahora=None):
+        """Entrada viva del chat (las caducadas cuentan como inexistentes)"""
+        self._cargar()
+        conv = self._entradas.get(chat_id)
+        ahora = ahora or time.time()
+        if conv is not None and conv.caduca <= ahora:
+            self._quitar(chat_id)
+            self.caducadas += 1
+            conv = None
+        if conv is None and crear:
+            self._barrer(ahora)
+            conv = self._entradas[chat_id] = _Conversacion(self.ttl)
+            self._tocar(chat_id, conv, ahora)
+            self._acotar()
+        return conv
+
+    def _limpiar_si_vacia(self, chat_id, conv):
+        if conv is not None and conv.vacia():
+            self._quitar(chat_id)
+
+    def _barrer(self, ahora):
+        """Retira las entradas caducadas; solo mira el principio de cada cola"""
+        retiradas = 0
+        for cola in list(self._colas.values()):
+            while cola:
+                chat_id = next(iter(cola))
+                conv = self._entradas.get(chat_id)
+                if conv is not None and conv.caduca > ahora:
+                    break
+                cola.popitem(last=False)
+                if conv is not None:
+                    self._quitar(chat_id)
+                    retiradas += 1
+        self.caducadas += retiradas
+        return retiradas
+
+    def _acotar(self):
+        """Expulsa las conversaciones que antes caducan mientras se supere el máximo"""
+        while len(self._entradas) > self.max_entradas:
+            cola = min((c for c in self._colas.values() if c),
+                       key=lambda c: self._entradas[next(iter(c))].caduca)
+            chat_id, _ = cola.popitem(last=False)
+            self._quitar(chat_id)
+            self.expulsadas += 1
+
+    # ===== ESTADO =====
+    def obtener_estado(self, chat_id, defecto=None):
+        with self._lock:
+            conv = self._entrada(chat_id)
+            return conv.estado if conv is not None and conv.estado is not None else defecto
+
+    def poner_estado(self, chat_id, estado, ttl=None):
+        """Establece el estado del chat; ttl permite una caducidad distinta para esta conversación"""
+        ahora = time.time()
+        with self._lock:
+            conv = self._entrada(chat_id, crear=True, ahora=ahora)
+            conv.estado = estado
+            conv.marca = ahora
+            self._tocar(chat_id, conv, ahora, ttl)
+        return estado
+
+    def quitar_estado(self, chat_id):
+        with self._lock:
+            conv = self._entrada(chat_id)
+            if conv is not None:
+                conv.estado = None
+                conv.marca = None
+                self._limpiar_si_vacia(chat_id, conv)
+
+    # ===== DATOS =====
+    def obtener_datos(self, chat_id, crear=False):
+        """Diccionario de datos del chat (se modifica en el sitio); None si no hay"""
+        ahora = time.time()
+        with self._lock:
+            conv = self._entrada(chat_id, crear=crear, ahora=ahora)
+            if conv is None:
+                return None
+            if conv.datos is None:
+                if not crear:
+                    return None
+                conv.datos = {}
+            self._tocar(chat_id, conv, ahora)
+            return conv.datos
+
+    def poner_datos(self, chat_id, datos):
+        ahora = time.time()
+        with self._lock:
+            conv = self._entrada(chat_id, crear=True, ahora=ahora)
+            conv.datos = datos
+            self._tocar(chat_id, conv, ahora)
+
+    def quitar_datos(self, chat_id):
+        with self._lock:
+            conv = self._entrada(chat_id)
+            if conv is not None:
+                conv.datos = None
+                self._limpiar_si_vacia(chat_id, conv)
+
+    # ===== MARCA DE TIEMPO =====
+    def obtener_marca(self, chat_id):
+        with self._lock:
+            conv = self._entrada(chat_id)
+            return conv.marca if conv is not None else None
+
+    def poner_marca(self, chat_id, marca):
+        ahora = time.time()
+        with self._lock:
+            conv = self._entrada(chat_id, crear=True, ahora=ahora)
+            conv.marca = marca
+            self._tocar(chat_id, conv, ahora)
+            self._limpiar_si_vacia(chat_id, conv)
+
+    def quitar_marca(self, chat_id):
+        with self._lock:
+            conv = self._entrada(chat_id)
+            if conv is not None:
+                conv.marca = None
+
+    # ===== CONJUNTO =====
+    def limpiar(self, chat_id):
+        """Olvida por completo la conversación del chat"""
+        with self._lock:
+            self._quitar(chat_id)
+        if self.compartido and chat_id not in self._abiertas():
+            # Fuera de una sesión nadie la va a devolver al backend: se borra allí también
+            self._get_backend().borrar(_clave(chat_id))
+
+    def limpiar_caducados(self):
+        with self._lock:
+            return self._barrer(time.time())
+
+    def claves(self, atributo):
+        """chat_id vivos con el atributo dado (copia, se puede modificar el almacén al recorrerla)"""
+        ahora = time.time()
+        with self._lock:
+            self._cargar()
+            return [chat_id for chat_id, conv in self._entradas.items()
+                    if conv.caduca > ahora and getattr(conv, atributo) is not None]
+
+    def estadisticas(self):
+        with self._lock:
+            return {
+                "conversaciones": len(self._entradas),
+                "max_conversaciones": self.max_entradas,
+                "ttl": self.ttl,
+                "colas_ttl": len(self._colas),
+                "caducadas": self.caducadas,
+                "expulsadas": self.expulsadas,
+                "persistente": self.persistente,
+                "compartido": self.compartido,
+                "sesiones": self.sesiones,
+                "esperas_agotadas": self.esperas_agotadas,
+                "pendientes_volcar": len(self._sucias) + len(self._borradas),
+            }
+
+    # ===== SESIONES (estado compartido entre procesos) =====
+    def _get_backend(self):
+        if self._backend is None:
+            from utils.backend_estado import get_backend
+            self._backend = get_backend()
+        return self._backend
+
+    def _abiertas(self):
+        abiertas = getattr(self._local, "abiertas", None)
+        if abiertas is None:
+            abiertas = self._local.abiertas = set()
+        return abiertas
+
+    def _traer(self, chat_id):
+        """Sustituye la copia local de la conversación por la del backend"""
+        valor = self._get_backend().leer(_clave(chat_id))
+        with self._lock:
+            self._quitar(chat_id)
+            if valor is None:
+                return
+            try:
+                conv = _Conversacion.deserializar(valor)
+            except (ValueError, KeyError) as e:
+                logger.warning(f"Conversación de {chat_id} ilegible, se descarta: {e}")
+                return
+            if conv.caduca > time.time():
+                self._entradas[chat_id] = conv
+                self._tocar(chat_id, conv, conv.caduca - conv.ttl)
+                self._acotar()
+
+    def _devolver(self, chat_id):
+        """Guarda la conversación en el backend y retira la copia local"""
+        ahora = time.time()
+        with self._lock:
+            conv = self._entrada(chat_id, ahora=ahora)
+            self._quitar(chat_id)
+        try:
+            valor = conv.serializar() if conv is not None else None
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Datos de conversación de {chat_id} no serializables: {e}")
+            return
+        if valor is None:
+            self._get_backend().borrar(_clave(chat_id))
+        else:
+            self._get_backend().escribir(_clave(chat_id), valor, conv.caduca - ahora)
+
+    @contextmanager
+    def sesion(self, *chat_ids, timeout=None):
+        """
+        Procesa un update con la conversación de los chats indicados en
+        exclusiva: toma sus cerrojos (en orden, para no interbloquearse), trae
+        sus conversaciones del backend y las devuelve al salir. Sin estado
+        compartido no hace nada. Las sesiones anidadas del mismo hilo
+        reutilizan la exterior.
+        """
+        abiertas = self._abiertas()
+        nuevos = sorted({c for c in chat_ids if c is not None and c not in abiertas}, key=str)
+        if not self.compartido or not nuevos:
+            yield
+            return
+
+        from utils.backend_estado import propietario_actual, ESPERA_CERROJO
+
+        backend = self._get_backend()
+        propietario = propietario_actual()
+        tomados = []
+        try:
+            for chat_id in nuevos:
+                if backend.esperar_cerrojo(f"chat:{chat_id}", propietario,
+                                           timeout=timeout or ESPERA_CERROJO):
+                    tomados.append(chat_id)
+                else:
+                    # Mejor atender el update sin exclusiva que perderlo
+                    logger.warning(f"Cerrojo del chat {chat_id} ocupado: se procesa sin él")
+                    self.esperas_agotadas += 1
+                self._traer(chat_id)
+                abiertas.add(chat_id)
+            self.sesiones += 1
+            yield
+        finally:
+            for chat_id in nuevos:
+                if chat_id in abiertas:
+                    abiertas.discard(chat_id)
+                    try:
+                        self._devolver(chat_id)
+                    except Exception as e:
+                        logger.error(f"Error guardando la conversación de {chat_id}: {e}")
+            for chat_id in tomados:
+                try:
+                    backend.liberar(f"chat:{chat_id}", propietario)
+                except Exception as e:
+                    logger.error(f"Error liberando el cerrojo del chat {chat_id}: {e}")
+
+    # ===== PERSISTENCIA (opcional) =====
+    def _cargar(self):
+        """Recupera del backend las conversaciones vigentes la primera vez que se usa el almacén"""
+        if self._cargado:
+            return
+        self._cargado = True
+        try:
+            filas = self._get_backend().escanear(PREFIJO_CLAVE)
+        except Exception as e:
+            logger.error(f"No se pudieron cargar los estados de conversación: {e}")
+            return
+        convs = []
+        for clave, valor, _ in filas:
+            try:
+                convs.append((int(clave[len(PREFIJO_CLAVE):]), _Conversacion.deserializar(valor)))
+            except (ValueError, KeyError) as e:
+                logger.warning(f"Conversación {clave} ilegible: {e}")
+        # En orden de caducidad, para que cada cola quede ordenada
+        for chat_id, conv in sorted(convs, key=lambda c: c[1].caduca):
+            self._entradas[chat_id] = conv
+            # Se respeta la caducidad guardada: se encola con el tiempo que le quedaba
+            self._tocar(chat_id, conv, conv.caduca - conv.ttl)
+        self._sucias.clear()
+        self._acotar()
+        if convs:
+            logger.info(f"Recuperadas {len(convs)} conversaciones en curso")
+        self._hilo = threading.Thread(target=self._bucle_volcado, name="estados-volcado", daemon=True)
+        self._hilo.start()
+
+    def volcar(self):
+        """Escribe en el backend las conversaciones modificadas desde el último volcado"""
+        ahora = time.time()
+        with self._lock:
+            self._barrer(ahora)
+            entradas = []
+            for chat_id in self._sucias:
+                conv = self._entradas.get(chat_id)
+                if conv is None:
+                    continue
+                try:
+                    entradas.append((_clave(chat_id), conv.serializar(), conv.caduca - ahora))
+                except (TypeError, ValueError) as e:
+                    logger.warning(f"Datos de conversación de {chat_id} no serializables: {e}")
+            borradas = [_clave(chat_id) for chat_id in self._borradas]
+            self._sucias.clear()
+            self._borradas.clear()
+
+        if not entradas and not borradas:
+            return 0
+
+        # Primero los borrados: un chat borrado y vuelto a crear queda con su versión nueva
+        backend = self._get_backend()
+        backend.borrar_varios(borradas)
+        backend.escribir_varios(entradas)
+        backend.limpiar_caducados()
+        return len(entradas) + len(borradas)
+
+    def _bucle_volcado(self):
+        while True:
+            time.sleep(INTERVALO_VOLCADO)
+            try:
+                self.volcar()
+            except Exception as e:
+                logger.error(f"Error volcando estados de conversación: {e}")
+
+
+# ===== VISTAS COMPATIBLES CON DICT =====
+class _Vista(MutableMapping):
+    """Diccionario {chat_id: valor} sobre un atributo de las conversaciones del almacén"""
+
+    _atributo = None
+
+    def __init__(self, almacen):
+        self._almacen = almacen
+
+    def __iter__(self):
+        return iter(self._almacen.claves(self._atributo))
+
+    def __len__(self):
+        return len(self._almacen.claves(self._atributo))
+
+    def __contains__(self, chat_id):
+        return self._leer(chat_id) is not None
+
+    def __getitem__(self, chat_id):
+        valor = self._leer(chat_id)
+        if valor is None:
+            raise KeyError(chat_id)
+        return valor
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+
+class VistaEstados(_Vista):
+    _atributo = "estado"
+
+    def _leer(self, chat_id):
+        return self._almacen.obtener_estado(chat_id)
+
+    def __setitem__(self, chat_id, estado):
+        self._almacen.poner_estado(chat_id, estado)
+
+    def __delitem__(self, chat_id):
+        if chat_id not in self:
+            raise KeyError(chat_id)
+        self._almacen.quitar_estado(chat_id)
+
+
+class VistaDatos(_Vista):
+    _atributo = "datos"
+
+    def _leer(self, chat_id):
+        return self._almacen.obtener_datos(chat_id)
+
+    def __setitem__(self, chat_id, datos):
+        self._almacen.poner_datos(chat_id, datos)
+
+    def __delitem__(self, chat_id):
+        if chat_id not in self:
+            raise KeyError(chat_id)
+        self._almacen.quitar_datos(chat_id)
+
+
+class VistaMarcas(_Vista):
+    _atributo = "marca"
+
+    def _leer(self, chat_id):
+        return self._almacen.obtener_marca(chat_id)
+
+    def __setitem__(self, chat_id, marca):
+        self._almacen.poner_marca(chat_id, marca)
+
+    def __delitem__(self, chat_id):
+        if chat_id not in self:
+            raise KeyError(chat_id)
+        self._almacen.quitar_marca(chat_id)
+
+
+def _crear_almacen():
+    try:
+        from config import ESTADOS_TTL, ESTADOS_MAX, ESTADOS_PERSISTENTES, ESTADOS_COMPARTIDOS
+    except ImportError:
+        return AlmacenEstados()
+    return AlmacenEstados(ttl=ESTADOS_TTL, max_entradas=ESTADOS_MAX, persistente=ESTADOS_PERSISTENTES,
+                          compartido=ESTADOS_COMPARTIDOS)
+
+
+# Almacén del proceso y vistas (compartidos entre módulos)
+almacen_estados = _crear_almacen()
+user_states = VistaEstados(almacen_estados)
+user_data = VistaDatos(almacen_estados)
+estados_timestamp = VistaMarcas(almacen_estados)
 
 def get_state(chat_id):
     """Obtiene el estado actual del chat"""
-    return user_states.get(chat_id, 'INICIO')
+    return almacen_estados.obtener_estado(chat_id, ESTADO_INICIAL)
 
-def set_state(chat_id, state):
-    """Establece el estado para un chat"""
-    user_states[chat_id] = state
-    estados_timestamp[chat_id] = time.time()  # Actualizar timestamp
-    return state
+def set_state(chat_id, state, ttl=None):
+    """Establece el estado para un chat (y su timestamp)"""
+    return almacen_estados.poner_estado(chat_id, state, ttl)
 
 def clear_state(chat_id):
     """Limpia el estado del usuario"""
-    if chat_id in user_states:
-        del user_states[chat_id]
-    if chat_id in user_data:
-        del user_data[chat_id]
-    if chat_id in estados_timestamp:  # También limpiar el timestamp
-        del estados_timestamp[chat_id]
\ No newline at end of file
+    almacen_estados.limpiar(chat_id)
+
+def limpiar_estados_caducados():
+    """Retira las conversaciones caducadas; devuelve cuántas"""
+    return almacen_estados.limpiar_caducados()
+
+def estadisticas_estados():
+    return almacen_estados.estadisticas()
+
+def sesion_conversacion(*chat_ids):
+    """Bloque con la conversación de los chats en exclusiva (ver AlmacenEstados.sesion)"""
+    return almacen_estados.sesion(*chat_ids)
+
+def _chats_del_update(update):
+    """chat_id y user_id a los que puede afectar un update (mensaje o callback)"""
+    mensaje = getattr(update, "message", None) or update
+    chat = getattr(mensaje, "chat", None)
+    usuario = getattr(update, "from_user", None)
+    return [getattr(chat, "id", None), getattr(usuario, "id", None)]
+
+def instalar_sesiones(bot):
+    """
+    Con estado compartido, procesa cada update del bot dentro de una sesión.
+    El bot debe crearse con use_class_middlewares=True.
+
+    Returns:
+        bool: True si se ha instalado el middleware
+    """
+    if not almacen_estados.compartido:
+        return False
+    from telebot.handler_backends import BaseMiddleware
+
+    class MiddlewareSesion(BaseMiddleware):
+        def __init__(self):
+            super().__init__()
+            self.update_types = ['message', 'edited_message', 'callback_query']
+
+        def pre_process(self, update, data):
+            sesion = almacen_estados.sesion(*_chats_del_update(update))
+            sesion.__enter__()
+            data['sesion_estado'] = sesion
+
+        def post_process(self, update, data, exception):
+            sesion = data.pop('sesion_estado', None)
+            if sesion is not None:
+                sesion.__exit__(None, None, None)
+
+    bot.setup_middleware(MiddlewareSesion())
+    return True
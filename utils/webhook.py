@@ -0,0 +1,170 @@
+"""
+Modo webhook de los bots.
+
+En lugar de preguntar a Telegram con getUpdates, el bot expone un endpoint
+HTTP al que Telegram envía cada update. El endpoint es una aplicación WSGI
+(se puede montar en cualquier servidor WSGI) que solo valida el update, lo
+pasa al DespachadorUpdates y responde; los handlers se ejecutan en los
+hilos del despachador, en orden dentro de cada chat. Si el despachador está
+lleno se responde 503 y Telegram reintenta más tarde.
+
+Como los updates llegan por HTTP, varios procesos del mismo bot pueden
+atenderlos detrás de un balanceador (con ESTADOS_COMPARTIDOS para que
+compartan las conversaciones). Para probarlo en local basta con enviar al
+endpoint updates grabados (WEBHOOK_GRABAR) con enviar_updates.py.
+"""
+import os
+import sys
+import json
+import hmac
+import signal
+import logging
+import threading
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+# Añadir directorio padre al path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.despachador import DespachadorUpdates, chat_del_update
+
+logger = logging.getLogger(__name__)
+
+MAX_CUERPO = 1024 * 1024   # Bytes máximos de un update
+
+
+class AplicacionWebhook:
+    """
+    Aplicación WSGI del webhook:
+        POST <ruta>   recibe un update (JSON) y lo encola
+        GET /salud    métricas del despachador en JSON (con el detalle por fragmento)
+    """
+
+    def __init__(self, despachador, ruta="/webhook", secreto=None, grabar=None):
+        self.despachador = despachador
+        self.ruta = ruta
+        self.secreto = secreto
+        self._grabar = open(grabar, "a", encoding="utf-8") if grabar else None
+        self._lock_grabar = threading.Lock()
+        self.invalidos = 0
+
+    @staticmethod
+    def _responder(start_response, estado, cuerpo=b"", cabeceras=()):
+        start_response(estado, [("Content-Type", "application/json"),
+                                ("Content-Length", str(len(cuerpo)))] + list(cabeceras))
+        return [cuerpo]
+
+    def __call__(self, environ, start_response):
+        metodo = environ.get("REQUEST_METHOD")
+        ruta = environ.get("PATH_INFO", "")
+
+        if metodo == "GET" and ruta == "/salud":
+            cuerpo = json.dumps(self.despachador.estadisticas(por_fragmento=True)).encode()
+            return self._responder(start_response, "200 OK", cuerpo)
+        if ruta != self.ruta:
+            return self._responder(start_response, "404 Not Found")
+        if metodo != "POST":
+            return self._responder(start_response, "405 Method Not Allowed")
+
+        # Telegram envía el secret_token de set_webhook en esta cabecera
+        if self.secreto and not hmac.compare_digest(
+                environ.get("HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN", ""), self.secreto):
+            return self._responder(start_response, "403 Forbidden")
+
+        try:
+            longitud = int(environ.get("CONTENT_LENGTH") or 0)
+            if not 0 < longitud <= MAX_CUERPO:
+                raise ValueError(f"longitud {longitud}")
+            cuerpo = environ["wsgi.input"].read(longitud)
+            update = json.loads(cuerpo)
+            if not isinstance(update, dict) or "update_id" not in update:
+                raise ValueError("sin update_id")
+        except ValueError as e:
+            self.invalidos += 1
+            logger.warning(f"Update inválido recibido en el webhook: {e}")
+            return self._responder(start_response, "400 Bad Request")
+
+        if self._grabar is not None:
+            with self._lock_grabar:
+                self._grabar.write(cuerpo.decode("utf-8") + "\n")
+                self._grabar.flush()
+
+        clave = chat_del_update(update)
+        if not self.despachador.encolar(update, update["update_id"] if clave is None else clave):
+            return self._responder(start_response, "503 Service Unavailable", cabeceras=[("Retry-After", "5")])
+        return self._responder(start_response, "200 OK")
+
+
+class _ServidorHilos(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _ManejadorSilencioso(WSGIRequestHandler):
+    def log_message(self, formato, *args):
+        logger.debug(formato % args)
+
+
+def procesador_telebot(bot):
+    """
+    Función para el despachador que pasa cada update a los handlers de un
+    TeleBot. El bot no debe usar su propio pool de hilos: el orden por chat
+    lo garantiza el despachador y se perdería al repartir de nuevo.
+    """
+    from telebot import types
+
+    bot.threaded = False
+
+    def procesar(update):
+        bot.process_new_updates([types.Update.de_json(update)])
+
+    return procesar
+
+
+def servir_webhook(bot, url_publica, host="0.0.0.0", puerto=8443, ruta="/webhook", secreto=None,
+                   hilos=None, capacidad=None, grabar=None, allowed_updates=None):
+    """
+    Registra el webhook en Telegram y atiende updates hasta recibir SIGINT o
+    SIGTERM. Al parar deja de aceptar updates y termina los que ya estaban
+    en cola antes de salir.
+
+    Args:
+        bot: TeleBot con los handlers registrados
+        url_publica: URL base con la que Telegram llega a este servidor (https)
+        grabar: Fichero donde añadir cada update recibido (JSON por línea)
+    """
+    from config import DESPACHADOR_HILOS, DESPACHADOR_CAPACIDAD
+
+    # El bot asíncrono trae su propio despachador sobre el bucle de eventos (utils/asincrono.py)
+    despachador = getattr(bot, "despachador", None)
+    if despachador is None:
+        despachador = DespachadorUpdates(procesador_telebot(bot), hilos=hilos or DESPACHADOR_HILOS,
+                                         capacidad=capacidad or DESPACHADOR_CAPACIDAD)
+    despachador.iniciar()
+    aplicacion = AplicacionWebhook(despachador, ruta=ruta, secreto=secreto, grabar=grabar)
+    servidor = make_server(host, puerto, aplicacion, server_class=_ServidorHilos,
+                           handler_class=_ManejadorSilencioso)
+
+    if url_publica:
+        bot.remove_webhook()
+        bot.set_webhook(url=url_publica.rstrip("/") + ruta, secret_token=secreto,
+                        allowed_updates=allowed_updates)
+        print(f"🔗 Webhook registrado en {url_publica.rstrip('/')}{ruta}")
+
+    def parar(signum, frame):
+        print("🛑 Deteniendo el webhook: terminando los updates en cola...")
+        # shutdown() espera a serve_forever(): se llama desde otro hilo
+        threading.Thread(target=servidor.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, parar)
+    signal.signal(signal.SIGINT, parar)
+
+    print(f"🌐 Escuchando updates en http://{host}:{puerto}{ruta}")
+    try:
+        servidor.serve_forever()
+    finally:
+        servidor.server_close()
+        pendientes = despachador.detener()
+        if pendientes:
+            logger.warning(f"{pendientes} updates sin procesar al detener el webhook")
+        print(f"👋 Webhook detenido: {despachador.estadisticas()['procesados']} updates procesados")
+    return despachador